@@ -22,15 +22,25 @@ import sys
 from time import time
 from flask import Flask
 from flask_restful import Api
-from elasticsearch import Elasticsearch
 import elasticsearch.exceptions
 
 from data_catalog.auth import Security
-from data_catalog.elastic_admin import ElasticSearchAdminResource
+from data_catalog.bases import create_elastic_search
+from data_catalog.bulk_import import BulkLoadMode
+from data_catalog.codec import output_json
+from data_catalog.compression import CompressionMiddleware
+from data_catalog.elastic_admin import (ElasticSearchAdminResource, ElasticSearchBulkLoadResource,
+                                        ElasticSearchReindexResource,
+                                        ElasticSearchReindexStatusResource,
+                                        ElasticSearchSettingsResource)
 from data_catalog.configuration import DCConfig
 from data_catalog.metadata_entry import MetadataEntryResource
-from data_catalog.search import DataSetSearchResource
+from data_catalog.metadata_index import MetadataIndex
+from data_catalog.metrics import MetricsResource, finish_request, metrics, start_request
+from data_catalog.search import DataSetSearchResource, DataSetMultiSearchResource
 from data_catalog.dataset_count import DataSetCountResource
+from data_catalog.export import DataSetExportResource
+from data_catalog.suggest import DataSetSuggestResource
 from data_catalog.api_doc import ApiDoc
 
 
@@ -82,31 +92,25 @@ def get_app():
     """
     config = DCConfig()
     _configure_logging(config)
+    if config.metrics_dir:
+        metrics.share(config.metrics_dir)
     _prepare_environment(config)
     return _create_app(config)
 
 
 def _prepare_environment(config):
     """
-    Prepares ElasticSearch index for work if it's not yet ready.
+    Prepares ElasticSearch index (and the alias used to access it) for work
+    if it's not yet ready. Restores settings changed by imports that didn't finish.
+    The embedded storage prepares its database itself.
     :param `DCConfig` config:
     """
-    elastic_search = Elasticsearch('{}:{}'.format(
-        config.elastic.elastic_hostname,
-        config.elastic.elastic_port))
+    if config.elastic.storage_backend != 'elasticsearch':
+        return
+    elastic_search = create_elastic_search(config.elastic)
     try:
-        elastic_search.indices.create(
-            index=config.elastic.elastic_index,
-            body=config.elastic.metadata_index_setup)
-    except elasticsearch.exceptions.RequestError as ex:
-        # Multiple workers can be created at the same time and there's no way
-        # to tell ElasticSearch to create index only if it's not already created,
-        # so we need to attempt to create it and ignore the error that it throws
-        # when attemting to create an existing index.
-        if 'IndexAlreadyExists' in ex.args[1]:
-            print('400 caused by "index already created" - no need to panic.')
-        else:
-            raise ex
+        MetadataIndex(elastic_search, config.elastic).create_if_missing()
+        BulkLoadMode.restore_interrupted(elastic_search, config.elastic)
     except elasticsearch.exceptions.TransportError:
         print("Can't start because of no connection to ElasticSearch.")
         raise
@@ -136,15 +140,34 @@ def _configure_logging(config):
 def _create_app(config):
     app = Flask(__name__)
     api = ExceptionHandlingApi(app)
+    api.representation('application/json')(output_json)
     api_doc_route = '/api-docs'
+    metrics_route = '/metrics'
 
     api.add_resource(DataSetSearchResource, config.app_base_path)
     api.add_resource(ApiDoc, api_doc_route)
+    api.add_resource(MetricsResource, metrics_route)
     api.add_resource(MetadataEntryResource, config.app_base_path + '/<entry_id>')
     api.add_resource(DataSetCountResource, config.app_base_path + '/count')
-    api.add_resource(ElasticSearchAdminResource, config.app_base_path + '/admin/elastic')
-
-    security = Security(auth_exceptions=[api_doc_route])
+    api.add_resource(DataSetMultiSearchResource, config.app_base_path + '/msearch')
+    # exports, suggestions and index administration work on ElasticSearch only
+    if config.elastic.storage_backend == 'elasticsearch':
+        api.add_resource(DataSetExportResource, config.app_base_path + '/export')
+        api.add_resource(DataSetSuggestResource, config.app_base_path + '/suggest')
+        api.add_resource(ElasticSearchAdminResource, config.app_base_path + '/admin/elastic')
+        api.add_resource(ElasticSearchBulkLoadResource,
+                         config.app_base_path + '/admin/elastic/bulk-load')
+        api.add_resource(ElasticSearchReindexResource,
+                         config.app_base_path + '/admin/elastic/reindex')
+        api.add_resource(ElasticSearchReindexStatusResource,
+                         config.app_base_path + '/admin/elastic/reindex/<index_name>')
+        api.add_resource(ElasticSearchSettingsResource,
+                         config.app_base_path + '/admin/elastic/settings')
+
+    security = Security(auth_exceptions=[api_doc_route, metrics_route])
+    app.before_request(start_request)
     app.before_request(security.authenticate)
+    app.after_request(finish_request)
+    app.wsgi_app = CompressionMiddleware(app.wsgi_app, config.compression)
 
     return app
@@ -16,6 +16,8 @@
 
 import json
 import logging
+import time
+
 import requests
 import flask
 from werkzeug.exceptions import BadRequest
@@ -24,6 +26,7 @@ import jwt
 import jwt.exceptions
 
 from data_catalog.configuration import DCConfig
+from data_catalog.metrics import measure_outbound_call, measure_stage
 
 
 class Security(object):
@@ -44,9 +47,19 @@ class Security(object):
         Verifies user's token and his/her accessibility to requested resources.
         Once token is validated, the role of user (flask.g.is_admin) and his/her scope
         (flask.g.org_uuid_list) is set up for current request.
+        Time taken (in seconds) is put in flask.g.auth_duration for profiled searches
+        and measured as the "auth" stage of the request.
         Raises Unauthorized when token is missing, invalid, expired or not signed by UAA
         Raises Forbidden: when org guid is missing, invalid or user can't access this org
         """
+        start_time = time.time()
+        try:
+            with measure_stage('auth'):
+                self._authenticate()
+        finally:
+            flask.g.auth_duration = time.time() - start_time
+
+    def _authenticate(self):
         if not self._uaa_public_key:
             self._get_token_verification_key()
 
@@ -71,7 +84,8 @@ class Security(object):
             abort(403)
 
     def _get_token_verification_key(self):
-        uaa_public_key = requests.get(DCConfig().services_url.uaa_token_uri).json()
+        with measure_outbound_call('uaa'):
+            uaa_public_key = requests.get(DCConfig().services_url.uaa_token_uri).json()
         self._uaa_public_key, self._uaa_sign_algorithm = _PublicKeyParser().parse(uaa_public_key)
 
     def _get_token_from_request(self):
@@ -169,9 +183,11 @@ class _Authorization(object):
             return []
 
     def _get_orgs_user_has_access(self, token):
-        response = requests.get(
-            self._config.services_url.user_management_uri,
-            headers={'Authorization': 'bearer {}'.format(token)})
+        with measure_outbound_call('user_management') as call:
+            response = requests.get(
+                self._config.services_url.user_management_uri,
+                headers={'Authorization': 'bearer {}'.format(token)})
+            call.failed = response.status_code != 200
         self._handle_downloader_status_code(response.status_code)
         org_uuid_list = []
         for org in json.loads(response.text):
@@ -19,7 +19,36 @@ import logging
 from elasticsearch import Elasticsearch
 
 from flask_restful import Resource
+from data_catalog.codec import CodecSerializer
 from data_catalog.configuration import DCConfig
+from data_catalog.metrics import MeasuredTransport
+from data_catalog.routing import OrgRouting
+from data_catalog.sqlite_storage import SqliteStorage
+from data_catalog.storage import ElasticSearchStorage
+
+
+def create_elastic_search(elastic_config):
+    """
+    :param ElasticConfig elastic_config:
+    :returns: ElasticSearch client encoding and decoding bodies with Data Catalog's JSON codec.
+    :rtype: Elasticsearch
+    """
+    return Elasticsearch(
+        '{}:{}'.format(elastic_config.elastic_hostname, elastic_config.elastic_port),
+        serializer=CodecSerializer(),
+        transport_class=MeasuredTransport)
+
+
+def create_storage(elastic_config, elastic_search):
+    """
+    :param ElasticConfig elastic_config:
+    :param Elasticsearch elastic_search: Client used by ElasticSearch storage.
+    :returns: Storage of the metadata entries of the configured backend.
+    :rtype: Storage
+    """
+    if elastic_config.storage_backend == 'sqlite':
+        return SqliteStorage.shared(elastic_config)
+    return ElasticSearchStorage(elastic_config, elastic_search)
 
 
 class DataCatalogResource(Resource):
@@ -44,39 +73,32 @@ class DataCatalogModel(object):
     def __init__(self):
         self._config = DCConfig()
         self._log = logging.getLogger(type(self).__name__)
-        self._elastic_search = Elasticsearch(
-            '{}:{}'.format(self._config.elastic.elastic_hostname,
-                           self._config.elastic.elastic_port))
+        self._elastic_search = create_elastic_search(self._config.elastic)
+        self._routing = OrgRouting(self._config.elastic, self._elastic_search)
+        self._storage = create_storage(self._config.elastic, self._elastic_search)
 
-    def _get_entry(self, entry_id):
+    def _get_entry(self, entry_id, org_uuid_list=()):
         """
         shortcut to ElasticSearch.get function
         Standard elastic (index/doc_type) params are added
         :param entry_id: elastic search id
+        :param org_uuid_list: organisations the entry probably belongs to (used for routing)
         :raises NotFoundError: entry not found in Elastic Search
         :raises ConnectionError: problem with connecting to Elastic Search
         :return: elastic search structure
         """
-        return self._elastic_search.get(
-            index=self._config.elastic.elastic_index,
-            doc_type=self._config.elastic.elastic_metadata_type,
-            id=entry_id)
+        return self._storage.get(entry_id, org_uuid_list=org_uuid_list)
 
-    def _delete_entry(self, entry_id):
+    def _delete_entry(self, entry_id, org_uuid):
         """
         shortcut to ElasticSearch.delete function
         data flush is performed after delete
         Standard elastic (index/doc_type) params are added
         :param entry_id: elastic search id
+        :param org_uuid: organisation of the entry (used for routing)
         :raises NotFoundError: entry not found in Elastic Search
         :raises ConnectionError: problem with connecting to Elastic Search
         :rtype: None
 
         """
-        self._elastic_search.delete(
-            index=self._config.elastic.elastic_index,
-            doc_type=self._config.elastic.elastic_metadata_type,
-            id=entry_id)
-
-        # flushing data - so immediate searches are aware of change
-        self._elastic_search.indices.flush()
+        self._storage.delete(entry_id, org_uuid)
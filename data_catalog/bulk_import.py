@@ -0,0 +1,393 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Indexing of many metadata entries at once (e.g. restoring a backup).
+"""
+
+import logging
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+from elasticsearch import helpers
+from elasticsearch.exceptions import ConflictError, ConnectionError, NotFoundError, TransportError
+
+from data_catalog.metadata_entry import (MetadataIndexingTransformer, InvalidEntryError,
+                                         ORG_UUID_FIELD)
+
+
+class BulkImporter(object):
+
+    """
+    Validates metadata entries and indexes them with ElasticSearch's bulk API.
+    Chunks of entries are sent by a few threads at once, but only as many chunks as there are
+    threads are kept in memory, so entries can come from a stream of any length.
+    """
+
+    def __init__(self, elastic_search, index, doc_type, routing, import_config):
+        """
+        :param Elasticsearch elastic_search:
+        :param str index: Index the entries are put in.
+        :param str doc_type:
+        :param OrgRouting routing:
+        :param BulkImportConfig import_config:
+        """
+        self._elastic_search = elastic_search
+        self._index = index
+        self._doc_type = doc_type
+        self._routing = routing
+        self._config = import_config
+        self._transformer = MetadataIndexingTransformer()
+        self._log = logging.getLogger(type(self).__name__)
+
+    def import_entries(self, entries):
+        """
+        :param entries: Iterable of metadata entries (with their IDs).
+        :returns: Numbers of entries: indexed, rejected (invalid) and failed (not accepted
+            by ElasticSearch).
+        :rtype: dict
+        :raises ValueError: Entries stream is malformed (entries before the error are indexed).
+        :raises ConnectionError:
+        """
+        summary = {'rejected': 0}
+        summary.update(self.index_actions(self._get_index_actions(entries, summary)))
+        self._log.info('Import finished: %s', summary)
+        return summary
+
+    def index_actions(self, actions):
+        """
+        Sends bulk API's actions (already prepared, e.g. copies of documents from another index)
+        in chunks.
+        :param actions: Iterable of actions, like the ones accepted by elasticsearch.helpers.
+        :returns: Numbers of indexed and failed actions.
+        :rtype: dict
+        :raises ConnectionError:
+        """
+        summary = {'indexed': 0, 'failed': 0}
+        pool = ThreadPool(self._config.concurrency)
+        pending_chunks = deque()
+        try:
+            for chunk in self._get_chunks(actions):
+                pending_chunks.append(pool.apply_async(self._index_chunk, (chunk,)))
+                if len(pending_chunks) >= self._config.concurrency:
+                    self._add_to_summary(pending_chunks.popleft().get(), summary)
+            while pending_chunks:
+                self._add_to_summary(pending_chunks.popleft().get(), summary)
+        finally:
+            pool.close()
+            pool.join()
+        return summary
+
+    def _get_index_actions(self, entries, summary):
+        for entry in entries:
+            action = self._get_index_action(entry)
+            if action is None:
+                summary['rejected'] += 1
+            else:
+                yield action
+
+    def _get_chunks(self, actions):
+        chunk = []
+        for action in actions:
+            chunk.append(action)
+            if len(chunk) >= self._config.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _get_index_action(self, entry):
+        """
+        :returns: Bulk API's action for a valid entry or None for an invalid one.
+        """
+        if not isinstance(entry, dict) or 'id' not in entry:
+            self._log.error('Entry without an ID rejected.')
+            return None
+        # exported entries have their IDs among the fields, but they aren't part of the metadata
+        entry_id = entry.pop('id')
+        try:
+            self._transformer.transform(entry)
+        except InvalidEntryError:
+            self._log.exception('Invalid entry %s rejected.', entry_id)
+            return None
+        action = {
+            '_index': self._index,
+            '_type': self._doc_type,
+            '_id': entry_id,
+            '_source': entry
+        }
+        routing = self._routing.params(entry[ORG_UUID_FIELD]).get('routing')
+        if routing:
+            action['_routing'] = routing
+        return action
+
+    def _index_chunk(self, actions):
+        """
+        Runs in the pool's threads.
+        :returns: Numbers of indexed and failed actions.
+        :rtype: (int, int)
+        :raises ConnectionError:
+        """
+        indexed = 0
+        try:
+            for success, item in helpers.streaming_bulk(self._elastic_search, actions,
+                                                        chunk_size=len(actions),
+                                                        raise_on_error=False):
+                if success:
+                    indexed += 1
+                else:
+                    self._log.error('Bulk action failed: %s', item)
+        except ConnectionError:
+            raise
+        except TransportError:
+            self._log.exception('Bulk request failed.')
+        return indexed, len(actions) - indexed
+
+    @staticmethod
+    def _add_to_summary(chunk_result, summary):
+        indexed, failed = chunk_result
+        summary['indexed'] += indexed
+        summary['failed'] += failed
+
+
+class BulkLoadMode(object):
+
+    """
+    Context manager that turns off refreshing and replication of an index while many
+    documents are written to it. ElasticSearch then doesn't create a new segment every second
+    and doesn't send every write to replicas. When the load ends the previous settings
+    are restored, the index is refreshed and (optionally) force merged.
+
+    The settings to restore are saved in a separate index before they're changed, so they can be
+    restored when the process dies during the load (see restore_interrupted). Loads running
+    at the same time share a single snapshot, which counts them (updated with optimistic
+    concurrency control), and only the last one to end restores the settings.
+    Live settings are only saved when there's no snapshot, so no load is running; the ones
+    of the bulk load mode are never saved, the configured ones are used instead.
+    """
+
+    BULK_LOAD_SETTINGS = {
+        'index.refresh_interval': '-1',
+        'index.number_of_replicas': '0'
+    }
+    SNAPSHOT_INDEX_SUFFIX = '-bulk-load'
+    SNAPSHOT_TYPE = 'settings'
+
+    def __init__(self, elastic_search, elastic_config, index, force_merge=False, enabled=True):
+        """
+        :param Elasticsearch elastic_search:
+        :param ElasticConfig elastic_config:
+        :param str index: Index (or alias) that is loaded.
+        :param bool force_merge: Whether the index should be merged to a single segment
+            after a successful load (faster searches, but merging takes a while).
+        :param bool enabled: When false, the settings aren't changed at all.
+        """
+        self._enabled = enabled
+        self._elastic_search = elastic_search
+        # restored when the index doesn't have its own values
+        self._default_settings = {
+            'index.refresh_interval': elastic_config.refresh_interval,
+            'index.number_of_replicas': str(elastic_config.number_of_replicas)
+        }
+        self._snapshot_index = self.get_snapshot_index(elastic_config)
+        self._index = index
+        self._force_merge = force_merge
+        self._loaded_indices = []
+        self._log = logging.getLogger(type(self).__name__)
+
+    @classmethod
+    def get_snapshot_index(cls, elastic_config):
+        return elastic_config.elastic_index + cls.SNAPSHOT_INDEX_SUFFIX
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.finish(succeeded=exc_type is None)
+        return False
+
+    def start(self):
+        """
+        Turns the bulk load mode on. Used directly (instead of the "with" statement)
+        when the load spans many requests; it's ended with "finish".
+        :returns: Names of the loaded indices.
+        :rtype: list[str]
+        """
+        if not self._enabled:
+            return []
+        current_settings = self._elastic_search.indices.get_settings(
+            index=self._index, name=','.join(self.BULK_LOAD_SETTINGS), flat_settings=True)
+        # pylint: disable=unexpected-keyword-arg
+        self._elastic_search.indices.create(
+            index=self._snapshot_index,
+            body={'settings': {'number_of_shards': 1}},
+            ignore=400)
+        for index_name, index_settings in current_settings.items():
+            self._join_load(index_name, index_settings['settings'])
+            self._loaded_indices.append(index_name)
+        self._log.info('Bulk load mode on for %s.', sorted(self._loaded_indices))
+        self._elastic_search.indices.put_settings(index=self._index,
+                                                  body=self.BULK_LOAD_SETTINGS)
+        return sorted(self._loaded_indices)
+
+    def finish(self, succeeded=True):
+        """
+        Ends the load, restoring the settings if it's the last one running. A load started
+        by another instance (e.g. in another request) ends on the indices behind the index.
+        :param bool succeeded: A failed load isn't force merged and errors of restoring
+            the settings are only logged.
+        :returns: Names of the loaded indices.
+        :rtype: list[str]
+        """
+        if not self._enabled:
+            return []
+        try:
+            if not self._loaded_indices:
+                self._loaded_indices = list(self._elastic_search.indices.get_settings(
+                    index=self._index, name=','.join(self.BULK_LOAD_SETTINGS)))
+            for index_name in self._loaded_indices:
+                self._leave_load(index_name)
+            self._log.info('Bulk load mode off for %s.', sorted(self._loaded_indices))
+        except TransportError:
+            if succeeded:
+                raise
+            # the load's error is more important, the settings are restored at the next start
+            self._log.exception('Restoring settings after a failed bulk load failed.')
+            return sorted(self._loaded_indices)
+        if succeeded and self._force_merge:
+            self._log.info('Force merging %s.', self._index)
+            self._elastic_search.indices.optimize(index=self._index, max_num_segments=1)
+        return sorted(self._loaded_indices)
+
+    def _join_load(self, index_name, index_settings):
+        """
+        Saves a snapshot of the index's settings or counts this load in the existing one.
+        """
+        while True:
+            snapshot = self._get_snapshot(index_name)
+            try:
+                if snapshot is None:
+                    body = {'settings': self._get_settings_to_restore(index_name, index_settings),
+                            'loads': 1}
+                    self._elastic_search.index(index=self._snapshot_index,
+                                               doc_type=self.SNAPSHOT_TYPE, id=index_name,
+                                               body=body, op_type='create', refresh=True)
+                else:
+                    body = {'settings': _get_snapshot_settings(snapshot['_source']),
+                            'loads': snapshot['_source'].get('loads', 1) + 1}
+                    self._elastic_search.index(index=self._snapshot_index,
+                                               doc_type=self.SNAPSHOT_TYPE, id=index_name,
+                                               body=body, version=snapshot['_version'],
+                                               refresh=True)
+                return
+            except ConflictError:
+                # another load has just saved or changed the snapshot
+                continue
+
+    def _leave_load(self, index_name):
+        """
+        Restores the index's settings if this is the last running load,
+        otherwise only uncounts it from the snapshot.
+        """
+        while True:
+            snapshot = self._get_snapshot(index_name)
+            if snapshot is None:
+                self._log.warning('Settings of %s were already restored.', index_name)
+                return
+            loads = snapshot['_source'].get('loads', 1)
+            try:
+                if loads > 1:
+                    body = {'settings': _get_snapshot_settings(snapshot['_source']),
+                            'loads': loads - 1}
+                    self._elastic_search.index(index=self._snapshot_index,
+                                               doc_type=self.SNAPSHOT_TYPE, id=index_name,
+                                               body=body, version=snapshot['_version'],
+                                               refresh=True)
+                else:
+                    _restore_settings(self._elastic_search, self._snapshot_index, index_name,
+                                      _get_snapshot_settings(snapshot['_source']),
+                                      version=snapshot['_version'])
+                return
+            except ConflictError:
+                # another load has just joined or ended, it's counted again
+                continue
+
+    def _get_snapshot(self, index_name):
+        """
+        :returns: The snapshot document (with "_version") or None.
+        :rtype: dict
+        """
+        try:
+            return self._elastic_search.get(index=self._snapshot_index,
+                                            doc_type=self.SNAPSHOT_TYPE, id=index_name)
+        except NotFoundError:
+            return None
+
+    def _get_settings_to_restore(self, index_name, index_settings):
+        """
+        :returns: The index's settings, with the configured ones instead of the missing ones
+            and the ones of the bulk load mode (left e.g. by a killed worker).
+        :rtype: dict
+        """
+        settings = dict(self._default_settings)
+        for name, value in index_settings.items():
+            if name not in self.BULK_LOAD_SETTINGS:
+                continue
+            if value == self.BULK_LOAD_SETTINGS[name]:
+                self._log.warning('%s of %s is left from a bulk load, the configured value '
+                                  'will be restored.', name, index_name)
+            else:
+                settings[name] = value
+        return settings
+
+    @classmethod
+    def restore_interrupted(cls, elastic_search, elastic_config):
+        """
+        Restores settings saved by loads that didn't end (e.g. their worker was killed).
+        A load running in another worker at the same time will just be slower.
+        :param Elasticsearch elastic_search:
+        :param ElasticConfig elastic_config:
+        """
+        snapshot_index = cls.get_snapshot_index(elastic_config)
+        try:
+            snapshots = list(helpers.scan(elastic_search, index=snapshot_index,
+                                          doc_type=cls.SNAPSHOT_TYPE))
+        except NotFoundError:
+            return
+        for snapshot in snapshots:
+            logging.getLogger(cls.__name__).warning(
+                'Restoring settings of %s after an interrupted bulk load.', snapshot['_id'])
+            _restore_settings(elastic_search, snapshot_index, snapshot['_id'],
+                              _get_snapshot_settings(snapshot['_source']))
+
+
+def _get_snapshot_settings(snapshot_source):
+    # snapshots saved before loads were counted only held the settings
+    return snapshot_source.get('settings', snapshot_source)
+
+
+def _restore_settings(elastic_search, snapshot_index, index_name, settings, version=None):
+    """
+    :param int version: Version of the snapshot, it isn't deleted (ConflictError is raised)
+        if it changed meanwhile.
+    """
+    # pylint: disable=unexpected-keyword-arg
+    elastic_search.indices.put_settings(index=index_name, body=settings, ignore=404)
+    elastic_search.indices.refresh(index=index_name, ignore=404)
+    delete_params = {'version': version} if version is not None else {}
+    elastic_search.delete(index=snapshot_index, doc_type=BulkLoadMode.SNAPSHOT_TYPE,
+                          id=index_name, ignore=404, **delete_params)
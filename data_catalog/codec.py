@@ -0,0 +1,326 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+JSON encoding and decoding shared by ElasticSearch's client, the query translator
+and REST responses. An accelerated library (ujson or simplejson) is used when installed,
+otherwise the standard library's json module.
+"""
+
+import codecs
+import json
+import re
+from datetime import date, datetime
+from decimal import Decimal
+
+from elasticsearch.exceptions import SerializationError
+from elasticsearch.serializer import JSONSerializer
+from flask import make_response, current_app
+
+from data_catalog.metrics import measure_stage
+
+
+class JsonCodec(object):
+
+    """
+    Wraps "dumps" and "loads" of a JSON library. Values the library can't encode
+    (e.g. dates for ujson) are encoded by the standard library instead.
+    """
+
+    def __init__(self, name, dumps, loads):
+        """
+        :param str name: Name of the library.
+        :param dumps: Function encoding an object to a JSON string.
+        :param loads: Function decoding a JSON string, raising ValueError on invalid documents.
+        """
+        self.name = name
+        self._dumps = dumps
+        self._loads = loads
+
+    def dumps(self, obj):
+        """
+        :rtype: str
+        :raises TypeError: The object can't be encoded.
+        """
+        try:
+            return self._dumps(obj)
+        except (TypeError, OverflowError):
+            return json.dumps(obj, default=_encode_default)
+
+    def loads(self, json_string):
+        """
+        :raises ValueError: The string isn't a valid JSON document.
+        """
+        return self._loads(json_string)
+
+
+def _encode_default(obj):
+    if isinstance(obj, (date, datetime)):
+        return obj.isoformat()
+    elif isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError('Unable to serialize {!r} (type: {})'.format(obj, type(obj)))
+
+
+def _create_codecs():
+    codecs = {'json': JsonCodec('json', json.dumps, json.loads)}
+    try:
+        import simplejson
+        codecs['simplejson'] = JsonCodec('simplejson', simplejson.dumps, simplejson.loads)
+    except ImportError:
+        pass
+    try:
+        import ujson
+        codecs['ujson'] = JsonCodec(
+            'ujson',
+            lambda obj: ujson.dumps(obj, escape_forward_slashes=False),
+            ujson.loads)
+    except ImportError:
+        pass
+    return codecs
+
+
+CODECS = _create_codecs()
+PREFERRED_CODECS = ['ujson', 'simplejson', 'json']
+
+
+def get_codec(name=None):
+    """
+    :param str name: One of the available codecs, the fastest one is returned if not given.
+    :rtype: JsonCodec
+    :raises KeyError: The codec's library isn't installed.
+    """
+    if name:
+        return CODECS[name]
+    return next(CODECS[codec_name] for codec_name in PREFERRED_CODECS if codec_name in CODECS)
+
+
+codec = get_codec()
+
+
+STREAM_CHUNK_SIZE = 64 * 1024
+# number of characters of a single element of a streamed array
+MAX_ELEMENT_SIZE = 16 * 1024 ** 2
+_WHITESPACE = ' \t\n\r'
+_STRUCTURAL_CHARS = re.compile(r'[{}\[\]"]')
+# rest of a string's content, up to its closing quote or a backslash ending the data
+_STRING_CONTENT = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)
+_SCALAR_END = re.compile(r'[ \t\n\r,\]}]')
+
+
+class ElementTooLargeError(ValueError):
+    pass
+
+
+def iter_json_array(stream, chunk_size=STREAM_CHUNK_SIZE, max_element_size=MAX_ELEMENT_SIZE):
+    """
+    Decodes elements of a JSON array one by one, reading the stream in chunks,
+    so only a single element and a chunk are kept in memory instead of the whole array.
+    :param stream: File-like object with a JSON array.
+    :param int chunk_size: Number of bytes read at a time.
+    :param int max_element_size: Maximal number of characters of a single element.
+    :returns: Generator of the array's elements.
+    :raises ValueError: The stream doesn't contain a valid JSON array. Elements before
+        the invalid part are still yielded.
+    :raises ElementTooLargeError: An element is bigger than the limit.
+    """
+    decoder = json.JSONDecoder()
+    buffer = _ChunkBuffer(stream, chunk_size, max_element_size)
+    if buffer.next_char() != '[':
+        raise ValueError('Expected a JSON array.')
+    buffer.position += 1
+    if buffer.next_char() == ']':
+        buffer.position += 1
+    else:
+        while True:
+            yield buffer.decode_value(decoder)
+            separator = buffer.next_char()
+            buffer.position += 1
+            if separator == ']':
+                break
+            if separator != ',':
+                raise ValueError('Expected "," or "]" after an array element.')
+    if buffer.next_char():
+        raise ValueError('Unexpected data after the JSON array.')
+
+
+class _ChunkBuffer(object):
+
+    """
+    Part of a stream that wasn't decoded yet.
+    """
+
+    def __init__(self, stream, chunk_size, max_element_size):
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._max_element_size = max_element_size
+        # multibyte characters can be split between chunks
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._data = u''
+        self.position = 0
+        self._finished = False
+
+    def _read_chunk(self, size=None):
+        """
+        :param int size: Number of bytes to read, the chunk size by default.
+        :returns: False if the stream has ended.
+        """
+        chunk = self._stream.read(size or self._chunk_size)
+        if not chunk:
+            self._finished = True
+            return False
+        if isinstance(chunk, str):
+            chunk = self._text_decoder.decode(chunk)
+        # the decoded part is dropped, so the buffer doesn't grow with the stream
+        self._data = self._data[self.position:] + chunk
+        self.position = 0
+        return True
+
+    def next_char(self):
+        """
+        Skips whitespace.
+        :returns: The next character or an empty string at the end of the stream.
+        """
+        while True:
+            while self.position < len(self._data) and self._data[self.position] in _WHITESPACE:
+                self.position += 1
+            if self.position < len(self._data):
+                return self._data[self.position]
+            if self._finished or not self._read_chunk():
+                return ''
+
+    def decode_value(self, decoder):
+        """
+        Decodes the value starting at the current position. Its end is found first,
+        reading more chunks if needed, so the value is decoded only once.
+        :raises ValueError: The value is invalid or the stream ended before its end.
+        :raises ElementTooLargeError:
+        """
+        self.next_char()
+        end = self._find_value_end()
+        self._check_element_size(end - self.position)
+        value = decoder.decode(self._data[self.position:end])
+        self.position = end
+        return value
+
+    def _find_value_end(self):
+        """
+        Scans the value starting at the current position, keeping track of nesting
+        and strings (where brackets and escaped quotes don't count). Mismatched brackets
+        are left for the decoder to report.
+        :returns: Position right after the value.
+        :rtype: int
+        :raises ValueError: The stream ended before the value's end.
+        :raises ElementTooLargeError:
+        """
+        # scanned offset is kept relative to the value's start, which moves as chunks are read
+        offset = 0
+        depth = 0
+        in_string = False
+        is_scalar = self._data[self.position:self.position + 1] not in ('{', '[', '"')
+        while True:
+            scan_position = self.position + offset
+            if is_scalar:
+                match = _SCALAR_END.search(self._data, scan_position)
+                if match:
+                    return match.start()
+                scan_position = len(self._data)
+            elif in_string:
+                scan_position = _STRING_CONTENT.match(self._data, scan_position).end()
+                if scan_position < len(self._data) and self._data[scan_position] == '"':
+                    in_string = False
+                    if not depth:
+                        return scan_position + 1
+                    offset = scan_position + 1 - self.position
+                    continue
+            else:
+                match = _STRUCTURAL_CHARS.search(self._data, scan_position)
+                if match:
+                    character = match.group()
+                    if character == '"':
+                        in_string = True
+                    elif character in '{[':
+                        depth += 1
+                    else:
+                        depth -= 1
+                        if not depth:
+                            return match.end()
+                    offset = match.end() - self.position
+                    continue
+                scan_position = len(self._data)
+
+            offset = scan_position - self.position
+            self._check_element_size(offset)
+            # reading a chunk drops the data before the value, so the offset stays valid;
+            # big values are read in bigger chunks, so their data isn't copied for every chunk
+            if self._finished or not self._read_chunk(max(self._chunk_size, offset)):
+                if is_scalar:
+                    return len(self._data)
+                raise ValueError('Unexpected end of a JSON value.')
+
+    def _check_element_size(self, size):
+        if size > self._max_element_size:
+            raise ElementTooLargeError(
+                'Array element is bigger than {} characters.'.format(self._max_element_size))
+
+
+class CodecSerializer(JSONSerializer):
+
+    """
+    ElasticSearch client's serializer that uses the codec for request and response bodies.
+    """
+
+    def __init__(self, json_codec=None):
+        """
+        :param JsonCodec json_codec: The default codec is used if not given.
+        """
+        self._codec = json_codec or codec
+
+    def loads(self, s):
+        try:
+            return self._codec.loads(s)
+        except (ValueError, TypeError) as ex:
+            raise SerializationError(s, ex)
+
+    def dumps(self, data):
+        if isinstance(data, basestring):
+            return data
+        try:
+            return self._codec.dumps(data)
+        except (ValueError, TypeError) as ex:
+            raise SerializationError(data, ex)
+
+
+def output_json(data, code, headers=None):
+    """
+    Flask-RESTful's JSON representation using the codec.
+    Formatting options from "RESTFUL_JSON" setting (and pretty printing in debug mode)
+    are only supported by the standard library, so it's used when they're set.
+    """
+    settings = dict(current_app.config.get('RESTFUL_JSON', {}))
+    if current_app.debug:
+        settings.setdefault('indent', 4)
+        settings.setdefault('sort_keys', True)
+
+    with measure_stage('serialization'):
+        if settings:
+            dumped = json.dumps(data, **settings)
+        else:
+            dumped = codec.dumps(data)
+
+    response = make_response(dumped + '\n', code)
+    response.headers.extend(headers or {})
+    return response
@@ -0,0 +1,298 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+WSGI middleware compressing responses and decompressing request bodies.
+"""
+
+import logging
+import zlib
+
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge, UnsupportedMediaType
+from werkzeug.wrappers import Response
+
+from data_catalog.codec import codec
+
+# wbits values of zlib: gzip container, zlib container (HTTP's "deflate")
+# and automatic detection of both
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+DEFLATE_WBITS = zlib.MAX_WBITS
+AUTO_WBITS = 32 + zlib.MAX_WBITS
+
+RESPONSE_ENCODINGS = [('gzip', GZIP_WBITS), ('deflate', DEFLATE_WBITS)]
+REQUEST_ENCODINGS = ['gzip', 'x-gzip', 'deflate']
+COMPRESSIBLE_MIMETYPES = ['application/json', 'application/x-ndjson', 'application/javascript']
+READ_CHUNK_SIZE = 64 * 1024
+
+
+class CompressionMiddleware(object):
+
+    """
+    Compresses responses for clients that accept gzip or deflate ("Accept-Encoding")
+    and decompresses request bodies sent with "Content-Encoding: gzip" or "deflate".
+    Responses with a known length below the threshold are left as they are,
+    streamed responses (e.g. exports) are compressed as they're generated.
+    """
+
+    CORRUPTED_ERROR_MESSAGE = 'Request body is not properly compressed.'
+    TOO_LARGE_ERROR_MESSAGE = 'Decompressed request body is too large.'
+
+    def __init__(self, app, compression_config):
+        """
+        :param app: WSGI application.
+        :param CompressionConfig compression_config:
+        """
+        self._app = app
+        self._config = compression_config
+        self._log = logging.getLogger(type(self).__name__)
+
+    def __call__(self, environ, start_response):
+        try:
+            self._decompress_request(environ)
+        except (BadRequest, RequestEntityTooLarge, UnsupportedMediaType) as ex:
+            # same kind of error body as the one of Flask-RESTful's "abort"
+            response = Response(codec.dumps({'message': ex.description}) + '\n',
+                                status=ex.code, mimetype='application/json')
+            return response(environ, start_response)
+
+        encoding = choose_encoding(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if not encoding or environ.get('REQUEST_METHOD') == 'HEAD':
+            return self._app(environ, start_response)
+
+        encoding_name, wbits = encoding
+        response_info = {}
+
+        def compressing_start_response(status, headers, exc_info=None):
+            headers = _add_vary(headers, 'Accept-Encoding')
+            if self._should_compress(status, headers):
+                response_info['compress'] = True
+                headers = [(name, value) for name, value in headers
+                           if name.lower() != 'content-length']
+                headers.append(('Content-Encoding', encoding_name))
+            return start_response(status, headers, exc_info)
+
+        app_iter = self._app(environ, compressing_start_response)
+        if not response_info.get('compress'):
+            return app_iter
+        return self._compress(app_iter, wbits)
+
+    def _should_compress(self, status, headers):
+        header_dict = dict((name.lower(), value) for name, value in headers)
+        if not status.startswith('200') or 'content-encoding' in header_dict:
+            return False
+        mimetype = header_dict.get('content-type', '').split(';')[0].strip().lower()
+        if not (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_MIMETYPES):
+            return False
+        content_length = header_dict.get('content-length')
+        # streamed responses have no length and are compressed regardless of their size
+        return content_length is None or int(content_length) >= self._config.min_size
+
+    def _compress(self, app_iter, wbits):
+        compressor = zlib.compressobj(self._config.level, zlib.DEFLATED, wbits)
+        try:
+            for chunk in app_iter:
+                compressed = compressor.compress(chunk)
+                if compressed:
+                    yield compressed
+            yield compressor.flush()
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+    def _decompress_request(self, environ):
+        """
+        Replaces a compressed request body with a stream decompressing it as the application
+        reads it, so big bodies (e.g. admin imports) are still streamed. Length of the
+        decompressed body isn't known up front, so the stream is marked as terminated
+        ("wsgi.input_terminated") for Werkzeug to read it until the end.
+        :raises UnsupportedMediaType: Unknown content encoding.
+        :raises BadRequest: Invalid "Content-Length".
+        """
+        content_encoding = environ.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if not content_encoding or content_encoding == 'identity':
+            return
+        if content_encoding not in REQUEST_ENCODINGS:
+            self._log.warning('Unsupported request content encoding: %s', content_encoding)
+            raise UnsupportedMediaType('Unsupported content encoding: {}'.format(content_encoding))
+
+        environ['wsgi.input'] = DecompressingStream(environ['wsgi.input'],
+                                                    self._get_content_length(environ),
+                                                    self._config.max_request_size)
+        environ['wsgi.input_terminated'] = True
+        environ.pop('CONTENT_LENGTH', None)
+        del environ['HTTP_CONTENT_ENCODING']
+
+    @staticmethod
+    def _get_content_length(environ):
+        """
+        :returns: Length of the compressed body or None if it has to be read until the end
+            (chunked requests don't have "Content-Length").
+        :rtype: int
+        """
+        content_length = environ.get('CONTENT_LENGTH')
+        if content_length:
+            try:
+                return max(int(content_length), 0)
+            except ValueError:
+                raise BadRequest('Invalid Content-Length header.')
+        if environ.get('wsgi.input_terminated') \
+                or 'chunked' in environ.get('HTTP_TRANSFER_ENCODING', '').lower():
+            return None
+        return 0
+
+
+class DecompressingStream(object):
+
+    """
+    File-like object decompressing a gzip or deflate stream as it's read. Every call
+    decompresses at most a chunk at a time and reading fails as soon as the decompressed size
+    exceeds the limit, so small "zip bombs" can't take the memory.
+    Reading errors are werkzeug's HTTP exceptions, so the application responds with them.
+    """
+
+    def __init__(self, stream, content_length, max_size):
+        """
+        :param stream: The compressed stream (request's "wsgi.input").
+        :param int content_length: Number of bytes to read from the stream,
+            None to read until its end.
+        :param int max_size: Maximal size of decompressed data.
+        """
+        self._stream = stream
+        self._remaining_input = content_length
+        self._max_size = max_size
+        self._decompressor = zlib.decompressobj(AUTO_WBITS)
+        self._unconsumed_input = b''
+        self._buffer = b''
+        self._size = 0
+        self._finished = False
+        self._error = None
+        self._log = logging.getLogger(type(self).__name__)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            parts = [self._buffer]
+            while not self._finished:
+                parts.append(self._decompress_next())
+            self._buffer = b''
+            return b''.join(parts)
+        while len(self._buffer) < size and not self._finished:
+            self._buffer += self._decompress_next()
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def readline(self, size=-1):
+        if size is None:
+            size = -1
+        while b'\n' not in self._buffer and not self._finished \
+                and (size < 0 or len(self._buffer) < size):
+            self._buffer += self._decompress_next()
+        line_end = self._buffer.find(b'\n') + 1 or len(self._buffer)
+        if size >= 0:
+            line_end = min(line_end, size)
+        line, self._buffer = self._buffer[:line_end], self._buffer[line_end:]
+        return line
+
+    def readlines(self, hint=None):
+        return list(self)
+
+    def __iter__(self):
+        return iter(self.readline, b'')
+
+    def _decompress_next(self):
+        """
+        :returns: Next part of the decompressed data, possibly empty.
+        :rtype: bytes
+        """
+        if self._error:
+            raise self._error
+        try:
+            data = self._decompress_chunk()
+        except zlib.error:
+            self._log.exception(CompressionMiddleware.CORRUPTED_ERROR_MESSAGE)
+            self._error = BadRequest(CompressionMiddleware.CORRUPTED_ERROR_MESSAGE)
+            raise self._error
+        self._size += len(data)
+        if self._size > self._max_size:
+            self._log.warning('Decompressed request body is bigger than %d bytes.',
+                              self._max_size)
+            self._error = RequestEntityTooLarge(CompressionMiddleware.TOO_LARGE_ERROR_MESSAGE)
+            raise self._error
+        return data
+
+    def _decompress_chunk(self):
+        compressed = self._unconsumed_input or self._read_input()
+        if not compressed:
+            self._finished = True
+            return self._decompressor.flush()
+        # at most one byte more than allowed is decompressed in total
+        data = self._decompressor.decompress(
+            compressed, min(READ_CHUNK_SIZE, self._max_size - self._size + 1))
+        self._unconsumed_input = self._decompressor.unconsumed_tail
+        return data
+
+    def _read_input(self):
+        if self._remaining_input is None:
+            return self._stream.read(READ_CHUNK_SIZE)
+        if self._remaining_input <= 0:
+            return b''
+        chunk = self._stream.read(min(READ_CHUNK_SIZE, self._remaining_input))
+        self._remaining_input -= len(chunk)
+        return chunk
+
+
+def _add_vary(headers, header_name):
+    """
+    Adds a header name to "Vary" header of a response, keeping the names already in it.
+    :param list[(str, str)] headers: Headers of the response.
+    :param str header_name:
+    :returns: The new headers.
+    :rtype: list[(str, str)]
+    """
+    varying = [name.strip() for header, value in headers if header.lower() == 'vary'
+               for name in value.split(',') if name.strip()]
+    if not any(name.lower() in (header_name.lower(), '*') for name in varying):
+        varying.append(header_name)
+    return [(header, value) for header, value in headers if header.lower() != 'vary'] + \
+           [('Vary', ', '.join(varying))]
+
+
+def choose_encoding(accept_encoding):
+    """
+    :param str accept_encoding: Value of "Accept-Encoding" header.
+    :returns: Name of the preferred encoding and its zlib's wbits or None if the client doesn't
+        accept compressed responses.
+    :rtype: (str, int)
+    """
+    qualities = {}
+    for part in accept_encoding.split(','):
+        name_and_params = [item.strip() for item in part.split(';')]
+        if not name_and_params[0]:
+            continue
+        quality = 1.0
+        for param in name_and_params[1:]:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        qualities[name_and_params[0].lower()] = quality
+
+    best = None
+    for name, wbits in RESPONSE_ENCODINGS:
+        quality = qualities.get(name, qualities.get('*', 0.0))
+        if quality > 0 and (best is None or quality > best[0]):
+            best = (quality, (name, wbits))
+    return best[1] if best else None
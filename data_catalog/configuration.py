@@ -20,12 +20,35 @@ Configuration for the Data Catalog app.
 
 import json
 import os
+import re
 from data_catalog import configuration_const
 
 VCAP_APPLICATION = 'VCAP_APPLICATION'
 VCAP_SERVICES = 'VCAP_SERVICES'
 VCAP_APP_PORT = 'VCAP_APP_PORT'
 LOG_LEVEL = 'LOG_LEVEL'
+METRICS_DIR = 'METRICS_DIR'
+ELASTIC_ORG_ROUTING = 'ELASTIC_ORG_ROUTING'
+ELASTIC_NUMBER_OF_SHARDS = 'ELASTIC_NUMBER_OF_SHARDS'
+ELASTIC_NUMBER_OF_REPLICAS = 'ELASTIC_NUMBER_OF_REPLICAS'
+ELASTIC_REFRESH_INTERVAL = 'ELASTIC_REFRESH_INTERVAL'
+STORAGE_BACKEND = 'STORAGE_BACKEND'
+SQLITE_PATH = 'SQLITE_PATH'
+SEARCH_TIMEOUT = 'SEARCH_TIMEOUT'
+SEARCH_TERMINATE_AFTER = 'SEARCH_TERMINATE_AFTER'
+SEARCH_REQUEST_TIMEOUT = 'SEARCH_REQUEST_TIMEOUT'
+SEARCH_TIME_ROUNDING = 'SEARCH_TIME_ROUNDING'
+QUERY_MAX_SIZE = 'QUERY_MAX_SIZE'
+QUERY_MAX_TERMS = 'QUERY_MAX_TERMS'
+QUERY_COST_DEGRADE_THRESHOLD = 'QUERY_COST_DEGRADE_THRESHOLD'
+QUERY_COST_REJECT_THRESHOLD = 'QUERY_COST_REJECT_THRESHOLD'
+COMPRESSION_MIN_SIZE = 'COMPRESSION_MIN_SIZE'
+COMPRESSION_LEVEL = 'COMPRESSION_LEVEL'
+REQUEST_MAX_DECOMPRESSED_SIZE = 'REQUEST_MAX_DECOMPRESSED_SIZE'
+IMPORT_CHUNK_SIZE = 'IMPORT_CHUNK_SIZE'
+IMPORT_CONCURRENCY = 'IMPORT_CONCURRENCY'
+IMPORT_BULK_LOAD_MODE = 'IMPORT_BULK_LOAD_MODE'
+IMPORT_FORCE_MERGE = 'IMPORT_FORCE_MERGE'
 
 
 class DCConfig(object):
@@ -54,9 +77,18 @@ class DCConfig(object):
         # if values aren't found we set defaults that are meant for local operations
         self.app_port = int(os.getenv(VCAP_APP_PORT, '5000'))
         self.log_level = os.getenv(LOG_LEVEL, 'DEBUG')
+        self.metrics_dir = os.getenv(METRICS_DIR) or None
+        if self.metrics_dir and os.path.exists(self.metrics_dir) \
+                and not os.path.isdir(self.metrics_dir):
+            raise InvalidConfigError('{} should be a directory, got {!r}.'.format(
+                METRICS_DIR, self.metrics_dir))
 
         services_config = json.loads(os.environ[VCAP_SERVICES])
         self.elastic = ElasticConfig(services_config)
+        self.search = SearchConfig()
+        self.query_cost = QueryCostConfig()
+        self.compression = CompressionConfig()
+        self.bulk_import = BulkImportConfig()
         self.services_url = ServiceUrlsConfig(services_config)
 
     @staticmethod
@@ -78,6 +110,74 @@ class NoConfigEnvError(Exception):
     pass
 
 
+class InvalidConfigError(ValueError):
+    """
+    Configuration value has a wrong format or is out of range.
+    """
+    pass
+
+
+# ElasticSearch's time value, e.g. "500ms", "30s" or "-1" (disabled)
+TIME_VALUE_PATTERN = re.compile(r'^(-1|\d+(ms|s|m|h|d)?)$')
+STORAGE_BACKENDS = ('elasticsearch', 'sqlite')
+# units of ElasticSearch's date math
+DATE_MATH_UNITS = ('y', 'M', 'w', 'd', 'h', 'H', 'm', 's')
+
+
+def parse_count(value, name, minimum, maximum=None):
+    """
+    :param value: Integer or its string representation.
+    :param str name: Name of the configured value, used in the error message.
+    :param int minimum: The smallest accepted number.
+    :param int maximum: The biggest accepted number, no limit if None.
+    :rtype: int
+    :raises InvalidConfigError:
+    """
+    try:
+        if isinstance(value, (bool, float)):
+            raise TypeError
+        count = int(value)
+    except (TypeError, ValueError):
+        raise InvalidConfigError('{} should be an integer, got {!r}.'.format(name, value))
+    if count < minimum:
+        raise InvalidConfigError('{} should be at least {}, got {!r}.'.format(name, minimum, value))
+    if maximum is not None and count > maximum:
+        raise InvalidConfigError('{} should be at most {}, got {!r}.'.format(name, maximum, value))
+    return count
+
+
+def parse_time_value(value, name):
+    """
+    :param str value: ElasticSearch's time value.
+    :param str name: Name of the configured value, used in the error message.
+    :rtype: str
+    :raises InvalidConfigError:
+    """
+    if not isinstance(value, basestring) or not TIME_VALUE_PATTERN.match(value):
+        raise InvalidConfigError(
+            '{} should be a time value like "1s" or "-1", got {!r}.'.format(name, value))
+    return value
+
+
+def parse_seconds(value, name):
+    """
+    :param value: Number of seconds (can be fractional) or its string representation.
+    :param str name: Name of the configured value, used in the error message.
+    :rtype: float
+    :raises InvalidConfigError:
+    """
+    try:
+        if isinstance(value, bool):
+            raise TypeError
+        seconds = float(value)
+    except (TypeError, ValueError):
+        raise InvalidConfigError('{} should be a number of seconds, got {!r}.'.format(name, value))
+    # also rejects NaN
+    if not 0 < seconds < float('inf'):
+        raise InvalidConfigError('{} should be more than 0, got {!r}.'.format(name, value))
+    return seconds
+
+
 class ElasticConfig(object):
 
     """
@@ -85,13 +185,25 @@ class ElasticConfig(object):
     """
 
     def __init__(self, services_config):
+        # alias pointing to the current version of the index (see data_catalog.metadata_index)
         self.elastic_index = 'trustedanalytics-meta'
         self.elastic_metadata_type = 'dataset'
         self.elastic_categories_type = 'categories'
-
+        self.org_routing = os.getenv(ELASTIC_ORG_ROUTING, 'false').lower() == 'true'
+        # defaults are ElasticSearch's, the number of shards can only be changed by reindexing
+        self.number_of_shards = parse_count(
+            os.getenv(ELASTIC_NUMBER_OF_SHARDS, '5'), ELASTIC_NUMBER_OF_SHARDS, 1)
+        self.number_of_replicas = parse_count(
+            os.getenv(ELASTIC_NUMBER_OF_REPLICAS, '1'), ELASTIC_NUMBER_OF_REPLICAS, 0)
+        self.refresh_interval = parse_time_value(
+            os.getenv(ELASTIC_REFRESH_INTERVAL, '1s'), ELASTIC_REFRESH_INTERVAL)
+
+        index_settings = dict(configuration_const.METADATA_SETTINGS)
+        index_settings['number_of_shards'] = self.number_of_shards
+        index_settings.update(self.dynamic_index_settings)
         self.metadata_index_setup = {
             'settings': {
-                'index': configuration_const.METADATA_SETTINGS
+                'index': index_settings
             },
             'mappings': {
                 self.elastic_metadata_type: configuration_const.METADATA_MAPPING
@@ -106,6 +218,105 @@ class ElasticConfig(object):
             self.elastic_hostname = 'localhost'
             self.elastic_port = 9200
 
+        # "sqlite" keeps the entries in an embedded database instead of ElasticSearch
+        # (see data_catalog.sqlite_storage)
+        self.storage_backend = os.getenv(STORAGE_BACKEND, 'elasticsearch').lower()
+        if self.storage_backend not in STORAGE_BACKENDS:
+            raise InvalidConfigError('{} should be one of {}, got {!r}.'.format(
+                STORAGE_BACKEND, ', '.join(STORAGE_BACKENDS), self.storage_backend))
+        self.sqlite_path = os.getenv(SQLITE_PATH, 'data_catalog.sqlite')
+
+    @property
+    def dynamic_index_settings(self):
+        """
+        Configured index settings that can be changed on a live index.
+        :rtype: dict
+        """
+        return {
+            'number_of_replicas': self.number_of_replicas,
+            'refresh_interval': self.refresh_interval
+        }
+
+
+class SearchConfig(object):
+
+    """
+    Time budgets of searches.
+    """
+
+    def __init__(self):
+        # ElasticSearch returns hits collected until this time passes, empty means no limit
+        self.timeout = os.getenv(SEARCH_TIMEOUT, '5s')
+        if self.timeout:
+            parse_time_value(self.timeout, SEARCH_TIMEOUT)
+        # number of documents collected on a shard after which the search ends, 0 means no limit
+        self.terminate_after = parse_count(
+            os.getenv(SEARCH_TERMINATE_AFTER, '0'), SEARCH_TERMINATE_AFTER, 0)
+        # seconds after which Data Catalog stops waiting for ElasticSearch's response
+        self.request_timeout = parse_seconds(
+            os.getenv(SEARCH_REQUEST_TIMEOUT, '10'), SEARCH_REQUEST_TIMEOUT)
+        # ElasticSearch's date math unit (e.g. "m", "h", "d") to which open-ended and relative
+        # time ranges are rounded, so that equal filters can be cached, empty means no rounding
+        self.time_rounding = os.getenv(SEARCH_TIME_ROUNDING, 'm')
+        if self.time_rounding and self.time_rounding not in DATE_MATH_UNITS:
+            raise InvalidConfigError('{} should be one of {}, got {!r}.'.format(
+                SEARCH_TIME_ROUNDING, ', '.join(DATE_MATH_UNITS), self.time_rounding))
+
+
+class QueryCostConfig(object):
+
+    """
+    Limits of search queries (costs are computed by data_catalog.query_cost).
+    """
+
+    def __init__(self):
+        # bigger sizes are lowered to this one
+        self.max_size = parse_count(os.getenv(QUERY_MAX_SIZE, '1000'), QUERY_MAX_SIZE, 1)
+        # queries with more values in filters are rejected
+        self.max_terms = parse_count(os.getenv(QUERY_MAX_TERMS, '1000'), QUERY_MAX_TERMS, 1)
+        # aggregations are dropped from queries that cost more
+        self.degrade_threshold = parse_count(
+            os.getenv(QUERY_COST_DEGRADE_THRESHOLD, '2000'), QUERY_COST_DEGRADE_THRESHOLD, 0)
+        # queries that cost more (after dropping aggregations) are rejected
+        self.reject_threshold = parse_count(
+            os.getenv(QUERY_COST_REJECT_THRESHOLD, '5000'), QUERY_COST_REJECT_THRESHOLD, 0)
+
+
+class CompressionConfig(object):
+
+    """
+    Compression of HTTP bodies (done by data_catalog.compression).
+    """
+
+    def __init__(self):
+        # responses with fewer bytes aren't compressed, streamed responses always are
+        self.min_size = parse_count(
+            os.getenv(COMPRESSION_MIN_SIZE, '1024'), COMPRESSION_MIN_SIZE, 0)
+        # zlib's compression level, from 1 (fastest) to 9 (smallest)
+        self.level = parse_count(os.getenv(COMPRESSION_LEVEL, '6'), COMPRESSION_LEVEL, 1, 9)
+        # compressed requests bigger than this after decompression are rejected
+        self.max_request_size = parse_count(
+            os.getenv(REQUEST_MAX_DECOMPRESSED_SIZE, str(100 * 1024 ** 2)),
+            REQUEST_MAX_DECOMPRESSED_SIZE, 1)
+
+
+class BulkImportConfig(object):
+
+    """
+    Admin import of metadata entries (done by data_catalog.bulk_import).
+    """
+
+    def __init__(self):
+        # number of entries in a single bulk request
+        self.chunk_size = parse_count(os.getenv(IMPORT_CHUNK_SIZE, '500'), IMPORT_CHUNK_SIZE, 1)
+        # number of bulk requests sent at the same time
+        self.concurrency = parse_count(
+            os.getenv(IMPORT_CONCURRENCY, '4'), IMPORT_CONCURRENCY, 1)
+        # whether refreshing and replication are turned off during imports and reindexing
+        self.bulk_load_mode = os.getenv(IMPORT_BULK_LOAD_MODE, 'true').lower() == 'true'
+        # whether the index is merged to a single segment after an import
+        self.force_merge = os.getenv(IMPORT_FORCE_MERGE, 'false').lower() == 'true'
+
 
 class ServiceUrlsConfig(object):
 
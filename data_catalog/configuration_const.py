@@ -18,6 +18,28 @@
 Configuration values that change very seldom.
 """
 
+# Name of the not analyzed copies of fields. They're used for aggregations, which need whole
+# values and read them from doc values (on disk) instead of fielddata (on heap).
+RAW_SUBFIELD = 'raw'
+# Name of the lowercased copies of whole values of the same fields, used for filtering,
+# so filters match regardless of case (e.g. "csv" matches "CSV").
+LOWERCASE_SUBFIELD = 'lowercase'
+RAW_SUBFIELD_FIELDS = ['category', 'format', 'sourceUri', 'targetUri']
+# longer terms can't be indexed by Lucene
+MAX_TERM_LENGTH = 8191
+RAW_SUBFIELD_MAPPING = {
+    RAW_SUBFIELD: {
+        'type': 'string',
+        'index': 'not_analyzed',
+        'doc_values': True,
+        'ignore_above': MAX_TERM_LENGTH
+    },
+    LOWERCASE_SUBFIELD: {
+        'type': 'string',
+        'analyzer': 'lowercase_keyword_analyzer'
+    }
+}
+
 METADATA_MAPPING = {
     '_all': {
         'enabled': False
@@ -31,10 +53,12 @@ METADATA_MAPPING = {
             'type': 'string'
         },
         'format': {
-            'type': 'string'
+            'type': 'string',
+            'fields': RAW_SUBFIELD_MAPPING
         },
         'category': {
-            'type': 'string'
+            'type': 'string',
+            'fields': RAW_SUBFIELD_MAPPING
         },
         'size': {
             'type': 'long'
@@ -44,10 +68,12 @@ METADATA_MAPPING = {
         },
         'sourceUri': {
             'type': 'string',
-            'analyzer': 'uri_analyzer'
+            'analyzer': 'uri_analyzer',
+            'fields': RAW_SUBFIELD_MAPPING
         },
         'targetUri': {
-            'type': 'string'
+            'type': 'string',
+            'fields': RAW_SUBFIELD_MAPPING
         },
         'storeType': {
             'type': 'string'
@@ -55,12 +81,29 @@ METADATA_MAPPING = {
         'creationTime': {
             'type': 'date'
         },
+        'indexedAt': {
+            'type': 'date'
+        },
         'orgUUID': {
             'type': 'string',
             'index': 'not_analyzed'
         },
         'isPublic': {
             'type': 'boolean'
+        },
+        'visibleTo': {
+            'type': 'string',
+            'index': 'not_analyzed'
+        },
+        'titleSuggest': {
+            'type': 'completion',
+            'analyzer': 'simple',
+            'payloads': False,
+            'context': {
+                'visibility': {
+                    'type': 'category'
+                }
+            }
         }
     }
 }
@@ -71,6 +114,10 @@ METADATA_SETTINGS = {
             'uri_stop_filter': {
                 'type': 'stop',
                 'stopwords': ['http', 'https', 'ftp', 'www', 'com']
+            },
+            'term_length_filter': {
+                'type': 'truncate',
+                'length': MAX_TERM_LENGTH
             }
         },
         'analyzer': {
@@ -78,6 +125,11 @@ METADATA_SETTINGS = {
                 'type': 'custom',
                 'tokenizer': 'lowercase',
                 'filter': 'uri_stop_filter'
+            },
+            'lowercase_keyword_analyzer': {
+                'type': 'custom',
+                'tokenizer': 'keyword',
+                'filter': ['lowercase', 'term_length_filter']
             }
         }
     }
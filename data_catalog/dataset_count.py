@@ -16,8 +16,6 @@
 
 import flask
 
-from elasticsearch import Elasticsearch
-
 from data_catalog.bases import DataCatalogResource
 from data_catalog.search import DataSetSearch
 
@@ -31,9 +29,6 @@ class DataSetCountResource(DataCatalogResource):
 
     def __init__(self):
         super(DataSetCountResource, self).__init__()
-        self._elastic_search = Elasticsearch(
-            '{}:{}'.format(self._config.elastic.elastic_hostname,
-                           self._config.elastic.elastic_port))
         self._search = DataSetSearch()
 
     def get(self):
@@ -43,6 +38,6 @@ class DataSetCountResource(DataCatalogResource):
         args = flask.request.args
         params = self._search.get_params_from_request_args(args)
 
-        return self._search.search({}, flask.g.org_uuid_list,
-                                   params['dataset_filtering'],
-                                   flask.g.is_admin)['total']
+        return self._search.count(flask.g.org_uuid_list,
+                                  params['dataset_filtering'],
+                                  flask.g.is_admin)
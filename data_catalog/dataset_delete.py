@@ -20,6 +20,7 @@ Removing of data sets.
 
 import requests
 from data_catalog.bases import DataCatalogModel
+from data_catalog.metrics import measure_outbound_call
 
 
 class DataSetRemover(DataCatalogModel):
@@ -40,7 +41,7 @@ class DataSetRemover(DataCatalogModel):
         metadata = elastic_data["_source"]
         target_uri = elastic_data["_source"]["targetUri"]
 
-        self._delete_entry(entry_id)
+        self._delete_entry(entry_id, metadata['orgUUID'])
 
         return {
             "deleted_from_downloader": self._delete_from_downloader(target_uri, token),
@@ -73,7 +74,7 @@ class DataSetRemover(DataCatalogModel):
     def _external_delete(self, service_name, token, url, data=None, parameters=None):
         """
         Deletes a data set from an external service.
-        :param str service_name: Service name. Only used in logging.
+        :param str service_name: Service name. Used in logging and metrics.
         :param str token: Security token that will be sent with the request.
         :param str url: URL to which to send DELETE message.
         :param dict data: Data to send in the DELETE request.
@@ -82,10 +83,13 @@ class DataSetRemover(DataCatalogModel):
         :rtype: bool
         """
         self._log.info('Sending delete request to: %s', url)
-        response = requests.delete(url,
-                                   headers={'Authorization': token},
-                                   json=data,
-                                   params=parameters)
+        metrics_service = service_name.lower().replace(' ', '_')
+        with measure_outbound_call(metrics_service) as call:
+            response = requests.delete(url,
+                                       headers={'Authorization': token},
+                                       json=data,
+                                       params=parameters)
+            call.failed = response.status_code != 200
         if response.status_code == 200:
             return True
         else:
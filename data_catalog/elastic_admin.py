@@ -19,11 +19,15 @@ Endpoint for administrative tasks on Data Catalog and its data.
 """
 
 import flask
-from elasticsearch import Elasticsearch
-from elasticsearch.exceptions import RequestError, ConnectionError
+from elasticsearch.exceptions import RequestError, ConnectionError, NotFoundError
+from flask_restful import abort
 
-from data_catalog.bases import DataCatalogResource
-from data_catalog.metadata_entry import MetadataIndexingTransformer, InvalidEntryError
+from data_catalog.bases import DataCatalogResource, create_elastic_search
+from data_catalog.bulk_import import BulkImporter, BulkLoadMode
+from data_catalog.codec import iter_json_array
+from data_catalog.configuration import InvalidConfigError, parse_count, parse_time_value
+from data_catalog.metadata_index import MetadataIndex, Reindexer, ReindexJobs
+from data_catalog.routing import OrgRouting
 
 
 class ElasticSearchAdminResource(DataCatalogResource):
@@ -31,53 +35,333 @@ class ElasticSearchAdminResource(DataCatalogResource):
     Contains REST endpoint for managing elastic search data
     """
 
+    CACHE_METRICS = ['request_cache', 'query_cache']
+
     def __init__(self):
         super(ElasticSearchAdminResource, self).__init__()
-        self._elastic_search = Elasticsearch(
-            '{}:{}'.format(self._config.elastic.elastic_hostname,
-                           self._config.elastic.elastic_port))
-        self._parser = MetadataIndexingTransformer()
+        self._elastic_search = create_elastic_search(self._config.elastic)
+        self._routing = OrgRouting(self._config.elastic, self._elastic_search)
+        self._index = MetadataIndex(self._elastic_search, self._config.elastic)
+        self._importer = BulkImporter(self._elastic_search,
+                                      self._config.elastic.elastic_index,
+                                      self._config.elastic.elastic_metadata_type,
+                                      self._routing,
+                                      self._config.bulk_import)
+
+    def get(self):
+        """
+        Get hit statistics of ElasticSearch's caches for the index.
+        "requestCache" holds whole results of facet and count queries,
+        "queryCache" holds results of filters.
+        """
+        if not flask.g.is_admin:
+            self._log.warn('Getting cache statistics aborted, not enough privileges '
+                           '(admin required)')
+            return None, 403
+        try:
+            stats = self._elastic_search.indices.stats(
+                index=self._config.elastic.elastic_index,
+                metric=','.join(self.CACHE_METRICS))
+        except NotFoundError:
+            self._log.exception("Index doesn't exist")
+            return None, 404
+        except ConnectionError:
+            self._log.exception("Failed connection to ElasticSearch")
+            return None, 503
+        total_stats = stats['_all']['total']
+        return {
+            'requestCache': self._get_cache_stats(total_stats['request_cache']),
+            'queryCache': self._get_cache_stats(total_stats['query_cache'])
+        }
+
+    @staticmethod
+    def _get_cache_stats(es_cache_stats):
+        hits = es_cache_stats.get('hit_count', 0)
+        misses = es_cache_stats.get('miss_count', 0)
+        lookups = hits + misses
+        return {
+            'hitCount': hits,
+            'missCount': misses,
+            'hitRate': float(hits) / lookups if lookups else 0.0,
+            'evictions': es_cache_stats.get('evictions', 0),
+            'memorySizeInBytes': es_cache_stats.get('memory_size_in_bytes', 0)
+        }
 
     def delete(self):
         """
-        Delete elastic search index
+        Delete elastic search index (all indices the alias points to)
         """
         self._log.info('Deleting the ElasticSearch index.')
         if not flask.g.is_admin:
             self._log.warn('Deleting index aborted, not enough privileges (admin required)')
             return None, 403
-        # pylint: disable=unexpected-keyword-arg
-        self._elastic_search.indices.delete(
-            self._config.elastic.elastic_index,
-            ignore=404)
+        self._index.delete()
 
     def put(self):
         """
-        Add all data into elastic search. Data that are corrupted are ommited
+        Add all data into elastic search. Data that are corrupted are ommited.
+        The body (a JSON array of entries) is read and indexed in parts, so it can be bigger
+        than the available memory. Returns numbers of indexed, rejected (invalid)
+        and failed entries. The index isn't refreshed or replicated until the import ends,
+        unless "bulkLoadMode=false" is passed (the caller sending many imports in a row
+        turns the mode on and off once with ElasticSearchBulkLoadResource).
         """
         self._log.info("Adding data to elastic search")
         if not flask.g.is_admin:
             self._log.warn('Inserting data aborted, not enough privileges (admin required)')
             return None, 403
-        data = flask.request.get_json(force=True)
 
         try:
-            for entry in data:
-                try:
-                    self._parser.transform(entry)
-                    self._elastic_search.index(
-                        index=self._config.elastic.elastic_index,
-                        doc_type=self._config.elastic.elastic_metadata_type,
-                        id=entry["id"],
-                        body=entry
-                    )
-                except InvalidEntryError as ex:
-                    self._log.exception(ex)
-        except RequestError:
+            self._create_index_if_missing()
+            with self._get_bulk_load_mode(flask.request.args.get('bulkLoadMode') != 'false'):
+                summary = self._importer.import_entries(iter_json_array(flask.request.stream))
+        except (RequestError, ValueError):
             self._log.exception("Malformed data")
             return None, 400
         except ConnectionError:
             self._log.exception("Failed connection to ElasticSearch")
             return None, 503
         self._log.info("Data added")
-        return None, 200
+        return summary, 200
+
+    def _create_index_if_missing(self):
+        """
+        The index could have been deleted (e.g. while migrating data), so it's created again
+        with Data Catalog's settings and mappings instead of ElasticSearch's defaults.
+        """
+        self._index.create_if_missing()
+
+    def _get_bulk_load_mode(self, requested=True):
+        return _create_bulk_load_mode(self._elastic_search, self._config, requested)
+
+
+class ElasticSearchBulkLoadResource(DataCatalogResource):
+
+    """
+    Bulk load mode (see BulkLoadMode) spanning many admin imports, e.g. ones sent
+    in chunks by the migration tool with "bulkLoadMode=false".
+    """
+
+    def __init__(self):
+        super(ElasticSearchBulkLoadResource, self).__init__()
+        self._elastic_search = create_elastic_search(self._config.elastic)
+
+    def post(self):
+        """
+        Turn the bulk load mode on (if it's enabled in the configuration), creating
+        the index if it's missing like the import does. Returns the names of the loaded indices.
+        """
+        if not flask.g.is_admin:
+            self._log.warn('Starting bulk load aborted, not enough privileges (admin required)')
+            return None, 403
+        try:
+            MetadataIndex(self._elastic_search, self._config.elastic).create_if_missing()
+            indices = _create_bulk_load_mode(self._elastic_search, self._config).start()
+        except NotFoundError:
+            self._log.exception("Index doesn't exist")
+            return None, 404
+        except ConnectionError:
+            self._log.exception("Failed connection to ElasticSearch")
+            return None, 503
+        return {'indices': indices}, 200
+
+    def delete(self):
+        """
+        End a bulk load started with POST, the settings are restored when it's the last
+        one running. Returns the names of the loaded indices.
+        """
+        if not flask.g.is_admin:
+            self._log.warn('Ending bulk load aborted, not enough privileges (admin required)')
+            return None, 403
+        try:
+            indices = _create_bulk_load_mode(self._elastic_search, self._config).finish()
+        except NotFoundError:
+            self._log.exception("Index doesn't exist")
+            return None, 404
+        except ConnectionError:
+            self._log.exception("Failed connection to ElasticSearch")
+            return None, 503
+        return {'indices': indices}, 200
+
+
+def _create_bulk_load_mode(elastic_search, config, requested=True):
+    return BulkLoadMode(elastic_search,
+                        config.elastic,
+                        config.elastic.elastic_index,
+                        force_merge=config.bulk_import.force_merge,
+                        enabled=requested and config.bulk_import.bulk_load_mode)
+
+
+class ElasticSearchReindexResource(DataCatalogResource):
+
+    """
+    Moves metadata entries to a new version of the index, created with the current
+    settings and mappings, while the service keeps working on the old one.
+    """
+
+    CONFLICT_ERROR_MESSAGE = 'New version of the index already exists, ' \
+                             'another reindex is probably running.'
+
+    def __init__(self):
+        super(ElasticSearchReindexResource, self).__init__()
+        self._elastic_search = create_elastic_search(self._config.elastic)
+        self._jobs = ReindexJobs(self._elastic_search,
+                                 self._config.elastic,
+                                 Reindexer(self._elastic_search,
+                                           self._config.elastic,
+                                           self._config.bulk_import))
+
+    def post(self):
+        """
+        Creates a new version of the index and starts copying the entries to it in the
+        background, the alias is pointed to it at the end. Returns 202 with the reindex's
+        status, which can be followed at the URL from the "Location" header.
+        """
+        if not flask.g.is_admin:
+            self._log.warn('Reindex aborted, not enough privileges (admin required)')
+            return None, 403
+        try:
+            status = self._jobs.start()
+        except NotFoundError:
+            self._log.exception("Index doesn't exist")
+            return None, 404
+        except RequestError as ex:
+            if 'IndexAlreadyExists' in str(ex.error):
+                self._log.exception(self.CONFLICT_ERROR_MESSAGE)
+                abort(409, message=self.CONFLICT_ERROR_MESSAGE)
+            raise
+        except ConnectionError:
+            self._log.exception("Failed connection to ElasticSearch")
+            return None, 503
+        return status, 202, {'Location': '{}/{}'.format(flask.request.base_url, status['index'])}
+
+
+class ElasticSearchReindexStatusResource(DataCatalogResource):
+
+    """
+    Status of a reindex started with ElasticSearchReindexResource.
+    """
+
+    def __init__(self):
+        super(ElasticSearchReindexStatusResource, self).__init__()
+        self._elastic_search = create_elastic_search(self._config.elastic)
+        self._jobs = ReindexJobs(self._elastic_search, self._config.elastic)
+
+    def get(self, index_name):
+        """
+        Get the status of the reindex into the given index: "running", "finished" (with
+        numbers of copied entries) or "failed" (with the error, the new index is deleted).
+        """
+        if not flask.g.is_admin:
+            self._log.warn('Getting reindex status aborted, not enough privileges '
+                           '(admin required)')
+            return None, 403
+        try:
+            return self._jobs.get_status(index_name), 200
+        except NotFoundError:
+            self._log.exception('No reindex into %s', index_name)
+            return None, 404
+        except ConnectionError:
+            self._log.exception("Failed connection to ElasticSearch")
+            return None, 503
+
+
+class ElasticSearchSettingsResource(DataCatalogResource):
+
+    """
+    Shard, replica and refresh settings of the live index.
+    """
+
+    # REST field names of the settings and their names in ElasticSearch
+    SETTINGS_FIELDS = {
+        'numberOfShards': 'index.number_of_shards',
+        'numberOfReplicas': 'index.number_of_replicas',
+        'refreshInterval': 'index.refresh_interval'
+    }
+    DYNAMIC_FIELDS = ['numberOfReplicas', 'refreshInterval']
+    STATIC_SETTING_ERROR_MESSAGE = 'Only numberOfReplicas and refreshInterval can be changed ' \
+                                   'on a live index, other settings need a reindex.'
+
+    def __init__(self):
+        super(ElasticSearchSettingsResource, self).__init__()
+        self._elastic_search = create_elastic_search(self._config.elastic)
+
+    def get(self):
+        """
+        Get the settings of the indices behind the alias and the configured ones
+        (used for new indices).
+        """
+        if not flask.g.is_admin:
+            self._log.warn('Getting index settings aborted, not enough privileges (admin required)')
+            return None, 403
+        try:
+            settings = self._elastic_search.indices.get_settings(
+                index=self._config.elastic.elastic_index,
+                name=','.join(self.SETTINGS_FIELDS.values()),
+                flat_settings=True)
+        except NotFoundError:
+            self._log.exception("Index doesn't exist")
+            return None, 404
+        except ConnectionError:
+            self._log.exception("Failed connection to ElasticSearch")
+            return None, 503
+        return {
+            'indices': {index: self._from_es_settings(index_settings['settings'])
+                        for index, index_settings in settings.items()},
+            'configured': self._get_configured_settings()
+        }
+
+    def put(self):
+        """
+        Apply the dynamic settings (numberOfReplicas and refreshInterval) to the live index.
+        Settings missing from the body are set to the configured values.
+        """
+        if not flask.g.is_admin:
+            self._log.warn('Changing index settings aborted, not enough privileges '
+                           '(admin required)')
+            return None, 403
+        body = flask.request.get_json(force=True, silent=True) or {}
+        if not isinstance(body, dict) or not set(body).issubset(self.DYNAMIC_FIELDS):
+            abort(400, message=self.STATIC_SETTING_ERROR_MESSAGE)
+        settings = {field: value for field, value in self._get_configured_settings().items()
+                    if field in self.DYNAMIC_FIELDS}
+        settings.update(body)
+        try:
+            settings['numberOfReplicas'] = parse_count(settings['numberOfReplicas'],
+                                                       'numberOfReplicas', 0)
+            settings['refreshInterval'] = parse_time_value(settings['refreshInterval'],
+                                                           'refreshInterval')
+        except InvalidConfigError as ex:
+            abort(400, message=str(ex))
+
+        self._log.info('Changing index settings to %s', settings)
+        try:
+            self._elastic_search.indices.put_settings(
+                index=self._config.elastic.elastic_index,
+                body={self.SETTINGS_FIELDS[field]: value for field, value in settings.items()})
+        except NotFoundError:
+            self._log.exception("Index doesn't exist")
+            return None, 404
+        except ConnectionError:
+            self._log.exception("Failed connection to ElasticSearch")
+            return None, 503
+        return settings, 200
+
+    def _get_configured_settings(self):
+        elastic_config = self._config.elastic
+        return {
+            'numberOfShards': elastic_config.number_of_shards,
+            'numberOfReplicas': elastic_config.number_of_replicas,
+            'refreshInterval': elastic_config.refresh_interval
+        }
+
+    def _from_es_settings(self, es_settings):
+        """
+        ElasticSearch returns numbers as strings and omits the settings left at their defaults.
+        """
+        settings = {}
+        for field, es_name in self.SETTINGS_FIELDS.items():
+            if es_name in es_settings:
+                value = es_settings[es_name]
+                settings[field] = value if field == 'refreshInterval' else int(value)
+        return settings
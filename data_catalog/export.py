@@ -0,0 +1,142 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Streaming export of the metadata visible to the user.
+"""
+
+import flask
+from elasticsearch.exceptions import RequestError, ConnectionError, TransportError
+from flask_restful import abort
+
+from data_catalog.bases import DataCatalogModel, DataCatalogResource
+from data_catalog.codec import codec
+from data_catalog.query_translation import ElasticSearchQueryTranslator, InvalidQueryError
+from data_catalog.search import DataSetSearch, IndexConnectionError, get_routed_orgs
+
+
+class DataSetExportResource(DataCatalogResource):
+
+    """
+    Exports all of the metadata entries matching a query as newline delimited JSON (NDJSON).
+    """
+
+    NDJSON_MIMETYPE = 'application/x-ndjson'
+
+    def __init__(self):
+        super(DataSetExportResource, self).__init__()
+        self._export = DataSetExport()
+
+    def get(self):
+        """
+        Streams all data sets matching the query, one JSON document per line.
+        Query, filters, "orgs", "onlyPublic" and "onlyPrivate" work the same way as
+        in the search endpoint. "from" and "size" fields of the query are ignored.
+        The data sets are sorted by their IDs; "after" (an ID) continues an interrupted export
+        with the data sets following it.
+        """
+        args = flask.request.args
+        params = DataSetSearch.get_params_from_request_args(args)
+        try:
+            lines = self._export.export(
+                args.get('query'),
+                flask.g.get('org_uuid_list'),
+                params['dataset_filtering'],
+                flask.g.is_admin,
+                args.get('after'))
+        except InvalidQueryError:
+            abort(400, message=DataSetSearch.INVALID_QUERY_ERROR_MESSAGE)
+        except IndexConnectionError:
+            abort(500, message=DataSetSearch.NO_CONNECTION_ERROR_MESSAGE)
+
+        return flask.Response(flask.stream_with_context(lines), mimetype=self.NDJSON_MIMETYPE)
+
+
+class DataSetExport(DataCatalogModel):
+
+    """
+    Scrolls through the ElasticSearch index, so that only one page of hits
+    is kept in memory at a time.
+    """
+
+    SCROLL_TIME = '1m'
+    PAGE_SIZE = 500
+
+    def __init__(self):
+        super(DataSetExport, self).__init__()
+        self._translator = ElasticSearchQueryTranslator(self._config.search.time_rounding)
+
+    def export(self, query, org_uuid_list, dataset_filtering, is_admin, after=None):
+        """
+        Starts scrolling over the data sets matching the query.
+        The first page is fetched right away, so that errors in the query or connection
+        are reported before anything is sent to the client.
+        :param str query: Data Catalog query.
+        :param list[str] org_uuid_list: Organisations of the user.
+        :param DataSetFiltering dataset_filtering:
+        :param bool is_admin:
+        :param str after: When given, only data sets with greater IDs are exported.
+        :returns: A generator of NDJSON lines with metadata entries (with their IDs).
+        :raises InvalidQueryError:
+        :raises IndexConnectionError:
+        """
+        after_uid = None
+        if after:
+            after_uid = '{}#{}'.format(self._config.elastic.elastic_metadata_type, after)
+        es_query = self._translator.translate_for_export(
+            query, org_uuid_list, dataset_filtering, is_admin, after_uid)
+        es_query['size'] = self.PAGE_SIZE
+        try:
+            first_page = self._elastic_search.search(
+                index=self._config.elastic.elastic_index,
+                doc_type=self._config.elastic.elastic_metadata_type,
+                body=es_query,
+                scroll=self.SCROLL_TIME,
+                **self._routing.search_params(get_routed_orgs(org_uuid_list, dataset_filtering)))
+        except RequestError:
+            self._log.exception(DataSetSearch.INVALID_QUERY_ERROR_MESSAGE)
+            raise InvalidQueryError(DataSetSearch.INVALID_QUERY_ERROR_MESSAGE)
+        except ConnectionError:
+            self._log.exception(DataSetSearch.NO_CONNECTION_ERROR_MESSAGE)
+            raise IndexConnectionError(DataSetSearch.NO_CONNECTION_ERROR_MESSAGE)
+        return self._generate_lines(first_page)
+
+    def _generate_lines(self, page):
+        scroll_id = page.get('_scroll_id')
+        try:
+            while page['hits']['hits']:
+                for hit in page['hits']['hits']:
+                    yield self._hit_to_line(hit)
+                page = self._elastic_search.scroll(scroll_id=scroll_id, scroll=self.SCROLL_TIME)
+                scroll_id = page.get('_scroll_id', scroll_id)
+        finally:
+            # also runs when the client disconnects in the middle of the export
+            self._clear_scroll(scroll_id)
+
+    @staticmethod
+    def _hit_to_line(hit):
+        entry = hit['_source']
+        entry['id'] = hit['_id']
+        return codec.dumps(entry) + '\n'
+
+    def _clear_scroll(self, scroll_id):
+        if not scroll_id:
+            return
+        try:
+            self._elastic_search.clear_scroll(scroll_id=scroll_id)
+        except TransportError:
+            self._log.warning('Failed to clear the scroll context, it will expire after %s.',
+                              self.SCROLL_TIME)
@@ -17,26 +17,40 @@
 from datetime import datetime
 from urlparse import urlparse
 
-from elasticsearch import Elasticsearch
 from elasticsearch.exceptions import RequestError, ConnectionError, NotFoundError
 import flask
 from flask import abort
 from cerberus import Validator
 
-from data_catalog.bases import DataCatalogResource
-from data_catalog.bases import DataCatalogModel
+from data_catalog.bases import (DataCatalogResource, DataCatalogModel, create_elastic_search,
+                                create_storage)
 from data_catalog.dataset_delete import DataSetRemover
 from data_catalog.notifier import CFNotifier
+from data_catalog.routing import ORG_UUID_FIELD
 
 # TODO dirty, but testable
 CURRENT_TIME_FUNCTION = datetime.now
+CURRENT_UTC_TIME_FUNCTION = datetime.utcnow
 
 TITLE_FIELD = 'title'
 CREATION_TIME_FIELD = 'creationTime'
 CATEGORY_FIELD = 'category'
 TARGET_URI_FIELD = 'targetUri'
 IS_PUBLIC_FIELD = 'isPublic'
-ORG_UUID_FIELD = 'orgUUID'
+# derived from orgUUID and isPublic at indexing time, not a part of the entry sent by users
+VISIBLE_TO_FIELD = 'visibleTo'
+PUBLIC_VISIBILITY_MARKER = 'public'
+# derived from title, orgUUID and isPublic, used for title suggestions
+TITLE_SUGGEST_FIELD = 'titleSuggest'
+SUGGEST_VISIBILITY_CONTEXT = 'visibility'
+# every entry is suggested in this context (used by admins)
+ALL_ORGS_VISIBILITY_MARKER = 'all'
+DERIVED_FIELDS = [VISIBLE_TO_FIELD, TITLE_SUGGEST_FIELD]
+# UTC time of the entry's last write, used to find entries changed while the index is copied
+INDEXED_AT_FIELD = 'indexedAt'
+# kept only for the index, left out of entries returned by the API
+INTERNAL_FIELDS = DERIVED_FIELDS + [INDEXED_AT_FIELD]
+DERIVED_FROM_FIELDS = [TITLE_FIELD, ORG_UUID_FIELD, IS_PUBLIC_FIELD]
 
 CERBERUS_SCHEMA = {
     CATEGORY_FIELD: {'required': True, 'type': 'string'},
@@ -65,8 +79,21 @@ class MetadataIndexingTransformer(DataCatalogModel):
         """
         Executes the whole process of validation and adjustment of metadata entry.
         """
+        # derived fields may come with entries exported from the index, they're computed again
+        for field in INTERNAL_FIELDS:
+            entry.pop(field, None)
         self._validate_entry(entry)
         self._fill_out_creation_time(entry)
+        self.fill_out_derived_fields(entry)
+        entry[INDEXED_AT_FIELD] = get_indexed_at()
+
+    @staticmethod
+    def fill_out_derived_fields(entry):
+        """
+        Sets the fields that are computed from other fields of the entry to speed up searching.
+        """
+        entry[VISIBLE_TO_FIELD] = get_visible_to(entry)
+        entry[TITLE_SUGGEST_FIELD] = get_title_suggest(entry)
 
     def _validate_entry(self, entry):
         """
@@ -94,6 +121,54 @@ class MetadataIndexingTransformer(DataCatalogModel):
             entry[CREATION_TIME_FIELD] = CURRENT_TIME_FUNCTION().isoformat()
 
 
+def without_internal_fields(entry):
+    """
+    :param dict entry: Metadata entry read from the index.
+    :returns: The entry without the fields kept only for the index.
+    :rtype: dict
+    """
+    return {field: value for field, value in entry.items() if field not in INTERNAL_FIELDS}
+
+
+def get_indexed_at():
+    """
+    :returns: Value of "indexedAt" field for an entry written now.
+    :rtype: str
+    """
+    return CURRENT_UTC_TIME_FUNCTION().isoformat()
+
+
+def get_visible_to(entry):
+    """
+    :param dict entry: Metadata entry.
+    :returns: Values of "visibleTo" field: UUID of the entry's organisation
+        and a marker of public data sets if the entry is public.
+    :rtype: list[str]
+    """
+    visible_to = [entry[ORG_UUID_FIELD].lower()]
+    if entry[IS_PUBLIC_FIELD]:
+        visible_to.append(PUBLIC_VISIBILITY_MARKER)
+    return visible_to
+
+
+def get_title_suggest(entry):
+    """
+    :param dict entry: Metadata entry.
+    :returns: Value of the completion field suggesting the entry's title. Title is suggested
+        for a prefix of any of its words, only to users that can see the entry.
+    :rtype: dict
+    """
+    title = entry[TITLE_FIELD]
+    words = title.split()
+    return {
+        'input': [' '.join(words[position:]) for position in range(len(words))],
+        'output': title,
+        'context': {
+            SUGGEST_VISIBILITY_CONTEXT: get_visible_to(entry) + [ALL_ORGS_VISIBILITY_MARKER]
+        }
+    }
+
+
 class InvalidEntryError(Exception):
 
     def __init__(self, value):
@@ -117,9 +192,8 @@ class MetadataEntryResource(DataCatalogResource):
 
     def __init__(self):
         super(MetadataEntryResource, self).__init__()
-        self._elastic_search = Elasticsearch(
-            '{}:{}'.format(self._config.elastic.elastic_hostname,
-                           self._config.elastic.elastic_port))
+        self._storage = create_storage(self._config.elastic,
+                                       create_elastic_search(self._config.elastic))
         self._parser = MetadataIndexingTransformer()
         self._dataset_delete = DataSetRemover()
         self._notifier = CFNotifier(self._config)
@@ -135,10 +209,9 @@ class MetadataEntryResource(DataCatalogResource):
             return None, 403
 
         try:
-            return self._elastic_search.get(
-                index=self._config.elastic.elastic_index,
-                doc_type=self._config.elastic.elastic_metadata_type,
-                id=entry_id)
+            document = self._storage.get(entry_id, org_uuid_list=flask.g.get('org_uuid_list'))
+            document['_source'] = without_internal_fields(document['_source'])
+            return document
         except NotFoundError:
             self._log.exception('Data set with the given ID not found.')
             return None, 404
@@ -168,14 +241,9 @@ class MetadataEntryResource(DataCatalogResource):
 
     def add_data_set(self, entry_id, entry):
         try:
-            response = self._elastic_search.index(
-                index=self._config.elastic.elastic_index,
-                doc_type=self._config.elastic.elastic_metadata_type,
-                id=entry_id,
-                body=entry
-            )
+            created = self._storage.index(entry_id, entry, flask.g.get('org_uuid_list'))
             self._notify(entry, 'Dataset added')
-            if response['created']:
+            if created:
                 return None, 201
             else:
                 return None, 200
@@ -239,7 +307,14 @@ class MetadataEntryResource(DataCatalogResource):
         if not set(body).issubset(CERBERUS_SCHEMA):
             self._log.warn('Request body is invalid. Data: %s', flask.request.data)
             abort(400)
-        body_dict = {'doc': body}
+        current_entry = self._get_entry(entry_id)
+        if set(body).intersection(DERIVED_FROM_FIELDS):
+            updated_entry = dict(current_entry)
+            updated_entry.update(body)
+            MetadataIndexingTransformer.fill_out_derived_fields(updated_entry)
+            for field in DERIVED_FIELDS:
+                body[field] = updated_entry[field]
+        body[INDEXED_AT_FIELD] = get_indexed_at()
 
         try:
             if 'isPublic' in body:
@@ -253,11 +328,7 @@ class MetadataEntryResource(DataCatalogResource):
             return None, 503
 
         try:
-            self._elastic_search.update(
-                index=self._config.elastic.elastic_index,
-                doc_type=self._config.elastic.elastic_metadata_type,
-                id=entry_id,
-                body=body_dict)
+            self._storage.update(entry_id, body, current_entry)
             is_public_status_tag = 'public' if self._get_is_public_status(entry_id) else 'private'
             self._notify(self._get_entry(entry_id),
                          "Dataset changed status on",
@@ -287,11 +358,12 @@ class MetadataEntryResource(DataCatalogResource):
         return self._get_entry(entry_id)["isPublic"]
 
     def _get_entry(self, entry_id):
+        """
+        The entry is looked for on the shards of the user's organisations first.
+        """
         try:
-            return self._elastic_search.get(
-                index=self._config.elastic.elastic_index,
-                doc_type=self._config.elastic.elastic_metadata_type,
-                id=entry_id)["_source"]
+            return self._storage.get(
+                entry_id, org_uuid_list=flask.g.get('org_uuid_list'))["_source"]
 
         except NotFoundError:
             self._log.exception("Not found")
@@ -0,0 +1,467 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Versions of the metadata index. Data Catalog reads and writes through an alias
+(named like the index in ElasticConfig), which points to a versioned index,
+e.g. "trustedanalytics-meta-v2". Changed settings or mappings are applied by copying
+the documents to a new version and moving the alias, without stopping the service.
+"""
+
+import logging
+import re
+import threading
+from datetime import timedelta
+
+from elasticsearch import helpers
+from elasticsearch.exceptions import NotFoundError, RequestError, TransportError
+
+from data_catalog import metadata_entry
+from data_catalog.bulk_import import BulkImporter, BulkLoadMode
+from data_catalog.metadata_entry import INDEXED_AT_FIELD, ORG_UUID_FIELD
+from data_catalog.routing import OrgRouting
+from data_catalog.storage import ReindexDeletes
+
+
+class MetadataIndex(object):
+
+    """
+    Finds and creates versions of the metadata index.
+    """
+
+    VERSION_SUFFIX = '-v'
+
+    def __init__(self, elastic_search, elastic_config):
+        """
+        :param Elasticsearch elastic_search:
+        :param ElasticConfig elastic_config:
+        """
+        self._elastic_search = elastic_search
+        self._config = elastic_config
+        self.alias = elastic_config.elastic_index
+        self._version_pattern = re.compile(
+            re.escape(self.alias + self.VERSION_SUFFIX) + r'(\d+)$')
+
+    def get_indices(self):
+        """
+        :returns: Names of the indices the alias points to. An index created before
+            the alias was introduced has the alias' name and is returned as well.
+        :rtype: list[str]
+        """
+        try:
+            return sorted(self._elastic_search.indices.get_alias(name=self.alias))
+        except NotFoundError:
+            if self._elastic_search.indices.exists(index=self.alias):
+                return [self.alias]
+            return []
+
+    def get_next_index_name(self):
+        """
+        :returns: Name of a new version of the index (following the newest existing one).
+        :rtype: str
+        """
+        existing = self._elastic_search.indices.get_settings(
+            index=self.alias + self.VERSION_SUFFIX + '*')
+        versions = [int(match.group(1)) for match in
+                    (self._version_pattern.match(name) for name in existing) if match]
+        return self.get_index_name(max(versions) + 1 if versions else 1)
+
+    def get_index_name(self, version):
+        return '{}{}{}'.format(self.alias, self.VERSION_SUFFIX, version)
+
+    def create(self, index_name, with_alias=False):
+        """
+        Creates an index with Data Catalog's settings and mappings.
+        :param str index_name:
+        :param bool with_alias: Whether the alias should point to the new index.
+        :raises RequestError: E.g. the index already exists.
+        """
+        body = dict(self._config.metadata_index_setup)
+        if with_alias:
+            body['aliases'] = {self.alias: {}}
+        self._elastic_search.indices.create(index=index_name, body=body)
+
+    def create_if_missing(self):
+        """
+        Creates the first version of the index with the alias, unless the alias
+        (or an index with its name) already exists.
+        """
+        if self._elastic_search.indices.exists(index=self.alias):
+            return
+        try:
+            self.create(self.get_index_name(1), with_alias=True)
+        except RequestError as ex:
+            # Multiple workers can be created at the same time and there's no way
+            # to tell ElasticSearch to create index only if it's not already created,
+            # so we need to attempt to create it and ignore the error that it throws
+            # when attemting to create an existing index.
+            if 'IndexAlreadyExists' not in str(ex.error):
+                raise
+
+    def delete(self):
+        """
+        Deletes the indices the alias points to (and so the alias).
+        """
+        self.delete_indices(self.get_indices())
+
+    def delete_indices(self, indices):
+        """
+        :param list[str] indices: Names of the indices, may be empty.
+        """
+        if indices:
+            # pylint: disable=unexpected-keyword-arg
+            self._elastic_search.indices.delete(index=','.join(indices), ignore=404)
+
+    def swap(self, old_indices, new_index):
+        """
+        Points the alias to the new index instead of the old ones in a single, atomic request.
+        An old index named like the alias has to be deleted first, so for it the swap isn't
+        atomic and searches fail for a moment.
+        :param list[str] old_indices:
+        :param str new_index:
+        """
+        actions = [{'add': {'index': new_index, 'alias': self.alias}}]
+        if self.alias in old_indices:
+            self._elastic_search.indices.delete(index=self.alias)
+        else:
+            actions[:0] = [{'remove': {'index': index, 'alias': self.alias}}
+                           for index in old_indices]
+        self._elastic_search.indices.update_aliases(body={'actions': actions})
+
+
+class Reindexer(object):
+
+    """
+    Copies the metadata entries to a new version of the index and moves the alias to it.
+
+    Entries are read with scroll requests and written by BulkImporter's parallel bulk requests.
+    Entries written during the copy (their "indexedAt" field is newer than the copy's start)
+    are copied again in catch-up passes, entries deleted meanwhile are deleted from the copy.
+    The alias is swapped after a pass that found few changes. Entries changed or deleted
+    between that pass and the swap are copied or deleted once more afterwards, unless
+    the new index has a newer version of them or they were deleted after the swap
+    (see ReindexDeletes).
+    """
+
+    MAX_CATCH_UP_PASSES = 5
+    # application instances' clocks can differ, so changes are looked up a bit earlier
+    CLOCK_SKEW_MARGIN = timedelta(minutes=1)
+    SCROLL_TIME = '5m'
+
+    def __init__(self, elastic_search, elastic_config, import_config):
+        """
+        :param Elasticsearch elastic_search:
+        :param ElasticConfig elastic_config:
+        :param BulkImportConfig import_config: Sizes and concurrency of bulk requests.
+        """
+        self._elastic_search = elastic_search
+        self._config = elastic_config
+        self._import_config = import_config
+        self._index = MetadataIndex(elastic_search, elastic_config)
+        self._routing = OrgRouting(elastic_config, elastic_search)
+        self._deletes = ReindexDeletes(elastic_search, elastic_config)
+        self._log = logging.getLogger(type(self).__name__)
+
+    def reindex(self):
+        """
+        Creates the new version of the index and copies the entries to it.
+        :returns: Summary of the reindex, see "copy".
+        :rtype: dict
+        :raises NotFoundError: There's no index to copy.
+        :raises RequestError: The new index can't be created, e.g. another reindex
+            is creating it.
+        :raises ConnectionError:
+        """
+        return self.copy(*self.prepare())
+
+    def prepare(self):
+        """
+        Creates the new version of the index.
+        :returns: Names of the indices that will be copied and of the new one.
+        :rtype: (list[str], str)
+        :raises NotFoundError: There's no index to copy.
+        :raises RequestError: The new index can't be created, e.g. another reindex
+            is creating it.
+        :raises ConnectionError:
+        """
+        source_indices = self._index.get_indices()
+        if not source_indices:
+            raise NotFoundError(404, 'No index behind alias {}.'.format(self._index.alias))
+        target = self._index.get_next_index_name()
+        self._log.info('Reindexing %s into %s.', source_indices, target)
+        self._index.create(target)
+        return source_indices, target
+
+    def copy(self, source_indices, target):
+        """
+        Copies the entries to the index created by "prepare" and points the alias to it.
+        When the copy fails before the swap, the new index is deleted.
+        :param list[str] source_indices:
+        :param str target:
+        :returns: Summary of the reindex: names of the new and previous indices,
+            numbers of copied, caught up (copied again), removed and failed entries.
+        :rtype: dict
+        :raises ConnectionError:
+        """
+        succeeded = False
+        try:
+            self._deletes.start()
+            summary = self._copy_and_swap(source_indices, target)
+            succeeded = True
+            return summary
+        finally:
+            self._stop_recording_deletes()
+            if not succeeded:
+                self._delete_unused(target)
+
+    def _stop_recording_deletes(self):
+        try:
+            self._deletes.stop()
+        except TransportError:
+            self._log.exception('Deleting %s after a reindex failed.', self._deletes.index)
+
+    def _delete_unused(self, target):
+        """
+        Deletes the new index after a failed copy, unless the alias already points to it.
+        """
+        try:
+            if target not in self._index.get_indices():
+                self._log.error('Reindex into %s failed, deleting the index.', target)
+                self._index.delete_indices([target])
+        except TransportError:
+            self._log.exception('Deleting %s after a failed reindex failed.', target)
+
+    def _copy_and_swap(self, source_indices, target):
+        importer = BulkImporter(self._elastic_search, target, self._config.elastic_metadata_type,
+                                self._routing, self._import_config)
+        source = ','.join(source_indices)
+        summary = {'index': target, 'previousIndices': source_indices,
+                   'copied': 0, 'caughtUp': 0, 'removed': 0, 'failed': 0}
+
+        copy_start = self._now()
+        # settings of the new index are restored before it starts serving searches
+        with BulkLoadMode(self._elastic_search, self._config, target,
+                          force_merge=self._import_config.force_merge,
+                          enabled=self._import_config.bulk_load_mode):
+            self._add_to_summary(summary, 'copied', self._copy(importer, source, target))
+            for _ in range(self.MAX_CATCH_UP_PASSES):
+                pass_start = self._now()
+                result = self._copy(importer, source, target, since=copy_start)
+                self._add_to_summary(summary, 'caughtUp', result)
+                copy_start = pass_start
+                if result['indexed'] + result['failed'] <= self._import_config.chunk_size:
+                    break
+        self._add_to_summary(summary, 'removed', self._remove_deleted(importer, source, target))
+
+        if self._index.alias in source_indices:
+            # the old index is deleted during the swap, so its last changes are copied before
+            self._add_to_summary(summary, 'caughtUp',
+                                 self._copy(importer, source, target, since=copy_start))
+            self._add_to_summary(summary, 'removed',
+                                 self._remove_deleted(importer, source, target))
+            self._index.swap(source_indices, target)
+        else:
+            swap_start = self._now()
+            self._index.swap(source_indices, target)
+            self._add_to_summary(summary, 'caughtUp',
+                                 self._copy(importer, source, target, since=copy_start,
+                                            only_newer=True))
+            # entries created in the new index after the swap aren't in the old one
+            self._add_to_summary(summary, 'removed',
+                                 self._remove_deleted(importer, source, target,
+                                                      before=swap_start))
+            self._index.delete_indices(source_indices)
+        self._log.info('Reindex finished: %s', summary)
+        return summary
+
+    @staticmethod
+    def _now():
+        return metadata_entry.CURRENT_UTC_TIME_FUNCTION()
+
+    @staticmethod
+    def _add_to_summary(summary, key, result):
+        summary[key] += result['indexed']
+        summary['failed'] += result['failed']
+
+    def _copy(self, importer, source, target, since=None, only_newer=False):
+        """
+        :param datetime since: Only entries written after this time are copied.
+        :param bool only_newer: Entries that have a newer version in the target index
+            (written there after the swap) are skipped.
+        :returns: Numbers of indexed and failed entries.
+        :rtype: dict
+        """
+        query = {'query': {'match_all': {}}}
+        if since is not None:
+            self._elastic_search.indices.refresh(index=source)
+            query = {'query': {'range': {INDEXED_AT_FIELD: {
+                'gte': (since - self.CLOCK_SKEW_MARGIN).isoformat()}}}}
+        hits = self._scan(source, query)
+        if only_newer:
+            # entries are compared with the ones written to the new index before the copy
+            self._elastic_search.indices.refresh(index=target)
+            hits = self._skip_outdated(hits, target)
+        return importer.index_actions(self._get_copy_action(hit, target) for hit in hits)
+
+    def _scan(self, index, query):
+        return helpers.scan(self._elastic_search, query=query, index=index,
+                            doc_type=self._config.elastic_metadata_type,
+                            scroll=self.SCROLL_TIME, size=self._import_config.chunk_size)
+
+    def _get_copy_action(self, hit, target):
+        action = {
+            '_index': target,
+            '_type': self._config.elastic_metadata_type,
+            '_id': hit['_id'],
+            '_source': hit['_source']
+        }
+        # routing is computed again, so the copy follows the current routing setting
+        action.update(('_' + key, value) for key, value in
+                      self._routing.params(hit['_source'][ORG_UUID_FIELD]).items())
+        return action
+
+    def _skip_outdated(self, hits, target):
+        for hit in hits:
+            try:
+                # realtime get from the shard of the entry's organisation, when it's routed
+                target_entry = self._routing.get_entry(
+                    hit['_id'], index=target,
+                    org_uuid_list=[hit['_source'][ORG_UUID_FIELD]])['_source']
+            except NotFoundError:
+                # not copied yet, unless it was deleted after the swap
+                deleted_at = self._deletes.get_deleted_at(hit['_id'])
+                if deleted_at is None or deleted_at < hit['_source'].get(INDEXED_AT_FIELD, ''):
+                    yield hit
+                continue
+            if target_entry.get(INDEXED_AT_FIELD, '') < hit['_source'].get(INDEXED_AT_FIELD, ''):
+                yield hit
+
+    def _remove_deleted(self, importer, source, target, before=None):
+        """
+        Deletes copies of entries that were deleted from the source index during the copy.
+        :param datetime before: Only copies written before this time are checked,
+            newer ones were written to the target index directly.
+        :returns: Numbers of deleted and failed entries.
+        :rtype: dict
+        """
+        self._elastic_search.indices.refresh(index='{},{}'.format(source, target))
+        # only the organisation is read, it's needed for routing
+        id_query = {'query': {'match_all': {}}, '_source': [ORG_UUID_FIELD]}
+        source_ids = set(hit['_id'] for hit in self._scan(source, id_query))
+        target_query = id_query
+        if before is not None:
+            target_query = dict(id_query, query={'range': {INDEXED_AT_FIELD: {
+                'lt': (before - self.CLOCK_SKEW_MARGIN).isoformat()}}})
+        return importer.index_actions(
+            self._get_delete_action(hit, target)
+            for hit in self._scan(target, target_query)
+            if hit['_id'] not in source_ids)
+
+    def _get_delete_action(self, hit, target):
+        action = {
+            '_op_type': 'delete',
+            '_index': target,
+            '_type': self._config.elastic_metadata_type,
+            '_id': hit['_id']
+        }
+        action.update(('_' + key, value) for key, value in
+                      self._routing.params(hit['_source'][ORG_UUID_FIELD]).items())
+        return action
+
+
+class ReindexJobs(object):
+
+    """
+    Runs reindexes in background threads, so they aren't limited by the request timeout.
+    Their statuses are kept in a separate index, so every application instance can report them.
+    A reindex interrupted by its worker's death stays "running"; its new index
+    and the index of its deletes (see ReindexDeletes) have to be deleted manually.
+    """
+
+    STATUS_INDEX_SUFFIX = '-reindex'
+    STATUS_TYPE = 'status'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    FAILED = 'failed'
+
+    def __init__(self, elastic_search, elastic_config, reindexer=None):
+        """
+        :param Elasticsearch elastic_search:
+        :param ElasticConfig elastic_config:
+        :param Reindexer reindexer: Needed only for starting reindexes.
+        """
+        self._elastic_search = elastic_search
+        self._status_index = elastic_config.elastic_index + self.STATUS_INDEX_SUFFIX
+        self._reindexer = reindexer
+        self._log = logging.getLogger(type(self).__name__)
+
+    def start(self):
+        """
+        Creates the new version of the index and starts copying the entries to it.
+        :returns: Status of the reindex (see "get_status").
+        :rtype: dict
+        :raises NotFoundError: There's no index to copy.
+        :raises RequestError: The new index can't be created, e.g. another reindex
+            is creating it.
+        :raises ConnectionError:
+        """
+        source_indices, target = self._reindexer.prepare()
+        status = {'index': target, 'previousIndices': source_indices, 'status': self.RUNNING,
+                  'startedAt': metadata_entry.CURRENT_UTC_TIME_FUNCTION().isoformat()}
+        self._save_status(status)
+        self._run_in_background(self._run, source_indices, target, status)
+        return status
+
+    def get_status(self, index_name):
+        """
+        :param str index_name: The new index of the reindex.
+        :returns: The status ("running", "finished" or "failed"), names of the new
+            and previous indices, start time, and for the finished reindexes the summary
+            (see Reindexer.copy) or the error and the end time.
+        :rtype: dict
+        :raises NotFoundError:
+        """
+        return self._elastic_search.get(index=self._status_index, doc_type=self.STATUS_TYPE,
+                                        id=index_name)['_source']
+
+    @staticmethod
+    def _run_in_background(function, *args):
+        # not a daemon, so a worker shutting down gracefully waits for the reindex
+        threading.Thread(target=function, args=args).start()
+
+    def _run(self, source_indices, target, status):
+        # the started status is still being returned by the request
+        status = dict(status)
+        try:
+            status.update(self._reindexer.copy(source_indices, target))
+            status['status'] = self.FINISHED
+        except Exception as ex:  # pylint: disable=broad-except
+            self._log.exception('Reindex into %s failed.', target)
+            status.update(status=self.FAILED, error=str(ex))
+        status['finishedAt'] = metadata_entry.CURRENT_UTC_TIME_FUNCTION().isoformat()
+        try:
+            self._save_status(status)
+        except TransportError:
+            self._log.exception('Saving status of the reindex into %s failed.', target)
+
+    def _save_status(self, status):
+        # pylint: disable=unexpected-keyword-arg
+        self._elastic_search.indices.create(
+            index=self._status_index,
+            body={'settings': {'number_of_shards': 1}},
+            ignore=400)
+        self._elastic_search.index(index=self._status_index, doc_type=self.STATUS_TYPE,
+                                   id=status['index'], body=status, refresh=True)
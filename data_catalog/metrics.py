@@ -0,0 +1,520 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Request instrumentation: time spent in every stage of a request (authentication, calls
+to UAA, user-management, ElasticSearch and NATS, serialization), kept as latency histograms
+per endpoint and stage along with counters of outbound calls and error responses.
+They're exposed in Prometheus' text format and every response gets a "Server-Timing" header
+with its own breakdown. Worker processes of the server share their metrics through files
+in a directory (see METRICS_DIR in README.md), otherwise every process keeps its own.
+"""
+
+import atexit
+import errno
+import fcntl
+import functools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+
+import flask
+from elasticsearch import Transport
+from flask_restful import Resource
+from werkzeug.wrappers import Response
+from werkzeug.wsgi import ClosingIterator
+
+# upper bounds (in seconds) of the histograms' buckets, same as Prometheus clients' defaults
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+TOTAL_STAGE = 'total'
+UNKNOWN_ENDPOINT = 'unknown'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# seconds between saves of a process' metrics to the shared directory
+SAVE_INTERVAL = 1.0
+# sums of the metrics of the workers that exited
+BASE_FILE = 'metrics-base.json'
+# held exclusively while the files of exited workers are added to the base file
+LOCK_FILE = 'metrics.lock'
+# files of the workers: metrics-<PID>-<start time in ms>.json,
+# older versions of the application named them metrics-<PID>.json
+WORKER_FILE = re.compile(r'metrics-(\d+)(?:-(\d+))?\.json\Z')
+
+
+class Metrics(object):
+
+    """
+    Thread safe registry of the application's metrics.
+    """
+
+    STAGE_DURATION = 'data_catalog_request_stage_duration_seconds'
+    OUTBOUND_CALLS = 'data_catalog_outbound_calls_total'
+    ERRORS = 'data_catalog_request_errors_total'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._outbound_calls = defaultdict(int)
+        self._errors = defaultdict(int)
+        self._directory = None
+        self._save_timer = None
+        # PID and name of the process' file
+        self._worker_file = None
+        self._log = logging.getLogger(type(self).__name__)
+
+    def share(self, directory):
+        """
+        Shares the metrics with the other processes using the directory. Every process
+        saves its own metrics to a file there (at most every SAVE_INTERVAL seconds)
+        and rendering sums the files of all processes. The files of the processes that exited
+        are added to a base file (summed too, so the counters don't go back when the server
+        replaces a worker) and removed.
+        :param str directory: Created if it doesn't exist.
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with self._lock:
+            self._directory = directory
+            own_file = self._get_worker_file()
+        try:
+            _fold_exited_workers(directory, own_file)
+        except (IOError, OSError, ValueError):
+            self._log.warning('Failed to sum up the metrics of exited workers in %s.',
+                              directory, exc_info=True)
+        # so the changes made since the last save aren't lost when the worker exits
+        atexit.register(self.save)
+
+    def _get_worker_file(self):
+        """
+        :returns: Name of the process' file, which is unique even when the PID of a worker
+            that exited is reused. Should be called with the lock held.
+        :rtype: str
+        """
+        # the PID is checked every time, the app may be loaded before the workers are forked
+        pid = os.getpid()
+        if self._worker_file is None or self._worker_file[0] != pid:
+            self._worker_file = (pid, 'metrics-{}-{}.json'.format(pid, int(time.time() * 1000)))
+        return self._worker_file[1]
+
+    def observe_stage(self, endpoint, method, stage, seconds):
+        labels = (('endpoint', endpoint), ('method', method), ('stage', stage))
+        with self._lock:
+            histogram = self._histograms.get(labels)
+            if histogram is None:
+                histogram = self._histograms[labels] = _Histogram()
+            histogram.observe(seconds)
+            self._schedule_save()
+
+    def count_outbound_call(self, service, outcome):
+        """
+        :param str service: Called service, e.g. "elasticsearch".
+        :param str outcome: "success" or "error".
+        """
+        with self._lock:
+            self._outbound_calls[(('service', service), ('outcome', outcome))] += 1
+            self._schedule_save()
+
+    def count_error(self, endpoint, method, status):
+        with self._lock:
+            self._errors[(('endpoint', endpoint), ('method', method), ('status', str(status)))] += 1
+            self._schedule_save()
+
+    def _schedule_save(self):
+        """
+        Saves the metrics a moment after they changed, so a burst of requests is saved once.
+        Should be called with the lock held.
+        """
+        if self._directory and self._save_timer is None:
+            self._save_timer = threading.Timer(SAVE_INTERVAL, self.save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def save(self):
+        """
+        Saves the process' metrics to the shared directory, if there's one.
+        """
+        with self._lock:
+            self._save_timer = None
+            directory = self._directory
+            if not directory:
+                return
+            state = _to_state(self._histograms, self._outbound_calls, self._errors)
+            path = os.path.join(directory, self._get_worker_file())
+        try:
+            _write_state(path, state)
+        except (IOError, OSError):
+            self._log.warning('Failed to save the metrics to %s.', path, exc_info=True)
+
+    @staticmethod
+    def _load_other_processes(directory, own_file):
+        """
+        :returns: Saved states of the other processes' metrics and of the exited ones.
+        :rtype: list[dict]
+        """
+        states = []
+        # files of exited workers aren't read while they're being added to the base file
+        with _locked(directory, fcntl.LOCK_SH):
+            for name in os.listdir(directory):
+                if name == own_file or (name != BASE_FILE and not WORKER_FILE.match(name)):
+                    continue
+                try:
+                    states.append(_read_state(os.path.join(directory, name)))
+                except (IOError, ValueError):
+                    # removed in the meantime
+                    continue
+        return states
+
+    def render(self):
+        """
+        :returns: The metrics (of all processes, if they're shared)
+            in Prometheus' text exposition format.
+        :rtype: str
+        """
+        with self._lock:
+            histograms = {labels: histogram.copy()
+                          for labels, histogram in self._histograms.items()}
+            outbound_calls = defaultdict(int, self._outbound_calls)
+            errors = defaultdict(int, self._errors)
+            directory = self._directory
+            own_file = self._get_worker_file()
+        if directory:
+            for state in self._load_other_processes(directory, own_file):
+                _add_state(state, histograms, outbound_calls, errors)
+        histograms = sorted(histograms.items())
+        outbound_calls = sorted(outbound_calls.items())
+        errors = sorted(errors.items())
+
+        lines = [
+            '# HELP {} Time spent in a stage of a request.'.format(self.STAGE_DURATION),
+            '# TYPE {} histogram'.format(self.STAGE_DURATION)
+        ]
+        for labels, histogram in histograms:
+            cumulative_count = 0
+            for bound, count in zip(BUCKETS, histogram.bucket_counts):
+                cumulative_count += count
+                lines.append(_sample(self.STAGE_DURATION + '_bucket',
+                                     labels + (('le', repr(bound)),), cumulative_count))
+            lines.append(_sample(self.STAGE_DURATION + '_bucket', labels + (('le', '+Inf'),),
+                                 histogram.count))
+            lines.append(_sample(self.STAGE_DURATION + '_sum', labels, repr(histogram.sum)))
+            lines.append(_sample(self.STAGE_DURATION + '_count', labels, histogram.count))
+
+        lines.append('# HELP {} Calls to other services.'.format(self.OUTBOUND_CALLS))
+        lines.append('# TYPE {} counter'.format(self.OUTBOUND_CALLS))
+        lines.extend(_sample(self.OUTBOUND_CALLS, labels, count)
+                     for labels, count in outbound_calls)
+
+        lines.append('# HELP {} Responses with an error status.'.format(self.ERRORS))
+        lines.append('# TYPE {} counter'.format(self.ERRORS))
+        lines.extend(_sample(self.ERRORS, labels, count) for labels, count in errors)
+        return '\n'.join(lines) + '\n'
+
+
+class _Histogram(object):
+
+    def __init__(self):
+        # the last counter is for values bigger than all bounds
+        self.bucket_counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        bucket = next((number for number, bound in enumerate(BUCKETS) if value <= bound),
+                      len(BUCKETS))
+        self.bucket_counts[bucket] += 1
+        self.sum += value
+        self.count += 1
+
+    def copy(self):
+        histogram = _Histogram()
+        histogram.add(self.bucket_counts, self.sum, self.count)
+        return histogram
+
+    def add(self, bucket_counts, total, count):
+        """
+        Adds observations of another histogram with the same buckets.
+        """
+        self.bucket_counts = [own + other for own, other in zip(self.bucket_counts, bucket_counts)]
+        self.sum += total
+        self.count += count
+
+
+def _to_state(histograms, outbound_calls, errors):
+    """
+    :returns: Metrics in the format of the shared directory's files.
+    :rtype: dict
+    """
+    return {
+        'histograms': [[labels, histogram.bucket_counts, histogram.sum, histogram.count]
+                       for labels, histogram in histograms.items()],
+        'outbound_calls': list(outbound_calls.items()),
+        'errors': list(errors.items())
+    }
+
+
+def _add_state(state, histograms, outbound_calls, errors):
+    """
+    Adds saved metrics to the histograms and counters.
+    """
+    for labels, bucket_counts, total, count in state['histograms']:
+        labels = _to_labels(labels)
+        histograms.setdefault(labels, _Histogram()).add(bucket_counts, total, count)
+    for labels, count in state['outbound_calls']:
+        outbound_calls[_to_labels(labels)] += count
+    for labels, count in state['errors']:
+        errors[_to_labels(labels)] += count
+
+
+def _read_state(path):
+    with open(path) as state_file:
+        return json.load(state_file)
+
+
+def _write_state(path, state):
+    # renaming is atomic, so other processes never read a half written file
+    with open(path + '.tmp', 'w') as state_file:
+        json.dump(state, state_file)
+    os.rename(path + '.tmp', path)
+
+
+@contextmanager
+def _locked(directory, operation):
+    """
+    Holds a lock (fcntl.LOCK_SH or LOCK_EX) shared by the processes using the directory.
+    """
+    with open(os.path.join(directory, LOCK_FILE), 'a') as lock_file:
+        fcntl.flock(lock_file, operation)
+        yield
+
+
+def _fold_exited_workers(directory, own_file):
+    """
+    Adds the files of the workers that exited to the base file and removes them,
+    so they don't pile up as the server replaces workers.
+    :param str directory: The shared directory.
+    :param str own_file: File of this process, which might not be saved yet.
+    """
+    with _locked(directory, fcntl.LOCK_EX):
+        exited = _find_exited_workers(directory, own_file)
+        if not exited:
+            return
+        histograms, outbound_calls, errors = {}, defaultdict(int), defaultdict(int)
+        base_path = os.path.join(directory, BASE_FILE)
+        if os.path.exists(base_path):
+            _add_state(_read_state(base_path), histograms, outbound_calls, errors)
+        for path in exited:
+            _add_state(_read_state(path), histograms, outbound_calls, errors)
+        _write_state(base_path, _to_state(histograms, outbound_calls, errors))
+        for path in exited:
+            os.remove(path)
+
+
+def _find_exited_workers(directory, own_file):
+    """
+    :returns: Paths of the files of the workers that exited.
+    :rtype: list[str]
+    """
+    files_by_pid = defaultdict(list)
+    for name in os.listdir(directory):
+        match = WORKER_FILE.match(name)
+        if match:
+            files_by_pid[int(match.group(1))].append((int(match.group(2) or 0), name))
+    own_pid = int(WORKER_FILE.match(own_file).group(1))
+    exited = []
+    for pid, files in files_by_pid.items():
+        if pid == own_pid:
+            running = own_file
+        elif _is_running(pid):
+            # only the worker that started last can still have the PID
+            running = max(files)[1]
+        else:
+            running = None
+        exited.extend(os.path.join(directory, name) for _, name in files
+                      if name != running)
+    return exited
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as error:
+        # the process exists, but belongs to another user
+        return error.errno == errno.EPERM
+    return True
+
+
+def _to_labels(saved_labels):
+    """
+    :returns: Labels of a metric loaded from JSON, which made lists of the tuples.
+    :rtype: tuple
+    """
+    return tuple((label, value) for label, value in saved_labels)
+
+
+def _sample(name, labels, value):
+    label_string = ','.join('{}="{}"'.format(label, _escape(label_value))
+                            for label, label_value in labels)
+    return '{}{{{}}} {}'.format(name, label_string, value)
+
+
+def _escape(label_value):
+    return label_value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def measure_stage(stage):
+    """
+    Adds the time spent in the block to the current request's stage. Outside of requests
+    nothing is measured. A stage entered again within itself (e.g. a storage call
+    made by another one) is only measured once.
+    :param str stage:
+    """
+    if not flask.has_request_context():
+        yield
+        return
+    durations = _get_stage_durations()
+    active_stages = flask.g.active_stages
+    if stage in active_stages:
+        yield
+        return
+    active_stages.add(stage)
+    start_time = time.time()
+    try:
+        yield
+    finally:
+        durations[stage] = durations.get(stage, 0.0) + time.time() - start_time
+        active_stages.discard(stage)
+
+
+@contextmanager
+def measure_outbound_call(service):
+    """
+    Measures a call to another service as a stage of the current request and counts it
+    as failed when the block raises an exception or sets "failed" of the yielded call
+    (e.g. for an error status), successful otherwise.
+    :param str service:
+    """
+    outermost = not (flask.has_request_context() and service in _get_active_stages())
+    call = _OutboundCall()
+    try:
+        with measure_stage(service):
+            yield call
+    except Exception:
+        call.failed = True
+        raise
+    finally:
+        if outermost:
+            metrics.count_outbound_call(service, 'error' if call.failed else 'success')
+
+
+class _OutboundCall(object):
+
+    def __init__(self):
+        self.failed = False
+
+
+def _get_stage_durations():
+    if 'stage_durations' not in flask.g:
+        flask.g.stage_durations = OrderedDict()
+        flask.g.active_stages = set()
+    return flask.g.stage_durations
+
+
+def _get_active_stages():
+    _get_stage_durations()
+    return flask.g.active_stages
+
+
+def start_request():
+    """
+    Flask's "before_request" function, should be registered before the other ones,
+    so the whole request is measured.
+    """
+    flask.g.request_start_time = time.time()
+    _get_stage_durations()
+
+
+def finish_request(response):
+    """
+    Flask's "after_request" function recording the request's stages and adding
+    the "Server-Timing" header (durations in milliseconds) to the response.
+    Streamed responses are recorded when they end, with the stages measured
+    while streaming (like ElasticSearch's scrolls of exports).
+    """
+    stage_durations = _get_stage_durations()
+    start_time = flask.g.get('request_start_time')
+    url_rule = flask.request.url_rule
+    record = functools.partial(
+        _record_request, url_rule.rule if url_rule else UNKNOWN_ENDPOINT, flask.request.method,
+        response.status_code, stage_durations, start_time)
+
+    durations = _with_total(stage_durations, start_time)
+    if response.is_streamed:
+        # closed after the last chunk (or when the client disconnects), after the stream's
+        # own clean-up, like clearing a scroll
+        response.response = ClosingIterator(response.response, record)
+    else:
+        record()
+
+    if durations:
+        response.headers['Server-Timing'] = ', '.join(
+            '{};dur={:.1f}'.format(stage, seconds * 1000) for stage, seconds in durations.items())
+    return response
+
+
+def _with_total(stage_durations, start_time):
+    durations = OrderedDict(stage_durations)
+    if start_time is not None:
+        durations[TOTAL_STAGE] = time.time() - start_time
+    return durations
+
+
+def _record_request(endpoint, method, status, stage_durations, start_time):
+    for stage, seconds in _with_total(stage_durations, start_time).items():
+        metrics.observe_stage(endpoint, method, stage, seconds)
+    if status >= 400:
+        metrics.count_error(endpoint, method, status)
+
+
+class MeasuredTransport(Transport):
+
+    """
+    ElasticSearch client's transport measuring requests to ElasticSearch.
+    """
+
+    def perform_request(self, method, url, params=None, body=None):
+        with measure_outbound_call('elasticsearch'):
+            return super(MeasuredTransport, self).perform_request(method, url, params, body)
+
+
+class MetricsResource(Resource):
+
+    """
+    Prometheus' scraping endpoint.
+    """
+
+    def get(self):
+        """
+        Flask-Restful HTTP GET.
+        """
+        return Response(metrics.render(), content_type=CONTENT_TYPE)
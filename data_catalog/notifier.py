@@ -24,6 +24,8 @@ import time
 
 import pynats
 
+from data_catalog.metrics import measure_outbound_call
+
 
 class CFNotifier(object):
 
@@ -48,9 +50,10 @@ class CFNotifier(object):
         :param message: message to send
         :param org_guid: organization guid to which this message is connected
         """
-        self._connection.connect()
         nats_message = self._create_message(message, org_guid)
-        self._connection.publish(self._subject, json.dumps(nats_message))
+        with measure_outbound_call('nats'):
+            self._connection.connect()
+            self._connection.publish(self._subject, json.dumps(nats_message))
 
     @staticmethod
     def _create_message(message, org_guid):
@@ -0,0 +1,160 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Estimation of the cost of ElasticSearch queries and admission control based on it.
+"""
+
+import logging
+
+
+DEFAULT_SIZE = 10
+
+
+class QueryCost(object):
+
+    """
+    Cost of a translated query. The score is a sum of weighted components,
+    so that the thresholds can be tuned with the components logged for every decision.
+    """
+
+    HIT_COST = 1
+    TERM_COST = 1
+    AGGREGATION_COST = 100
+    # wildcards are cheaper the more literal characters they contain
+    WILDCARD_COST = 1000
+
+    def __init__(self, hits, wildcard_lengths, terms, aggregations):
+        """
+        :param int hits: Number of hits to return ("from" + "size").
+        :param list[int] wildcard_lengths: Number of literal characters in each wildcard pattern.
+        :param int terms: Number of values in all term and terms clauses.
+        :param int aggregations: Number of top level aggregations.
+        """
+        self.hits = hits
+        self.wildcard_lengths = wildcard_lengths
+        self.terms = terms
+        self.aggregations = aggregations
+
+    @property
+    def score(self):
+        wildcards_cost = sum(float(self.WILDCARD_COST) / max(length, 1)
+                             for length in self.wildcard_lengths)
+        return int(self.hits * self.HIT_COST
+                   + wildcards_cost
+                   + self.terms * self.TERM_COST
+                   + self.aggregations * self.AGGREGATION_COST)
+
+    def __str__(self):
+        return 'score={} hits={} wildcard_lengths={} terms={} aggregations={}'.format(
+            self.score, self.hits, self.wildcard_lengths, self.terms, self.aggregations)
+
+
+def estimate_cost(es_query):
+    """
+    :param dict es_query: ElasticSearch query made by the translator.
+    :rtype: QueryCost
+    """
+    hits = es_query.get('from', 0) + es_query.get('size', DEFAULT_SIZE)
+    # aggregations also have "terms" clauses, but they aren't filters
+    filtering_parts = [es_query.get('query'), es_query.get('post_filter')]
+    wildcard_lengths = [_get_literal_length(pattern)
+                        for clause in _find_clauses(filtering_parts, 'wildcard')
+                        for pattern in clause.values()]
+    terms = sum(len(values) if isinstance(values, list) else 1
+                for clause in _find_clauses(filtering_parts, 'terms', 'term')
+                for values in clause.values())
+    aggregations = len(es_query.get('aggregations', {}))
+    return QueryCost(hits, wildcard_lengths, terms, aggregations)
+
+
+def _find_clauses(node, *clause_names):
+    """
+    Yields contents of all clauses of the given types, at any depth of the query.
+    """
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key in clause_names and isinstance(value, dict):
+                yield value
+            else:
+                for clause in _find_clauses(value, *clause_names):
+                    yield clause
+    elif isinstance(node, list):
+        for item in node:
+            for clause in _find_clauses(item, *clause_names):
+                yield clause
+
+
+def _get_literal_length(pattern):
+    if isinstance(pattern, dict):
+        pattern = pattern.get('value', '')
+    return len(pattern.replace('*', '').replace('?', ''))
+
+
+class QueryRejectedError(Exception):
+
+    def __init__(self, status, message):
+        super(QueryRejectedError, self).__init__(message)
+        self.status = status
+        self.message = message
+
+
+class QueryAdmission(object):
+
+    """
+    Decides if a query can be sent to ElasticSearch, possibly after making it cheaper.
+    """
+
+    TOO_MANY_TERMS_MESSAGE = 'Query contains too many filter values.'
+    TOO_EXPENSIVE_MESSAGE = 'Query is too expensive, narrow it down or try again later.'
+
+    def __init__(self, cost_config):
+        """
+        :param QueryCostConfig cost_config:
+        """
+        self._config = cost_config
+        self._log = logging.getLogger(type(self).__name__)
+
+    def admit(self, es_query):
+        """
+        Clamps the number of returned hits, drops aggregations of expensive queries
+        and rejects the queries that would still be too expensive.
+        :param dict es_query: ElasticSearch query made by the translator. It's changed in place.
+        :returns: The admitted query.
+        :rtype: dict
+        :raises QueryRejectedError:
+        """
+        cost = estimate_cost(es_query)
+        if cost.terms > self._config.max_terms:
+            self._log.warning('Query rejected, too many terms: %s', cost)
+            raise QueryRejectedError(400, self.TOO_MANY_TERMS_MESSAGE)
+
+        if es_query.get('size', DEFAULT_SIZE) > self._config.max_size:
+            self._log.info('Query size clamped to %d: %s', self._config.max_size, cost)
+            es_query['size'] = self._config.max_size
+            cost = estimate_cost(es_query)
+
+        if cost.score > self._config.degrade_threshold and cost.aggregations:
+            self._log.info('Query degraded, aggregations dropped: %s', cost)
+            del es_query['aggregations']
+            cost = estimate_cost(es_query)
+
+        if cost.score > self._config.reject_threshold:
+            self._log.warning('Query rejected, too expensive: %s', cost)
+            raise QueryRejectedError(429, self.TOO_EXPENSIVE_MESSAGE)
+
+        self._log.info('Query admitted: %s', cost)
+        return es_query
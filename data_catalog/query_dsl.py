@@ -0,0 +1,289 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+ElasticSearch's semantics of mappings, analysis, query clauses and dates, for evaluating
+translated queries without ElasticSearch. Shared by the embedded storage
+(data_catalog.sqlite_storage) and the fake ElasticSearch used in tests.
+"""
+
+import datetime
+import fnmatch
+import re
+
+# Lucene's English stop words
+ENGLISH_STOP_WORDS = frozenset(
+    'a an and are as at be but by for if in into is it no not of on or such that the their then '
+    'there these they this to was will with'.split())
+# tokenizer, stop words and whether the tokens are lowercased
+BUILT_IN_ANALYZERS = {
+    'standard': ('standard', frozenset(), False),
+    'english': ('standard', ENGLISH_STOP_WORDS, False),
+    'simple': ('lowercase', frozenset(), False),
+    'whitespace': ('whitespace', frozenset(), False),
+    'keyword': ('keyword', frozenset(), False),
+}
+TOKENIZERS = {
+    'standard': lambda text: re.findall(r'\w+', text.lower(), re.UNICODE),
+    'lowercase': lambda text: re.findall(r'[^\W\d_]+', text.lower(), re.UNICODE),
+    'whitespace': lambda text: text.split(),
+    'keyword': lambda text: [text],
+}
+NUMERIC_TYPES = ('long', 'integer', 'short', 'byte', 'double', 'float')
+
+
+class ElasticError(Exception):
+
+    """
+    Error response of ElasticSearch's API, in ElasticSearch 2.x format.
+    """
+
+    def __init__(self, status, error_type, reason, index=None):
+        super(ElasticError, self).__init__(reason)
+        self.status = status
+        self.error_type = error_type
+        self.reason = reason
+        self.index = index
+
+    def to_response(self):
+        error = {'type': self.error_type, 'reason': self.reason}
+        if self.index:
+            error['index'] = self.index
+        error['root_cause'] = [dict(error)]
+        return {'error': error, 'status': self.status}
+
+
+def get_field_mapping(mappings, field, doc_type=None):
+    """
+    :param dict mappings: Mappings of an index' types.
+    :param str field: Field (or its subfield, like "category.raw").
+    :param str doc_type: Type the field is looked for in, any type if None.
+    :returns: Mapping of the field, empty if the field isn't mapped.
+    :rtype: dict
+    """
+    type_mappings = [mappings.get(doc_type, {})] if doc_type else list(mappings.values())
+    for type_mapping in type_mappings:
+        properties = type_mapping.get('properties', {})
+        parts = field.split('.')
+        mapping = None
+        for position, part in enumerate(parts):
+            if part in properties:
+                mapping = properties[part]
+                properties = mapping.get('properties', {})
+            elif mapping and part in mapping.get('fields', {}) and position == len(parts) - 1:
+                mapping = mapping['fields'][part]
+            else:
+                mapping = None
+                break
+        if mapping:
+            return mapping
+    return {}
+
+
+def get_analyzer(flat_settings, name):
+    """
+    :param dict flat_settings: Index settings in the flat format (see flatten_settings).
+    :param str name: Name of a built-in analyzer or a custom one from the settings.
+    :returns: Tokenizer, stop words and whether the tokens are lowercased.
+    :rtype: (str, frozenset[str], bool)
+    """
+    prefix = 'index.analysis.analyzer.{}.'.format(name)
+    if prefix + 'tokenizer' not in flat_settings:
+        return BUILT_IN_ANALYZERS.get(name, BUILT_IN_ANALYZERS['standard'])
+    filter_names = as_list(flat_settings.get(prefix + 'filter', []))
+    stop_words = set()
+    for filter_name in filter_names:
+        stop_words.update(as_list(flat_settings.get(
+            'index.analysis.filter.{}.stopwords'.format(filter_name), [])))
+    return flat_settings[prefix + 'tokenizer'], frozenset(stop_words), \
+        'lowercase' in filter_names
+
+
+def analyze(text, analyzer):
+    """
+    :param str text:
+    :param (str, frozenset, bool) analyzer: Tokenizer, stop words and lowercasing.
+    :rtype: list[str]
+    """
+    tokenizer, stop_words, lowercase = analyzer
+    tokens = TOKENIZERS.get(tokenizer, TOKENIZERS['standard'])(text)
+    if lowercase:
+        tokens = [token.lower() for token in tokens]
+    return [token for token in tokens if token not in stop_words]
+
+
+def get_field_clause(clause, value_key):
+    """
+    :returns: Field, its value and boost from a clause like {"field": value}
+        or {"field": {"value": value, "boost": 2}}.
+    :raises ElasticError: The clause has more fields.
+    """
+    options = dict(clause)
+    boost = options.pop('boost', 1.0)
+    if len(options) != 1:
+        raise ElasticError(400, 'query_parsing_exception',
+                           'Expected a single field: {}'.format(list(options)))
+    (field, value), = options.items()
+    if isinstance(value, dict):
+        boost = value.get('boost', boost)
+        value = value[value_key] if value_key in value else value.get('value')
+    return field, value, float(boost)
+
+
+def filter_source(source, source_filter):
+    """
+    :param source_filter: "_source" of a search: a flag, field patterns
+        or a dict with "includes" and "excludes".
+    :returns: Fields of the source chosen by the filter.
+    :rtype: dict
+    """
+    if source_filter in (True, 'true', None):
+        return source
+    if isinstance(source_filter, dict):
+        includes = as_list(source_filter.get('includes', source_filter.get('include', '*')))
+        excludes = as_list(source_filter.get('excludes', source_filter.get('exclude', [])))
+    else:
+        includes = source_filter.split(',') if isinstance(source_filter, basestring) \
+            else source_filter
+        excludes = []
+    return {field: value for field, value in source.items()
+            if any(fnmatch.fnmatchcase(field, pattern) for pattern in includes)
+            and not any(fnmatch.fnmatchcase(field, pattern) for pattern in excludes)}
+
+
+def merge(target, changes):
+    """
+    Applies a partial update ("doc") to the target, objects are merged recursively.
+    :rtype: dict
+    """
+    for key, value in changes.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge(target[key], value)
+        else:
+            target[key] = value
+    return target
+
+
+def flatten_settings(settings, prefix=''):
+    """
+    :returns: Settings in the flat format ("index.number_of_shards": "5"), always prefixed
+        with "index.", with values as strings (lists are kept as lists of strings).
+    :rtype: dict
+    """
+    flat = {}
+    for key, value in settings.items():
+        name = prefix + key
+        if isinstance(value, dict):
+            flat.update(flatten_settings(value, name + '.'))
+            continue
+        if not name.startswith('index.'):
+            name = 'index.' + name
+        if isinstance(value, list):
+            flat[name] = [str(item) for item in value]
+        elif isinstance(value, bool):
+            flat[name] = 'true' if value else 'false'
+        else:
+            flat[name] = None if value is None else str(value)
+    return flat
+
+
+def unflatten_settings(flat_settings):
+    nested = {}
+    for name, value in flat_settings.items():
+        parts = name.split('.')
+        level = nested
+        for part in parts[:-1]:
+            level = level.setdefault(part, {})
+        level[parts[-1]] = value
+    return nested
+
+
+def as_list(value):
+    return value if isinstance(value, list) else [value]
+
+
+_DATE_PATTERN = re.compile(
+    r'^(\d{4})(?:-(\d{2})(?:-(\d{2})(?:[T ](\d{2})(?::(\d{2})(?::(\d{2})(?:\.(\d{1,6})\d*)?)?)?'
+    r'(Z|[+-]\d{2}:?\d{2})?)?)?)?$')
+_DATE_MATH_PATTERN = re.compile(r'([+-]\d+|/)([yMwdhHms])')
+_UNIT_SECONDS = {'w': 604800, 'd': 86400, 'h': 3600, 'H': 3600, 'm': 60, 's': 1}
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def parse_date(value):
+    """
+    :param value: Date in one of ISO 8601 formats or milliseconds since the epoch.
+    :returns: The date in UTC.
+    :rtype: datetime.datetime
+    :raises ElasticError: Not a date.
+    """
+    if isinstance(value, (int, long, float)) and not isinstance(value, bool):
+        return EPOCH + datetime.timedelta(milliseconds=value)
+    match = _DATE_PATTERN.match(str(value))
+    try:
+        year, month, day, hour, minute, second, fraction, zone = match.groups()
+        date = datetime.datetime(int(year), int(month or 1), int(day or 1), int(hour or 0),
+                                 int(minute or 0), int(second or 0),
+                                 int((fraction or '0').ljust(6, '0')))
+    except (AttributeError, ValueError):
+        raise ElasticError(400, 'mapper_parsing_exception',
+                           'failed to parse date field [{}]'.format(value))
+    if zone and zone != 'Z':
+        offset = datetime.timedelta(hours=int(zone[1:3]), minutes=int(zone[-2:]))
+        date = date - offset if zone[0] == '+' else date + offset
+    return date
+
+
+def parse_date_math(value, round_up):
+    """
+    :param value: Date, possibly with date math, e.g. "now-1d/d" or "2016-01-01||+1M/M".
+    :param bool round_up: Whether rounding goes to the last millisecond of the unit.
+    :rtype: datetime.datetime
+    :raises ElasticError: Not a date.
+    """
+    if not isinstance(value, basestring):
+        return parse_date(value)
+    if value.startswith('now'):
+        date, math = datetime.datetime.utcnow(), value[3:]
+    else:
+        anchor, _, math = value.partition('||')
+        date = parse_date(anchor)
+    for operation, unit in _DATE_MATH_PATTERN.findall(math):
+        if operation == '/':
+            date = _round_date(date, unit, round_up)
+        elif unit in 'yM':
+            months = date.month - 1 + int(operation) * (12 if unit == 'y' else 1)
+            date = date.replace(year=date.year + months // 12, month=months % 12 + 1)
+        else:
+            date += datetime.timedelta(seconds=int(operation) * _UNIT_SECONDS[unit])
+    return date
+
+
+def _round_date(date, unit, round_up):
+    if unit in 'yM':
+        start = date.replace(month=1 if unit == 'y' else date.month, day=1, hour=0, minute=0,
+                             second=0, microsecond=0)
+        months = start.month - 1 + (12 if unit == 'y' else 1)
+        end = start.replace(year=start.year + months // 12, month=months % 12 + 1)
+    else:
+        epoch = EPOCH
+        if unit == 'w':
+            # weeks start on Monday
+            epoch += datetime.timedelta(days=4)
+        seconds = int((date - epoch).total_seconds()) // _UNIT_SECONDS[unit] * _UNIT_SECONDS[unit]
+        start = epoch + datetime.timedelta(seconds=seconds)
+        end = start + datetime.timedelta(seconds=_UNIT_SECONDS[unit])
+    return end - datetime.timedelta(milliseconds=1) if round_up else start
@@ -14,17 +14,24 @@
 # limitations under the License.
 #
 
-import json
 import logging
 
+from data_catalog.codec import codec
+from data_catalog.configuration_const import (RAW_SUBFIELD, LOWERCASE_SUBFIELD,
+                                              RAW_SUBFIELD_FIELDS)
 from data_catalog.metadata_entry import (CERBERUS_SCHEMA, ORG_UUID_FIELD, CREATION_TIME_FIELD,
-                                         IS_PUBLIC_FIELD)
+                                         IS_PUBLIC_FIELD, VISIBLE_TO_FIELD,
+                                         PUBLIC_VISIBILITY_MARKER, INTERNAL_FIELDS)
 
 
 class ElasticSearchQueryTranslator(object):
-    def __init__(self):
+    def __init__(self, time_rounding=None):
+        """
+        :param str time_rounding: ElasticSearch's date math unit to which open-ended
+            and relative time ranges are rounded. No rounding if not set.
+        """
         self._log = logging.getLogger(type(self).__name__)
-        self._filter_translator = ElasticSearchFilterExtractor()
+        self._filter_translator = ElasticSearchFilterExtractor(time_rounding)
         self._base_query_creator = ElasticSearchBaseQueryCreator()
 
     def translate(self, data_catalog_query, org_uuid_list, dataset_filtering, is_admin):
@@ -41,18 +48,58 @@ class ElasticSearchQueryTranslator(object):
         :rtype str:
         :raises ValueError:
         """
+        return codec.dumps(self.translate_to_dict(
+            data_catalog_query, org_uuid_list, dataset_filtering, is_admin))
+
+    def translate_to_dict(self, data_catalog_query, org_uuid_list, dataset_filtering, is_admin):
+        """
+        Same as "translate", but returns the ElasticSearch query as a dictionary,
+        so it can be inspected and adjusted before sending.
+        :rtype dict:
+        :raises InvalidQueryError:
+        """
         query_dict = self._get_query_dict(data_catalog_query)
+        final_query = self._create_filtered_query(query_dict, org_uuid_list,
+                                                  dataset_filtering, is_admin)
+
+        self._add_pagination(final_query, query_dict)
+        return final_query
 
+    def translate_for_export(self, data_catalog_query, org_uuid_list, dataset_filtering, is_admin,
+                             after_uid=None):
+        """
+        Translates a Data Catalog query to an ElasticSearch query meant for scrolling through
+        all of the matching data sets.
+        Filters and visibility rules are the same as in "translate", but aggregations
+        and pagination are left out. The hits are sorted by their UIDs, so an interrupted
+        export can be continued after the last hit it returned.
+        :param str data_catalog_query: A query string from Data Catalog.
+        :param list[str] org_uuid_list: A list of org_uuids that dataset belongs to.
+        :param DataSetFiltering dataset_filtering: Describes if the data sets we want
+                should be private, public or both.
+        :param str after_uid: Only hits with greater UIDs ("<type>#<id>") are returned.
+        :returns: A dictionary that is a valid ElasticSearch query.
+        :rtype dict:
+        :raises InvalidQueryError:
+        """
+        query_dict = self._get_query_dict(data_catalog_query)
+        export_query = self._create_filtered_query(query_dict, org_uuid_list,
+                                                   dataset_filtering, is_admin)
+        del export_query['aggregations']
+        export_query['sort'] = ['_uid']
+        if after_uid:
+            export_query['query']['bool']['filter'].append(
+                {'range': {'_uid': {'gt': after_uid}}})
+        return export_query
+
+    def _create_filtered_query(self, query_dict, org_uuid_list, dataset_filtering, is_admin):
         es_query_base = self._base_query_creator.create_base_query(query_dict)
         query_filters, post_filters = self._filter_translator.extract_filter(
             query_dict,
             org_uuid_list,
             dataset_filtering,
             is_admin)
-        final_query = self._combine_query_and_filters(es_query_base, query_filters, post_filters)
-
-        self._add_pagination(final_query, query_dict)
-        return json.dumps(final_query)
+        return self._combine_query_and_filters(es_query_base, query_filters, post_filters)
 
     def _get_query_dict(self, data_catalog_query):
         """
@@ -60,7 +107,7 @@ class ElasticSearchQueryTranslator(object):
         """
         if data_catalog_query:
             try:
-                query_dict = json.loads(data_catalog_query)
+                query_dict = codec.loads(data_catalog_query)
             except ValueError:
                 self._log_and_raise_invalid_query('Supplied query is not a JSON document.')
         else:
@@ -70,13 +117,18 @@ class ElasticSearchQueryTranslator(object):
     @staticmethod
     def _combine_query_and_filters(base_es_query, query_filters, post_filters):
         """
-        Combines translated base query, filters into one output query and aggregation for categories
+        Combines translated base query, filters into one output query and aggregation
+        for categories.
+        Query filters are put in the filter context of a bool query, so they don't take part
+        in scoring and ElasticSearch can cache them. Fields kept only for the index
+        are left out of the returned hits.
         """
         return {
+            '_source': {'excludes': list(INTERNAL_FIELDS)},
             'query': {
-                'filtered': {
-                    'filter': query_filters,
-                    'query': base_es_query
+                'bool': {
+                    'must': base_es_query,
+                    'filter': query_filters
                 }
             },
             'post_filter': post_filters,
@@ -84,29 +136,33 @@ class ElasticSearchQueryTranslator(object):
                 'categories': {
                     'terms': {
                         'size': 100,
-                        'field': 'category'
+                        'field': get_raw_field('category')
                     }
                 },
                 'formats': {
                     'terms': {
-                        'field': 'format'
+                        'field': get_raw_field('format')
                     }
                 }
             }
         }
 
-    @staticmethod
-    def _add_pagination(final_query, input_query_dict):
+    def _add_pagination(self, final_query, input_query_dict):
         """
         If input query contains pagination information ("from" and "size" fields) then they
-        will be added to the output query.
+        will be added to the output query. They have to be non-negative integers, but numeric
+        strings (e.g. "10") are accepted as well.
         """
-        from_field = 'from'
-        size_field = 'size'
-        if from_field in input_query_dict:
-            final_query[from_field] = input_query_dict[from_field]
-        if size_field in input_query_dict:
-            final_query[size_field] = input_query_dict[size_field]
+        for field in ('from', 'size'):
+            if field in input_query_dict:
+                try:
+                    value = int(input_query_dict[field])
+                except (TypeError, ValueError):
+                    value = -1
+                if value < 0:
+                    self._log_and_raise_invalid_query(
+                        '"{}" has to be a non-negative integer.'.format(field))
+                final_query[field] = value
 
     def _log_and_raise_invalid_query(self, message):
         self._log.error(message)
@@ -161,86 +217,70 @@ class ElasticSearchBaseQueryCreator(object):
 
 
 class ElasticSearchFilterExtractor(object):
-    def __init__(self):
+    def __init__(self, time_rounding=None):
         self._log = logging.getLogger(type(self).__name__)
+        self._time_rounding = time_rounding
 
-    # pylint: disable=too-many-branches
     def extract_filter(self, query_dict, org_uuid_list,
                        dataset_filtering, is_admin):
         """
         Creates a filter for the ElasticSearch query based on the filter information
         from the Data Catalog query.
-        None is returned when there are no filters.
         :param dict query_dict: A Data Catalog query in a form of dict (can be empty)
         :param list[str] org_uuid_list: List of the organisations' UUIDs
-        :returns: Two types of filters; each as a dict {'and': [filter1, filter2, ...]}
-        :rtype (dict, dict):
+        :returns: Query filters as a list of clauses for bool query's filter context
+            and post filters as a bool query {'bool': {'filter': [filter1, filter2, ...]}}
+            (or an empty dict when there are no post filters).
+        :rtype (list, dict):
         """
-        # TODO this should totally be rewritten to have less branches
         filters = query_dict.get('filters', [])
 
-        if dataset_filtering is DataSetFiltering.PRIVATE_AND_PUBLIC:
-            if not is_admin or org_uuid_list:
-                filters.append({'orgUUID': org_uuid_list})
-                filters.append({'isPublic': [True]})
-        elif dataset_filtering is DataSetFiltering.ONLY_PRIVATE:
+        if dataset_filtering is DataSetFiltering.ONLY_PRIVATE:
             if not is_admin or org_uuid_list:
-                filters.append({'orgUUID': org_uuid_list})
-            filters.append({'isPublic': [False]})
-        else:
-            filters.append({'isPublic': [True]})
+                filters.append({ORG_UUID_FIELD: org_uuid_list})
+            filters.append({IS_PUBLIC_FIELD: [False]})
+        elif dataset_filtering is DataSetFiltering.ONLY_PUBLIC:
+            filters.append({IS_PUBLIC_FIELD: [True]})
 
-        result = self._filters_segregation(filters, dataset_filtering)
-        query_filters, post_filters, or_filters = result
+        query_filters, post_filters = self._filters_segregation(filters)
 
-        return self._prepare_query_filters_dict(query_filters, post_filters, or_filters)
-
-    @staticmethod
-    def _prepare_query_filters_dict(query_filters, post_filters, or_filters):
-        if not query_filters and or_filters:
-            query_filters_dict = {'or': or_filters}
-        elif or_filters and query_filters:
-            query_filters.append({'or': or_filters})
-            query_filters_dict = {'and': query_filters}
-        elif not or_filters and query_filters:
-            query_filters_dict = {'and': query_filters}
-        else:
-            query_filters_dict = {}
+        if dataset_filtering is DataSetFiltering.PRIVATE_AND_PUBLIC \
+                and (not is_admin or org_uuid_list):
+            query_filters.append(self._create_visibility_filter(org_uuid_list or []))
 
         if post_filters:
-            return query_filters_dict, {'and': post_filters}
+            return query_filters, {'bool': {'filter': post_filters}}
         else:
-            return query_filters_dict, {}
+            return query_filters, {}
+
+    @staticmethod
+    def _create_visibility_filter(org_uuid_list):
+        """
+        Data sets of the given organisations or public ones.
+        It's a single filter over "visibleTo" field that is filled out when indexing,
+        so it's cheaper than an alternative of an "orgUUID" and an "isPublic" filter.
+        """
+        visible_to_values = [org_uuid.lower() for org_uuid in org_uuid_list]
+        visible_to_values.append(PUBLIC_VISIBILITY_MARKER)
+        return {'terms': {VISIBLE_TO_FIELD: visible_to_values}}
 
-    def _filters_segregation(self, filters, dataset_filtering):
+    def _filters_segregation(self, filters):
         query_filters = []
         post_filters = []
-        or_filters = []
         # filters should be in form NAME: [VALUE, VALUE, ...]
         for data_set_filter in filters:
             filter_type, filter_values = self._get_filter_properties(data_set_filter)
             es_filter = self._translate_filter(filter_type, filter_values)
             if not es_filter:
                 continue
-            if dataset_filtering is DataSetFiltering.PRIVATE_AND_PUBLIC:
-                if filter_type in [ORG_UUID_FIELD, IS_PUBLIC_FIELD]:
-                    # filters that are applied with 'or' parameter
-                    or_filters.append(es_filter)
-                elif filter_type in [CREATION_TIME_FIELD]:
-                    # filters that are applied with the query (result are filtered)
-                    query_filters.append(es_filter)
-                else:
-                    # filters that are applied AFTER the query (results are unfiltered)
-                    post_filters.append(es_filter)
+            if filter_type in [ORG_UUID_FIELD, CREATION_TIME_FIELD, IS_PUBLIC_FIELD]:
+                # filters that are applied with the query (result are filtered)
+                query_filters.append(es_filter)
             else:
-                if filter_type in [ORG_UUID_FIELD, CREATION_TIME_FIELD, IS_PUBLIC_FIELD]:
-                    # filters that are applied with the query (result are filtered)
-                    query_filters.append(es_filter)
-                else:
-                    # filters that are applied AFTER the query (results are unfiltered)
-                    post_filters.append(es_filter)
+                # filters that are applied AFTER the query (results are unfiltered)
+                post_filters.append(es_filter)
 
-        return query_filters, post_filters, or_filters
+        return query_filters, post_filters
 
     def _get_filter_properties(self, query_filter):
         """
@@ -270,20 +310,26 @@ class ElasticSearchFilterExtractor(object):
 
         def create_normal_filter(values):
             values = [str(value).lower() for value in values]
+            if filter_type in RAW_SUBFIELD_FIELDS:
+                # whole values are matched, regardless of case
+                field = get_lowercase_field(filter_type)
+            else:
+                field = filter_type
             if len(values) == 1:
-                return {'term': {filter_type: values[0]}}
+                return {'term': {field: values[0]}}
             else:
-                return {'terms': {filter_type: values}}
+                return {'terms': {field: values}}
 
         def create_time_filter(values):
             time_range = {}
             if len(values) != 2:
                 self._log_and_raise_invalid_query('There should be exactly two time range values.')
 
+            open_ended = -1 in values
             if values[0] != -1:
-                time_range['from'] = values[0]
+                time_range['from'] = self._round_time(values[0], open_ended)
             if values[1] != -1:
-                time_range['to'] = values[1]
+                time_range['to'] = self._round_time(values[1], open_ended)
             return {
                 'range': {
                     CREATION_TIME_FIELD: time_range
@@ -300,11 +346,49 @@ class ElasticSearchFilterExtractor(object):
         else:
             return create_time_filter(filter_values)
 
+    def _round_time(self, value, open_ended):
+        """
+        Bounds of open-ended (e.g. "everything since the last visit") and relative
+        (e.g. "now-7d") time ranges differ between almost all queries, so filters with them
+        would never be served from ElasticSearch's caches. They're rounded with date math,
+        which widens the range to whole units.
+        """
+        if not self._time_rounding or isinstance(value, bool) \
+                or not isinstance(value, (basestring, int, long)):
+            return value
+        text = str(value)
+        if '/' in text:
+            # already rounded by the user
+            return value
+        if text.startswith('now') or '||' in text:
+            return '{}/{}'.format(text, self._time_rounding)
+        if open_ended:
+            return '{}||/{}'.format(text, self._time_rounding)
+        return value
+
     def _log_and_raise_invalid_query(self, message):
         self._log.error(message)
         raise InvalidQueryError(message)
 
 
+def get_raw_field(field):
+    """
+    :param str field: One of the fields with a not analyzed subfield.
+    :returns: Path of the field's not analyzed subfield.
+    :rtype: str
+    """
+    return '{}.{}'.format(field, RAW_SUBFIELD)
+
+
+def get_lowercase_field(field):
+    """
+    :param str field: One of the fields with a not analyzed subfield.
+    :returns: Path of the field's subfield with the lowercased whole value.
+    :rtype: str
+    """
+    return '{}.{}'.format(field, LOWERCASE_SUBFIELD)
+
+
 class InvalidQueryError(Exception):
     pass
 
@@ -0,0 +1,135 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Routing of metadata entries to ElasticSearch shards by their organisation.
+"""
+
+from elasticsearch.exceptions import NotFoundError
+
+# field of metadata entries with their organisation, routing value of the entries
+ORG_UUID_FIELD = 'orgUUID'
+# an entry has more copies only for a moment, when its organisation changes
+MAX_ENTRY_COPIES = 10
+
+
+class OrgRouting(object):
+
+    """
+    When enabled, every entry is stored on the shard chosen by its organisation's UUID,
+    so searches limited to a few organisations only need to ask a few shards.
+    When disabled, ElasticSearch's default routing (by entry ID) is used.
+    """
+
+    def __init__(self, elastic_config, elastic_search):
+        """
+        :param ElasticConfig elastic_config:
+        :param Elasticsearch elastic_search:
+        """
+        self._config = elastic_config
+        self._elastic_search = elastic_search
+
+    @property
+    def enabled(self):
+        return self._config.org_routing
+
+    def params(self, org_uuid):
+        """
+        :param str org_uuid: Organisation of the entry.
+        :returns: Keyword arguments that need to be passed to ElasticSearch's single document
+            calls (index, get, update, delete) on the entry.
+        :rtype: dict
+        """
+        if not self.enabled:
+            return {}
+        return {'routing': org_uuid.lower()}
+
+    def search_params(self, org_uuid_list):
+        """
+        :param list[str] org_uuid_list: Organisations that all of the searched entries belong to.
+            Should be empty when the search can also hit entries from other organisations
+            (e.g. public ones or any entries for an admin).
+        :returns: Keyword arguments for ElasticSearch's search call.
+        :rtype: dict
+        """
+        if not self.enabled or not org_uuid_list:
+            return {}
+        return {'routing': ','.join(sorted(set(org_uuid.lower() for org_uuid in org_uuid_list)))}
+
+    def get_entry(self, entry_id, index=None, org_uuid_list=()):
+        """
+        Gets the current version of the entry with the given ID with a realtime GET.
+        With routing enabled the entry's shard isn't known from the ID, so it's first looked
+        for on the shards of the given organisations (e.g. the user's). Otherwise it's
+        looked up on all shards with a search, which only sees refreshed entries,
+        and its current version is read from the found entry's shard.
+        :param str entry_id:
+        :param str index: Metadata index (or its alias) used if not the configured one.
+        :param list[str] org_uuid_list: Organisations the entry probably belongs to.
+        :returns: ElasticSearch document (with "_id" and "_source").
+        :rtype: dict
+        :raises NotFoundError: entry not found in ElasticSearch
+        :raises ConnectionError: problem with connecting to ElasticSearch
+        """
+        index = index or self._config.elastic_index
+        if not self.enabled:
+            return self._elastic_search.get(
+                index=index,
+                doc_type=self._config.elastic_metadata_type,
+                id=entry_id)
+
+        document = self._get_from_orgs(entry_id, index, org_uuid_list)
+        if document:
+            return document
+        copies = self.find_copies(entry_id, index)
+        if not copies:
+            raise NotFoundError(404, 'Entry {} not found.'.format(entry_id))
+        return self._elastic_search.get(
+            index=index,
+            doc_type=self._config.elastic_metadata_type,
+            id=entry_id,
+            **self.params(copies[0]['_source'][ORG_UUID_FIELD]))
+
+    def find_copies(self, entry_id, index=None):
+        """
+        Searches all shards for the entry. It can be stored on more shards
+        when its organisation changed.
+        :param str entry_id:
+        :param str index: Metadata index (or its alias) used if not the configured one.
+        :returns: Search hits of the entry's copies.
+        :rtype: list[dict]
+        """
+        index = index or self._config.elastic_index
+        response = self._elastic_search.search(
+            index=index,
+            doc_type=self._config.elastic_metadata_type,
+            body={'query': {'ids': {'values': [entry_id]}}, 'size': MAX_ENTRY_COPIES})
+        return response['hits']['hits']
+
+    def _get_from_orgs(self, entry_id, index, org_uuid_list):
+        """
+        :returns: The entry found on one of the organisations' shards or None.
+        :rtype: dict
+        """
+        routings = sorted(set(org_uuid.lower() for org_uuid in org_uuid_list or ()))
+        if not routings:
+            return None
+        response = self._elastic_search.mget(
+            index=index,
+            doc_type=self._config.elastic_metadata_type,
+            body={'docs': [{'_id': entry_id, '_routing': routing} for routing in routings]})
+        return next((document for document in response['docs'] if document.get('found')),
+                    None)
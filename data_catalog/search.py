@@ -14,12 +14,18 @@
 # limitations under the License.
 #
 
+import json
+
+import time
+
 import flask
 
-from elasticsearch.exceptions import RequestError, ConnectionError
+from elasticsearch.exceptions import RequestError, ConnectionError, ConnectionTimeout
 from flask_restful import abort
 
 from data_catalog.bases import DataCatalogModel, DataCatalogResource
+from data_catalog.codec import codec
+from data_catalog.query_cost import QueryAdmission, QueryRejectedError
 from data_catalog.query_translation import ElasticSearchQueryTranslator, \
     InvalidQueryError, DataSetFiltering
 
@@ -30,6 +36,8 @@ class DataSetSearchResource(DataCatalogResource):
     Enables searching for metadata describing data sets.
     """
 
+    PROFILE_FORBIDDEN_ERROR_MESSAGE = 'Only admins can profile searches.'
+
     def __init__(self):
         super(DataSetSearchResource, self).__init__()
         self._search = DataSetSearch()
@@ -66,27 +74,146 @@ class DataSetSearchResource(DataCatalogResource):
         In addition to a query, they allow to choose only private data sets or only public ones.
         They are mutually exclusive!
 
+        Admins can set 'profile' to true to get the translated query and a breakdown
+        of the time spent in ElasticSearch (on every shard) and in Data Catalog
+        along with the results.
         """
         args = flask.request.args
         query_string = args.get('query')
         is_admin = flask.g.is_admin
         org_uuid_list = flask.g.get('org_uuid_list')
         params = self._search.get_params_from_request_args(args)
+        profile = args.get('profile', default='', type=str).lower() == 'true'
+        if profile and not is_admin:
+            abort(403, message=self.PROFILE_FORBIDDEN_ERROR_MESSAGE)
         try:
-            return self._search.search(
+            result = self._search.search(
                 query_string, org_uuid_list,
                 params['dataset_filtering'],
-                is_admin)
+                is_admin,
+                profile=profile)
         except InvalidQueryError:
             abort(400, message=DataSetSearch.INVALID_QUERY_ERROR_MESSAGE)
+        except QueryRejectedError as ex:
+            abort(ex.status, message=ex.message)
+        except SearchTimeoutError:
+            abort(504, message=DataSetSearch.TIMEOUT_ERROR_MESSAGE)
         except IndexConnectionError:
             abort(500, message=DataSetSearch.NO_CONNECTION_ERROR_MESSAGE)
 
+        if profile:
+            self._add_request_timings(result)
+        return result
+
+    @staticmethod
+    def _add_request_timings(result):
+        """
+        The results are encoded once more to measure it, it's the same work
+        Flask-RESTful does when sending them.
+        """
+        timings = result['profile']['timings']
+        timings['authMs'] = to_milliseconds(flask.g.get('auth_duration', 0))
+        start_time = time.time()
+        codec.dumps(result)
+        timings['serializationMs'] = to_milliseconds(time.time() - start_time)
+
+
+class DataSetMultiSearchResource(DataCatalogResource):
+
+    """
+    Runs a batch of searches for data sets in one request.
+    """
+
+    MAX_QUERIES = 10
+    INVALID_BATCH_ERROR_MESSAGE = \
+        '"queries" should be a JSON list of at most {} searches.'.format(MAX_QUERIES)
+
+    def __init__(self):
+        super(DataSetMultiSearchResource, self).__init__()
+        self._search = DataSetSearch()
+
+    def get(self):
+        """
+        Do many searches for data sets at once.
+        Parameter "queries" should be a JSON list of searches in this format:
+        [
+            {
+                "query": DATA_CATALOG_QUERY,
+                "onlyPublic": true,
+                "onlyPrivate": false
+            }
+        ]
+
+        DATA_CATALOG_QUERY has the same format as the query of the search endpoint.
+        All fields are optional, "onlyPublic" and "onlyPrivate" work like in the search endpoint.
+        Field 'orgs' applies to all of the searches.
+
+        Results are returned in the order of the searches, each one with its own status:
+        {"status": 200, "hits": [...], "total": ..., "categories": [...], "formats": [...]}
+        or {"status": 400, "message": ERROR_MESSAGE} when the search failed.
+        """
+        searches = self._get_searches(flask.request.args.get('queries'))
+        try:
+            return {
+                'responses': self._search.multi_search(
+                    searches,
+                    flask.g.get('org_uuid_list'),
+                    flask.g.is_admin)
+            }
+        except SearchTimeoutError:
+            abort(504, message=DataSetSearch.TIMEOUT_ERROR_MESSAGE)
+        except IndexConnectionError:
+            abort(500, message=DataSetSearch.NO_CONNECTION_ERROR_MESSAGE)
+
+    def _get_searches(self, queries_string):
+        """
+        :returns: Pairs of a Data Catalog query and its DataSetFiltering.
+        :rtype: list[(str, DataSetFiltering)]
+        """
+        try:
+            queries = json.loads(queries_string or '')
+        except ValueError:
+            queries = None
+        if not isinstance(queries, list) or not 0 < len(queries) <= self.MAX_QUERIES \
+                or not all(isinstance(query, dict) for query in queries):
+            self._log.warning('Invalid batch of queries: %s', queries_string)
+            abort(400, message=self.INVALID_BATCH_ERROR_MESSAGE)
+
+        searches = []
+        for query in queries:
+            data_catalog_query = query.get('query')
+            if data_catalog_query is not None and not isinstance(data_catalog_query, basestring):
+                data_catalog_query = json.dumps(data_catalog_query)
+            searches.append((data_catalog_query, DataSetSearch.get_dataset_filtering(
+                query.get('onlyPublic'), query.get('onlyPrivate'))))
+        return searches
+
 
 class IndexConnectionError(Exception):
     pass
 
 
+class SearchTimeoutError(IndexConnectionError):
+    pass
+
+
+def to_milliseconds(seconds):
+    return round(seconds * 1000, 3)
+
+
+def get_routed_orgs(org_uuid_list, dataset_filtering):
+    """
+    Only searches for private data sets are limited to the given organisations,
+    the others can also hit public data sets of any organisation.
+    :returns: Organisations that all of the searched data sets belong to
+        or an empty list if the search can't be routed to them.
+    :rtype: list[str]
+    """
+    if dataset_filtering is DataSetFiltering.ONLY_PRIVATE and org_uuid_list:
+        return org_uuid_list
+    return []
+
+
 class DataSetSearch(DataCatalogModel):
 
     """
@@ -97,32 +224,156 @@ class DataSetSearch(DataCatalogModel):
     SEARCH_ERROR_MESSAGE = 'Searching in the index failed'
     INVALID_QUERY_ERROR_MESSAGE = SEARCH_ERROR_MESSAGE + ': invalid query.'
     NO_CONNECTION_ERROR_MESSAGE = SEARCH_ERROR_MESSAGE + ': failed to connect to ElasticSearch.'
+    TIMEOUT_ERROR_MESSAGE = SEARCH_ERROR_MESSAGE + ': ElasticSearch took too long to respond.'
 
     def __init__(self):
         super(DataSetSearch, self).__init__()
-        self._translator = ElasticSearchQueryTranslator()
+        self._translator = ElasticSearchQueryTranslator(self._config.search.time_rounding)
+        self._admission = QueryAdmission(self._config.query_cost)
+
+    def search(self, query, org_uuid_list, dataset_filtering, is_admin, profile=False):
+        """
+        Searches within the configured time budget. When ElasticSearch runs out of time
+        it returns the hits collected so far and the result has "timedOut" set.
+        :param bool profile: Run the search with ElasticSearch's profile API and add
+            a "profile" with the translated query and timings to the result.
+        :raises InvalidQueryError:
+        :raises QueryRejectedError: The query is too expensive.
+        :raises SearchTimeoutError: ElasticSearch didn't respond before the deadline.
+        :raises IndexConnectionError:
+        """
+        translation_start = time.time()
+        es_query = self._admission.admit(self._translator.translate_to_dict(
+            query, org_uuid_list, dataset_filtering, is_admin))
+        search_start = time.time()
+        if not profile:
+            return self._extract_metadata(
+                self._run_search(es_query, org_uuid_list, dataset_filtering))
+
+        translated_query = dict(es_query)
+        es_query['profile'] = True
+        es_response = self._run_search(es_query, org_uuid_list, dataset_filtering)
+        extraction_start = time.time()
+        result = self._extract_metadata(es_response)
+        result['profile'] = {
+            'query': translated_query,
+            'took': es_response.get('took'),
+            'shards': es_response.get('profile', {}).get('shards', []),
+            'timings': {
+                'translationMs': to_milliseconds(search_start - translation_start),
+                'elasticSearchMs': to_milliseconds(extraction_start - search_start),
+                'extractionMs': to_milliseconds(time.time() - extraction_start)
+            }
+        }
+        return result
 
-    def search(self, query, org_uuid_list, dataset_filtering, is_admin):
-        query_string = self._translator.translate(query, org_uuid_list, dataset_filtering, is_admin)
+    def count(self, org_uuid_list, dataset_filtering, is_admin):
+        """
+        Counts the data sets visible to the user, without fetching any of them.
+        :returns: The number of data sets.
+        :rtype: int
+        :raises SearchTimeoutError:
+        :raises IndexConnectionError:
+        """
+        es_query = self._translator.translate_to_dict(
+            None, org_uuid_list, dataset_filtering, is_admin)
+        return self._run_search(es_query, org_uuid_list, dataset_filtering,
+                                self._storage.count)
+
+    def _run_search(self, es_query, org_uuid_list, dataset_filtering, run=None):
+        """
+        :param run: Storage's function running the query, "search" by default.
+        :returns: Its result, ElasticSearch's response in case of "search".
+        """
+        run = run or self._storage.search
         try:
-            elastic_search_results = self._elastic_search.search(
-                index=self._config.elastic.elastic_index,
-                doc_type=self._config.elastic.elastic_metadata_type,
-                body=query_string
-            )
-            return self._extract_metadata(elastic_search_results)
+            return run(es_query, get_routed_orgs(org_uuid_list, dataset_filtering),
+                       **self._get_time_budget_params())
         except RequestError:
             self._log.exception(self.INVALID_QUERY_ERROR_MESSAGE)
             raise InvalidQueryError(self.INVALID_QUERY_ERROR_MESSAGE)
+        except ConnectionTimeout:
+            self._log.exception(self.TIMEOUT_ERROR_MESSAGE)
+            raise SearchTimeoutError(self.TIMEOUT_ERROR_MESSAGE)
         except ConnectionError:
             self._log.exception(self.NO_CONNECTION_ERROR_MESSAGE)
             raise IndexConnectionError(self.NO_CONNECTION_ERROR_MESSAGE)
 
+    def multi_search(self, searches, org_uuid_list, is_admin):
+        """
+        Runs all of the searches at once (with a single ElasticSearch multi search request).
+        :param list[(str, DataSetFiltering)] searches: Data Catalog queries with
+            the kind of data sets they look for.
+        :param list[str] org_uuid_list:
+        :param bool is_admin:
+        :returns: Results of searches (like the ones from "search") or errors,
+            each one with a HTTP status.
+        :rtype: list[dict]
+        :raises IndexConnectionError:
+        """
+        results = [None] * len(searches)
+        storage_searches = []
+        sent_positions = []
+        for position, (query, dataset_filtering) in enumerate(searches):
+            try:
+                es_query = self._admission.admit(self._translator.translate_to_dict(
+                    query, org_uuid_list, dataset_filtering, is_admin))
+            except InvalidQueryError:
+                results[position] = self._create_error(400, self.INVALID_QUERY_ERROR_MESSAGE)
+                continue
+            except QueryRejectedError as ex:
+                results[position] = self._create_error(ex.status, ex.message)
+                continue
+            storage_searches.append(
+                (es_query, get_routed_orgs(org_uuid_list, dataset_filtering)))
+            sent_positions.append(position)
+
+        if not storage_searches:
+            return results
+
+        try:
+            responses = self._storage.multi_search(storage_searches,
+                                                   **self._get_time_budget_params())
+        except ConnectionTimeout:
+            self._log.exception(self.TIMEOUT_ERROR_MESSAGE)
+            raise SearchTimeoutError(self.TIMEOUT_ERROR_MESSAGE)
+        except ConnectionError:
+            self._log.exception(self.NO_CONNECTION_ERROR_MESSAGE)
+            raise IndexConnectionError(self.NO_CONNECTION_ERROR_MESSAGE)
+
+        for position, response in zip(sent_positions, responses):
+            if 'error' in response:
+                self._log.error('%s %s', self.INVALID_QUERY_ERROR_MESSAGE, response['error'])
+                results[position] = self._create_error(400, self.INVALID_QUERY_ERROR_MESSAGE)
+            else:
+                results[position] = self._extract_metadata(response)
+                results[position]['status'] = 200
+        return results
+
+    def _get_time_budget_params(self):
+        """
+        "timeout" and "terminate_after" are checked by ElasticSearch, so it stops searching
+        and returns partial results. "request_timeout" is Data Catalog's deadline for the call,
+        after which it stops waiting, even if ElasticSearch doesn't.
+        """
+        params = {'request_timeout': self._config.search.request_timeout}
+        if self._config.search.timeout:
+            params['timeout'] = self._config.search.timeout
+        if self._config.search.terminate_after:
+            params['terminate_after'] = self._config.search.terminate_after
+        return params
+
+    @staticmethod
+    def _create_error(status, message):
+        return {'status': status, 'message': message}
+
     @staticmethod
     def _extract_metadata(es_query_result):
         hits = es_query_result['hits']
-        category_aggregations = es_query_result['aggregations']['categories']['buckets']
-        format_aggregations = es_query_result['aggregations']['formats']['buckets']
+        # aggregations are dropped from expensive queries
+        aggregations = es_query_result.get('aggregations', {})
+        category_aggregations = aggregations.get('categories', {}).get('buckets', [])
+        format_aggregations = aggregations.get('formats', {}).get('buckets', [])
         entries = []
         for entry in hits['hits']:
             entries.append(entry['_source'])
@@ -132,14 +383,26 @@ class DataSetSearch(DataCatalogModel):
         return {'hits': entries,
                 'total': hits['total'],
                 'categories': categories,
-                'formats': formats}
+                'formats': formats,
+                'timedOut': es_query_result.get('timed_out', False)
+                            or es_query_result.get('terminated_early', False)}
 
     @staticmethod
     def get_params_from_request_args(args):
+        return {'dataset_filtering': DataSetSearch.get_dataset_filtering(
+            args.get('onlyPublic', default="", type=str),
+            args.get('onlyPrivate', default="", type=str))}
+
+    @staticmethod
+    def get_dataset_filtering(only_public, only_private):
+        """
+        :param only_public: Value of "onlyPublic" parameter (a string or a boolean).
+        :param only_private: Value of "onlyPrivate" parameter (a string or a boolean).
+        :rtype: DataSetFiltering
+        """
         dataset_filtering = DataSetFiltering.PRIVATE_AND_PUBLIC
-        if args.get('onlyPublic', default="", type=str).lower() == 'true':
+        if str(only_public).lower() == 'true':
             dataset_filtering = DataSetFiltering.ONLY_PUBLIC
-        if args.get('onlyPrivate', default="", type=str).lower() == 'true':
+        if str(only_private).lower() == 'true':
             dataset_filtering = DataSetFiltering.ONLY_PRIVATE
-
-        return {'dataset_filtering': dataset_filtering}
+        return dataset_filtering
@@ -0,0 +1,907 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Embedded storage for small deployments (e.g. edge sites with a few thousand data sets),
+where running ElasticSearch only for Data Catalog isn't worth it.
+
+SqliteStorage keeps the metadata entries in an SQLite database and evaluates the queries
+made by the query translation by compiling them to SQL:
+ * keyword, boolean, number and date values (also elements of lists, like "visibleTo"),
+   and whole values of strings analyzed with the keyword tokenizer (e.g. lowercased ones)
+   are kept in an indexed table of field values, used by filters, ranges and facets,
+ * analyzed text is tokenized like by ElasticSearch's analyzers (without stemming)
+   and searched with an FTS5 full text index.
+Fields are indexed according to the metadata index' mappings and analysis settings
+(see ElasticConfig.metadata_index_setup), the entries are analyzed again when they change.
+
+Entries can be read and searched right after they're written. Routing is ignored
+(there's a single shard) and relevance is the sum of boosts of the matching clauses.
+All requests of a process share one connection, SQLite's locking serializes writes
+of multiple processes.
+"""
+
+import functools
+import json
+import re
+import sqlite3
+import threading
+import time
+
+from elasticsearch.exceptions import HTTP_EXCEPTIONS, TransportError
+
+from data_catalog.metrics import measure_stage
+from data_catalog.query_dsl import (EPOCH, NUMERIC_TYPES, ElasticError, analyze, as_list,
+                                    filter_source, flatten_settings, get_analyzer,
+                                    get_field_clause, get_field_mapping, merge, parse_date,
+                                    parse_date_math)
+from data_catalog.storage import Storage
+
+SCHEMA = [
+    # mappings and analysis settings the entries were analyzed with, as JSON
+    'CREATE TABLE IF NOT EXISTS setup (id INTEGER PRIMARY KEY CHECK (id = 1), body TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS documents (id INTEGER PRIMARY KEY, doc_id TEXT NOT NULL UNIQUE)',
+    # sources are apart, so that searches looking up many documents read only small rows
+    'CREATE TABLE IF NOT EXISTS sources (id INTEGER PRIMARY KEY, source TEXT NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS field_values ('
+    ' document INTEGER NOT NULL, field TEXT NOT NULL, term TEXT, number REAL)',
+    'CREATE INDEX IF NOT EXISTS field_values_term ON field_values (field, term, document)',
+    'CREATE INDEX IF NOT EXISTS field_values_number ON field_values (field, number, document)',
+    'CREATE INDEX IF NOT EXISTS field_values_document ON field_values (document)',
+    # a row per document (rowid is the document's id), tokens are prefixed with their field
+    'CREATE VIRTUAL TABLE IF NOT EXISTS documents_text USING fts5('
+    " tokens, tokenize = \"unicode61 tokenchars '_'\")",
+]
+
+# source of the document "d" in queries
+SOURCE = '(SELECT source FROM sources WHERE id = d.id)'
+# Lucene's limit of clauses in a query, wildcards matching more terms are checked differently
+MAX_WILDCARD_TERMS = 1024
+WILDCARD_CACHE_SIZE = 256
+# changed when the entries are analyzed differently, so that they're analyzed again
+ANALYSIS_VERSION = 2
+
+
+def _api(method):
+    """
+    Raises errors as ElasticSearch's client does for error responses and measures time
+    spent as the "sqlite" stage of the request.
+    """
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        try:
+            with measure_stage('sqlite'):
+                return method(*args, **kwargs)
+        except ElasticError as ex:
+            raise HTTP_EXCEPTIONS.get(ex.status, TransportError)(
+                ex.status, ex.error_type, ex.to_response())
+    return wrapper
+
+
+class SqliteStorage(Storage):
+
+    """
+    Metadata entries in an SQLite database.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, elastic_config):
+        """
+        :param ElasticConfig elastic_config: Its "sqlite_path" is the database file
+            (":memory:" for a temporary in-memory database).
+        """
+        self._config = elastic_config
+        self._setup = _IndexSetup(elastic_config.metadata_index_setup,
+                                  elastic_config.elastic_metadata_type)
+        path = elastic_config.sqlite_path
+        self._connection = sqlite3.connect(path, timeout=30, isolation_level=None,
+                                           check_same_thread=False)
+        self._connection.create_function('es_wildcard', 3, _wildcard_function)
+        self._lock = threading.RLock()
+        with self._lock:
+            if path != ':memory:':
+                self._connection.execute('PRAGMA journal_mode = WAL')
+                self._connection.execute('PRAGMA synchronous = NORMAL')
+            for statement in SCHEMA:
+                self._connection.execute(statement)
+            # documents matching the current search, used by aggregations
+            self._connection.execute(
+                'CREATE TEMP TABLE matches (id INTEGER PRIMARY KEY, score REAL NOT NULL)')
+            # terms of the full text index, for expanding wildcards
+            self._connection.execute('CREATE VIRTUAL TABLE temp.documents_terms '
+                                     'USING fts5vocab(main, documents_text, row)')
+        self._analyze_again_if_changed()
+
+    @classmethod
+    def shared(cls, elastic_config):
+        """
+        :returns: Storage shared by all models of the process.
+        :rtype: SqliteStorage
+        """
+        with cls._instances_lock:
+            path = elastic_config.sqlite_path
+            if path not in cls._instances:
+                cls._instances[path] = cls(elastic_config)
+            return cls._instances[path]
+
+    def _execute(self, sql, params=()):
+        return self._connection.execute(sql, params)
+
+    def _transaction(self):
+        return _Transaction(self._connection, self._lock)
+
+    def _analyze_again_if_changed(self):
+        """
+        Indexes the stored entries again when the mappings or analysis settings
+        aren't the ones they were indexed with.
+        """
+        setup_json = self._setup.to_json()
+        with self._transaction():
+            row = self._execute('SELECT body FROM setup').fetchone()
+            if row and row[0] == setup_json:
+                return
+            self._execute('DELETE FROM field_values')
+            self._execute('DELETE FROM documents_text')
+            for row_id, source in self._execute('SELECT id, source FROM sources').fetchall():
+                self._insert_analysis(row_id, json.loads(source))
+            self._execute('INSERT OR REPLACE INTO setup (id, body) VALUES (1, ?)', (setup_json,))
+
+    @_api
+    def get(self, entry_id, org_uuid_list=()):
+        with self._lock:
+            row = self._execute(
+                'SELECT s.source FROM documents d JOIN sources s ON s.id = d.id '
+                'WHERE d.doc_id = ?', (entry_id,)).fetchone()
+        if row is None:
+            raise ElasticError(404, 'not_found', 'Document not found',
+                               self._config.elastic_index)
+        return self._get_document(entry_id, json.loads(row[0]))
+
+    def _get_document(self, entry_id, source, score=None):
+        document = {'_index': self._config.elastic_index,
+                    '_type': self._config.elastic_metadata_type, '_id': entry_id}
+        if score is not None:
+            document['_score'] = score
+        if source is not None:
+            document['_source'] = source
+        return document
+
+    @_api
+    def index(self, entry_id, entry, org_uuid_list=()):
+        with self._transaction():
+            return self._write_document(entry_id, entry)
+
+    @_api
+    def update(self, entry_id, changes, current_entry):
+        with self._transaction():
+            row = self._execute(
+                'SELECT s.source FROM documents d JOIN sources s ON s.id = d.id '
+                'WHERE d.doc_id = ?', (entry_id,)).fetchone()
+            if row is None:
+                raise ElasticError(404, 'document_missing_exception',
+                                   '[{}][{}]: document missing'.format(
+                                       self._config.elastic_metadata_type, entry_id),
+                                   self._config.elastic_index)
+            self._write_document(entry_id, merge(json.loads(row[0]), changes))
+
+    @_api
+    def delete(self, entry_id, org_uuid):
+        with self._transaction():
+            row = self._execute('SELECT id FROM documents WHERE doc_id = ?',
+                                (entry_id,)).fetchone()
+            if row is None:
+                raise ElasticError(404, 'not_found', 'Document not found',
+                                   self._config.elastic_index)
+            self._execute('DELETE FROM documents WHERE id = ?', row)
+            self._delete_document_rows(row[0])
+
+    def _write_document(self, entry_id, source):
+        """
+        :returns: Whether the document was added.
+        :rtype: bool
+        """
+        if not isinstance(source, dict):
+            raise ElasticError(400, 'mapper_parsing_exception', 'Document should be an object')
+        # a document that doesn't fit the mappings fails before anything is written
+        values, tokens = _DocumentAnalysis(self._setup).analyze(source)
+        current = self._execute('SELECT id FROM documents WHERE doc_id = ?',
+                                (entry_id,)).fetchone()
+        if current:
+            row_id = current[0]
+            self._delete_document_rows(row_id)
+        else:
+            row_id = self._execute('INSERT INTO documents (doc_id) VALUES (?)',
+                                   (entry_id,)).lastrowid
+        self._execute('INSERT INTO sources (id, source) VALUES (?, ?)',
+                      (row_id, json.dumps(source)))
+        self._insert_analysis(row_id, source, values, tokens)
+        return current is None
+
+    def _insert_analysis(self, row_id, source, values=None, tokens=None):
+        if values is None:
+            values, tokens = _DocumentAnalysis(self._setup).analyze(source)
+        self._connection.executemany(
+            'INSERT INTO field_values (document, field, term, number) VALUES (?, ?, ?, ?)',
+            [(row_id,) + value for value in values])
+        self._execute('INSERT INTO documents_text (rowid, tokens) VALUES (?, ?)',
+                      (row_id, ' '.join(tokens)))
+
+    def _delete_document_rows(self, row_id):
+        self._execute('DELETE FROM sources WHERE id = ?', (row_id,))
+        self._execute('DELETE FROM field_values WHERE document = ?', (row_id,))
+        self._execute('DELETE FROM documents_text WHERE rowid = ?', (row_id,))
+
+    @_api
+    def search(self, query, routed_orgs=(), **params):
+        with self._lock:
+            return self._search(query, params.get('terminate_after'))
+
+    def _search(self, body, terminate_after):
+        search_start = time.time()
+        query = _SearchQuery(self._setup, body.get('query'),
+                             body.get('terminate_after', terminate_after), self._get_terms)
+        post_filter = _SearchQuery(self._setup, body.get('post_filter'),
+                                   get_terms=self._get_terms) \
+            if body.get('post_filter') else None
+        size = int(body.get('size', 10))
+        start = int(body.get('from', 0))
+
+        aggregations = body.get('aggregations', body.get('aggs'))
+        where, where_params = query.where()
+        score, score_params = query.score()
+        if aggregations:
+            # aggregations and hits share the matching documents, the query runs only once
+            self._execute('DELETE FROM temp.matches')
+            self._execute('INSERT INTO temp.matches (id, score) SELECT d.id, {} '
+                          'FROM documents d WHERE {}'.format(score, where),
+                          score_params + where_params)
+            tables = 'temp.matches m JOIN documents d ON d.id = m.id'
+            where, where_params, score, score_params = '1', [], 'm.score', []
+        else:
+            tables = 'documents d'
+        if post_filter:
+            filter_where, filter_params = post_filter.where()
+            where = '{} AND {}'.format(where, filter_where)
+            where_params = where_params + filter_params
+        total = self._execute('SELECT COUNT(*) FROM {} WHERE {}'.format(tables, where),
+                              where_params).fetchone()[0]
+        order_by, order_params, sorted_by_score = query.order_by(body.get('sort'))
+        matches = [(row_id, row_score if sorted_by_score else None)
+                   for row_id, row_score in self._execute(
+                       'SELECT d.id, {} FROM {} WHERE {} ORDER BY {} LIMIT ? OFFSET ?'.format(
+                           score, tables, where, order_by),
+                       score_params + where_params + order_params + [size, start])] \
+            if size else []
+
+        response = {
+            'timed_out': False,
+            '_shards': {'total': 1, 'successful': 1, 'failed': 0},
+            'hits': {
+                'total': total,
+                'max_score': max([row_score for _, row_score in matches] or [None]),
+                'hits': self._load_hits(matches, body.get('_source', True))
+            }
+        }
+        if query.terminate_after:
+            response['terminated_early'] = total >= query.terminate_after
+        if aggregations:
+            response['aggregations'] = self._aggregate(aggregations, query)
+            self._execute('DELETE FROM temp.matches')
+        response['took'] = int((time.time() - search_start) * 1000)
+        return response
+
+    def _get_terms(self, prefix):
+        """
+        :returns: Terms of the full text index starting with the prefix.
+        :rtype: list[str]
+        """
+        return [term for term, in self._execute(
+            'SELECT term FROM temp.documents_terms WHERE term >= ? AND term < ?',
+            (prefix, prefix + u'\uffff'))]
+
+    def _load_hits(self, matches, source_filter):
+        """
+        :param list matches: IDs and scores of the documents' rows.
+        :rtype: list[dict]
+        """
+        if not matches:
+            return []
+        rows = {}
+        row_ids = [row_id for row_id, _ in matches]
+        # SQLite limits the number of parameters
+        for start in range(0, len(row_ids), 500):
+            chunk = row_ids[start:start + 500]
+            rows.update((row[0], row[1:]) for row in self._execute(
+                'SELECT d.id, d.doc_id, s.source FROM documents d JOIN sources s ON s.id = d.id '
+                'WHERE d.id IN ({})'.format(','.join('?' * len(chunk))), chunk))
+        hits = []
+        for row_id, row_score in matches:
+            doc_id, source = rows[row_id]
+            hits.append(self._get_document(
+                doc_id,
+                None if source_filter in (False, 'false')
+                else filter_source(json.loads(source), source_filter),
+                row_score))
+        return hits
+
+    def _aggregate(self, aggregations, query):
+        """
+        Counts the values of the documents in the "matches" temporary table.
+        """
+        result = {}
+        for name, aggregation in aggregations.items():
+            if list(aggregation) != ['terms']:
+                raise ElasticError(400, 'search_parse_exception',
+                                   'Unsupported aggregation: {}'.format(list(aggregation)))
+            field = aggregation['terms']['field']
+            column = 'number' if query.get_kind(field) in ('number', 'date') else 'term'
+            buckets = self._execute(
+                'SELECT v.{0}, COUNT(DISTINCT v.document) AS doc_count FROM field_values v '
+                'WHERE v.field = ? AND v.{0} IS NOT NULL '
+                'AND v.document IN (SELECT id FROM temp.matches) '
+                'GROUP BY v.{0} ORDER BY doc_count DESC, v.{0}'.format(column),
+                [field]).fetchall()
+            size = aggregation['terms'].get('size', 10) or len(buckets)
+            result[name] = {
+                'doc_count_error_upper_bound': 0,
+                'sum_other_doc_count': sum(count for _, count in buckets[size:]),
+                'buckets': [{'key': key, 'doc_count': count} for key, count in buckets[:size]]
+            }
+        return result
+
+    @_api
+    def count(self, query, routed_orgs=(), **params):
+        with self._lock:
+            where, where_params = _SearchQuery(self._setup, query.get('query'),
+                                               params.get('terminate_after'),
+                                               self._get_terms).where()
+            return self._execute('SELECT COUNT(*) FROM documents d WHERE ' + where,
+                                 where_params).fetchone()[0]
+
+    def optimize(self):
+        """
+        Merges the full text index's segments and updates the statistics of the query
+        planner, e.g. after loading many entries.
+        """
+        with self._lock:
+            self._execute("INSERT INTO documents_text (documents_text) VALUES ('optimize')")
+            self._execute('ANALYZE')
+
+    def get_size(self):
+        """
+        :returns: Bytes taken by the database.
+        :rtype: int
+        """
+        with self._lock:
+            page_size = self._execute('PRAGMA page_size').fetchone()[0]
+            page_count = self._execute('PRAGMA page_count').fetchone()[0]
+        return page_size * page_count
+
+
+class _Transaction(object):
+
+    """
+    Holds the storage's lock and runs the statements in an SQLite transaction.
+    """
+
+    def __init__(self, connection, lock):
+        self._connection = connection
+        self._lock = lock
+        self._outermost = False
+
+    def __enter__(self):
+        self._lock.acquire()
+        self._outermost = not self._connection.in_transaction \
+            if hasattr(self._connection, 'in_transaction') else True
+        if self._outermost:
+            try:
+                self._connection.execute('BEGIN IMMEDIATE')
+            except sqlite3.OperationalError:
+                # already in a transaction of the same thread
+                self._outermost = False
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if self._outermost:
+                self._connection.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+        finally:
+            self._lock.release()
+        return False
+
+
+class _IndexSetup(object):
+
+    """
+    Mappings and analysis settings of the metadata index.
+    """
+
+    def __init__(self, body, doc_type):
+        """
+        :param dict body: Settings and mappings of the index.
+        :param str doc_type: Type of the entries.
+        """
+        self.settings = {name: value for name, value
+                         in flatten_settings(body.get('settings', {})).items()
+                         if name.startswith('index.analysis.')}
+        self.mappings = body.get('mappings', {})
+        self.doc_type = doc_type
+
+    def to_json(self):
+        return json.dumps({'settings': self.settings, 'mappings': self.mappings,
+                           'type': self.doc_type, 'version': ANALYSIS_VERSION}, sort_keys=True)
+
+    def get_field_mapping(self, field):
+        """
+        :returns: Mapping of the field (or its subfield, like "category.raw"),
+            empty if the field isn't mapped.
+        :rtype: dict
+        """
+        return get_field_mapping(self.mappings, field, self.doc_type)
+
+    def get_analyzer(self, name):
+        """
+        :returns: Tokenizer, stop words and whether the tokens are lowercased, of a built-in
+            analyzer or a custom one from the index's settings.
+        :rtype: (str, frozenset[str], bool)
+        """
+        return get_analyzer(self.settings, name)
+
+    def is_keyword(self, mapping):
+        """
+        :param dict mapping: Mapping of a string field.
+        :returns: Whether the field's values are indexed whole: not analyzed or analyzed
+            with the keyword tokenizer.
+        :rtype: bool
+        """
+        if mapping.get('index') == 'not_analyzed':
+            return True
+        return mapping.get('index') != 'no' \
+            and self.get_analyzer(mapping.get('analyzer', 'standard'))[0] == 'keyword'
+
+
+class _DocumentAnalysis(object):
+
+    """
+    Derives the indexed values of a document from its source, according to the mapping.
+    """
+
+    def __init__(self, setup):
+        self._setup = setup
+        self._properties = setup.mappings.get(setup.doc_type, {}).get('properties', {})
+        self._values = []
+        self._tokens = []
+
+    def analyze(self, source):
+        """
+        :returns: Field values (field, term, number) and prefixed text tokens.
+        :rtype: (list[tuple], list[str])
+        :raises ElasticError: A value doesn't fit the field's type.
+        """
+        self._add_object(source, self._properties, '')
+        return self._values, self._tokens
+
+    def _add_object(self, value, properties, prefix):
+        for name, field_value in value.items():
+            self._add_value(prefix + name, properties.get(name, {}), field_value)
+
+    def _add_value(self, field, mapping, value):
+        if value is None:
+            return
+        if isinstance(value, list):
+            for item in value:
+                self._add_value(field, mapping, item)
+            return
+        field_type = mapping.get('type', 'object' if 'properties' in mapping else None)
+        if field_type == 'completion':
+            # suggestions are made by ElasticSearch only
+            return
+        elif isinstance(value, dict):
+            if field_type in (None, 'object', 'nested'):
+                self._add_object(value, mapping.get('properties', {}), field + '.')
+        elif field_type is None:
+            # dynamic mapping of unmapped fields
+            if isinstance(value, bool):
+                self._add_value(field, {'type': 'boolean'}, value)
+            elif isinstance(value, (int, long, float)):
+                self._add_value(field, {'type': 'double'}, value)
+            else:
+                self._add_value(field, {'type': 'string'}, value)
+        elif field_type == 'string':
+            self._add_string(field, mapping, value)
+        elif field_type == 'boolean':
+            self._values.append((field, _normalize_boolean(value), None))
+        elif field_type == 'date':
+            self._values.append((field, None, _to_millis(parse_date(value))))
+        elif field_type in NUMERIC_TYPES:
+            self._values.append((field, None, _to_number(value, field)))
+
+    def _add_string(self, field, mapping, value):
+        value = value if isinstance(value, basestring) else json.dumps(value)
+        if mapping.get('index') == 'not_analyzed':
+            if len(value) <= mapping.get('ignore_above', len(value)):
+                self._values.append((field, value, None))
+        elif mapping.get('index') != 'no':
+            analyzer = self._setup.get_analyzer(mapping.get('analyzer', 'standard'))
+            if self._setup.is_keyword(mapping):
+                # a single term, matched only as a whole like in ElasticSearch
+                self._values.extend((field, token, None) for token in analyze(value, analyzer))
+            else:
+                prefix = _text_token(field, '')
+                self._tokens.extend(prefix + token.lower()
+                                    for token in analyze(value, analyzer))
+        for subfield, subfield_mapping in mapping.get('fields', {}).items():
+            self._add_value('{}.{}'.format(field, subfield), subfield_mapping, value)
+
+
+class _SearchQuery(object):
+
+    """
+    Compiles ElasticSearch's query DSL (the part produced by the query translation)
+    to an SQL condition and score on the "documents d" table.
+    """
+
+    def __init__(self, setup, query, terminate_after=None, get_terms=None):
+        """
+        :param _IndexSetup setup: Mappings and analysis of the searched fields.
+        :param dict query: Query DSL, None matches all documents.
+        :param terminate_after: Maximal number of matching documents.
+        :param get_terms: Function returning the terms of the full text index
+            that start with the given prefix.
+        """
+        self._mapping_setup = setup
+        self._get_terms = get_terms
+        self._compiled = None
+        self._query = query or {}
+        self.terminate_after = int(terminate_after or 0)
+
+    def where(self):
+        """
+        :returns: SQL condition selecting the matching documents and its parameters.
+        :rtype: (str, list)
+        """
+        condition, params, _, _ = self._get_compiled()
+        where, params = '({})'.format(condition), list(params)
+        if self.terminate_after:
+            where = 'd.id IN (SELECT d.id FROM documents d WHERE {} LIMIT ?)'.format(where)
+            params.append(self.terminate_after)
+        return where, params
+
+    def score(self):
+        """
+        :returns: SQL expression of the score of a matching document and its parameters.
+        :rtype: (str, list)
+        """
+        _, _, score, score_params = self._get_compiled()
+        return score, score_params
+
+    def _get_compiled(self):
+        # compiling may look up terms of wildcards, so it's done once
+        if self._compiled is None:
+            self._compiled = self._compile(self._query)
+        return self._compiled
+
+    def order_by(self, sort):
+        """
+        :returns: SQL ordering, its parameters and whether documents are sorted by score.
+        :rtype: (str, list, bool)
+        """
+        if not sort:
+            return '2 DESC, d.id', [], True
+        terms, params, sorted_by_score = [], [], False
+        for sort_spec in as_list(sort):
+            if isinstance(sort_spec, dict):
+                (field, order), = sort_spec.items()
+                if isinstance(order, dict):
+                    order = order.get('order', 'asc')
+            else:
+                field, order = sort_spec, 'desc' if sort_spec == '_score' else 'asc'
+            direction = 'DESC' if order == 'desc' else 'ASC'
+            if field == '_doc':
+                terms.append('d.id ' + direction)
+            elif field == '_score':
+                sorted_by_score = True
+                terms.append('2 ' + direction)
+            else:
+                column = 'number' if self.get_kind(field) in ('number', 'date') else 'term'
+                terms.append('(SELECT {0}({1}) FROM field_values WHERE document = d.id '
+                             'AND field = ?) {2}'.format('MAX' if direction == 'DESC' else 'MIN',
+                                                         column, direction))
+                params.append(field)
+        terms.append('d.id')
+        return ', '.join(terms), params, sorted_by_score
+
+    def get_kind(self, field):
+        """
+        :returns: How the field is indexed: "keyword", "boolean", "number", "date", "text"
+            or "completion".
+        :rtype: str
+        """
+        mapping = self._mapping_setup.get_field_mapping(field)
+        field_type = mapping.get('type')
+        if field_type == 'string' or field_type is None:
+            return 'keyword' if self._mapping_setup.is_keyword(mapping) else 'text'
+        if field_type in NUMERIC_TYPES:
+            return 'number'
+        return field_type
+
+    def _compile(self, query):
+        """
+        :returns: Condition, its parameters, score (0 for documents that don't match)
+            and its parameters.
+        :rtype: (str, list, str, list)
+        :raises RequestError: Unsupported query.
+        """
+        if not query:
+            return '1', [], '1.0', []
+        if not isinstance(query, dict) or len(query) != 1:
+            raise ElasticError(400, 'query_parsing_exception',
+                               'Query should have a single clause: {}'.format(query))
+        (clause_name, clause), = query.items()
+        compile_clause = getattr(self, '_compile_' + clause_name, None)
+        if compile_clause is None:
+            raise ElasticError(400, 'query_parsing_exception',
+                               'No query registered for [{}]'.format(clause_name))
+        return compile_clause(clause)
+
+    @staticmethod
+    def _scored(condition, params, boost):
+        """
+        :returns: A clause whose score is its boost when it matches.
+        """
+        return condition, params, 'CASE WHEN {} THEN {!r} ELSE 0.0 END'.format(
+            condition, float(boost)), list(params)
+
+    def _compile_match_all(self, clause):
+        return '1', [], repr(float(clause.get('boost', 1.0))), []
+
+    def _compile_bool(self, clause):
+        conditions, params, scores, score_params = [], [], [], []
+        # SQLite checks the conditions in this order, the filters usually are the cheapest ones
+        for must_filter in as_list(clause.get('filter', [])):
+            condition, condition_params, _, _ = self._compile(must_filter)
+            conditions.append(condition)
+            params.extend(condition_params)
+        for must_not in as_list(clause.get('must_not', [])):
+            condition, condition_params, _, _ = self._compile(must_not)
+            conditions.append('NOT ({})'.format(condition))
+            params.extend(condition_params)
+        for must in as_list(clause.get('must', [])):
+            condition, condition_params, score, must_score_params = self._compile(must)
+            conditions.append(condition)
+            params.extend(condition_params)
+            scores.append(score)
+            score_params.extend(must_score_params)
+        should_conditions, should_params = [], []
+        for should in as_list(clause.get('should', [])):
+            condition, condition_params, score, should_score_params = self._compile(should)
+            should_conditions.append('({})'.format(condition))
+            should_params.extend(condition_params)
+            scores.append('CASE WHEN {} THEN {} ELSE 0.0 END'.format(condition, score))
+            score_params.extend(condition_params + should_score_params)
+        required_should = clause.get('minimum_should_match')
+        if required_should is None:
+            required_should = 0 if 'must' in clause or 'filter' in clause \
+                or not should_conditions else 1
+        if int(required_should):
+            conditions.append('({}) >= {}'.format(' + '.join(should_conditions),
+                                                  int(required_should)))
+            params.extend(should_params)
+        condition = ' AND '.join('({})'.format(condition) for condition in conditions) or '1'
+        score = '({}) * {!r}'.format(' + '.join(scores) or '0.0',
+                                     float(clause.get('boost', 1.0)))
+        return condition, params, score, score_params
+
+    def _compile_constant_score(self, clause):
+        condition, params, _, _ = self._compile(clause['filter'])
+        return self._scored(condition, params, clause.get('boost', 1.0))
+
+    def _compile_ids(self, clause):
+        values = as_list(clause['values'])
+        condition = 'd.doc_id IN ({})'.format(','.join('?' * len(values))) if values else '0'
+        return self._scored(condition, list(values), clause.get('boost', 1.0))
+
+    def _compile_exists(self, clause):
+        field = clause['field']
+        if self.get_kind(field) == 'text':
+            return self._scored('json_extract({}, ?) IS NOT NULL'.format(SOURCE),
+                                [_json_path(field)], 1.0)
+        return self._scored('d.id IN (SELECT document FROM field_values WHERE field = ?)',
+                            [field], 1.0)
+
+    def _compile_term(self, clause):
+        field, value, boost = get_field_clause(clause, 'value')
+        return self._compile_terms({field: [value], 'boost': boost})
+
+    def _compile_terms(self, clause):
+        options = dict(clause)
+        boost = options.pop('boost', 1.0)
+        (field, values), = options.items()
+        values = as_list(values)
+        if not values:
+            return self._scored('0', [], boost)
+        kind = self.get_kind(field)
+        if kind == 'text':
+            return self._scored('d.id IN (SELECT rowid FROM documents_text '
+                                'WHERE documents_text MATCH ?)',
+                                [' OR '.join(_fts_string(_text_token(field, value))
+                                             for value in values)], boost)
+        column, values = self._get_column_values(field, kind, values)
+        return self._scored('d.id IN (SELECT document FROM field_values WHERE field = ? '
+                            'AND {} IN ({}))'.format(column, ','.join('?' * len(values))),
+                            [field] + values, boost)
+
+    def _get_column_values(self, field, kind, values):
+        if kind == 'boolean':
+            return 'term', [_normalize_boolean(value) for value in values]
+        if kind == 'date':
+            return 'number', [_to_millis(parse_date_math(value, False)) for value in values]
+        if kind == 'number':
+            return 'number', [_to_number(value, field) for value in values]
+        return 'term', [value if isinstance(value, basestring) else json.dumps(value)
+                        for value in values]
+
+    def _compile_match(self, clause):
+        field, text, boost = get_field_clause(clause, 'query')
+        operator = clause[field].get('operator', 'or') if isinstance(clause[field], dict) \
+            else 'or'
+        kind = self.get_kind(field)
+        if kind != 'text':
+            return self._compile_terms({field: [text], 'boost': boost})
+        mapping = self._mapping_setup.get_field_mapping(field)
+        tokens = analyze(text, self._mapping_setup.get_analyzer(
+            mapping.get('search_analyzer', mapping.get('analyzer', 'standard'))))
+        if not tokens:
+            return self._scored('0', [], boost)
+        separator = ' AND ' if operator.lower() == 'and' else ' OR '
+        return self._scored(
+            'd.id IN (SELECT rowid FROM documents_text WHERE documents_text MATCH ?)',
+            [separator.join(_fts_string(_text_token(field, token)) for token in tokens)],
+            boost)
+
+    def _compile_wildcard(self, clause):
+        field, pattern, boost = get_field_clause(clause, 'wildcard')
+        kind = self.get_kind(field)
+        if kind != 'text':
+            return self._scored('d.id IN (SELECT document FROM field_values WHERE field = ? '
+                                'AND term GLOB ?)', [field, _wildcard_to_glob(pattern)], boost)
+        # like Lucene, the pattern is matched against the indexed terms
+        prefix = _text_token(field, '')
+        pattern = pattern.lower()
+        literal_prefix = re.match(r'[^*?]*', pattern).group()
+        if self._get_terms:
+            regex = _wildcard_regex(prefix + pattern)
+            terms = [term for term in self._get_terms(prefix + literal_prefix)
+                     if regex.match(term)]
+            if not terms:
+                return self._scored('0', [], boost)
+            if len(terms) <= MAX_WILDCARD_TERMS:
+                return self._scored(
+                    'd.id IN (SELECT rowid FROM documents_text WHERE documents_text MATCH ?)',
+                    [' OR '.join(_fts_string(term) for term in terms)], boost)
+        # too many terms, LIKE quickly skips most documents and the wildcard is checked
+        # on the terms of the rest (CASE, unlike AND in arithmetic, never evaluates both)
+        mapping = self._mapping_setup.get_field_mapping(field)
+        analyzer = self._mapping_setup.get_analyzer(mapping.get('analyzer', 'standard'))
+        like = '%{}%'.format(pattern.replace('\\', '\\\\').replace('%', '\\%')
+                             .replace('_', '\\_').replace('*', '%').replace('?', '_'))
+        return self._scored(
+            "CASE WHEN json_extract({0}, ?) LIKE ? ESCAPE '\\' "
+            "THEN es_wildcard(json_extract({0}, ?), ?, ?) ELSE 0 END".format(SOURCE),
+            [_json_path(field), like, _json_path(field), pattern,
+             json.dumps([analyzer[0], sorted(analyzer[1]), analyzer[2]])], boost)
+
+    def _compile_prefix(self, clause):
+        field, prefix, boost = get_field_clause(clause, 'prefix')
+        escaped = prefix.replace('*', '').replace('?', '')
+        return self._compile_wildcard({field: {'wildcard': escaped + '*', 'boost': boost}})
+
+    def _compile_range(self, clause):
+        options = dict(clause)
+        (field, bounds), = options.items()
+        kind = self.get_kind(field)
+        if kind == 'text':
+            raise ElasticError(400, 'query_parsing_exception',
+                               'Ranges on analyzed fields are not supported: ' + field)
+        column = 'number' if kind in ('number', 'date') else 'term'
+        conditions, params = ['field = ?'], [field]
+        lower_inclusive = bounds.get('include_lower', True)
+        upper_inclusive = bounds.get('include_upper', True)
+        for key, inclusive, is_lower in (('from', lower_inclusive, True),
+                                         ('gte', True, True), ('gt', False, True),
+                                         ('to', upper_inclusive, False),
+                                         ('lte', True, False), ('lt', False, False)):
+            if bounds.get(key) is None:
+                continue
+            if kind == 'date':
+                # like in ElasticSearch, rounding includes the whole unit in inclusive ranges
+                bound = _to_millis(parse_date_math(bounds[key], inclusive != is_lower))
+            else:
+                bound = self._get_column_values(field, kind, [bounds[key]])[1][0]
+            conditions.append('{} {}{} ?'.format(column, '>' if is_lower else '<',
+                                                 '=' if inclusive else ''))
+            params.append(bound)
+        return self._scored('d.id IN (SELECT document FROM field_values WHERE {})'.format(
+            ' AND '.join(conditions)), params, bounds.get('boost', 1.0))
+
+
+def _text_token(field, token):
+    """
+    Text of all fields is in a single full text index, so the tokens are prefixed
+    with the field's name.
+    """
+    return u'{}_{}'.format(field.replace('.', '_'), token).lower()
+
+
+def _fts_string(token):
+    return u'"{}"'.format(token.replace('"', '""'))
+
+
+# compiled wildcards of the recent searches, cleared when it's full
+_wildcard_cache = {}
+
+
+def _wildcard_function(text, pattern, analyzer_json):
+    """
+    SQL function checking whether any term of the analyzed text matches the wildcard.
+    """
+    if text is None:
+        return 0
+    key = (pattern, analyzer_json)
+    if key not in _wildcard_cache:
+        if len(_wildcard_cache) >= WILDCARD_CACHE_SIZE:
+            _wildcard_cache.clear()
+        tokenizer, stop_words, lowercase = json.loads(analyzer_json)
+        _wildcard_cache[key] = (_wildcard_regex(pattern),
+                                (tokenizer, frozenset(stop_words), lowercase))
+    regex, analyzer = _wildcard_cache[key]
+    return int(any(regex.match(term) for term in analyze(text, analyzer)))
+
+
+def _wildcard_regex(pattern):
+    """
+    :returns: Regular expression of a wildcard, in which only "*" and "?" are special.
+    """
+    return re.compile(''.join('.*' if char == '*' else '.' if char == '?' else re.escape(char)
+                              for char in pattern) + r'\Z', re.DOTALL)
+
+
+def _wildcard_to_glob(pattern):
+    return pattern.replace('[', '[[]')
+
+
+def _json_path(field):
+    return '$' + ''.join('."{}"'.format(part) for part in field.split('.'))
+
+
+def _normalize_boolean(value):
+    return 'false' if value in (False, 'false', 'F', 'off', 'no', '0', 0, '') else 'true'
+
+
+def _to_number(value, field):
+    try:
+        if isinstance(value, bool):
+            raise TypeError
+        return float(value)
+    except (TypeError, ValueError):
+        raise ElasticError(400, 'mapper_parsing_exception',
+                           'failed to parse [{}]: {!r} is not a number'.format(field, value))
+
+
+def _to_millis(date):
+    return (date - EPOCH).total_seconds() * 1000
@@ -0,0 +1,312 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Storage of metadata entries behind the models (see STORAGE_BACKEND in README.md).
+"""
+
+from datetime import datetime
+
+from elasticsearch.exceptions import NotFoundError, RequestError
+
+from data_catalog.routing import ORG_UUID_FIELD, OrgRouting
+
+
+class Storage(object):
+
+    """
+    Operations the models need on metadata entries. Searches, facets and counts take
+    queries made by ElasticSearchQueryTranslator and return ElasticSearch's responses,
+    so the translation and the extraction of results are the same for every backend.
+    Errors are raised as ElasticSearch client's exceptions (NotFoundError, RequestError,
+    ConnectionError...).
+    """
+
+    def get(self, entry_id, org_uuid_list=()):
+        """
+        :param str entry_id:
+        :param list[str] org_uuid_list: Organisations the entry probably belongs to.
+        :returns: Document of the entry (with "_id" and "_source").
+        :rtype: dict
+        :raises NotFoundError:
+        """
+        raise NotImplementedError()
+
+    def index(self, entry_id, entry, org_uuid_list=()):
+        """
+        Adds the entry or replaces the one with the same ID.
+        :param list[str] org_uuid_list: Organisations the replaced entry probably belongs to.
+        :returns: Whether the entry was added.
+        :rtype: bool
+        :raises RequestError: The entry doesn't fit the mappings.
+        """
+        raise NotImplementedError()
+
+    def update(self, entry_id, changes, current_entry):
+        """
+        Replaces the values of the changed fields.
+        :param dict changes: New values of the fields.
+        :param dict current_entry: The entry before the change.
+        :raises NotFoundError:
+        """
+        raise NotImplementedError()
+
+    def delete(self, entry_id, org_uuid):
+        """
+        Deletes the entry, searches made right after it don't find it.
+        :param str org_uuid: Organisation of the entry.
+        :raises NotFoundError:
+        """
+        raise NotImplementedError()
+
+    def search(self, query, routed_orgs=(), **params):
+        """
+        :param dict query: Translated query, its "aggregations" are the facets.
+        :param list[str] routed_orgs: Organisations all the searched entries belong to
+            (see search.get_routed_orgs), empty if they can belong to any.
+        :param params: ElasticSearch's search parameters: "timeout", "terminate_after"
+            and "request_timeout".
+        :returns: ElasticSearch's search response.
+        :rtype: dict
+        :raises RequestError: Invalid query.
+        """
+        raise NotImplementedError()
+
+    def facets(self, query, routed_orgs=(), **params):
+        """
+        Like "search", without fetching the hits.
+        :returns: ElasticSearch's aggregations of the query.
+        :rtype: dict
+        """
+        query = dict(query, size=0)
+        return self.search(query, routed_orgs, **params).get('aggregations', {})
+
+    def count(self, query, routed_orgs=(), **params):
+        """
+        Like "search", without fetching the hits and facets.
+        :returns: Number of the matching entries.
+        :rtype: int
+        """
+        query = dict(query, size=0)
+        query.pop('aggregations', None)
+        return self.search(query, routed_orgs, **params)['hits']['total']
+
+    def multi_search(self, searches, **params):
+        """
+        :param list[(dict, list[str])] searches: Queries with their routed organisations.
+        :returns: Responses of the searches, ones with "error" for the invalid queries.
+        :rtype: list[dict]
+        """
+        responses = []
+        for query, routed_orgs in searches:
+            try:
+                responses.append(self.search(query, routed_orgs, **params))
+            except RequestError as ex:
+                responses.append({'error': ex.error, 'status': ex.status_code})
+        return responses
+
+
+class ElasticSearchStorage(Storage):
+
+    """
+    Entries in ElasticSearch's index (through its alias), stored on the shards of their
+    organisations when the routing is enabled (see OrgRouting).
+    """
+
+    def __init__(self, elastic_config, elastic_search):
+        """
+        :param ElasticConfig elastic_config:
+        :param Elasticsearch elastic_search:
+        """
+        self._config = elastic_config
+        self._elastic_search = elastic_search
+        self._routing = OrgRouting(elastic_config, elastic_search)
+        self._reindex_deletes = ReindexDeletes(elastic_search, elastic_config)
+
+    def get(self, entry_id, org_uuid_list=()):
+        return self._routing.get_entry(entry_id, org_uuid_list=org_uuid_list)
+
+    def index(self, entry_id, entry, org_uuid_list=()):
+        self._remove_copy_from_other_shard(entry_id, entry[ORG_UUID_FIELD], org_uuid_list)
+        response = self._elastic_search.index(
+            index=self._config.elastic_index,
+            doc_type=self._config.elastic_metadata_type,
+            id=entry_id,
+            body=entry,
+            **self._routing.params(entry[ORG_UUID_FIELD])
+        )
+        return response['created']
+
+    def update(self, entry_id, changes, current_entry):
+        if self._changes_routing(current_entry, changes):
+            self._move_entry(entry_id, current_entry, changes)
+            return
+        self._elastic_search.update(
+            index=self._config.elastic_index,
+            doc_type=self._config.elastic_metadata_type,
+            id=entry_id,
+            body={'doc': changes},
+            **self._routing.params(current_entry[ORG_UUID_FIELD]))
+
+    def delete(self, entry_id, org_uuid):
+        # recorded first, so a running reindex can't copy the entry back in the meantime
+        self._reindex_deletes.record(entry_id)
+        self._elastic_search.delete(
+            index=self._config.elastic_index,
+            doc_type=self._config.elastic_metadata_type,
+            id=entry_id,
+            **self._routing.params(org_uuid))
+        # flushing data - so immediate searches are aware of change
+        self._elastic_search.indices.flush()
+
+    def search(self, query, routed_orgs=(), **params):
+        params.update(self._routing.search_params(routed_orgs))
+        if self._is_cacheable(query):
+            params['request_cache'] = True
+        return self._elastic_search.search(
+            index=self._config.elastic_index,
+            doc_type=self._config.elastic_metadata_type,
+            body=query,
+            **params
+        )
+
+    def multi_search(self, searches, **params):
+        """
+        Runs all of the searches with a single ElasticSearch multi search request.
+        """
+        request_timeout = params.pop('request_timeout', None)
+        request_body = []
+        for query, routed_orgs in searches:
+            header = self._routing.search_params(routed_orgs)
+            if self._is_cacheable(query):
+                header['request_cache'] = True
+            request_body.append(header)
+            # multi search's headers don't take them, so every search has its own budget
+            request_body.append(dict(query, **params))
+        return self._elastic_search.msearch(
+            index=self._config.elastic_index,
+            doc_type=self._config.elastic_metadata_type,
+            body=request_body,
+            request_timeout=request_timeout)['responses']
+
+    @staticmethod
+    def _is_cacheable(query):
+        """
+        ElasticSearch's shard request cache only keeps results of queries that don't return
+        any hits (facets and counts), it has to be asked for explicitly in version 2.x.
+        """
+        return query.get('size') == 0
+
+    def _changes_routing(self, current_entry, changes):
+        new_org_uuid = changes.get(ORG_UUID_FIELD, current_entry[ORG_UUID_FIELD])
+        return self._routing.params(new_org_uuid) != \
+            self._routing.params(current_entry[ORG_UUID_FIELD])
+
+    def _move_entry(self, entry_id, current_entry, changes):
+        """
+        Entry moved to another organisation belongs to another shard, so it can't be
+        updated in place. It's indexed again with the new routing and removed from the old shard.
+        """
+        moved_entry = dict(current_entry)
+        moved_entry.update(changes)
+        self._elastic_search.index(
+            index=self._config.elastic_index,
+            doc_type=self._config.elastic_metadata_type,
+            id=entry_id,
+            body=moved_entry,
+            **self._routing.params(moved_entry[ORG_UUID_FIELD]))
+        self._elastic_search.delete(
+            index=self._config.elastic_index,
+            doc_type=self._config.elastic_metadata_type,
+            id=entry_id,
+            **self._routing.params(current_entry[ORG_UUID_FIELD]))
+
+    def _remove_copy_from_other_shard(self, entry_id, org_uuid, org_uuid_list):
+        """
+        With routing enabled, putting an existing entry with a changed organisation
+        would leave its old version on the old organisation's shard. The stored entry is read
+        with a routed get, in realtime from the new organisation's shard and the given
+        organisations' ones, and its old version is deleted only when its organisation differs.
+        """
+        if not self._routing.enabled:
+            return
+        try:
+            stored_entry = self._routing.get_entry(
+                entry_id, org_uuid_list=[org_uuid] + list(org_uuid_list or ()))['_source']
+        except NotFoundError:
+            return
+        if self._changes_routing(stored_entry, {ORG_UUID_FIELD: org_uuid}):
+            self._elastic_search.delete(
+                index=self._config.elastic_index,
+                doc_type=self._config.elastic_metadata_type,
+                id=entry_id,
+                ignore=404,
+                **self._routing.params(stored_entry[ORG_UUID_FIELD]))
+
+
+class ReindexDeletes(object):
+
+    """
+    Entries deleted while a reindex runs (see metadata_index.Reindexer). Ones deleted after
+    the alias is moved to the new index are still in the old one, so they're recorded
+    to keep the reindex from copying them back. The records are kept in a separate index
+    that exists only during a reindex.
+    """
+
+    INDEX_SUFFIX = '-reindex-deletes'
+    TYPE = 'deleted'
+
+    def __init__(self, elastic_search, elastic_config):
+        """
+        :param Elasticsearch elastic_search:
+        :param ElasticConfig elastic_config:
+        """
+        self._elastic_search = elastic_search
+        self.index = elastic_config.elastic_index + self.INDEX_SUFFIX
+
+    def start(self):
+        """
+        Starts recording deletes, records left by an interrupted reindex are dropped.
+        """
+        # pylint: disable=unexpected-keyword-arg
+        self._elastic_search.indices.delete(index=self.index, ignore=404)
+        self._elastic_search.indices.create(index=self.index,
+                                            body={'settings': {'number_of_shards': 1}})
+
+    def stop(self):
+        # pylint: disable=unexpected-keyword-arg
+        self._elastic_search.indices.delete(index=self.index, ignore=404)
+
+    def record(self, entry_id):
+        """
+        Records the delete of the entry if a reindex is running.
+        """
+        if self._elastic_search.indices.exists(index=self.index):
+            self._elastic_search.index(index=self.index, doc_type=self.TYPE, id=entry_id,
+                                       body={'deletedAt': datetime.utcnow().isoformat()})
+
+    def get_deleted_at(self, entry_id):
+        """
+        :returns: Time of the entry's last delete recorded during the reindex,
+            in the format of "indexedAt" field, or None.
+        :rtype: str
+        """
+        # pylint: disable=unexpected-keyword-arg
+        document = self._elastic_search.get(index=self.index, doc_type=self.TYPE, id=entry_id,
+                                            ignore=404)
+        if not document.get('found'):
+            return None
+        return document['_source']['deletedAt']
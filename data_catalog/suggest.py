@@ -0,0 +1,122 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Suggestions of data set titles for search boxes.
+"""
+
+import flask
+from elasticsearch.exceptions import RequestError, ConnectionError
+from flask_restful import abort
+
+from data_catalog.bases import DataCatalogModel, DataCatalogResource
+from data_catalog.metadata_entry import (TITLE_SUGGEST_FIELD, SUGGEST_VISIBILITY_CONTEXT,
+                                         PUBLIC_VISIBILITY_MARKER, ALL_ORGS_VISIBILITY_MARKER)
+from data_catalog.search import DataSetSearch, IndexConnectionError
+
+
+class DataSetSuggestResource(DataCatalogResource):
+
+    """
+    Suggests titles of data sets visible to the user.
+    """
+
+    DEFAULT_SIZE = 5
+    MAX_SIZE = 20
+    INVALID_PARAMS_ERROR_MESSAGE = \
+        '"prefix" is required and "size" should be a number from 1 to {}.'.format(MAX_SIZE)
+
+    def __init__(self):
+        super(DataSetSuggestResource, self).__init__()
+        self._suggest = DataSetSuggest()
+
+    def get(self):
+        """
+        Get titles of data sets that have a word starting with the given prefix.
+        Field 'orgs' works like in the search endpoint.
+        """
+        args = flask.request.args
+        # Python 2's str would fail on (and werkzeug drop) non-ASCII prefixes
+        prefix = args.get('prefix', default=u'', type=unicode).strip()
+        size = args.get('size', default=self.DEFAULT_SIZE, type=int)
+        if not prefix or not 0 < size <= self.MAX_SIZE:
+            abort(400, message=self.INVALID_PARAMS_ERROR_MESSAGE)
+        try:
+            return {
+                'suggestions': self._suggest.suggest(
+                    prefix, size, flask.g.get('org_uuid_list'), flask.g.is_admin)
+            }
+        except IndexConnectionError:
+            abort(500, message=DataSetSearch.NO_CONNECTION_ERROR_MESSAGE)
+
+
+class DataSetSuggest(DataCatalogModel):
+
+    """
+    Gets title suggestions from ElasticSearch's completion suggester.
+    It reads an in-memory structure instead of running a search, so it's fast enough
+    to be asked on every keystroke.
+    """
+
+    SUGGESTION_NAME = 'titles'
+
+    def suggest(self, prefix, size, org_uuid_list, is_admin):
+        """
+        :param str prefix: Beginning of a word in the title.
+        :param int size: Maximal number of suggestions.
+        :param list[str] org_uuid_list:
+        :param bool is_admin:
+        :returns: Suggested titles.
+        :rtype: list[str]
+        :raises IndexConnectionError:
+        """
+        body = {
+            self.SUGGESTION_NAME: {
+                'text': prefix,
+                'completion': {
+                    'field': TITLE_SUGGEST_FIELD,
+                    'size': size,
+                    'context': {
+                        SUGGEST_VISIBILITY_CONTEXT: self._get_visibility(org_uuid_list, is_admin)
+                    }
+                }
+            }
+        }
+        try:
+            response = self._elastic_search.suggest(
+                index=self._config.elastic.elastic_index,
+                body=body)
+        except RequestError:
+            # e.g. the index was created before the completion field was added to the mapping
+            self._log.exception('Failed to get suggestions.')
+            return []
+        except ConnectionError:
+            self._log.exception(DataSetSearch.NO_CONNECTION_ERROR_MESSAGE)
+            raise IndexConnectionError(DataSetSearch.NO_CONNECTION_ERROR_MESSAGE)
+        return [option['text']
+                for suggestion in response.get(self.SUGGESTION_NAME, [])
+                for option in suggestion['options']]
+
+    @staticmethod
+    def _get_visibility(org_uuid_list, is_admin):
+        """
+        Same data sets as in searches for private and public data sets.
+        """
+        if is_admin and not org_uuid_list:
+            return [ALL_ORGS_VISIBILITY_MARKER]
+        visibility = [org_uuid.lower() for org_uuid in org_uuid_list or []]
+        visibility.append(PUBLIC_VISIBILITY_MARKER)
+        return visibility
@@ -22,7 +22,18 @@ from mock import MagicMock
 
 import data_catalog.app
 from data_catalog.configuration import (DCConfig, VCAP_APP_PORT, VCAP_SERVICES, VCAP_APPLICATION,
-                                        LOG_LEVEL)
+                                        LOG_LEVEL, METRICS_DIR, ELASTIC_ORG_ROUTING,
+                                        ELASTIC_NUMBER_OF_SHARDS, ELASTIC_NUMBER_OF_REPLICAS,
+                                        ELASTIC_REFRESH_INTERVAL,
+                                        STORAGE_BACKEND, SQLITE_PATH, SEARCH_TIMEOUT,
+                                        SEARCH_TERMINATE_AFTER, SEARCH_REQUEST_TIMEOUT,
+                                        SEARCH_TIME_ROUNDING,
+                                        QUERY_MAX_SIZE, QUERY_MAX_TERMS,
+                                        QUERY_COST_DEGRADE_THRESHOLD, QUERY_COST_REJECT_THRESHOLD,
+                                        COMPRESSION_MIN_SIZE, COMPRESSION_LEVEL,
+                                        REQUEST_MAX_DECOMPRESSED_SIZE, IMPORT_CHUNK_SIZE,
+                                        IMPORT_CONCURRENCY, IMPORT_BULK_LOAD_MODE,
+                                        IMPORT_FORCE_MERGE)
 
 
 @pytest.yield_fixture
@@ -143,6 +154,28 @@ def clean_fake_env():
     os.environ.pop(VCAP_APP_PORT, None)
     os.environ.pop(LOG_LEVEL, None)
     os.environ.pop(VCAP_APPLICATION, None)
+    os.environ.pop(ELASTIC_ORG_ROUTING, None)
+    os.environ.pop(SEARCH_TIMEOUT, None)
+    os.environ.pop(SEARCH_TERMINATE_AFTER, None)
+    os.environ.pop(SEARCH_REQUEST_TIMEOUT, None)
+    os.environ.pop(SEARCH_TIME_ROUNDING, None)
+    os.environ.pop(QUERY_MAX_SIZE, None)
+    os.environ.pop(QUERY_MAX_TERMS, None)
+    os.environ.pop(QUERY_COST_DEGRADE_THRESHOLD, None)
+    os.environ.pop(QUERY_COST_REJECT_THRESHOLD, None)
+    os.environ.pop(COMPRESSION_MIN_SIZE, None)
+    os.environ.pop(COMPRESSION_LEVEL, None)
+    os.environ.pop(REQUEST_MAX_DECOMPRESSED_SIZE, None)
+    os.environ.pop(IMPORT_CHUNK_SIZE, None)
+    os.environ.pop(IMPORT_CONCURRENCY, None)
+    os.environ.pop(IMPORT_BULK_LOAD_MODE, None)
+    os.environ.pop(IMPORT_FORCE_MERGE, None)
+    os.environ.pop(ELASTIC_NUMBER_OF_SHARDS, None)
+    os.environ.pop(ELASTIC_NUMBER_OF_REPLICAS, None)
+    os.environ.pop(ELASTIC_REFRESH_INTERVAL, None)
+    os.environ.pop(STORAGE_BACKEND, None)
+    os.environ.pop(SQLITE_PATH, None)
+    os.environ.pop(METRICS_DIR, None)
 
 
 @contextmanager
@@ -0,0 +1,1031 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+In-memory stand-in for the part of ElasticSearch's HTTP API that Data Catalog uses.
+
+It replaces the HTTP connection of the ElasticSearch client, so the application's code,
+the client's serialization, helpers and exceptions all run like with a real cluster.
+Every request is counted, so tests can check how many round trips an operation makes,
+and an artificial latency can be added to every request.
+
+Simplifications:
+ * only the query DSL produced by the query translation (and a few similar clauses)
+   is supported, other clauses are rejected like invalid queries,
+ * text is analyzed naively (lowercase words, stop words, no stemming) and the score
+   is the sum of boosts of the matching clauses,
+ * documents can be searched right after they're written, as if every write refreshed
+   the index,
+ * shards are only modelled by routing: a document written with a routing value is only
+   read, updated and deleted with the same value and searches with routing only see
+   the documents written with one of the given values.
+"""
+
+import copy
+import fnmatch
+import json
+import re
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from urllib import unquote
+
+from elasticsearch.connection import Urllib3HttpConnection
+from elasticsearch.exceptions import ConnectionError
+from mock import patch
+
+from data_catalog.query_dsl import (ElasticError, analyze, as_list, filter_source,
+                                    flatten_settings, get_analyzer, get_field_clause,
+                                    get_field_mapping, merge, parse_date, parse_date_math,
+                                    unflatten_settings)
+
+
+class FakeElasticSearch(object):
+
+    """
+    Use as a context manager (or call start and stop), all ElasticSearch clients created
+    in the meantime talk to this instance:
+
+        with FakeElasticSearch(latency=0.005) as fake_es:
+            ...
+            self.assertEqual(1, fake_es.requests['search'])
+    """
+
+    NUMBER_OF_SHARDS = 5
+    JSON_HEADERS = {'content-type': 'application/json'}
+
+    def __init__(self, latency=0):
+        """
+        :param float latency: Seconds every request waits before it's handled.
+        """
+        self.latency = latency
+        # when false, requests fail like with ElasticSearch being down
+        self.available = True
+        # numbers of requests by API name, e.g. "search" or "indices.create"
+        self.requests = Counter()
+        self.indices = OrderedDict()
+        self._scrolls = {}
+        self._lock = threading.RLock()
+        self._patcher = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def start(self):
+        fake = self
+
+        def perform_request(connection, method, url, params=None, body=None, timeout=None,
+                            ignore=()):
+            # pylint: disable=unused-argument
+            return fake.perform_request(connection, method, url, params, body, ignore)
+
+        self._patcher = patch.object(Urllib3HttpConnection, 'perform_request', perform_request)
+        self._patcher.start()
+
+    def stop(self):
+        self._patcher.stop()
+        self._patcher = None
+
+    @property
+    def total_requests(self):
+        return sum(self.requests.values())
+
+    @property
+    def open_scrolls(self):
+        """
+        :returns: Number of scroll contexts that weren't cleared or read to the end.
+        :rtype: int
+        """
+        return len(self._scrolls)
+
+    def reset_counters(self):
+        self.requests.clear()
+
+    def perform_request(self, connection, method, url, params, body, ignore):
+        """
+        Handles a request like Urllib3HttpConnection.perform_request.
+        :returns: Status, headers and body of the response.
+        :rtype: (int, dict, str)
+        :raises TransportError: For statuses other than 2xx which aren't ignored.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        if not self.available:
+            raise ConnectionError('N/A', 'Connection refused (fake ElasticSearch stopped)', None)
+        path = url.split('?', 1)[0]
+        parts = [unquote(part) for part in path.strip('/').split('/') if part]
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        request = _Request(method, parts, dict(params or {}), body)
+
+        with self._lock:
+            try:
+                api, handler = self._route(request)
+            except ElasticError as ex:
+                api, handler = 'unknown', None
+                status, response = ex.status, ex.to_response()
+            self.requests[api] += 1
+            if handler:
+                try:
+                    status, response = handler(request)
+                except ElasticError as ex:
+                    status, response = ex.status, ex.to_response()
+        raw_response = '' if method == 'HEAD' else json.dumps(response)
+        if not 200 <= status < 300 and status not in ignore:
+            # pylint: disable=protected-access
+            connection._raise_error(status, raw_response)
+        return status, dict(self.JSON_HEADERS), raw_response
+
+    def _route(self, request):
+        """
+        :returns: Name of the API and the function handling the request.
+        :raises ElasticError: Unsupported request.
+        """
+        parts, method = request.parts, request.method
+        endpoint_positions = [position for position, part in enumerate(parts)
+                              if part.startswith('_')]
+        if not parts:
+            return 'info', self._info
+        if not endpoint_positions:
+            routes = {
+                (1, 'PUT'): ('indices.create', self._create_index),
+                (1, 'POST'): ('indices.create', self._create_index),
+                (1, 'DELETE'): ('indices.delete', self._delete_index),
+                (1, 'HEAD'): ('indices.exists', self._index_exists),
+                (2, 'POST'): ('index', self._index),
+                (3, 'PUT'): ('index', self._index),
+                (3, 'POST'): ('index', self._index),
+                (3, 'GET'): ('get', self._get),
+                (3, 'HEAD'): ('exists', self._get),
+                (3, 'DELETE'): ('delete', self._delete),
+            }
+            route = routes.get((len(parts), method))
+        else:
+            position = endpoint_positions[0]
+            endpoint = parts[position]
+            request.path_args = parts[:position]
+            request.endpoint_args = parts[position + 1:]
+            if endpoint == '_search' and request.endpoint_args[:1] == ['scroll']:
+                route = {'GET': ('scroll', self._scroll),
+                         'POST': ('scroll', self._scroll),
+                         'DELETE': ('clear_scroll', self._clear_scroll)}.get(method)
+            else:
+                route = {
+                    '_search': ('search', self._search),
+                    '_count': ('count', self._count),
+                    '_msearch': ('msearch', self._msearch),
+                    '_bulk': ('bulk', self._bulk),
+                    '_mget': ('mget', self._mget),
+                    '_suggest': ('suggest', self._suggest),
+                    '_update': ('update', self._update),
+                    '_create': ('index', self._index),
+                    '_refresh': ('indices.refresh', self._refresh),
+                    '_flush': ('indices.flush', self._refresh),
+                    '_optimize': ('indices.optimize', self._refresh),
+                    '_stats': ('indices.stats', self._stats),
+                    '_alias': ('indices.get_alias', self._get_alias),
+                    '_aliases': ('indices.update_aliases', self._update_aliases),
+                    '_settings': ('indices.get_settings' if method == 'GET'
+                                  else 'indices.put_settings', self._settings),
+                }.get(endpoint)
+        if route is None:
+            raise ElasticError(400, 'illegal_argument_exception', 'Unsupported request: {} /{}'
+                               .format(method, '/'.join(parts)))
+        return route
+
+    # --- indices ---
+
+    def _info(self, _):
+        return 200, {'name': 'fake', 'version': {'number': '2.3.0'}}
+
+    def _create_index(self, request):
+        name = request.parts[0]
+        if name in self.indices or self._get_aliased(name):
+            raise ElasticError(400, 'index_already_exists_exception', 'already exists',
+                               index=name)
+        self.indices[name] = _Index(name, request.json() or {})
+        return 200, {'acknowledged': True}
+
+    def _delete_index(self, request):
+        for name in self._resolve(request.parts[0]):
+            del self.indices[name]
+        return 200, {'acknowledged': True}
+
+    def _index_exists(self, request):
+        try:
+            return 200 if self._resolve(request.parts[0]) else 404, {}
+        except ElasticError:
+            return 404, {}
+
+    def _refresh(self, request):
+        indices = self._resolve(request.path_args[0] if request.path_args else None)
+        return 200, {'_shards': self._get_shards(indices)}
+
+    def _stats(self, request):
+        indices = self._resolve(request.path_args[0] if request.path_args else None)
+        index_stats = {name: self._get_index_stats([name]) for name in indices}
+        return 200, {
+            '_shards': self._get_shards(indices),
+            '_all': self._get_index_stats(indices),
+            'indices': index_stats
+        }
+
+    def _get_index_stats(self, indices):
+        stats = {
+            'docs': {'count': sum(len(self.indices[name].documents) for name in indices),
+                     'deleted': 0},
+            'query_cache': {'memory_size_in_bytes': 0, 'hit_count': 0, 'miss_count': 0,
+                            'evictions': 0},
+            'request_cache': {'memory_size_in_bytes': 0, 'hit_count': 0, 'miss_count': 0,
+                              'evictions': 0}
+        }
+        return {'primaries': stats, 'total': copy.deepcopy(stats)}
+
+    def _get_alias(self, request):
+        indices = self._resolve(request.path_args[0] if request.path_args else None)
+        patterns = request.endpoint_args[0].split(',') if request.endpoint_args else ['*']
+        result = {}
+        for name in indices:
+            aliases = [alias for alias in sorted(self.indices[name].aliases)
+                       if any(fnmatch.fnmatchcase(alias, pattern) for pattern in patterns)]
+            if aliases:
+                result[name] = {'aliases': {alias: {} for alias in aliases}}
+        if not result and request.endpoint_args:
+            raise ElasticError(404, 'aliases_not_found_exception',
+                               'alias [{}] missing'.format(request.endpoint_args[0]))
+        return 200, result
+
+    def _update_aliases(self, request):
+        changes = []
+        for action in request.json()['actions']:
+            (action_type, details), = action.items()
+            if action_type not in ('add', 'remove'):
+                raise ElasticError(400, 'illegal_argument_exception',
+                                   'Unsupported alias action: ' + action_type)
+            index_names = details.get('indices') or [details['index']]
+            aliases = details.get('aliases') or [details['alias']]
+            for index_name in index_names:
+                for name in self._resolve(index_name):
+                    changes.append((action_type, self.indices[name], aliases))
+        # all indices are checked before any alias changes, the whole request is atomic
+        for action_type, index, aliases in changes:
+            if action_type == 'add':
+                index.aliases.update(aliases)
+            else:
+                index.aliases.difference_update(aliases)
+        return 200, {'acknowledged': True}
+
+    def _settings(self, request):
+        indices = self._resolve(request.path_args[0] if request.path_args else None)
+        if request.method == 'GET':
+            patterns = request.endpoint_args[0].split(',') if request.endpoint_args else ['*']
+            flat = request.params.get('flat_settings') in (True, 'true')
+            result = {}
+            for name in indices:
+                settings = {key: value for key, value in self.indices[name].settings.items()
+                            if any(fnmatch.fnmatchcase(key, pattern) for pattern in patterns)}
+                result[name] = {'settings': settings if flat else unflatten_settings(settings)}
+            return 200, result
+        body = request.json()
+        new_settings = flatten_settings(body.get('settings', body))
+        for name in indices:
+            for key, value in new_settings.items():
+                if value is None:
+                    self.indices[name].settings.pop(key, None)
+                else:
+                    self.indices[name].settings[key] = value
+        return 200, {'acknowledged': True}
+
+    def _resolve(self, expression, ignore_missing=False):
+        """
+        :param str expression: Comma separated names or patterns of indices or aliases,
+            all indices if empty.
+        :returns: Names of the existing indices.
+        :rtype: list[str]
+        :raises ElasticError: Index not found.
+        """
+        if expression in (None, '', '_all', '*'):
+            return list(self.indices)
+        names = []
+        for name in expression.split(','):
+            if '*' in name:
+                matching = [index.name for index in self.indices.values()
+                            if fnmatch.fnmatchcase(index.name, name)
+                            or any(fnmatch.fnmatchcase(alias, name) for alias in index.aliases)]
+            elif name in self.indices:
+                matching = [name]
+            else:
+                matching = self._get_aliased(name)
+                if not matching and not ignore_missing:
+                    raise ElasticError(404, 'index_not_found_exception', 'no such index',
+                                       index=name)
+            names.extend(index_name for index_name in matching if index_name not in names)
+        return names
+
+    def _get_aliased(self, alias):
+        return [index.name for index in self.indices.values() if alias in index.aliases]
+
+    def _get_write_index(self, name):
+        """
+        :returns: The index documents written to the index or alias go to. An index is created
+            if it doesn't exist, like ElasticSearch does by default.
+        :rtype: _Index
+        """
+        if name in self.indices:
+            return self.indices[name]
+        aliased = self._get_aliased(name)
+        if len(aliased) > 1:
+            raise ElasticError(400, 'illegal_argument_exception',
+                               'Alias [{}] has more than one indices associated with it'
+                               .format(name))
+        if aliased:
+            return self.indices[aliased[0]]
+        self.indices[name] = _Index(name, {})
+        return self.indices[name]
+
+    def _get_shards(self, indices):
+        shards = sum(int(self.indices[name].settings['index.number_of_shards'])
+                     for name in indices)
+        return {'total': shards, 'successful': shards, 'failed': 0}
+
+    # --- documents ---
+
+    def _index(self, request):
+        if len(request.parts) < 3:
+            index_name, doc_type = request.parts
+            doc_id = None
+        else:
+            index_name, doc_type, doc_id = request.parts[:3]
+        op_type = 'create' if request.parts[-1] == '_create' else request.params.get('op_type')
+        return self._write_document(index_name, doc_type, doc_id, request.json(),
+                                    request.params.get('routing'), op_type,
+                                    request.params.get('version'))
+
+    def _write_document(self, index_name, doc_type, doc_id, source, routing, op_type=None,
+                        expected_version=None):
+        index = self._get_write_index(index_name)
+        doc_id = doc_id or uuid.uuid4().hex[:20]
+        key = (doc_type, doc_id, routing)
+        current = index.documents.get(key)
+        if current and op_type == 'create':
+            raise ElasticError(409, 'document_already_exists_exception',
+                               '[{}][{}]: document already exists'.format(doc_type, doc_id),
+                               index=index.name)
+        _check_version(index, doc_type, doc_id, current, expected_version)
+        version = current['_version'] + 1 if current else 1
+        index.documents[key] = {'_index': index.name, '_type': doc_type, '_id': doc_id,
+                                '_version': version, '_routing': routing, '_source': source,
+                                '_seq': index.next_seq()}
+        return 201 if current is None else 200, {
+            '_index': index.name, '_type': doc_type, '_id': doc_id, '_version': version,
+            '_shards': {'total': 2, 'successful': 1, 'failed': 0},
+            'created': current is None
+        }
+
+    def _find_document(self, index_name, doc_type, doc_id, routing):
+        """
+        :returns: The index and the stored document (None if there's no such document).
+        :raises ElasticError: The index doesn't exist.
+        """
+        names = self._resolve(index_name)
+        if len(names) != 1:
+            raise ElasticError(400, 'illegal_argument_exception',
+                               '[{}] resolves to {} indices'.format(index_name, len(names)))
+        index = self.indices[names[0]]
+        if doc_type == '_all':
+            for (stored_type, stored_id, stored_routing), document in index.documents.items():
+                if stored_id == doc_id and stored_routing == routing:
+                    return index, document
+            return index, None
+        return index, index.documents.get((doc_type, doc_id, routing))
+
+    def _get(self, request):
+        index_name, doc_type, doc_id = request.parts
+        return self._get_document(index_name, doc_type, doc_id, request.params.get('routing'))
+
+    def _get_document(self, index_name, doc_type, doc_id, routing):
+        index, document = self._find_document(index_name, doc_type, doc_id, routing)
+        if document is None:
+            return 404, {'_index': index.name, '_type': doc_type, '_id': doc_id, 'found': False}
+        return 200, {'_index': index.name, '_type': document['_type'], '_id': doc_id,
+                     '_version': document['_version'], 'found': True,
+                     '_source': document['_source']}
+
+    def _mget(self, request):
+        index_name = request.path_args[0] if request.path_args else None
+        doc_type = request.path_args[1] if len(request.path_args) > 1 else '_all'
+        body = request.json()
+        specs = body.get('docs') or [{'_id': doc_id} for doc_id in body.get('ids', [])]
+        docs = []
+        for spec in specs:
+            spec_index = spec.get('_index', index_name)
+            spec_type = spec.get('_type', doc_type)
+            try:
+                docs.append(self._get_document(
+                    spec_index, spec_type, spec['_id'],
+                    spec.get('_routing', request.params.get('routing')))[1])
+            except ElasticError as ex:
+                docs.append({'_index': spec_index, '_type': spec_type, '_id': spec['_id'],
+                             'error': ex.to_response()['error']})
+        return 200, {'docs': docs}
+
+    def _update(self, request):
+        index_name, doc_type, doc_id = request.path_args
+        return self._update_document(index_name, doc_type, doc_id, request.json(),
+                                     request.params.get('routing'))
+
+    def _update_document(self, index_name, doc_type, doc_id, body, routing):
+        if 'doc' not in body:
+            raise ElasticError(400, 'action_request_validation_exception',
+                               'Only partial updates with "doc" are supported')
+        index, document = self._find_document(index_name, doc_type, doc_id, routing)
+        if document is None:
+            if not body.get('doc_as_upsert'):
+                raise ElasticError(404, 'document_missing_exception',
+                                   '[{}][{}]: document missing'.format(doc_type, doc_id),
+                                   index=index.name)
+            source = body['doc']
+        else:
+            source = merge(copy.deepcopy(document['_source']), body['doc'])
+        status, response = self._write_document(index.name, doc_type, doc_id, source, routing)
+        del response['created']
+        return status, response
+
+    def _delete(self, request):
+        index_name, doc_type, doc_id = request.parts
+        return self._delete_document(index_name, doc_type, doc_id,
+                                     request.params.get('routing'), request.params.get('version'))
+
+    def _delete_document(self, index_name, doc_type, doc_id, routing, expected_version=None):
+        index, document = self._find_document(index_name, doc_type, doc_id, routing)
+        response = {'_index': index.name, '_type': doc_type, '_id': doc_id,
+                    '_shards': {'total': 2, 'successful': 1, 'failed': 0}}
+        if document is None:
+            response.update(found=False, _version=1)
+            return 404, response
+        _check_version(index, doc_type, doc_id, document, expected_version)
+        del index.documents[(document['_type'], doc_id, routing)]
+        response.update(found=True, _version=document['_version'] + 1)
+        return 200, response
+
+    def _bulk(self, request):
+        default_index = request.path_args[0] if request.path_args else None
+        default_type = request.path_args[1] if len(request.path_args) > 1 else None
+        lines = iter(line for line in request.body.splitlines() if line.strip())
+        items = []
+        for line in lines:
+            (action, meta), = json.loads(line).items()
+            source = None if action == 'delete' else json.loads(next(lines))
+            index_name = meta.get('_index', default_index)
+            doc_type = meta.get('_type', default_type)
+            doc_id = meta.get('_id')
+            routing = meta.get('_routing', meta.get('routing'))
+            try:
+                if action in ('index', 'create'):
+                    status, response = self._write_document(index_name, doc_type, doc_id,
+                                                            source, routing, action)
+                elif action == 'update':
+                    status, response = self._update_document(index_name, doc_type, doc_id,
+                                                             source, routing)
+                elif action == 'delete':
+                    status, response = self._delete_document(index_name, doc_type, doc_id,
+                                                             routing)
+                else:
+                    raise ElasticError(400, 'illegal_argument_exception',
+                                       'Unknown bulk action: ' + action)
+            except ElasticError as ex:
+                status = ex.status
+                response = {'_index': index_name, '_type': doc_type, '_id': doc_id,
+                            'error': ex.to_response()['error']}
+            response.pop('_shards', None)
+            response['status'] = status
+            items.append({action: response})
+        errors = any('error' in list(item.values())[0] for item in items)
+        return 200, {'took': 1, 'errors': errors, 'items': items}
+
+    # --- searches ---
+
+    def _get_search_scope(self, request_path_args, params):
+        indices = self._resolve(request_path_args[0] if request_path_args else None)
+        doc_types = request_path_args[1].split(',') if len(request_path_args) > 1 else None
+        routing = params.get('routing')
+        routing_values = set(routing.split(',')) if routing else None
+        documents = []
+        for name in indices:
+            index = self.indices[name]
+            documents.extend(
+                (index, document) for document in index.documents.values()
+                if (doc_types is None or document['_type'] in doc_types)
+                and (routing_values is None or document['_routing'] in routing_values))
+        return indices, documents
+
+    def _search(self, request):
+        return 200, self._run_search(request.path_args, request.params, request.json() or {})
+
+    def _run_search(self, path_args, params, body):
+        indices, documents = self._get_search_scope(path_args, params)
+        size = int(params.get('size', body.get('size', 10)))
+        start = int(params.get('from', body.get('from', 0)))
+        terminate_after = int(params.get('terminate_after', body.get('terminate_after', 0)))
+        query = body.get('query', {})
+        post_filter = body.get('post_filter')
+        for name in indices:
+            _Matcher(self.indices[name]).validate(query)
+            _Matcher(self.indices[name]).validate(post_filter)
+
+        matches = []
+        for index, document in documents:
+            score = _Matcher(index).score(query, document)
+            if score is not None:
+                matches.append((score, index, document))
+                if terminate_after and len(matches) >= terminate_after:
+                    break
+        aggregations = self._aggregate(body.get('aggregations', body.get('aggs')), matches)
+        if post_filter:
+            matches = [match for match in matches
+                       if _Matcher(match[1]).score(post_filter, match[2]) is not None]
+        sort = body.get('sort')
+        sorted_by_score = _sort(matches, sort)
+        hits = [self._to_hit(score if sorted_by_score else None, document, body, params)
+                for score, _, document in matches]
+
+        response = {
+            'took': 1,
+            'timed_out': False,
+            '_shards': self._get_shards(indices),
+            'hits': {
+                'total': len(matches),
+                'max_score': max([score for score, _, _ in matches] or [None])
+                             if sorted_by_score else None,
+                'hits': hits[start:start + size]
+            }
+        }
+        if terminate_after:
+            response['terminated_early'] = len(matches) >= terminate_after
+        if aggregations is not None:
+            response['aggregations'] = aggregations
+        if body.get('profile'):
+            response['profile'] = {'shards': [
+                {'id': '[fake][{}][0]'.format(name), 'searches': [], 'aggregations': []}
+                for name in indices]}
+        if 'scroll' in params:
+            if params.get('search_type') == 'scan':
+                remaining = hits
+                response['hits']['hits'] = []
+            else:
+                remaining = hits[start + size:]
+            scroll_id = uuid.uuid4().hex
+            self._scrolls[scroll_id] = {'hits': remaining, 'size': size,
+                                        'response': copy.deepcopy(response)}
+            response['_scroll_id'] = scroll_id
+        return response
+
+    @staticmethod
+    def _to_hit(score, document, body, params):
+        hit = {'_index': document['_index'], '_type': document['_type'], '_id': document['_id'],
+               '_score': score}
+        if document['_routing'] is not None:
+            hit['_routing'] = document['_routing']
+        source_filter = body.get('_source', params.get('_source', True))
+        if source_filter not in (False, 'false'):
+            hit['_source'] = filter_source(document['_source'], source_filter)
+        return hit
+
+    @staticmethod
+    def _aggregate(aggregations, matches):
+        if aggregations is None:
+            return None
+        result = {}
+        for name, aggregation in aggregations.items():
+            if list(aggregation) != ['terms']:
+                raise ElasticError(400, 'search_parse_exception',
+                                   'Unsupported aggregation: {}'.format(list(aggregation)))
+            field = aggregation['terms']['field']
+            counts = Counter()
+            for _, index, document in matches:
+                counts.update(set(_Matcher(index).get_terms(field, document['_source'])))
+            buckets = sorted(counts.items(), key=lambda bucket: (-bucket[1], bucket[0]))
+            size = aggregation['terms'].get('size', 10) or len(buckets)
+            result[name] = {
+                'doc_count_error_upper_bound': 0,
+                'sum_other_doc_count': sum(count for _, count in buckets[size:]),
+                'buckets': [{'key': key, 'doc_count': count} for key, count in buckets[:size]]
+            }
+        return result
+
+    def _scroll(self, request):
+        scroll_id = request.params.get('scroll_id') or (request.body or '').strip()
+        if scroll_id.startswith('{'):
+            scroll_id = json.loads(scroll_id)['scroll_id']
+        context = self._scrolls.get(scroll_id)
+        if context is None:
+            raise ElasticError(404, 'search_context_missing_exception',
+                               'No search context found for id [{}]'.format(scroll_id))
+        page = context['hits'][:context['size']]
+        context['hits'] = context['hits'][context['size']:]
+        if not page:
+            # contexts read to the end expire
+            del self._scrolls[scroll_id]
+        response = copy.deepcopy(context['response'])
+        response['hits']['hits'] = page
+        response['_scroll_id'] = scroll_id
+        return 200, response
+
+    def _clear_scroll(self, request):
+        ids = request.endpoint_args[1] if len(request.endpoint_args) > 1 else request.body
+        if ids and ids.strip().startswith('{'):
+            ids = ','.join(as_list(json.loads(ids)['scroll_id']))
+        freed = [scroll_id for scroll_id in (ids or '').split(',')
+                 if self._scrolls.pop(scroll_id.strip(), None) is not None]
+        return 200 if freed else 404, {'succeeded': True, 'num_freed': len(freed)}
+
+    def _count(self, request):
+        body = request.json() or {}
+        indices, documents = self._get_search_scope(request.path_args, request.params)
+        query = body.get('query', {})
+        for name in indices:
+            _Matcher(self.indices[name]).validate(query)
+        count = sum(1 for index, document in documents
+                    if _Matcher(index).score(query, document) is not None)
+        return 200, {'count': count, '_shards': self._get_shards(indices)}
+
+    def _msearch(self, request):
+        lines = [json.loads(line) for line in request.body.splitlines() if line.strip()]
+        responses = []
+        for header, body in zip(lines[::2], lines[1::2]):
+            path_args = list(request.path_args)
+            if 'index' in header:
+                path_args[:1] = [','.join(as_list(header['index']))]
+            if 'type' in header:
+                path_args[1:2] = [','.join(as_list(header['type']))]
+            params = {key: value for key, value in header.items()
+                      if key not in ('index', 'type')}
+            try:
+                responses.append(self._run_search(path_args, params, body))
+            except ElasticError as ex:
+                responses.append(ex.to_response())
+        return 200, {'responses': responses}
+
+    def _suggest(self, request):
+        indices, documents = self._get_search_scope(request.path_args[:1], request.params)
+        response = {'_shards': self._get_shards(indices)}
+        for name, suggestion in request.json().items():
+            if 'completion' not in suggestion:
+                raise ElasticError(400, 'illegal_argument_exception',
+                                   'Only completion suggestions are supported')
+            completion = suggestion['completion']
+            for index_name in indices:
+                field_mapping = self.indices[index_name].get_field_mapping(completion['field'])
+                if field_mapping.get('type') != 'completion':
+                    raise ElasticError(400, 'illegal_argument_exception',
+                                       'Field [{}] is not a completion suggest field'
+                                       .format(completion['field']))
+            options = {}
+            for _, document in documents:
+                option = _suggest_option(suggestion['text'], completion,
+                                         _get_values(document['_source'], completion['field']))
+                if option:
+                    options.setdefault(option['text'], option)
+            options = sorted(options.values(), key=lambda option: (-option['score'],
+                                                                   option['text']))
+            response[name] = [{'text': suggestion['text'], 'offset': 0,
+                               'length': len(suggestion['text']),
+                               'options': options[:completion.get('size', 5)]}]
+        return 200, response
+
+
+class _Request(object):
+
+    def __init__(self, method, parts, params, body):
+        self.method = method
+        self.parts = parts
+        self.params = params
+        self.body = body
+        self.path_args = []
+        self.endpoint_args = []
+
+    def json(self):
+        if not self.body:
+            return None
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            raise ElasticError(400, 'parse_exception', 'Failed to parse the request body')
+
+
+class _Index(object):
+
+    DEFAULT_SETTINGS = {
+        'index.number_of_shards': str(FakeElasticSearch.NUMBER_OF_SHARDS),
+        'index.number_of_replicas': '1'
+    }
+
+    def __init__(self, name, body):
+        self.name = name
+        self.settings = dict(self.DEFAULT_SETTINGS)
+        self.settings.update(flatten_settings(body.get('settings', {})))
+        self.mappings = copy.deepcopy(body.get('mappings', {}))
+        self.aliases = set(body.get('aliases', {}))
+        # (type, ID, routing) -> document, in the order the documents were first written
+        self.documents = OrderedDict()
+        self._seq = 0
+
+    def next_seq(self):
+        self._seq += 1
+        return self._seq
+
+    def get_field_mapping(self, field):
+        return get_field_mapping(self.mappings, field)
+
+    def get_analyzer(self, name):
+        return get_analyzer(self.settings, name)
+
+
+class _Matcher(object):
+
+    """
+    Evaluates queries against documents of an index.
+    """
+
+    def __init__(self, index):
+        self._index = index
+
+    def score(self, query, document):
+        """
+        :returns: Score of the matching document, None if it doesn't match.
+        :rtype: float
+        """
+        if not query:
+            # e.g. an empty post filter
+            return 1.0
+        clause_name, clause = self._get_clause(query)
+        return getattr(self, '_query_' + clause_name)(clause, document)
+
+    def validate(self, query):
+        """
+        Checks the whole query, like ElasticSearch does even when no document is evaluated.
+        :raises ElasticError: The query has unsupported clauses.
+        """
+        if not query:
+            return
+        clause_name, clause = self._get_clause(query)
+        if clause_name == 'bool':
+            for occurrence in ('must', 'filter', 'should', 'must_not'):
+                for subquery in as_list(clause.get(occurrence, [])):
+                    self.validate(subquery)
+        elif clause_name == 'constant_score':
+            self.validate(clause['filter'])
+
+    def _get_clause(self, query):
+        if len(query) != 1:
+            raise ElasticError(400, 'query_parsing_exception',
+                               'Query should have a single clause: {}'.format(list(query)))
+        (clause_name, clause), = query.items()
+        if not hasattr(self, '_query_' + clause_name):
+            raise ElasticError(400, 'query_parsing_exception',
+                               'No query registered for [{}]'.format(clause_name))
+        return clause_name, clause
+
+    def get_terms(self, field, source):
+        """
+        :returns: Terms the field's values are indexed as.
+        :rtype: list
+        """
+        mapping = self._index.get_field_mapping(field)
+        terms = []
+        for value in _get_values(source, field):
+            if mapping.get('type', 'string') == 'string' and isinstance(value, basestring) \
+                    and mapping.get('index') != 'not_analyzed':
+                terms.extend(self._analyze(value, mapping.get('analyzer', 'standard')))
+            else:
+                terms.append(self._normalize(value, mapping))
+        return terms
+
+    def _analyze(self, text, analyzer_name):
+        return analyze(text, self._index.get_analyzer(analyzer_name))
+
+    def _normalize(self, value, mapping):
+        field_type = mapping.get('type')
+        if field_type == 'boolean':
+            return value not in (False, 'false', 'F', 'off', 'no', '0', 0, '')
+        if field_type in ('long', 'integer', 'short', 'byte', 'double', 'float'):
+            return float(value)
+        if field_type == 'date':
+            return parse_date(value)
+        if isinstance(value, bool):
+            return 'T' if value else 'F'
+        return value
+
+    def _query_match_all(self, clause, _):
+        return float(clause.get('boost', 1.0))
+
+    def _query_bool(self, clause, document):
+        score = 0.0
+        for must in as_list(clause.get('must', [])):
+            must_score = self.score(must, document)
+            if must_score is None:
+                return None
+            score += must_score
+        for must_filter in as_list(clause.get('filter', [])):
+            if self.score(must_filter, document) is None:
+                return None
+        for must_not in as_list(clause.get('must_not', [])):
+            if self.score(must_not, document) is not None:
+                return None
+        should_scores = [should_score for should_score in
+                         (self.score(should, document)
+                          for should in as_list(clause.get('should', [])))
+                         if should_score is not None]
+        required_should = clause.get('minimum_should_match')
+        if required_should is None:
+            required_should = 0 if 'must' in clause or 'filter' in clause \
+                or not clause.get('should') else 1
+        if len(should_scores) < int(required_should):
+            return None
+        return (score + sum(should_scores)) * float(clause.get('boost', 1.0))
+
+    def _query_constant_score(self, clause, document):
+        if self.score(clause['filter'], document) is None:
+            return None
+        return float(clause.get('boost', 1.0))
+
+    def _query_ids(self, clause, document):
+        if document['_id'] not in clause['values']:
+            return None
+        if 'type' in clause and document['_type'] not in as_list(clause['type']):
+            return None
+        return 1.0
+
+    def _query_exists(self, clause, document):
+        return 1.0 if _get_values(document['_source'], clause['field']) else None
+
+    def _query_term(self, clause, document):
+        field, value, boost = get_field_clause(clause, 'value')
+        return self._match_terms(field, [value], document, boost)
+
+    def _query_terms(self, clause, document):
+        options = dict(clause)
+        boost = float(options.pop('boost', 1.0))
+        (field, values), = options.items()
+        return self._match_terms(field, values, document, boost)
+
+    def _match_terms(self, field, values, document, boost):
+        mapping = self._index.get_field_mapping(field)
+        terms = set(self.get_terms(field, document['_source']))
+        return boost if any(self._normalize(value, mapping) in terms for value in values) \
+            else None
+
+    def _query_match(self, clause, document):
+        field, text, boost = get_field_clause(clause, 'query')
+        operator = clause[field].get('operator', 'or') if isinstance(clause[field], dict) \
+            else 'or'
+        mapping = self._index.get_field_mapping(field)
+        if mapping.get('type', 'string') != 'string' or mapping.get('index') == 'not_analyzed':
+            return self._match_terms(field, [text], document, boost)
+        query_tokens = self._analyze(text, mapping.get('search_analyzer',
+                                                       mapping.get('analyzer', 'standard')))
+        terms = set(self.get_terms(field, document['_source']))
+        matched = [token for token in query_tokens if token in terms]
+        if not matched or (operator.lower() == 'and' and len(matched) < len(query_tokens)):
+            return None
+        return boost * len(matched)
+
+    def _query_wildcard(self, clause, document):
+        field, pattern, boost = get_field_clause(clause, 'wildcard')
+        regex = re.compile('^' + '.*'.join('.'.join(re.escape(part) for part in piece.split('?'))
+                                           for piece in pattern.split('*')) + '$', re.DOTALL)
+        terms = self.get_terms(field, document['_source'])
+        return boost if any(isinstance(term, basestring) and regex.match(term)
+                            for term in terms) else None
+
+    def _query_prefix(self, clause, document):
+        field, prefix, boost = get_field_clause(clause, 'prefix')
+        terms = self.get_terms(field, document['_source'])
+        return boost if any(isinstance(term, basestring) and term.startswith(prefix)
+                            for term in terms) else None
+
+    def _query_range(self, clause, document):
+        options = dict(clause)
+        (field, bounds), = options.items()
+        mapping = self._index.get_field_mapping(field)
+        is_date = mapping.get('type') == 'date'
+        checks = []
+        lower_inclusive = bounds.get('include_lower', True)
+        upper_inclusive = bounds.get('include_upper', True)
+        for key, inclusive, is_lower in (('from', lower_inclusive, True),
+                                         ('gte', True, True), ('gt', False, True),
+                                         ('to', upper_inclusive, False),
+                                         ('lte', True, False), ('lt', False, False)):
+            if bounds.get(key) is None:
+                continue
+            # like in ElasticSearch, rounding includes the whole unit in inclusive ranges
+            round_up = inclusive != is_lower
+            bound = parse_date_math(bounds[key], round_up) if is_date \
+                else self._normalize(bounds[key], mapping)
+            checks.append((bound, inclusive, is_lower))
+
+        for value in self.get_terms(field, document['_source']):
+            if all((value > bound or (inclusive and value == bound)) if is_lower
+                   else (value < bound or (inclusive and value == bound))
+                   for bound, inclusive, is_lower in checks):
+                return float(bounds.get('boost', 1.0))
+        return None
+
+
+def _sort(matches, sort):
+    """
+    Sorts the matches (score, index, document) in place.
+    :returns: Whether the hits are sorted by the score and so should have it.
+    :rtype: bool
+    """
+    if not sort:
+        matches.sort(key=lambda match: (-match[0], match[2]['_seq']))
+        return True
+    sorted_by_score = False
+    # stable sorts from the last key to the first one
+    for sort_spec in reversed(as_list(sort)):
+        if isinstance(sort_spec, dict):
+            (field, order), = sort_spec.items()
+            if isinstance(order, dict):
+                order = order.get('order', 'asc')
+        else:
+            field, order = sort_spec, 'desc' if sort_spec == '_score' else 'asc'
+        if field == '_doc':
+            key = lambda match: match[2]['_seq']
+        elif field == '_score':
+            sorted_by_score = True
+            key = lambda match: match[0]
+        else:
+            key = lambda match, field=field: _Matcher(match[1]).get_terms(
+                field, match[2]['_source'])[:1] or None
+        matches.sort(key=key, reverse=order == 'desc')
+    return sorted_by_score
+
+
+def _suggest_option(text, completion, values):
+    """
+    :returns: Suggestion of a completion field's value if it's input starts with the text
+        and it's in the right context, None otherwise.
+    :rtype: dict
+    """
+    prefix = text.lower()
+    for value in values:
+        if not isinstance(value, dict):
+            value = {'input': value}
+        contexts = completion.get('context', {})
+        if any(not set(as_list(expected)) & set(as_list(value.get('context', {}).get(name)))
+               for name, expected in contexts.items()):
+            continue
+        inputs = as_list(value['input'])
+        if any(suggestion_input.lower().startswith(prefix) for suggestion_input in inputs):
+            return {'text': value.get('output', inputs[0]), 'score': float(value.get('weight', 1))}
+    return None
+
+
+def _get_values(source, field):
+    """
+    :returns: Values of a (possibly nested) field, values of the parent field for
+        a subfield like "category.raw".
+    :rtype: list
+    """
+    values = [source]
+    for part in field.split('.'):
+        objects = [value for value in values if isinstance(value, dict)]
+        if not objects:
+            # "raw" and other subfields are indexed from the parent field's value
+            break
+        values = [item for value in objects if part in value for item in as_list(value[part])]
+    return [value for value in values if value is not None]
+
+
+def _check_version(index, doc_type, doc_id, document, expected_version):
+    """
+    Optimistic concurrency control of writes and deletes given a "version".
+    """
+    if expected_version is None:
+        return
+    current_version = document['_version'] if document else -1
+    if current_version != int(expected_version):
+        raise ElasticError(409, 'version_conflict_engine_exception',
+                           '[{}][{}]: version conflict, current [{}], provided [{}]'.format(
+                               doc_type, doc_id, current_version, expected_version),
+                           index=index.name)
@@ -26,6 +26,7 @@ import pytest
 import base_test
 
 import data_catalog.app as app
+from data_catalog.bulk_import import BulkLoadMode
 from data_catalog.configuration import DCConfig
 
 
@@ -35,6 +36,19 @@ def mock_es_create():
         yield mock_create
 
 
+@pytest.yield_fixture(autouse=True)
+def mock_restore_interrupted():
+    with mock.patch.object(BulkLoadMode, 'restore_interrupted') as mock_restore:
+        yield mock_restore
+
+
+@pytest.yield_fixture(autouse=True)
+def mock_es_exists():
+    with mock.patch.object(elasticsearch.client.indices.IndicesClient, 'exists',
+                           return_value=False) as mock_exists:
+        yield mock_exists
+
+
 @pytest.fixture
 def test_config(fake_env_vars):
     return DCConfig()
@@ -43,9 +57,23 @@ def test_config(fake_env_vars):
 def test_first_prepare_environment(mock_es_create, test_config):
     app._prepare_environment(test_config)
 
+    index_setup = dict(test_config.elastic.metadata_index_setup)
+    index_setup['aliases'] = {test_config.elastic.elastic_index: {}}
     mock_es_create.assert_called_with(
-        index=test_config.elastic.elastic_index,
-        body=test_config.elastic.metadata_index_setup)
+        index=test_config.elastic.elastic_index + '-v1',
+        body=index_setup)
+
+
+def test_prepare_environment_alias_exists(mock_es_create, mock_es_exists, test_config):
+    mock_es_exists.return_value = True
+    app._prepare_environment(test_config)
+    assert not mock_es_create.called
+
+
+def test_prepare_environment_interrupted_bulk_load(mock_es_create, mock_restore_interrupted,
+                                                   test_config):
+    app._prepare_environment(test_config)
+    mock_restore_interrupted.assert_called_once_with(mock.ANY, test_config.elastic)
 
 
 def test_subsequent_prepare_environment(mock_es_create, test_config):
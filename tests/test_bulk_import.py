@@ -0,0 +1,269 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import unittest
+
+from elasticsearch.exceptions import ConflictError, ConnectionError, NotFoundError
+from mock import MagicMock, patch
+
+from data_catalog.bases import create_elastic_search
+from data_catalog.bulk_import import BulkImporter, BulkLoadMode
+from data_catalog.codec import CodecSerializer
+from data_catalog.metadata_index import MetadataIndex
+from data_catalog.routing import OrgRouting
+from tests.base_test import DataCatalogTestCase
+from tests.fake_elastic_search import FakeElasticSearch
+
+
+class BulkImporterTests(DataCatalogTestCase):
+
+    FAILING_ID = 'failing-entry'
+
+    def setUp(self):
+        super(BulkImporterTests, self).setUp()
+        self._mock_es = MagicMock()
+        self._mock_es.transport.serializer = CodecSerializer()
+        self._mock_es.bulk.side_effect = self._fake_bulk
+        self._bulk_bodies = []
+        self._config.bulk_import.chunk_size = 2
+        self._config.bulk_import.concurrency = 2
+        self._importer = BulkImporter(self._mock_es, 'test-index', 'test-type',
+                                      OrgRouting(self._config.elastic, self._mock_es),
+                                      self._config.bulk_import)
+
+    def _fake_bulk(self, body, **_):
+        """
+        Accepts all entries except the failing one.
+        """
+        self._bulk_bodies.append(body)
+        actions = [json.loads(line) for line in body.splitlines()[::2]]
+        return {'items': [{'index': {'_id': action['index']['_id'],
+                                     'status': 500 if action['index']['_id'] == self.FAILING_ID
+                                               else 201}}
+                          for action in actions]}
+
+    @staticmethod
+    def _get_entry(entry_id, **fields):
+        entry = {
+            'id': entry_id,
+            'orgUUID': 'org01',
+            'category': 'health',
+            'dataSample': 'some sample',
+            'format': 'csv',
+            'recordCount': 13,
+            'size': 99999,
+            'sourceUri': 'some uri',
+            'targetUri': 'hdfs://6.6.6.6:8200/borker/long-long-hash/9213-154b-a0b9/00000_1',
+            'title': 'a great title',
+            'isPublic': True,
+            'creationTime': '2015-02-13T13:00:00'
+        }
+        entry.update(fields)
+        return entry
+
+    def test_importEntries_validEntries_indexedInChunks(self):
+        entries = [self._get_entry('entry-{}'.format(number)) for number in range(5)]
+
+        summary = self._importer.import_entries(iter(entries))
+
+        self.assertEqual({'indexed': 5, 'rejected': 0, 'failed': 0}, summary)
+        self.assertEqual(3, len(self._bulk_bodies))
+        action, source = [json.loads(line) for line in self._bulk_bodies[0].splitlines()[:2]]
+        self.assertEqual({'index': {'_index': 'test-index', '_type': 'test-type',
+                                    '_id': 'entry-0'}}, action)
+        self.assertNotIn('id', source)
+        self.assertEqual(['org01', 'public'], source['visibleTo'])
+
+    def test_importEntries_invalidAndFailingEntries_counted(self):
+        entries = [self._get_entry('valid'),
+                   self._get_entry('invalid', recordCount='not a number'),
+                   {'title': 'no ID'},
+                   self._get_entry(self.FAILING_ID)]
+
+        summary = self._importer.import_entries(iter(entries))
+
+        self.assertEqual({'indexed': 1, 'rejected': 2, 'failed': 1}, summary)
+
+    def test_importEntries_orgRouting_entriesRouted(self):
+        self._config.elastic.org_routing = True
+        self._importer.import_entries(iter([self._get_entry('entry', orgUUID='ORG01')]))
+        action = json.loads(self._bulk_bodies[0].splitlines()[0])
+        self.assertEqual('org01', action['index']['_routing'])
+
+    def test_importEntries_noConnection_connectionErrorRaised(self):
+        self._mock_es.bulk.side_effect = ConnectionError
+        with self.assertRaises(ConnectionError):
+            self._importer.import_entries(iter([self._get_entry('entry')]))
+
+
+class BulkLoadModeTests(DataCatalogTestCase):
+
+    INDEX = 'trustedanalytics-meta-v1'
+    SNAPSHOT_INDEX = 'trustedanalytics-meta-bulk-load'
+
+    def setUp(self):
+        super(BulkLoadModeTests, self).setUp()
+        self._mock_es = MagicMock()
+        self._mock_es.indices.get_settings.return_value = {
+            self.INDEX: {'settings': {'index.number_of_replicas': '2'}}}
+        self._previous_settings = {'index.refresh_interval': '1s',
+                                   'index.number_of_replicas': '2'}
+
+    def _get_mode(self, **kwargs):
+        return BulkLoadMode(self._mock_es, self._config.elastic,
+                            self._config.elastic.elastic_index, **kwargs)
+
+    def _get_snapshot(self, loads, version, settings=None):
+        return {'_id': self.INDEX, '_version': version,
+                '_source': {'settings': settings or self._previous_settings, 'loads': loads}}
+
+    def test_bulkLoad_success_settingsChangedAndRestored(self):
+        self._mock_es.get.side_effect = [NotFoundError, self._get_snapshot(1, 1)]
+        with self._get_mode():
+            self._mock_es.index.assert_called_once_with(
+                index=self.SNAPSHOT_INDEX, doc_type='settings', id=self.INDEX,
+                body={'settings': self._previous_settings, 'loads': 1}, op_type='create',
+                refresh=True)
+            self._mock_es.indices.put_settings.assert_called_once_with(
+                index=self._config.elastic.elastic_index, body=BulkLoadMode.BULK_LOAD_SETTINGS)
+
+        self._mock_es.indices.put_settings.assert_called_with(
+            index=self.INDEX, body=self._previous_settings, ignore=404)
+        self._mock_es.indices.refresh.assert_called_once_with(index=self.INDEX, ignore=404)
+        self._mock_es.delete.assert_called_once_with(
+            index=self.SNAPSHOT_INDEX, doc_type='settings', id=self.INDEX, ignore=404, version=1)
+        self.assertFalse(self._mock_es.indices.optimize.called)
+
+    def test_bulkLoad_failure_settingsRestoredAndErrorRaised(self):
+        self._mock_es.get.side_effect = [NotFoundError, self._get_snapshot(1, 1)]
+        with self.assertRaises(ConnectionError):
+            with self._get_mode(force_merge=True):
+                raise ConnectionError
+        self._mock_es.indices.put_settings.assert_called_with(
+            index=self.INDEX, body=self._previous_settings, ignore=404)
+        self.assertFalse(self._mock_es.indices.optimize.called)
+
+    def test_bulkLoad_otherLoadRunning_loadCountedAndSettingsNotRestored(self):
+        running_settings = {'index.refresh_interval': '30s', 'index.number_of_replicas': '1'}
+        self._mock_es.indices.get_settings.return_value = {
+            self.INDEX: {'settings': BulkLoadMode.BULK_LOAD_SETTINGS}}
+        self._mock_es.get.side_effect = [self._get_snapshot(1, 3, running_settings),
+                                         self._get_snapshot(2, 4, running_settings)]
+        with self._get_mode():
+            pass
+        self.assertEqual(
+            [({'settings': running_settings, 'loads': 2}, 3),
+             ({'settings': running_settings, 'loads': 1}, 4)],
+            [(call[1]['body'], call[1]['version']) for call in self._mock_es.index.call_args_list])
+        self._mock_es.indices.put_settings.assert_called_once_with(
+            index=self._config.elastic.elastic_index, body=BulkLoadMode.BULK_LOAD_SETTINGS)
+        self.assertFalse(self._mock_es.delete.called)
+
+    def test_bulkLoad_snapshotChangedByOtherLoad_retried(self):
+        self._mock_es.get.side_effect = [NotFoundError, self._get_snapshot(1, 1),
+                                         self._get_snapshot(2, 2), self._get_snapshot(1, 3)]
+        self._mock_es.index.side_effect = [ConflictError, None, None]
+        with self._get_mode():
+            pass
+        self.assertEqual([1, 2, 1], [call[1]['body']['loads']
+                                     for call in self._mock_es.index.call_args_list])
+        self.assertFalse(self._mock_es.delete.called)
+
+    def test_bulkLoad_settingsLeftFromBulkLoad_configuredSettingsSaved(self):
+        self._mock_es.indices.get_settings.return_value = {
+            self.INDEX: {'settings': BulkLoadMode.BULK_LOAD_SETTINGS}}
+        self._mock_es.get.side_effect = NotFoundError
+        with self._get_mode():
+            pass
+        self.assertEqual({'index.refresh_interval': '1s', 'index.number_of_replicas': '1'},
+                         self._mock_es.index.call_args[1]['body']['settings'])
+
+    def test_bulkLoad_overlappingLoads_lastOneRestoresSettings(self):
+        with FakeElasticSearch():
+            elastic_search = create_elastic_search(self._config.elastic)
+            MetadataIndex(elastic_search, self._config.elastic).create_if_missing()
+            elastic_search.indices.put_settings(index=self.INDEX,
+                                                body={'index.refresh_interval': '5s'})
+
+            def get_settings():
+                return elastic_search.indices.get_settings(
+                    index=self.INDEX, flat_settings=True)[self.INDEX]['settings']
+
+            first_load = BulkLoadMode(elastic_search, self._config.elastic, self.INDEX)
+            second_load = BulkLoadMode(elastic_search, self._config.elastic, self.INDEX)
+            first_load.__enter__()
+            second_load.__enter__()
+            first_load.__exit__(None, None, None)
+            self.assertEqual('-1', get_settings()['index.refresh_interval'])
+            # a load starting after the first one ended doesn't save bulk load settings
+            with BulkLoadMode(elastic_search, self._config.elastic, self.INDEX):
+                second_load.__exit__(None, None, None)
+            self.assertEqual('5s', get_settings()['index.refresh_interval'])
+            with self.assertRaises(NotFoundError):
+                elastic_search.get(index=self.SNAPSHOT_INDEX, doc_type='settings', id=self.INDEX)
+
+    def test_startAndFinish_separateInstances_settingsRestoredOnIndicesBehindAlias(self):
+        alias = self._config.elastic.elastic_index
+        with FakeElasticSearch():
+            elastic_search = create_elastic_search(self._config.elastic)
+            MetadataIndex(elastic_search, self._config.elastic).create_if_missing()
+
+            def get_refresh_interval():
+                return elastic_search.indices.get_settings(
+                    index=self.INDEX, flat_settings=True)[self.INDEX]['settings'].get(
+                        'index.refresh_interval')
+
+            self.assertEqual([self.INDEX],
+                             BulkLoadMode(elastic_search, self._config.elastic, alias).start())
+            self.assertEqual('-1', get_refresh_interval())
+            self.assertEqual([self.INDEX],
+                             BulkLoadMode(elastic_search, self._config.elastic, alias).finish())
+            self.assertEqual(self._config.elastic.refresh_interval, get_refresh_interval())
+
+    def test_bulkLoad_forceMerge_indexMerged(self):
+        self._mock_es.get.side_effect = [NotFoundError, self._get_snapshot(1, 1)]
+        with self._get_mode(force_merge=True):
+            pass
+        self._mock_es.indices.optimize.assert_called_once_with(
+            index=self._config.elastic.elastic_index, max_num_segments=1)
+
+    def test_bulkLoad_disabled_settingsNotChanged(self):
+        with self._get_mode(enabled=False):
+            pass
+        self.assertFalse(self._mock_es.indices.put_settings.called)
+
+    @patch('data_catalog.bulk_import.helpers.scan')
+    def test_restoreInterrupted_snapshotsLeft_settingsRestored(self, mock_scan):
+        # the second one was saved before loads were counted
+        mock_scan.return_value = iter([self._get_snapshot(2, 5),
+                                       {'_id': 'other', '_source': self._previous_settings}])
+        BulkLoadMode.restore_interrupted(self._mock_es, self._config.elastic)
+        self.assertEqual(
+            [((), {'index': self.INDEX, 'body': self._previous_settings, 'ignore': 404}),
+             ((), {'index': 'other', 'body': self._previous_settings, 'ignore': 404})],
+            self._mock_es.indices.put_settings.call_args_list)
+        self._mock_es.delete.assert_any_call(
+            index=self.SNAPSHOT_INDEX, doc_type='settings', id=self.INDEX, ignore=404)
+
+    @patch('data_catalog.bulk_import.helpers.scan', side_effect=NotFoundError)
+    def test_restoreInterrupted_noSnapshotIndex_nothingDone(self, _):
+        BulkLoadMode.restore_interrupted(self._mock_es, self._config.elastic)
+        self.assertFalse(self._mock_es.indices.put_settings.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import unittest
+from datetime import datetime
+from io import BytesIO
+
+from elasticsearch.exceptions import SerializationError
+
+from data_catalog.codec import (CODECS, CodecSerializer, ElementTooLargeError, JsonCodec,
+                                get_codec, iter_json_array)
+
+
+class CodecTests(unittest.TestCase):
+
+    ENTRY = {'title': u'Zebras \u2013 Africa', 'dataSample': 'a,b\n1,2', 'size': 1234,
+             'isPublic': True, 'sourceUri': 'http://example.com/zebras.csv'}
+
+    def test_availableCodecs_entryRoundTrip_sameEntry(self):
+        for codec in CODECS.values():
+            self.assertEqual(self.ENTRY, codec.loads(codec.dumps(self.ENTRY)), codec.name)
+            self.assertEqual(self.ENTRY, json.loads(codec.dumps(self.ENTRY)), codec.name)
+
+    def test_getCodec_noName_fastestAvailableCodecReturned(self):
+        self.assertIn(get_codec().name, CODECS)
+        self.assertEqual('json', get_codec('json').name)
+        with self.assertRaises(KeyError):
+            get_codec('nonexistent')
+
+    def test_dumps_valueUnsupportedByLibrary_standardLibraryUsed(self):
+        def failing_dumps(_):
+            raise TypeError
+        codec = JsonCodec('failing', failing_dumps, json.loads)
+        self.assertEqual({'creationTime': '2016-01-02T03:04:05'},
+                         json.loads(codec.dumps({'creationTime': datetime(2016, 1, 2, 3, 4, 5)})))
+
+    def test_serializer_stringBody_passedUnchanged(self):
+        self.assertEqual('{"query": {}}', CodecSerializer().dumps('{"query": {}}'))
+
+    def test_serializer_invalidResponse_serializationErrorRaised(self):
+        with self.assertRaises(SerializationError):
+            CodecSerializer().loads('not json')
+
+    def test_iterJsonArray_smallChunks_elementsDecoded(self):
+        array = [self.ENTRY, 12.5e3, [1, 2], 'text, with ] inside', None, -7,
+                 {'escaped': 'quote \\" and } brace [', 'nested': [{'a': ['\\']}]}, True]
+        array_json = json.dumps(array, ensure_ascii=False).encode('utf-8')
+        for chunk_size in [1, 3, 1024]:
+            self.assertEqual(array, list(iter_json_array(BytesIO(array_json), chunk_size)))
+        self.assertEqual([], list(iter_json_array(BytesIO(' [ ] '))))
+
+    def test_iterJsonArray_elementOverLimit_elementTooLargeErrorRaised(self):
+        array_json = json.dumps([{'title': 'a'}, {'title': 'a' * 100}, {'title': 'a'}])
+        for chunk_size in [7, 1024]:
+            elements = iter_json_array(BytesIO(array_json), chunk_size, max_element_size=50)
+            self.assertEqual({'title': 'a'}, next(elements))
+            with self.assertRaises(ElementTooLargeError):
+                next(elements)
+
+    def test_iterJsonArray_malformedArray_valueErrorRaised(self):
+        for malformed_json in ['', '{"a": 1}', '[1 2]', '[{"a": 1}', '[1,]', '[1] 2',
+                               '[{"a": "}"]', '[{"a": 1]}', '["\\"]', '[{"a": 1}}]']:
+            with self.assertRaises(ValueError):
+                list(iter_json_array(BytesIO(malformed_json), 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import unittest
+import zlib
+from io import BytesIO
+
+from ddt import ddt, data, unpack
+from mock import MagicMock
+from werkzeug.exceptions import HTTPException
+from werkzeug.test import Client
+from werkzeug.wrappers import BaseResponse, Request, Response
+
+from data_catalog.compression import CompressionMiddleware, choose_encoding, GZIP_WBITS
+
+
+def _compress(body, wbits=GZIP_WBITS):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, wbits)
+    return compressor.compress(body) + compressor.flush()
+
+
+def _decompress(body):
+    return zlib.decompress(body, 32 + zlib.MAX_WBITS)
+
+
+@Request.application
+def _echo_app(request):
+    """
+    Returns the request's body (or its first "read" bytes), streamed if "stream" argument
+    is given. Errors are returned like Flask-RESTful does.
+    """
+    try:
+        body = request.stream.read(request.args.get('read', default=-1, type=int))
+    except HTTPException as ex:
+        return Response(json.dumps({'message': ex.description}), status=ex.code,
+                        mimetype='application/json')
+    if request.args.get('stream'):
+        return Response(iter([body[:10], body[10:]]), mimetype='application/x-ndjson')
+    response = Response(body, mimetype=request.args.get('mimetype', 'application/json'))
+    if request.args.get('vary'):
+        response.headers['Vary'] = request.args['vary']
+    return response
+
+
+@ddt
+class CompressionMiddlewareTests(unittest.TestCase):
+
+    BODY = json.dumps([{'title': 'zebras', 'dataSample': 'a,b,c\n' * 100}] * 5)
+
+    def setUp(self):
+        self._config = MagicMock(min_size=1024, level=6, max_request_size=100000)
+        self._client = Client(CompressionMiddleware(_echo_app, self._config), BaseResponse)
+
+    def test_response_gzipAccepted_bodyCompressed(self):
+        response = self._client.post('/', data=self.BODY, headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual('gzip', response.headers['Content-Encoding'])
+        self.assertEqual('Accept-Encoding', response.headers['Vary'])
+        self.assertLess(len(response.data), len(self.BODY))
+        self.assertEqual(self.BODY, _decompress(response.data))
+
+    def test_response_varyHeaderSetByApp_acceptEncodingAdded(self):
+        response = self._client.post('/?vary=Origin', data=self.BODY,
+                                     headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual('Origin, Accept-Encoding', response.headers['Vary'])
+
+    def test_response_onlyDeflateAccepted_deflateUsed(self):
+        response = self._client.post('/', data=self.BODY,
+                                     headers={'Accept-Encoding': 'gzip;q=0, deflate'})
+        self.assertEqual('deflate', response.headers['Content-Encoding'])
+        self.assertEqual(self.BODY, zlib.decompress(response.data))
+
+    def test_response_streamed_bodyCompressed(self):
+        response = self._client.post('/?stream=true', data='{"a": 1}\n' * 3,
+                                     headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual('gzip', response.headers['Content-Encoding'])
+        self.assertEqual('{"a": 1}\n' * 3, _decompress(response.data))
+
+    @data(('/', 'small body', 'gzip'),
+          ('/', BODY, ''),
+          ('/?mimetype=image/png', BODY, 'gzip'))
+    @unpack
+    def test_response_notCompressible_bodyUnchanged(self, url, body, accept_encoding):
+        response = self._client.post(url, data=body,
+                                     headers={'Accept-Encoding': accept_encoding})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(body, response.data)
+
+    @data(GZIP_WBITS, zlib.MAX_WBITS)
+    def test_request_compressedBody_decompressedForApp(self, wbits):
+        response = self._client.put('/', data=_compress(self.BODY, wbits),
+                                    headers={'Content-Encoding': 'gzip'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(self.BODY, response.data)
+
+    def test_request_chunkedWithoutContentLength_decompressedForApp(self):
+        response = self._client.put('/', input_stream=BytesIO(_compress(self.BODY)),
+                                    headers={'Content-Encoding': 'gzip',
+                                             'Transfer-Encoding': 'chunked'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(self.BODY, response.data)
+
+    def test_request_partOfBodyRead_onlyThatPartDecompressed(self):
+        response = self._client.put('/?read=10', data=_compress('0' * 1000000),
+                                    headers={'Content-Encoding': 'gzip'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('0' * 10, response.data)
+
+    def test_request_bodyOverLimit_413Returned(self):
+        response = self._client.put('/', data=_compress('0' * 100001),
+                                    headers={'Content-Encoding': 'gzip'})
+        self.assertEqual(413, response.status_code)
+        self.assertEqual(CompressionMiddleware.TOO_LARGE_ERROR_MESSAGE,
+                         json.loads(response.data)['message'])
+
+    def test_request_corruptedBody_400Returned(self):
+        response = self._client.put('/', data='not gzip at all',
+                                    headers={'Content-Encoding': 'gzip'})
+        self.assertEqual(400, response.status_code)
+
+    def test_request_unknownEncoding_415Returned(self):
+        response = self._client.put('/', data=self.BODY, headers={'Content-Encoding': 'br'})
+        self.assertEqual(415, response.status_code)
+
+    @data(('gzip, deflate', 'gzip'),
+          ('deflate;q=1, gzip;q=0.5', 'deflate'),
+          ('*', 'gzip'),
+          ('br', None),
+          ('gzip;q=0, *;q=0', None),
+          ('', None))
+    @unpack
+    def test_chooseEncoding_acceptEncodingHeader_preferredEncodingChosen(self, header, encoding):
+        chosen = choose_encoding(header)
+        self.assertEqual(encoding, chosen[0] if chosen else None)
+
+
+if __name__ == '__main__':
+    unittest.main()
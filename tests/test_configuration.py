@@ -18,10 +18,23 @@ import json
 import os
 import unittest
 
-from data_catalog.configuration import DCConfig, NoConfigEnvError, VCAP_SERVICES
+from ddt import ddt, data, unpack
+
+from data_catalog.configuration import (DCConfig, NoConfigEnvError, InvalidConfigError,
+                                        VCAP_SERVICES, SEARCH_TIMEOUT,
+                                        SEARCH_TERMINATE_AFTER, SEARCH_REQUEST_TIMEOUT,
+                                        SEARCH_TIME_ROUNDING, QUERY_MAX_SIZE, QUERY_MAX_TERMS,
+                                        QUERY_COST_DEGRADE_THRESHOLD,
+                                        QUERY_COST_REJECT_THRESHOLD, COMPRESSION_MIN_SIZE,
+                                        COMPRESSION_LEVEL, REQUEST_MAX_DECOMPRESSED_SIZE,
+                                        IMPORT_CHUNK_SIZE, IMPORT_CONCURRENCY,
+                                        ELASTIC_NUMBER_OF_SHARDS, ELASTIC_NUMBER_OF_REPLICAS,
+                                        ELASTIC_REFRESH_INTERVAL, STORAGE_BACKEND,
+                                        METRICS_DIR)
 from .conftest import fake_env, clean_fake_env
 
 
+@ddt
 class ConfigTests(unittest.TestCase):
     def test_getConfig_noVcapServices_raiseError(self):
         with self.assertRaises(NoConfigEnvError):
@@ -45,6 +58,11 @@ class ConfigTests(unittest.TestCase):
 
         self.assertEqual('localhost', config.elastic.elastic_hostname)
         self.assertEqual(9200, config.elastic.elastic_port)
+        self.assertFalse(config.elastic.org_routing)
+
+        self.assertEqual('5s', config.search.timeout)
+        self.assertEqual(0, config.search.terminate_after)
+        self.assertEqual(10, config.search.request_timeout)
 
         self.assertEqual(
             'http://localhost:8091/rest/tables',
@@ -75,6 +93,100 @@ class ConfigTests(unittest.TestCase):
                 config.services_url.user_management_uri)
 
 
+    def test_getConfig_searchBudgetsSet_searchConfigured(self):
+        with fake_env():
+            os.environ[SEARCH_TIMEOUT] = '200ms'
+            os.environ[SEARCH_TERMINATE_AFTER] = '10000'
+            os.environ[SEARCH_REQUEST_TIMEOUT] = '1.5'
+            config = DCConfig()
+            self.assertEqual('200ms', config.search.timeout)
+            self.assertEqual(10000, config.search.terminate_after)
+            self.assertEqual(1.5, config.search.request_timeout)
+
+    def test_getConfig_searchBudgetsDisabled_noLimits(self):
+        with fake_env():
+            os.environ[SEARCH_TIMEOUT] = ''
+            os.environ[SEARCH_TIME_ROUNDING] = ''
+            config = DCConfig()
+            self.assertEqual('', config.search.timeout)
+            self.assertEqual('', config.search.time_rounding)
+
+    @data((SEARCH_TIMEOUT, '5 seconds'),
+          (SEARCH_TERMINATE_AFTER, '-1'),
+          (SEARCH_TERMINATE_AFTER, 'many'),
+          (SEARCH_REQUEST_TIMEOUT, '0'),
+          (SEARCH_REQUEST_TIMEOUT, 'nan'),
+          (SEARCH_REQUEST_TIMEOUT, 'soon'),
+          (SEARCH_TIME_ROUNDING, 'minute'))
+    @unpack
+    def test_getConfig_invalidSearchSetting_raiseError(self, env_var, value):
+        with fake_env():
+            os.environ[env_var] = value
+            with self.assertRaises(InvalidConfigError):
+                DCConfig()
+
+    def test_getConfig_indexSettingsSet_indexSetupConfigured(self):
+        with fake_env():
+            os.environ[ELASTIC_NUMBER_OF_SHARDS] = '3'
+            os.environ[ELASTIC_NUMBER_OF_REPLICAS] = '0'
+            os.environ[ELASTIC_REFRESH_INTERVAL] = '30s'
+            config = DCConfig()
+            index_settings = config.elastic.metadata_index_setup['settings']['index']
+            self.assertEqual(3, index_settings['number_of_shards'])
+            self.assertEqual(0, index_settings['number_of_replicas'])
+            self.assertEqual('30s', index_settings['refresh_interval'])
+            self.assertIn('analysis', index_settings)
+
+    @data((QUERY_MAX_SIZE, '0'),
+          (QUERY_MAX_TERMS, '1e3'),
+          (QUERY_COST_DEGRADE_THRESHOLD, '-5'),
+          (QUERY_COST_REJECT_THRESHOLD, 'high'))
+    @unpack
+    def test_getConfig_invalidQueryLimit_raiseError(self, env_var, value):
+        with fake_env():
+            os.environ[env_var] = value
+            with self.assertRaises(InvalidConfigError):
+                DCConfig()
+
+    @data((COMPRESSION_MIN_SIZE, '-1'),
+          (COMPRESSION_LEVEL, '0'),
+          (COMPRESSION_LEVEL, '12'),
+          (REQUEST_MAX_DECOMPRESSED_SIZE, '100MiB'))
+    @unpack
+    def test_getConfig_invalidCompressionSetting_raiseError(self, env_var, value):
+        with fake_env():
+            os.environ[env_var] = value
+            with self.assertRaises(InvalidConfigError):
+                DCConfig()
+
+    @data((IMPORT_CHUNK_SIZE, '0'),
+          (IMPORT_CHUNK_SIZE, '500 entries'),
+          (IMPORT_CONCURRENCY, '0'))
+    @unpack
+    def test_getConfig_invalidImportSetting_raiseError(self, env_var, value):
+        with fake_env():
+            os.environ[env_var] = value
+            with self.assertRaises(InvalidConfigError):
+                DCConfig()
+
+    @data((ELASTIC_NUMBER_OF_SHARDS, '0'),
+          (ELASTIC_NUMBER_OF_SHARDS, 'many'),
+          (ELASTIC_NUMBER_OF_REPLICAS, '-1'),
+          (ELASTIC_REFRESH_INTERVAL, '1 second'),
+          (STORAGE_BACKEND, 'mongodb'))
+    @unpack
+    def test_getConfig_invalidIndexSetting_raiseError(self, env_var, value):
+        with fake_env():
+            os.environ[env_var] = value
+            with self.assertRaises(InvalidConfigError):
+                DCConfig()
+
+    def test_getConfig_metricsDirIsFile_raiseError(self):
+        with fake_env():
+            os.environ[METRICS_DIR] = __file__
+            with self.assertRaises(InvalidConfigError):
+                DCConfig()
+
     #TODO we should make downloader config not in user-provided services obsolete soon
     def test_getConfig_alternativeDownloaderSetup_downloaderUrlSet(self):
         def set_alternative_downloader_conf():
@@ -28,7 +28,7 @@ class DataSetDeleteTest(DataCatalogTestCase):
     AUTH_TOKEN = 'authorization-token'
     DATABASE_ID = 'database_id'
     TARGET_URI = 'hdfs://URI/DATA/{}/000000_1'.format(DATABASE_ID)
-    MOCK_GET = {'_source': {'targetUri': TARGET_URI}}
+    MOCK_GET = {'_source': {'targetUri': TARGET_URI, 'orgUUID': 'org01'}}
 
     def setUp(self):
         super(DataSetDeleteTest, self).setUp()
@@ -37,6 +37,8 @@ class DataSetDeleteTest(DataCatalogTestCase):
         self._delete_obj._elastic_search.delete = self._mock_es_delete = MagicMock()
         self._delete_obj._elastic_search.get = self._mock_es_get = MagicMock()
         self._delete_obj._elastic_search.indices.flush = self._mock_es_flush = MagicMock()
+        # no reindex is running
+        self._delete_obj._elastic_search.indices.exists = MagicMock(return_value=False)
         self._mock_es_get.return_value = self.MOCK_GET
         requests.delete = self._mock_req_delete = MagicMock()
 
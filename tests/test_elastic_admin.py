@@ -0,0 +1,302 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import unittest
+import zlib
+
+import flask
+from ddt import ddt, data
+from elasticsearch.exceptions import NotFoundError, RequestError
+from mock import MagicMock, patch
+
+from data_catalog.bulk_import import BulkImporter, BulkLoadMode
+from data_catalog.elastic_admin import (ElasticSearchAdminResource, ElasticSearchBulkLoadResource,
+                                        ElasticSearchReindexResource,
+                                        ElasticSearchSettingsResource)
+from data_catalog.metadata_index import MetadataIndex, Reindexer, ReindexJobs
+from tests.base_test import DataCatalogTestCase
+
+
+class ElasticSearchAdminTests(DataCatalogTestCase):
+
+    def setUp(self):
+        super(ElasticSearchAdminTests, self).setUp()
+        self._resource = ElasticSearchAdminResource()
+        self._resource._elastic_search = self._mock_es = MagicMock()
+        self.request_context = self.app.test_request_context('/rest/datasets/admin/elastic')
+        self.request_context.push()
+        flask.g.is_admin = True
+
+    def tearDown(self):
+        super(ElasticSearchAdminTests, self).tearDown()
+        self.request_context.pop()
+
+    def test_get_admin_cacheStatsReturned(self):
+        self._mock_es.indices.stats.return_value = {
+            '_all': {
+                'total': {
+                    'request_cache': {'memory_size_in_bytes': 2048, 'evictions': 0,
+                                      'hit_count': 3, 'miss_count': 1},
+                    'query_cache': {'memory_size_in_bytes': 0, 'evictions': 0,
+                                    'hit_count': 0, 'miss_count': 0}
+                }
+            }
+        }
+
+        stats = self._resource.get()
+
+        self.assertEqual({'hitCount': 3, 'missCount': 1, 'hitRate': 0.75,
+                          'evictions': 0, 'memorySizeInBytes': 2048}, stats['requestCache'])
+        self.assertEqual(0.0, stats['queryCache']['hitRate'])
+        self._mock_es.indices.stats.assert_called_once_with(
+            index=self._config.elastic.elastic_index, metric='request_cache,query_cache')
+
+    def test_get_notAdmin_403Returned(self):
+        flask.g.is_admin = False
+        self.assertEqual((None, 403), self._resource.get())
+        self.assertFalse(self._mock_es.indices.stats.called)
+
+    def test_get_noIndex_404Returned(self):
+        self._mock_es.indices.stats.side_effect = NotFoundError
+        self.assertEqual((None, 404), self._resource.get())
+
+    def test_delete_admin_indicesBehindAliasDeleted(self):
+        alias = self._config.elastic.elastic_index
+        self._resource._index = MetadataIndex(self._mock_es, self._config.elastic)
+        self._mock_es.indices.get_alias.return_value = {alias + '-v2': {}}
+        self._resource.delete()
+        self._mock_es.indices.delete.assert_called_once_with(index=alias + '-v2', ignore=404)
+
+    @patch.object(BulkLoadMode, '__exit__', return_value=False)
+    @patch.object(BulkLoadMode, '__enter__')
+    @patch.object(ElasticSearchAdminResource, '_create_index_if_missing')
+    @patch.object(BulkImporter, 'import_entries')
+    def test_put_entriesArray_summaryReturned(self, mock_import_entries, *_):
+        mock_import_entries.side_effect = lambda entries: {'indexed': len(list(entries)),
+                                                           'rejected': 0, 'failed': 0}
+
+        response = self.client.put('/rest/datasets/admin/elastic',
+                                   data=json.dumps([{'id': 'entry-1'}, {'id': 'entry-2'}]))
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({'indexed': 2, 'rejected': 0, 'failed': 0}, json.loads(response.data))
+
+    @patch.object(BulkLoadMode, '__exit__', return_value=False)
+    @patch.object(BulkLoadMode, '__enter__')
+    @patch.object(ElasticSearchAdminResource, '_create_index_if_missing')
+    @patch.object(BulkImporter, 'import_entries')
+    def test_put_gzippedEntriesArray_decompressedWhileImporting(self, mock_import_entries, *_):
+        mock_import_entries.side_effect = lambda entries: {'indexed': len(list(entries)),
+                                                           'rejected': 0, 'failed': 0}
+        self._config.compression.max_request_size = 100
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        entries = [{'id': 'entry-{}'.format(number)} for number in range(10)]
+
+        def put(entries):
+            body = compressor.copy()
+            return self.client.put('/rest/datasets/admin/elastic',
+                                   data=body.compress(json.dumps(entries)) + body.flush(),
+                                   headers={'Content-Encoding': 'gzip'})
+
+        response = put(entries[:2])
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, json.loads(response.data)['indexed'])
+
+        response = put(entries)
+        self.assertEqual(413, response.status_code)
+        self.assertIn('message', json.loads(response.data))
+
+    @patch.object(BulkLoadMode, '__exit__', return_value=False)
+    @patch.object(BulkLoadMode, '__enter__')
+    @patch.object(ElasticSearchAdminResource, '_create_index_if_missing')
+    @patch.object(BulkImporter, 'import_entries')
+    def test_put_malformedBody_400Returned(self, mock_import_entries, *_):
+        mock_import_entries.side_effect = lambda entries: list(entries)
+        response = self.client.put('/rest/datasets/admin/elastic', data='{"not": "an array"}')
+        self.assertEqual(400, response.status_code)
+
+
+    @patch.object(BulkLoadMode, '_leave_load')
+    @patch.object(BulkLoadMode, '_join_load')
+    @patch.object(ElasticSearchAdminResource, '_create_index_if_missing')
+    @patch.object(BulkImporter, 'import_entries')
+    def test_put_bulkLoadModeFalse_settingsNotChanged(self, mock_import_entries, _,
+                                                      mock_join_load, mock_leave_load):
+        mock_import_entries.side_effect = lambda entries: {'indexed': len(list(entries)),
+                                                           'rejected': 0, 'failed': 0}
+        response = self.client.put('/rest/datasets/admin/elastic?bulkLoadMode=false',
+                                   data=json.dumps([{'id': 'entry-1'}]))
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(mock_join_load.called)
+        self.assertFalse(mock_leave_load.called)
+
+
+class ElasticSearchBulkLoadTests(DataCatalogTestCase):
+
+    BULK_LOAD_URL = '/rest/datasets/admin/elastic/bulk-load'
+
+    def setUp(self):
+        super(ElasticSearchBulkLoadTests, self).setUp()
+        self.request_context = self.app.test_request_context(self.BULK_LOAD_URL)
+        self.request_context.push()
+        flask.g.is_admin = True
+
+    def tearDown(self):
+        super(ElasticSearchBulkLoadTests, self).tearDown()
+        self.request_context.pop()
+
+    @patch.object(BulkLoadMode, 'finish', return_value=['trustedanalytics-meta-v1'])
+    @patch.object(BulkLoadMode, 'start', return_value=['trustedanalytics-meta-v1'])
+    @patch.object(MetadataIndex, 'create_if_missing')
+    def test_postAndDelete_admin_loadStartedAndFinished(self, mock_create_if_missing,
+                                                        mock_start, mock_finish):
+        response = self.client.post(self.BULK_LOAD_URL)
+        self.assertEqual(200, response.status_code)
+        mock_create_if_missing.assert_called_once_with()
+        self.assertEqual({'indices': ['trustedanalytics-meta-v1']}, json.loads(response.data))
+        mock_start.assert_called_once_with()
+        self.assertFalse(mock_finish.called)
+
+        response = self.client.delete(self.BULK_LOAD_URL)
+        self.assertEqual(200, response.status_code)
+        mock_finish.assert_called_once_with()
+
+    @patch.object(BulkLoadMode, 'start')
+    def test_post_notAdmin_403Returned(self, mock_start):
+        flask.g.is_admin = False
+        self.assertEqual((None, 403), ElasticSearchBulkLoadResource().post())
+        self.assertFalse(mock_start.called)
+
+
+class ElasticSearchReindexTests(DataCatalogTestCase):
+
+    REINDEX_URL = '/rest/datasets/admin/elastic/reindex'
+
+    def setUp(self):
+        super(ElasticSearchReindexTests, self).setUp()
+        self.request_context = self.app.test_request_context(self.REINDEX_URL)
+        self.request_context.push()
+        flask.g.is_admin = True
+
+    def tearDown(self):
+        super(ElasticSearchReindexTests, self).tearDown()
+        self.request_context.pop()
+
+    @patch.object(ReindexJobs, 'start')
+    def test_post_admin_startedStatusReturned(self, mock_start):
+        mock_start.return_value = {'index': 'trustedanalytics-meta-v2', 'status': 'running'}
+        response = self.client.post(self.REINDEX_URL)
+        self.assertEqual(202, response.status_code)
+        self.assertEqual(mock_start.return_value, json.loads(response.data))
+        self.assertTrue(response.headers['Location'].endswith(
+            self.REINDEX_URL + '/trustedanalytics-meta-v2'))
+
+    @patch.object(ReindexJobs, 'start')
+    def test_post_notAdmin_403Returned(self, mock_start):
+        flask.g.is_admin = False
+        self.assertEqual((None, 403), ElasticSearchReindexResource().post())
+        self.assertFalse(mock_start.called)
+
+    @patch.object(ReindexJobs, 'get_status')
+    def test_getStatus_reindexStarted_statusReturned(self, mock_get_status):
+        mock_get_status.return_value = {'index': 'trustedanalytics-meta-v2', 'status': 'failed',
+                                        'error': 'Connection refused.'}
+        response = self.client.get(self.REINDEX_URL + '/trustedanalytics-meta-v2')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(mock_get_status.return_value, json.loads(response.data))
+        mock_get_status.assert_called_once_with('trustedanalytics-meta-v2')
+
+    @patch.object(ReindexJobs, 'get_status', side_effect=NotFoundError)
+    def test_getStatus_unknownReindex_404Returned(self, _):
+        response = self.client.get(self.REINDEX_URL + '/trustedanalytics-meta-v7')
+        self.assertEqual(404, response.status_code)
+
+    @patch.object(Reindexer, 'prepare')
+    def test_post_reindexRunning_409Returned(self, mock_prepare):
+        mock_prepare.side_effect = RequestError(400, 'IndexAlreadyExistsException')
+        response = self.client.post(self.REINDEX_URL)
+        self.assertEqual(409, response.status_code)
+        self.assertEqual(ElasticSearchReindexResource.CONFLICT_ERROR_MESSAGE,
+                         json.loads(response.data)['message'])
+
+
+@ddt
+class ElasticSearchSettingsTests(DataCatalogTestCase):
+
+    SETTINGS_URL = '/rest/datasets/admin/elastic/settings'
+
+    def setUp(self):
+        super(ElasticSearchSettingsTests, self).setUp()
+        self._mock_es = MagicMock()
+        patcher = patch('data_catalog.elastic_admin.create_elastic_search',
+                        return_value=self._mock_es)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.request_context = self.app.test_request_context(self.SETTINGS_URL)
+        self.request_context.push()
+        flask.g.is_admin = True
+
+    def tearDown(self):
+        super(ElasticSearchSettingsTests, self).tearDown()
+        self.request_context.pop()
+
+    def test_get_admin_indexAndConfiguredSettingsReturned(self):
+        self._mock_es.indices.get_settings.return_value = {
+            'trustedanalytics-meta-v1': {'settings': {'index.number_of_shards': '5',
+                                                      'index.number_of_replicas': '1'}}}
+
+        response = self.client.get(self.SETTINGS_URL)
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({
+            'indices': {'trustedanalytics-meta-v1': {'numberOfShards': 5,
+                                                     'numberOfReplicas': 1}},
+            'configured': {'numberOfShards': 5, 'numberOfReplicas': 1, 'refreshInterval': '1s'}
+        }, json.loads(response.data))
+
+    def test_put_newReplicas_dynamicSettingsApplied(self):
+        response = self.client.put(self.SETTINGS_URL, data=json.dumps({'numberOfReplicas': 2}))
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({'numberOfReplicas': 2, 'refreshInterval': '1s'},
+                         json.loads(response.data))
+        self._mock_es.indices.put_settings.assert_called_once_with(
+            index=self._config.elastic.elastic_index,
+            body={'index.number_of_replicas': 2, 'index.refresh_interval': '1s'})
+
+    def test_put_noBody_configuredSettingsApplied(self):
+        response = self.client.put(self.SETTINGS_URL)
+        self.assertEqual(200, response.status_code)
+        self._mock_es.indices.put_settings.assert_called_once_with(
+            index=self._config.elastic.elastic_index,
+            body={'index.number_of_replicas': 1, 'index.refresh_interval': '1s'})
+
+    @data({'numberOfShards': 10},
+          {'numberOfReplicas': -1},
+          {'refreshInterval': 'often'})
+    def test_put_invalidSettings_400Returned(self, body):
+        response = self.client.put(self.SETTINGS_URL, data=json.dumps(body))
+        self.assertEqual(400, response.status_code)
+        self.assertFalse(self._mock_es.indices.put_settings.called)
+
+    def test_put_notAdmin_403Returned(self):
+        flask.g.is_admin = False
+        self.assertEqual((None, 403), ElasticSearchSettingsResource().put())
+
+
+if __name__ == '__main__':
+    unittest.main()
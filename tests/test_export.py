@@ -0,0 +1,149 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import unittest
+
+import flask
+from elasticsearch.exceptions import RequestError, ConnectionError
+from mock import patch, MagicMock
+
+from data_catalog.export import DataSetExport, DataSetExportResource
+from data_catalog.search import InvalidQueryError, IndexConnectionError
+from tests.base_test import DataCatalogTestCase
+
+
+class ExportTests(DataCatalogTestCase):
+
+    SCROLL_ID = 'fake-scroll-id'
+
+    def setUp(self):
+        super(ExportTests, self).setUp()
+        self._export_obj = DataSetExport()
+        self._export_obj._elastic_search.search = self._mock_es_search = MagicMock()
+        self._export_obj._elastic_search.scroll = self._mock_es_scroll = MagicMock()
+        self._export_obj._elastic_search.clear_scroll = self._mock_es_clear_scroll = MagicMock()
+        self.request_context = self.app.test_request_context('/rest/datasets/export')
+        self.request_context.push()
+
+    def tearDown(self):
+        super(ExportTests, self).tearDown()
+        self.request_context.pop()
+
+    def _page(self, *ids):
+        return {
+            '_scroll_id': self.SCROLL_ID,
+            'hits': {
+                'hits': [{'_id': entry_id, '_source': {'title': 'title ' + entry_id}}
+                         for entry_id in ids]
+            }
+        }
+
+    def test_export_manyPages_allHitsStreamedAndScrollCleared(self):
+        self._mock_es_search.return_value = self._page('1', '2')
+        self._mock_es_scroll.side_effect = [self._page('3'), self._page()]
+
+        lines = list(self._export_obj.export(None, ['org01'], None, False))
+
+        self.assertEqual(
+            [{'id': '1', 'title': 'title 1'},
+             {'id': '2', 'title': 'title 2'},
+             {'id': '3', 'title': 'title 3'}],
+            [json.loads(line) for line in lines])
+        self.assertTrue(all(line.endswith('\n') for line in lines))
+        self.assertEqual(2, self._mock_es_scroll.call_count)
+        self._mock_es_clear_scroll.assert_called_once_with(scroll_id=self.SCROLL_ID)
+
+    def test_export_queryTranslated_noAggregationsScrollStarted(self):
+        self._mock_es_search.return_value = self._page()
+
+        list(self._export_obj.export(None, ['org01'], None, False))
+
+        call_kwargs = self._mock_es_search.call_args[1]
+        self.assertEqual(DataSetExport.SCROLL_TIME, call_kwargs['scroll'])
+        self.assertEqual(DataSetExport.PAGE_SIZE, call_kwargs['body']['size'])
+        self.assertEqual(['_uid'], call_kwargs['body']['sort'])
+        self.assertNotIn('aggregations', call_kwargs['body'])
+
+    def test_export_afterId_onlyGreaterUidsSearched(self):
+        self._mock_es_search.return_value = self._page()
+
+        list(self._export_obj.export(None, ['org01'], None, False, after='id5'))
+
+        uid = '{}#id5'.format(self._config.elastic.elastic_metadata_type)
+        self.assertIn({'range': {'_uid': {'gt': uid}}},
+                      self._mock_es_search.call_args[1]['body']['query']['bool']['filter'])
+
+    def test_export_generatorClosedEarly_scrollCleared(self):
+        self._mock_es_search.return_value = self._page('1', '2')
+
+        lines = self._export_obj.export(None, ['org01'], None, False)
+        next(lines)
+        lines.close()
+
+        self._mock_es_clear_scroll.assert_called_once_with(scroll_id=self.SCROLL_ID)
+        self.assertFalse(self._mock_es_scroll.called)
+
+    def test_export_invalidQuery_invalidQueryErrorRaised(self):
+        self._mock_es_search.side_effect = RequestError
+        with self.assertRaises(InvalidQueryError):
+            self._export_obj.export(None, ['org01'], None, False)
+
+    def test_export_noIndexConnection_connectionErrorRaised(self):
+        self._mock_es_search.side_effect = ConnectionError
+        with self.assertRaises(IndexConnectionError):
+            self._export_obj.export(None, ['org01'], None, False)
+
+    @patch.object(DataSetExport, 'export')
+    def test_restExport_withQuery_ndjsonStreamed(self, mock_export):
+        flask.g.org_uuid_list = ['orgid001']
+        flask.g.is_admin = False
+        test_query = 'fake data catalog query'
+        mock_export.return_value = iter(['{"id": "1"}\n', '{"id": "2"}\n'])
+
+        response = self.client.get('/rest/datasets/export?query={}'.format(test_query))
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(DataSetExportResource.NDJSON_MIMETYPE, response.mimetype)
+        self.assertEqual('{"id": "1"}\n{"id": "2"}\n', response.data)
+        mock_export.assert_called_once_with(test_query, ['orgid001'], None, False, None)
+
+    @patch.object(DataSetExport, 'export')
+    def test_restExport_afterId_exportContinuedAfterId(self, mock_export):
+        flask.g.is_admin = True
+        mock_export.return_value = iter([])
+
+        self.client.get('/rest/datasets/export?after=id5')
+
+        self.assertEqual('id5', mock_export.call_args[0][4])
+
+    @patch.object(DataSetExport, 'export')
+    def test_restExport_invalidQuery_400Returned(self, mock_export):
+        flask.g.is_admin = False
+        mock_export.side_effect = InvalidQueryError
+        response = self.client.get('/rest/datasets/export?query=some_invalid_query')
+        self.assertEqual(400, response.status_code)
+
+    @patch.object(DataSetExport, 'export')
+    def test_restExport_noIndexConnection_500Returned(self, mock_export):
+        flask.g.is_admin = False
+        mock_export.side_effect = IndexConnectionError
+        response = self.client.get('/rest/datasets/export')
+        self.assertEqual(500, response.status_code)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,206 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import time
+import unittest
+
+import flask
+from elasticsearch import helpers
+from elasticsearch.exceptions import ConflictError, ConnectionError, NotFoundError, RequestError
+from mock import patch
+
+from data_catalog.bases import create_elastic_search
+from data_catalog.export import DataSetExport
+from data_catalog.metadata_entry import CFNotifier, MetadataIndexingTransformer
+from data_catalog.metadata_index import MetadataIndex
+from tests.base_test import DataCatalogTestCase
+from tests.fake_elastic_search import FakeElasticSearch
+
+
+def get_entry(number, **fields):
+    entry = {
+        'orgUUID': 'org0{}'.format(number % 2 + 1),
+        'category': ['health', 'finance', 'science'][number % 3],
+        'dataSample': 'some sample',
+        'format': 'csv' if number % 2 else 'json',
+        'recordCount': 13,
+        'size': 1000 * number,
+        'sourceUri': 'http://example.com/data/{}.csv'.format(number),
+        'targetUri': 'hdfs://nameservice1/org/{}/000000_1'.format(number),
+        'title': 'population census number {}'.format(number),
+        'isPublic': number % 2 == 0,
+        'creationTime': '2015-02-{:02d}T13:00:00'.format(number + 1)
+    }
+    entry.update(fields)
+    return entry
+
+
+class FakeElasticSearchTests(DataCatalogTestCase):
+
+    def setUp(self):
+        super(FakeElasticSearchTests, self).setUp()
+        self._fake_es = FakeElasticSearch()
+        self._fake_es.start()
+        self.addCleanup(self._fake_es.stop)
+        self._es = create_elastic_search(self._config.elastic)
+        self._index = self._config.elastic.elastic_index
+        self._type = self._config.elastic.elastic_metadata_type
+        MetadataIndex(self._es, self._config.elastic).create_if_missing()
+
+    def _index_entries(self, entries):
+        transformer = MetadataIndexingTransformer()
+        for number, entry in enumerate(entries):
+            transformer.transform(entry)
+            self._es.index(index=self._index, doc_type=self._type, id='entry-{}'.format(number),
+                           body=entry)
+
+    def test_documents_writtenAndRead_likeInElasticSearch(self):
+        response = self._es.index(index=self._index, doc_type=self._type, id='entry',
+                                  body={'title': 'old', 'orgUUID': 'org01'})
+        self.assertTrue(response['created'])
+        self._es.update(index=self._index, doc_type=self._type, id='entry',
+                        body={'doc': {'title': 'new'}})
+        self.assertEqual({'title': 'new', 'orgUUID': 'org01'},
+                         self._es.get(index=self._index, doc_type=self._type,
+                                      id='entry')['_source'])
+        self.assertFalse(self._es.index(index=self._index, doc_type=self._type, id='entry',
+                                        body={'title': 'newer'})['created'])
+        with self.assertRaises(ConflictError):
+            self._es.index(index=self._index, doc_type=self._type, id='entry',
+                           body={'title': 'stale'}, version=2)
+        with self.assertRaises(ConflictError):
+            self._es.delete(index=self._index, doc_type=self._type, id='entry', version=2)
+        self._es.delete(index=self._index, doc_type=self._type, id='entry', version=3)
+        with self.assertRaises(NotFoundError):
+            self._es.get(index=self._index, doc_type=self._type, id='entry')
+
+    def test_documents_routed_onlyFoundWithTheirRouting(self):
+        self._es.index(index=self._index, doc_type=self._type, id='entry', body={},
+                       routing='org01')
+        self._es.get(index=self._index, doc_type=self._type, id='entry', routing='org01')
+        with self.assertRaises(NotFoundError):
+            self._es.get(index=self._index, doc_type=self._type, id='entry', routing='org02')
+        self.assertEqual(0, self._es.search(index=self._index,
+                                            routing='org02')['hits']['total'])
+
+    def test_bulkAndScan_manyEntries_allReadAndScrollCleared(self):
+        helpers.bulk(self._es, ({'_index': self._index, '_type': self._type,
+                                 '_id': 'entry-{}'.format(number), '_source': get_entry(number)}
+                                for number in range(25)))
+        hits = list(helpers.scan(self._es, index=self._index, doc_type=self._type, size=10))
+        self.assertEqual(25, len(hits))
+        self.assertEqual(4, self._fake_es.requests['scroll'])
+        self.assertEqual(0, self._fake_es.open_scrolls)
+
+    def test_suggest_titlePrefix_visibleTitlesSuggested(self):
+        self._index_entries([get_entry(0), get_entry(1)])
+        response = self._es.suggest(index=self._index, body={'titles': {
+            'text': 'cens', 'completion': {'field': 'titleSuggest',
+                                           'context': {'visibility': ['public']}}}})
+        self.assertEqual(['population census number 0'],
+                         [option['text'] for option in response['titles'][0]['options']])
+
+    def test_indices_aliasSwapped_readThroughAlias(self):
+        indices = MetadataIndex(self._es, self._config.elastic)
+        self.assertEqual([self._index + '-v1'], indices.get_indices())
+        indices.create(self._index + '-v2')
+        indices.swap([self._index + '-v1'], self._index + '-v2')
+        self.assertEqual([self._index + '-v2'], indices.get_indices())
+        self.assertEqual(self._index + '-v3', indices.get_next_index_name())
+
+    def test_errors_unsupportedOrInvalidRequests_errorsRaised(self):
+        with self.assertRaises(RequestError):
+            self._es.indices.create(index=self._index + '-v1')
+        with self.assertRaises(RequestError):
+            self._es.search(index=self._index, body={'query': {'fuzzy': {'title': 'x'}}})
+        with self.assertRaises(NotFoundError):
+            self._es.search(index='missing-index')
+        self._fake_es.available = False
+        with self.assertRaises(ConnectionError):
+            self._es.search(index=self._index)
+
+    def test_latency_set_requestsDelayedAndCounted(self):
+        self._fake_es.latency = 0.02
+        self._fake_es.reset_counters()
+        start = time.time()
+        self._es.search(index=self._index)
+        self._es.count(index=self._index)
+        self.assertGreaterEqual(time.time() - start, 0.04)
+        self.assertEqual({'search': 1, 'count': 1}, dict(self._fake_es.requests))
+        self.assertEqual(2, self._fake_es.total_requests)
+
+
+class RoundTripTests(DataCatalogTestCase):
+
+    """
+    Checks how many requests to ElasticSearch the application's endpoints make.
+    """
+
+    def setUp(self):
+        super(RoundTripTests, self).setUp()
+        self._fake_es = FakeElasticSearch()
+        self._fake_es.start()
+        self.addCleanup(self._fake_es.stop)
+        MetadataIndex(create_elastic_search(self._config.elastic),
+                      self._config.elastic).create_if_missing()
+        notifier_patcher = patch.object(CFNotifier, 'notify')
+        notifier_patcher.start()
+        self.addCleanup(notifier_patcher.stop)
+        self.request_context = self.app.test_request_context('fake_path')
+        self.request_context.push()
+        self.addCleanup(self.request_context.pop)
+        flask.g.is_admin = False
+        flask.g.org_uuid_list = ['org01', 'org02']
+
+    def _put_entries(self, number):
+        for entry_number in range(number):
+            response = self.client.put('/rest/datasets/entry-{}'.format(entry_number),
+                                       data=json.dumps(get_entry(entry_number)))
+            self.assertEqual(201, response.status_code)
+
+    def test_putEntry_noOrgRouting_singleIndexRequest(self):
+        self._fake_es.reset_counters()
+        self._put_entries(1)
+        self.assertEqual({'index': 1}, dict(self._fake_es.requests))
+
+    def test_search_query_singleSearchRequest(self):
+        self._put_entries(4)
+        self._fake_es.reset_counters()
+
+        response = self.client.get('/rest/datasets',
+                                   query_string={'query': json.dumps({'query': 'census'})})
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(4, json.loads(response.data)['total'])
+        self.assertEqual({'search': 1}, dict(self._fake_es.requests))
+
+    def test_export_manyPages_scrolledAndCleared(self):
+        self._put_entries(5)
+        self._fake_es.reset_counters()
+
+        with patch.object(DataSetExport, 'PAGE_SIZE', 2):
+            response = self.client.get('/rest/datasets/export')
+            lines = response.data.splitlines()
+
+        self.assertEqual(5, len(lines))
+        self.assertEqual({'search': 1, 'scroll': 3, 'clear_scroll': 1},
+                         dict(self._fake_es.requests))
+        self.assertEqual(0, self._fake_es.open_scrolls)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,14 +15,19 @@
 #
 
 import json
+import os
 import unittest
+from datetime import datetime
 
 import flask
 from ddt import ddt, data, unpack
+from elasticsearch import Elasticsearch
+from elasticsearch.client import IndicesClient
 from mock import patch
 
+from data_catalog.configuration import ELASTIC_ORG_ROUTING
 from data_catalog.dataset_delete import DataSetRemover
-from data_catalog.metadata_entry import (MetadataIndexingTransformer, Elasticsearch,
+from data_catalog.metadata_entry import (MetadataIndexingTransformer,
                                          InvalidEntryError, NotFoundError, ConnectionError,
                                          CFNotifier, MetadataEntryResource)
 from tests.base_test import DataCatalogTestCase
@@ -36,9 +41,17 @@ class MetadataEntryTests(DataCatalogTestCase):
     ORG_UUID_FIELD = 'orgUUID'
     AUTH_TOKEN = 'authorization-token'
     IS_PUBLIC_FIELD = 'isPublic'
+    VISIBLE_TO_FIELD = 'visibleTo'
+    TITLE_SUGGEST_FIELD = 'titleSuggest'
+    INDEXED_AT_FIELD = 'indexedAt'
+    INDEXED_AT = '2016-03-01T12:00:00'
 
     def setUp(self):
         super(MetadataEntryTests, self).setUp()
+        time_patcher = patch('data_catalog.metadata_entry.CURRENT_UTC_TIME_FUNCTION',
+                             return_value=datetime(2016, 3, 1, 12))
+        time_patcher.start()
+        self.addCleanup(time_patcher.stop)
         # TODO: refactor of tests so they do not need a full metadata entry
         self.test_entry = {
             '_source': {
@@ -68,7 +81,11 @@ class MetadataEntryTests(DataCatalogTestCase):
                 'targetUri': 'hdfs://6.6.6.6:8200/borker/long-long-hash/9213-154b-a0b9/00000_1',
                 'title': 'a great title',
                 'isPublic': True,
-                self.CREATION_TIME_FIELD: '2015-02-13T13:00:00'
+                self.CREATION_TIME_FIELD: '2015-02-13T13:00:00',
+                self.VISIBLE_TO_FIELD: ['org02', 'public'],
+                self.TITLE_SUGGEST_FIELD: self._get_title_suggest('a great title',
+                                                                  ['org02', 'public', 'all']),
+                self.INDEXED_AT_FIELD: self.INDEXED_AT
             }
         }
 
@@ -89,6 +106,15 @@ class MetadataEntryTests(DataCatalogTestCase):
         super(MetadataEntryTests, self).tearDown()
         self.request_context.pop()
 
+    @staticmethod
+    def _get_title_suggest(title, visibility):
+        words = title.split()
+        return {
+            'input': [' '.join(words[position:]) for position in range(len(words))],
+            'output': title,
+            'context': {'visibility': visibility}
+        }
+
     @patch.object(CFNotifier, 'notify')
     @patch.object(Elasticsearch, 'index')
     def test_insertEntry_newEntry_entryCreated(self, mock_es_index, mock_notifier):
@@ -219,7 +245,12 @@ class MetadataEntryTests(DataCatalogTestCase):
     @patch.object(DataSetRemover, 'delete_public_from_hive')
     @patch.object(MetadataEntryResource, '_get_token_from_request', return_value=AUTH_TOKEN)
     def test_changeField_dataSetExists_FieldUpdated(self, mock_get_token, mock_dataset_remover, mock_update_method, mock_get_method, mock_notifier):
-        proper_update_request = {'doc': {self.IS_PUBLIC_FIELD: self.test_entry_index['_source'][self.IS_PUBLIC_FIELD]}}
+        mock_get_method.return_value = self.test_entry
+        proper_update_request = {'doc': {
+            self.IS_PUBLIC_FIELD: self.test_entry_index['_source'][self.IS_PUBLIC_FIELD],
+            self.VISIBLE_TO_FIELD: self.test_entry_index['_source'][self.VISIBLE_TO_FIELD],
+            self.TITLE_SUGGEST_FIELD: self.test_entry_index['_source'][self.TITLE_SUGGEST_FIELD],
+            self.INDEXED_AT_FIELD: self.INDEXED_AT}}
         response = self.client.post(
             self.TEST_ENTRY_URL,
             data=json.dumps(self.TEST_BODY))
@@ -241,6 +272,7 @@ class MetadataEntryTests(DataCatalogTestCase):
     @patch.object(DataSetRemover, 'delete_public_from_hive')
     @patch.object(MetadataEntryResource, '_get_token_from_request', return_value=AUTH_TOKEN)
     def test_change_noDataSet_404Returned(self, mock_get_token, mock_dataset_remover, mock_update_method, mock_get_method, mock_notifier):
+        mock_get_method.return_value = self.test_entry
         mock_update_method.side_effect = NotFoundError()
         response = self.client.post(
             self.TEST_ENTRY_URL,
@@ -257,6 +289,7 @@ class MetadataEntryTests(DataCatalogTestCase):
     @patch.object(Elasticsearch, 'update')
     @patch.object(DataSetRemover, 'delete_public_from_hive')
     def test_changeField_internalError_503Returned(self, mock_dataset_remover, mock_update_method, mock_get_method, mock_notifier):
+        mock_get_method.return_value = self.test_entry
         mock_update_method.side_effect = ConnectionError()
         response = self.client.post(
             self.TEST_ENTRY_URL,
@@ -264,6 +297,153 @@ class MetadataEntryTests(DataCatalogTestCase):
         self.assertEqual(503, response.status_code)
         self.assertTrue(mock_notifier.called)
 
+    @patch.object(CFNotifier, 'notify')
+    @patch.object(Elasticsearch, 'get')
+    @patch.object(Elasticsearch, 'update')
+    @patch.object(DataSetRemover, 'delete_public_from_hive')
+    @patch.object(MetadataEntryResource, '_get_token_from_request', return_value=AUTH_TOKEN)
+    def test_changeField_madePrivate_visibleToUpdated(self, mock_get_token, mock_dataset_remover, mock_update_method, mock_get_method, mock_notifier):
+        mock_get_method.return_value = self.test_entry
+        response = self.client.post(
+            self.TEST_ENTRY_URL,
+            data=json.dumps({self.IS_PUBLIC_FIELD: False}))
+        self.assertEqual(200, response.status_code)
+        mock_update_method.assert_called_with(
+            index=self._config.elastic.elastic_index,
+            doc_type=self._config.elastic.elastic_metadata_type,
+            id=self.TEST_DATA_SET_ID,
+            body={'doc': {
+                self.IS_PUBLIC_FIELD: False,
+                self.VISIBLE_TO_FIELD: ['org02'],
+                self.TITLE_SUGGEST_FIELD: self._get_title_suggest('a great title', ['org02', 'all']),
+                self.INDEXED_AT_FIELD: self.INDEXED_AT
+            }})
+
+    @patch.object(CFNotifier, 'notify')
+    @patch.object(Elasticsearch, 'get')
+    @patch.object(Elasticsearch, 'update')
+    def test_changeField_otherField_visibleToNotUpdated(self, mock_update_method, mock_get_method, mock_notifier):
+        mock_get_method.return_value = self.test_entry
+        response = self.client.post(
+            self.TEST_ENTRY_URL,
+            data=json.dumps({'category': 'science'}))
+        self.assertEqual(200, response.status_code)
+        mock_update_method.assert_called_with(
+            index=self._config.elastic.elastic_index,
+            doc_type=self._config.elastic.elastic_metadata_type,
+            id=self.TEST_DATA_SET_ID,
+            body={'doc': {'category': 'science', self.INDEXED_AT_FIELD: self.INDEXED_AT}})
+
+    @patch.object(CFNotifier, 'notify')
+    @patch.object(Elasticsearch, 'get')
+    @patch.object(Elasticsearch, 'update')
+    def test_changeField_title_titleSuggestUpdated(self, mock_update_method, mock_get_method, mock_notifier):
+        mock_get_method.return_value = self.test_entry
+        response = self.client.post(
+            self.TEST_ENTRY_URL,
+            data=json.dumps({'title': 'a better title'}))
+        self.assertEqual(200, response.status_code)
+        mock_update_method.assert_called_with(
+            index=self._config.elastic.elastic_index,
+            doc_type=self._config.elastic.elastic_metadata_type,
+            id=self.TEST_DATA_SET_ID,
+            body={'doc': {
+                'title': 'a better title',
+                self.VISIBLE_TO_FIELD: ['org02', 'public'],
+                self.TITLE_SUGGEST_FIELD: self._get_title_suggest('a better title',
+                                                                  ['org02', 'public', 'all']),
+                self.INDEXED_AT_FIELD: self.INDEXED_AT
+            }})
+
+    @patch.object(CFNotifier, 'notify')
+    @patch.object(IndicesClient, 'refresh')
+    @patch.object(Elasticsearch, 'search')
+    @patch.object(Elasticsearch, 'mget')
+    @patch.object(Elasticsearch, 'delete')
+    @patch.object(Elasticsearch, 'index')
+    def test_insertEntry_orgRoutingSameOrg_entryIndexedWithoutSearch(self, mock_es_index, mock_es_delete, mock_es_mget, mock_es_search, mock_es_refresh, mock_notifier):
+        os.environ[ELASTIC_ORG_ROUTING] = 'true'
+        mock_es_index.return_value = {'created': False}
+        mock_es_mget.return_value = {'docs': [
+            dict(self.test_entry, _id=self.TEST_DATA_SET_ID, found=True)]}
+        response = self.client.put(
+            self.TEST_ENTRY_URL,
+            data=json.dumps(self.test_entry['_source']))
+        self.assertEqual(200, response.status_code)
+        mock_es_index.assert_called_with(routing='org02', **self.index_args)
+        # the stored entry is read in realtime from the entry's organisation shard
+        self.assertEqual([{'_id': self.TEST_DATA_SET_ID, '_routing': 'org02'}],
+                         mock_es_mget.call_args[1]['body']['docs'])
+        self.assertFalse(mock_es_search.called)
+        self.assertFalse(mock_es_delete.called)
+        self.assertFalse(mock_es_refresh.called)
+
+    @patch.object(CFNotifier, 'notify')
+    @patch.object(IndicesClient, 'refresh')
+    @patch.object(Elasticsearch, 'get')
+    @patch.object(Elasticsearch, 'search')
+    @patch.object(Elasticsearch, 'mget')
+    @patch.object(Elasticsearch, 'delete')
+    @patch.object(Elasticsearch, 'index')
+    def test_insertEntry_orgChangedWithRouting_oldCopyDeleted(self, mock_es_index, mock_es_delete, mock_es_mget, mock_es_search, mock_es_get, mock_es_refresh, mock_notifier):
+        os.environ[ELASTIC_ORG_ROUTING] = 'true'
+        mock_es_index.return_value = {'created': False}
+        mock_es_mget.return_value = {'docs': [{'_id': self.TEST_DATA_SET_ID, 'found': False}]}
+        mock_es_search.return_value = {
+            'hits': {'hits': [{'_id': self.TEST_DATA_SET_ID, '_source': {'orgUUID': 'org01'}}]}}
+        mock_es_get.return_value = {'_id': self.TEST_DATA_SET_ID, 'found': True,
+                                    '_source': {'orgUUID': 'org01'}}
+        response = self.client.put(
+            self.TEST_ENTRY_URL,
+            data=json.dumps(self.test_entry['_source']))
+        self.assertEqual(200, response.status_code)
+        mock_es_delete.assert_called_once_with(routing='org01', ignore=404, **self.get_args)
+        self.assertFalse(mock_es_refresh.called)
+
+    @patch.object(CFNotifier, 'notify')
+    @patch.object(IndicesClient, 'refresh')
+    @patch.object(Elasticsearch, 'get')
+    @patch.object(Elasticsearch, 'search')
+    @patch.object(Elasticsearch, 'delete')
+    @patch.object(Elasticsearch, 'index')
+    def test_changeField_orgChangedWithRouting_entryMoved(self, mock_es_index, mock_es_delete, mock_es_search, mock_es_get, mock_es_refresh, mock_notifier):
+        os.environ[ELASTIC_ORG_ROUTING] = 'true'
+        mock_es_search.return_value = {
+            'hits': {'hits': [dict(self.test_entry, _id=self.TEST_DATA_SET_ID)]}}
+        mock_es_get.return_value = dict(self.test_entry, _id=self.TEST_DATA_SET_ID, found=True)
+        response = self.client.post(
+            self.TEST_ENTRY_URL,
+            data=json.dumps({self.ORG_UUID_FIELD: 'org03'}))
+        self.assertEqual(200, response.status_code)
+        moved_entry = dict(self.test_entry_index['_source'])
+        moved_entry[self.ORG_UUID_FIELD] = 'org03'
+        moved_entry[self.VISIBLE_TO_FIELD] = ['org03', 'public']
+        moved_entry[self.TITLE_SUGGEST_FIELD] = self._get_title_suggest(
+            'a great title', ['org03', 'public', 'all'])
+        mock_es_index.assert_called_once_with(routing='org03', body=moved_entry, **self.get_args)
+        mock_es_delete.assert_called_once_with(routing='org02', **self.get_args)
+        # the entry is read in realtime from its shard, the search only tells which one it is
+        mock_es_get.assert_called_with(routing='org02', **self.get_args)
+
+    @patch.object(Elasticsearch, 'search')
+    @patch.object(Elasticsearch, 'mget')
+    def test_getEntry_routingEnabled_entryReadFromUserOrgShards(self, mock_es_mget, mock_es_search):
+        os.environ[ELASTIC_ORG_ROUTING] = 'true'
+        flask.g.is_admin = False
+        flask.g.org_uuid_list = ['org01', 'org02']
+        mock_es_mget.return_value = {'docs': [
+            {'_id': self.TEST_DATA_SET_ID, 'found': False},
+            dict(self.test_entry, _id=self.TEST_DATA_SET_ID, found=True)]}
+        response = self.client.get(self.TEST_ENTRY_URL)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(self.test_entry['_source'], json.loads(response.data)['_source'])
+        mock_es_mget.assert_called_with(
+            index=self._config.elastic.elastic_index,
+            doc_type=self._config.elastic.elastic_metadata_type,
+            body={'docs': [{'_id': self.TEST_DATA_SET_ID, '_routing': 'org01'},
+                           {'_id': self.TEST_DATA_SET_ID, '_routing': 'org02'}]})
+        self.assertFalse(mock_es_search.called)
+
     def test_changeField_badInput_400Returned(self):
         response = self.client.post(
             self.TEST_ENTRY_URL,
@@ -278,9 +458,15 @@ class MetadataEntryTransformationTests(DataCatalogTestCase):
     CATEGORY_FIELD = 'category'
     TARGET_URI_FIELD = 'targetUri'
     ORG_UUID_FIELD = 'orgUUID'
+    VISIBLE_TO_FIELD = 'visibleTo'
+    INDEXED_AT_FIELD = 'indexedAt'
 
     def setUp(self):
         super(MetadataEntryTransformationTests, self).setUp()
+        time_patcher = patch('data_catalog.metadata_entry.CURRENT_UTC_TIME_FUNCTION',
+                             return_value=datetime(2016, 3, 1, 12))
+        time_patcher.start()
+        self.addCleanup(time_patcher.stop)
         self.org_uuid = 'org01'
         self.test_entry = {
             self.CATEGORY_FIELD: 'health',
@@ -307,7 +493,14 @@ class MetadataEntryTransformationTests(DataCatalogTestCase):
             'title': 'a great title',
             'isPublic': True,
             self.CREATION_TIME_FIELD: '2015-02-13T13:00:00',
-            self.ORG_UUID_FIELD: self.org_uuid
+            self.ORG_UUID_FIELD: self.org_uuid,
+            self.VISIBLE_TO_FIELD: [self.org_uuid, 'public'],
+            'titleSuggest': {
+                'input': ['a great title', 'great title', 'title'],
+                'output': 'a great title',
+                'context': {'visibility': [self.org_uuid, 'public', 'all']}
+            },
+            self.INDEXED_AT_FIELD: '2016-03-01T12:00:00'
         }
         self.parser = MetadataIndexingTransformer()
 
@@ -318,6 +511,17 @@ class MetadataEntryTransformationTests(DataCatalogTestCase):
             self.test_entry_index,
             self.test_entry)
 
+    def test_entryTransformation_privateEntryWithStaleVisibleTo_visibleToComputed(self):
+        self.test_entry['isPublic'] = False
+        self.test_entry[self.VISIBLE_TO_FIELD] = ['other-org', 'public']
+        self.parser.transform(self.test_entry)
+        self.assertEqual([self.org_uuid], self.test_entry[self.VISIBLE_TO_FIELD])
+
+    def test_entryTransformation_exportedEntryWithIndexingTime_indexingTimeUpdated(self):
+        self.test_entry[self.INDEXED_AT_FIELD] = '2015-01-01T00:00:00'
+        self.parser.transform(self.test_entry)
+        self.assertEqual('2016-03-01T12:00:00', self.test_entry[self.INDEXED_AT_FIELD])
+
     def test_entryTransformation_invalidEntryURIs_raisesInvalidEntryError(self):
         def check_raises_for_url(url):
             self.test_entry[self.TARGET_URI_FIELD] = url
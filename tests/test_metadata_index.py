@@ -0,0 +1,303 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+from datetime import datetime
+
+from elasticsearch.exceptions import ConnectionError, NotFoundError, RequestError
+from mock import MagicMock, patch
+
+from data_catalog.bulk_import import BulkImporter, BulkLoadMode
+from data_catalog.metadata_index import MetadataIndex, Reindexer, ReindexJobs
+from tests.base_test import DataCatalogTestCase
+
+
+class MetadataIndexTests(DataCatalogTestCase):
+
+    def setUp(self):
+        super(MetadataIndexTests, self).setUp()
+        self._mock_es = MagicMock()
+        self._index = MetadataIndex(self._mock_es, self._config.elastic)
+        self._alias = self._config.elastic.elastic_index
+
+    def test_getIndices_alias_indicesReturned(self):
+        self._mock_es.indices.get_alias.return_value = {
+            self._alias + '-v2': {'aliases': {self._alias: {}}},
+            self._alias + '-v1': {'aliases': {self._alias: {}}}
+        }
+        self.assertEqual([self._alias + '-v1', self._alias + '-v2'], self._index.get_indices())
+
+    def test_getIndices_indexWithoutAlias_indexReturned(self):
+        self._mock_es.indices.get_alias.side_effect = NotFoundError
+        self._mock_es.indices.exists.return_value = True
+        self.assertEqual([self._alias], self._index.get_indices())
+
+    def test_getNextIndexName_versionsExist_nextVersionReturned(self):
+        self._mock_es.indices.get_settings.return_value = {
+            self._alias + '-v1': {}, self._alias + '-v3': {}, self._alias + '-vintage': {}}
+        self.assertEqual(self._alias + '-v4', self._index.get_next_index_name())
+
+    def test_getNextIndexName_noVersions_firstVersionReturned(self):
+        self._mock_es.indices.get_settings.return_value = {}
+        self.assertEqual(self._alias + '-v1', self._index.get_next_index_name())
+
+    def test_createIfMissing_noAlias_firstVersionCreatedWithAlias(self):
+        self._mock_es.indices.exists.return_value = False
+        self._index.create_if_missing()
+        index_setup = dict(self._config.elastic.metadata_index_setup)
+        index_setup['aliases'] = {self._alias: {}}
+        self._mock_es.indices.create.assert_called_once_with(index=self._alias + '-v1',
+                                                             body=index_setup)
+
+    def test_createIfMissing_createdByOtherWorker_errorIgnored(self):
+        self._mock_es.indices.exists.return_value = False
+        self._mock_es.indices.create.side_effect = RequestError(400, 'IndexAlreadyExistsException')
+        self._index.create_if_missing()
+
+    def test_createIfMissing_otherError_errorRaised(self):
+        self._mock_es.indices.exists.return_value = False
+        self._mock_es.indices.create.side_effect = RequestError(400, 'MapperParsingException')
+        with self.assertRaises(RequestError):
+            self._index.create_if_missing()
+
+    def test_swap_versionedIndex_aliasMovedAtomically(self):
+        self._index.swap([self._alias + '-v1'], self._alias + '-v2')
+        self._mock_es.indices.update_aliases.assert_called_once_with(body={'actions': [
+            {'remove': {'index': self._alias + '-v1', 'alias': self._alias}},
+            {'add': {'index': self._alias + '-v2', 'alias': self._alias}}
+        ]})
+        self.assertFalse(self._mock_es.indices.delete.called)
+
+    def test_swap_indexWithoutAlias_indexDeletedBeforeAdding(self):
+        self._index.swap([self._alias], self._alias + '-v1')
+        self._mock_es.indices.delete.assert_called_once_with(index=self._alias)
+        self._mock_es.indices.update_aliases.assert_called_once_with(body={'actions': [
+            {'add': {'index': self._alias + '-v1', 'alias': self._alias}}
+        ]})
+
+
+class ReindexerTests(DataCatalogTestCase):
+
+    def setUp(self):
+        super(ReindexerTests, self).setUp()
+        self._alias = self._config.elastic.elastic_index
+        self._source = self._alias + '-v1'
+        self._target = self._alias + '-v2'
+        self._mock_es = MagicMock()
+        self._mock_es.indices.get_alias.return_value = {self._source: {}}
+        self._mock_es.indices.get_settings.return_value = {self._source: {}}
+        self._source_hits = [self._get_hit('entry-1', '2016-03-01T10:00:00'),
+                             self._get_hit('entry-2', '2016-03-01T10:00:00')]
+        self._changed_hits = [self._get_hit('entry-2', '2016-03-01T12:00:00')]
+        self._target_hits = self._source_hits + [self._get_hit('deleted', '2016-03-01T10:00:00')]
+        self._sent_actions = []
+        self._config.bulk_import.bulk_load_mode = False
+        self._reindexer = Reindexer(self._mock_es, self._config.elastic, self._config.bulk_import)
+        self._deletes_index = self._alias + '-reindex-deletes'
+
+    @staticmethod
+    def _get_hit(entry_id, indexed_at):
+        return {'_id': entry_id, '_source': {'orgUUID': 'org01', 'indexedAt': indexed_at}}
+
+    def _fake_scan(self, _, query, index, **__):
+        if index == self._target:
+            indexed_before = query['query'].get('range', {}).get('indexedAt', {}).get('lt')
+            return iter([hit for hit in self._target_hits if indexed_before is None
+                         or hit['_source']['indexedAt'] < indexed_before])
+        if 'range' in query['query']:
+            return iter(self._changed_hits)
+        return iter(self._source_hits)
+
+    def _fake_index_actions(self, actions):
+        actions = list(actions)
+        self._sent_actions.append(actions)
+        deleted_ids = [action['_id'] for action in actions if action.get('_op_type') == 'delete']
+        self._target_hits = [hit for hit in self._target_hits if hit['_id'] not in deleted_ids]
+        return {'indexed': len(actions), 'failed': 0}
+
+    def _reindex(self):
+        with patch('data_catalog.metadata_index.helpers.scan', side_effect=self._fake_scan), \
+                patch.object(BulkImporter, 'index_actions', autospec=True,
+                             side_effect=lambda _, actions: self._fake_index_actions(actions)), \
+                patch('data_catalog.metadata_entry.CURRENT_UTC_TIME_FUNCTION',
+                      return_value=datetime(2016, 3, 1, 11)):
+            return self._reindexer.reindex()
+
+    def test_reindex_versionedIndex_entriesCopiedAndAliasSwapped(self):
+        self._mock_es.get.return_value = {'_source': {'indexedAt': '2016-03-01T10:00:00'}}
+
+        summary = self._reindex()
+
+        self.assertEqual({'index': self._target, 'previousIndices': [self._source],
+                          'copied': 2, 'caughtUp': 2, 'removed': 1, 'failed': 0}, summary)
+        copy, catch_up, removal, last_catch_up, last_removal = self._sent_actions
+        self.assertEqual({'_index': self._target, '_type': 'dataset', '_id': 'entry-1',
+                          '_source': self._source_hits[0]['_source']}, copy[0])
+        self.assertEqual(['entry-2'], [action['_id'] for action in catch_up])
+        self.assertEqual([{'_op_type': 'delete', '_index': self._target, '_type': 'dataset',
+                           '_id': 'deleted'}], removal)
+        self.assertEqual(['entry-2'], [action['_id'] for action in last_catch_up])
+        self.assertEqual([], last_removal)
+        self._mock_es.indices.create.assert_any_call(
+            index=self._target, body=self._config.elastic.metadata_index_setup)
+        self._mock_es.indices.update_aliases.assert_called_once_with(body={'actions': [
+            {'remove': {'index': self._source, 'alias': self._alias}},
+            {'add': {'index': self._target, 'alias': self._alias}}
+        ]})
+        self._mock_es.indices.delete.assert_any_call(index=self._source, ignore=404)
+        # deletes are recorded only while the reindex runs
+        self._mock_es.indices.delete.assert_called_with(index=self._deletes_index, ignore=404)
+
+    def test_reindex_newerEntryInTargetAfterSwap_entryNotOverwritten(self):
+        self._mock_es.get.return_value = {'_source': {'indexedAt': '2016-03-01T12:30:00'}}
+        self._reindex()
+        self.assertEqual([], self._sent_actions[-2])
+        self._mock_es.indices.refresh.assert_any_call(index=self._target)
+
+    def test_reindex_entryDeletedAfterSwap_entryNotCopiedBack(self):
+        self._changed_hits = [self._get_hit('entry-2', '2016-03-01T12:00:00'),
+                              self._get_hit('entry-3', '2016-03-01T12:00:00')]
+        # entry-3 was deleted and created again, before the swap
+        deleted_at = {'entry-2': '2016-03-01T12:30:00', 'entry-3': '2016-03-01T11:30:00'}
+
+        def get(index, id, **_):  # pylint: disable=redefined-builtin
+            if index == self._deletes_index:
+                return {'found': True, '_source': {'deletedAt': deleted_at[id]}}
+            raise NotFoundError(404, 'Missing.')
+        self._mock_es.get.side_effect = get
+
+        self._reindex()
+
+        self.assertEqual(['entry-3'], [action['_id'] for action in self._sent_actions[-2]])
+        self._mock_es.indices.create.assert_any_call(
+            index=self._deletes_index, body={'settings': {'number_of_shards': 1}})
+
+    def test_reindex_entriesChangedAroundSwap_deletedOnlyIfDeletedFromSource(self):
+        self._mock_es.get.return_value = {'_source': {'indexedAt': '2016-03-01T10:00:00'}}
+
+        def swap(**_):
+            # entry-1 is deleted right before the swap and another one created right after it
+            self._source_hits = self._source_hits[1:]
+            self._target_hits.append(self._get_hit('new', '2016-03-01T11:00:00'))
+        self._mock_es.indices.update_aliases.side_effect = swap
+
+        summary = self._reindex()
+
+        self.assertEqual(2, summary['removed'])
+        self.assertEqual(['entry-1'], [action['_id'] for action in self._sent_actions[-1]])
+
+    def test_reindex_copyFails_newIndexDeleted(self):
+        self._mock_es.indices.get_alias.side_effect = [{self._source: {}}, {self._source: {}}]
+        with patch('data_catalog.metadata_index.helpers.scan', side_effect=ConnectionError), \
+                self.assertRaises(ConnectionError):
+            self._reindexer.reindex()
+        self._mock_es.indices.delete.assert_any_call(index=self._target, ignore=404)
+        self.assertFalse(self._mock_es.indices.update_aliases.called)
+
+    def test_reindex_orgRouting_copiesRouted(self):
+        self._config.elastic.org_routing = True
+        self._mock_es.search.return_value = {'hits': {'hits': []}}
+        self._reindex()
+        self.assertEqual('org01', self._sent_actions[0][0]['_routing'])
+        self.assertEqual('org01', self._sent_actions[2][0]['_routing'])
+        # the newer version in the new index is looked up on the organisation's shard
+        self.assertEqual([{'_id': 'entry-2', '_routing': 'org01'}],
+                         self._mock_es.mget.call_args[1]['body']['docs'])
+
+    def test_reindex_bulkLoadMode_settingsRestoredBeforeSwap(self):
+        self._config.bulk_import.bulk_load_mode = True
+        self._mock_es.indices.get_settings.side_effect = \
+            lambda index, **_: {self._source: {}} if index.endswith('*') \
+            else {self._target: {'settings': {'index.number_of_replicas': '2'}}}
+
+        def get(index, **_):
+            if not index.endswith(BulkLoadMode.SNAPSHOT_INDEX_SUFFIX):
+                return {'_source': {'indexedAt': '2016-03-01T10:00:00'}}
+            if not self._mock_es.index.called:
+                raise NotFoundError
+            return {'_version': 1, '_source': self._mock_es.index.call_args[1]['body']}
+        self._mock_es.get.side_effect = get
+
+        self._reindex()
+
+        settings_calls = self._mock_es.indices.put_settings.call_args_list
+        self.assertEqual(BulkLoadMode.BULK_LOAD_SETTINGS, settings_calls[0][1]['body'])
+        self.assertEqual({'index.refresh_interval': '1s', 'index.number_of_replicas': '2'},
+                         settings_calls[1][1]['body'])
+        self.assertEqual(self._target, settings_calls[1][1]['index'])
+
+    def test_reindex_noIndex_notFoundErrorRaised(self):
+        self._mock_es.indices.get_alias.side_effect = NotFoundError
+        self._mock_es.indices.exists.return_value = False
+        with self.assertRaises(NotFoundError):
+            self._reindex()
+        self.assertFalse(self._mock_es.indices.create.called)
+
+
+class ReindexJobsTests(DataCatalogTestCase):
+
+    def setUp(self):
+        super(ReindexJobsTests, self).setUp()
+        self._mock_es = MagicMock()
+        self._mock_reindexer = MagicMock()
+        self._mock_reindexer.prepare.return_value = (['meta-v1'], 'meta-v2')
+        self._jobs = ReindexJobs(self._mock_es, self._config.elastic, self._mock_reindexer)
+        self._status_index = self._config.elastic.elastic_index + '-reindex'
+
+    def _start(self):
+        with patch.object(ReindexJobs, '_run_in_background',
+                          side_effect=lambda function, *args: function(*args)), \
+                patch('data_catalog.metadata_entry.CURRENT_UTC_TIME_FUNCTION',
+                      return_value=datetime(2016, 3, 1, 11)):
+            return self._jobs.start()
+
+    def _get_saved_statuses(self):
+        return [call[1]['body']['status'] for call in self._mock_es.index.call_args_list]
+
+    def test_start_reindexSucceeds_finishedStatusWithSummarySaved(self):
+        self._mock_reindexer.copy.return_value = {'index': 'meta-v2', 'copied': 3}
+
+        status = self._start()
+
+        self.assertEqual('meta-v2', status['index'])
+        self.assertEqual(['running', 'finished'], self._get_saved_statuses())
+        saved = self._mock_es.index.call_args[1]
+        self.assertEqual((self._status_index, 'meta-v2'), (saved['index'], saved['id']))
+        self.assertEqual(3, saved['body']['copied'])
+        self.assertEqual('2016-03-01T11:00:00', saved['body']['finishedAt'])
+        self._mock_reindexer.copy.assert_called_once_with(['meta-v1'], 'meta-v2')
+
+    def test_start_reindexFails_failedStatusWithErrorSaved(self):
+        self._mock_reindexer.copy.side_effect = ConnectionError('N/A', 'Connection refused.', None)
+        self._start()
+        self.assertEqual(['running', 'failed'], self._get_saved_statuses())
+        self.assertIn('Connection refused.', self._mock_es.index.call_args[1]['body']['error'])
+
+    def test_start_newIndexExists_errorRaisedAndNothingSaved(self):
+        self._mock_reindexer.prepare.side_effect = RequestError(400, 'IndexAlreadyExists')
+        with self.assertRaises(RequestError):
+            self._start()
+        self.assertFalse(self._mock_es.index.called)
+
+    def test_getStatus_savedStatusReturned(self):
+        self._mock_es.get.return_value = {'_source': {'index': 'meta-v2', 'status': 'running'}}
+        self.assertEqual('running', self._jobs.get_status('meta-v2')['status'])
+        self._mock_es.get.assert_called_once_with(index=self._status_index, doc_type='status',
+                                                  id='meta-v2')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,265 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import atexit
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+
+import flask
+from elasticsearch import Transport
+from elasticsearch.exceptions import ConnectionError
+from mock import patch
+
+import data_catalog.app
+import data_catalog.metrics
+from data_catalog.auth import Security
+from data_catalog.metrics import (Metrics, measure_outbound_call, measure_stage,
+                                  start_request)
+from tests.base_test import DataCatalogTestCase
+
+
+class MetricsTests(unittest.TestCase):
+
+    def test_render_observedStages_cumulativeBucketsRendered(self):
+        metrics = Metrics()
+        metrics.observe_stage('/rest/datasets', 'GET', 'total', 0.02)
+        metrics.observe_stage('/rest/datasets', 'GET', 'total', 0.3)
+        metrics.observe_stage('/rest/datasets', 'GET', 'total', 20)
+
+        lines = metrics.render().splitlines()
+
+        labels = 'endpoint="/rest/datasets",method="GET",stage="total"'
+        name = Metrics.STAGE_DURATION
+        self.assertIn('# TYPE {} histogram'.format(name), lines)
+        self.assertIn('{}_bucket{{{},le="0.01"}} 0'.format(name, labels), lines)
+        self.assertIn('{}_bucket{{{},le="0.025"}} 1'.format(name, labels), lines)
+        self.assertIn('{}_bucket{{{},le="0.5"}} 2'.format(name, labels), lines)
+        self.assertIn('{}_bucket{{{},le="10.0"}} 2'.format(name, labels), lines)
+        self.assertIn('{}_bucket{{{},le="+Inf"}} 3'.format(name, labels), lines)
+        self.assertIn('{}_sum{{{}}} 20.32'.format(name, labels), lines)
+        self.assertIn('{}_count{{{}}} 3'.format(name, labels), lines)
+
+    def test_render_countersWithSpecialCharacters_labelsEscaped(self):
+        metrics = Metrics()
+        metrics.count_outbound_call('nats', 'error')
+        metrics.count_outbound_call('nats', 'error')
+        metrics.count_error('/rest/"data"\\sets', 'PUT', 400)
+
+        lines = metrics.render().splitlines()
+
+        self.assertIn('data_catalog_outbound_calls_total{service="nats",outcome="error"} 2',
+                      lines)
+        self.assertIn('data_catalog_request_errors_total'
+                      '{endpoint="/rest/\\"data\\"\\\\sets",method="PUT",status="400"} 1', lines)
+
+    def test_measureOutboundCall_failedAndNestedCalls_countedOnce(self):
+        metrics = Metrics()
+        app = flask.Flask(__name__)
+        with patch.object(data_catalog.metrics, 'metrics', metrics), \
+                app.test_request_context('/'):
+            with measure_outbound_call('elasticsearch'):
+                with measure_outbound_call('elasticsearch'):
+                    pass
+            with self.assertRaises(ConnectionError):
+                with measure_outbound_call('elasticsearch'):
+                    raise ConnectionError('N/A', 'Connection refused.', None)
+            with measure_outbound_call('user_management') as call:
+                call.failed = True
+            with measure_stage('serialization'):
+                with measure_stage('serialization'):
+                    pass
+
+            self.assertEqual(['elasticsearch', 'user_management', 'serialization'],
+                             list(flask.g.stage_durations))
+        lines = metrics.render().splitlines()
+        self.assertIn(
+            'data_catalog_outbound_calls_total{service="elasticsearch",outcome="success"} 1',
+            lines)
+        self.assertIn(
+            'data_catalog_outbound_calls_total{service="elasticsearch",outcome="error"} 1',
+            lines)
+        self.assertIn(
+            'data_catalog_outbound_calls_total{service="user_management",outcome="error"} 1',
+            lines)
+
+    # saves are made by the test, not by timers or at exit
+    @patch.object(atexit, 'register')
+    @patch.object(threading, 'Timer')
+    def test_render_sharedByProcesses_metricsSummed(self, timer_class, _):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        other_worker = Metrics()
+        other_worker.share(directory)
+        this_worker = Metrics()
+        this_worker.share(directory)
+        with patch.object(os, 'getpid', return_value=1):
+            other_worker.observe_stage('/rest/datasets', 'GET', 'total', 0.02)
+            other_worker.count_error('/rest/datasets', 'GET', 500)
+            other_worker.save()
+        this_worker.observe_stage('/rest/datasets', 'GET', 'total', 0.3)
+        this_worker.count_error('/rest/datasets', 'GET', 500)
+        # a save per worker is scheduled for all of the changes
+        self.assertEqual(2, timer_class.call_count)
+
+        lines = this_worker.render().splitlines()
+
+        labels = 'endpoint="/rest/datasets",method="GET",stage="total"'
+        name = Metrics.STAGE_DURATION
+        self.assertIn('{}_bucket{{{},le="0.025"}} 1'.format(name, labels), lines)
+        self.assertIn('{}_bucket{{{},le="0.5"}} 2'.format(name, labels), lines)
+        self.assertIn('{}_count{{{}}} 2'.format(name, labels), lines)
+        self.assertIn('data_catalog_request_errors_total'
+                      '{endpoint="/rest/datasets",method="GET",status="500"} 2', lines)
+
+        # this worker's file isn't counted twice
+        this_worker.save()
+        self.assertEqual(lines, this_worker.render().splitlines())
+
+    @patch.object(atexit, 'register')
+    @patch.object(threading, 'Timer')
+    def test_share_exitedWorkerPidReused_countersKeptAndFileFolded(self, _, __):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        exited_process = subprocess.Popen(['true'])
+        exited_process.wait()
+        this_worker = Metrics()
+        this_worker.share(directory)
+        errors_line = ('data_catalog_request_errors_total'
+                       '{endpoint="/rest/datasets",method="GET",status="500"} 2')
+        with patch.object(os, 'getpid', return_value=exited_process.pid):
+            exited_worker = Metrics()
+            exited_worker.share(directory)
+            exited_worker.count_error('/rest/datasets', 'GET', 500)
+            exited_worker.save()
+            time.sleep(0.002)
+            # a new worker got the PID
+            new_worker = Metrics()
+            new_worker.share(directory)
+            new_worker.count_error('/rest/datasets', 'GET', 500)
+            new_worker.save()
+
+        # the files don't collide and the exited worker's one is added to the base file
+        self.assertIn(errors_line, this_worker.render().splitlines())
+        worker_files = set(os.listdir(directory)) - {'metrics-base.json', 'metrics.lock'}
+        self.assertEqual(1, len(worker_files))
+        self.assertTrue(worker_files.pop().startswith('metrics-{}-'.format(exited_process.pid)))
+        self.assertTrue(os.path.exists(os.path.join(directory, 'metrics-base.json')))
+
+        # the new worker exited as well
+        Metrics().share(directory)
+        self.assertEqual(['metrics-base.json', 'metrics.lock'], sorted(os.listdir(directory)))
+        self.assertIn(errors_line, this_worker.render().splitlines())
+
+
+class MetricsAppTests(DataCatalogTestCase):
+
+    def setUp(self):
+        super(MetricsAppTests, self).setUp()
+        self._metrics = Metrics()
+        metrics_patcher = patch.object(data_catalog.metrics, 'metrics', self._metrics)
+        metrics_patcher.start()
+        self.addCleanup(metrics_patcher.stop)
+        # authentication is disabled by replacing all "before_request" functions
+        self.app.before_request_funcs[None].insert(0, start_request)
+        self.request_context = self.app.test_request_context('fake_path')
+        self.request_context.push()
+        self.addCleanup(self.request_context.pop)
+        flask.g.is_admin = True
+        flask.g.org_uuid_list = []
+
+    @patch.object(Transport, 'perform_request', return_value=(200, {'hits': {'total': 7}}))
+    def test_request_elasticSearchCalled_stagesInServerTimingAndMetrics(self, _):
+        response = self.client.get('/rest/datasets/count')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(7, json.loads(response.data))
+
+        server_timing = [part.strip().split(';')
+                         for part in response.headers['Server-Timing'].split(',')]
+        self.assertEqual(['elasticsearch', 'serialization', 'total'],
+                         [stage for stage, _ in server_timing])
+        self.assertTrue(all(duration.startswith('dur=') for _, duration in server_timing))
+
+        response = self.client.get('/metrics')
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.content_type.startswith('text/plain; version=0.0.4'))
+        lines = response.data.splitlines()
+        for stage in ('elasticsearch', 'serialization', 'total'):
+            self.assertIn('data_catalog_request_stage_duration_seconds_count{endpoint='
+                          '"/rest/datasets/count",method="GET",stage="' + stage + '"} 1', lines)
+        self.assertIn(
+            'data_catalog_outbound_calls_total{service="elasticsearch",outcome="success"} 1',
+            lines)
+
+    @patch.object(Transport, 'perform_request',
+                  side_effect=ConnectionError('N/A', 'Connection refused.', None))
+    def test_request_elasticSearchUnavailable_errorsCounted(self, _):
+        self.assertEqual(500, self.client.get('/rest/datasets/count').status_code)
+
+        lines = self._metrics.render().splitlines()
+        self.assertIn(
+            'data_catalog_outbound_calls_total{service="elasticsearch",outcome="error"} 1',
+            lines)
+        self.assertIn('data_catalog_request_errors_total'
+                      '{endpoint="/rest/datasets/count",method="GET",status="500"} 1', lines)
+
+    @patch.object(Transport, 'perform_request')
+    def test_request_streamedExport_scrollsMeasuredAfterStreaming(self, perform_request):
+        def respond(method, url, params=None, body=None):
+            if url.endswith('/_search'):
+                return 200, {'_scroll_id': 'scroll01',
+                             'hits': {'hits': [{'_id': 'entry01', '_source': {}}]}}
+            if method == 'GET':
+                time.sleep(0.05)
+                return 200, {'_scroll_id': 'scroll01', 'hits': {'hits': []}}
+            return 200, {}
+        perform_request.side_effect = respond
+
+        response = self.client.get('/rest/datasets/export')
+        self.assertEqual(200, response.status_code)
+        name = 'data_catalog_request_stage_duration_seconds'
+        labels = 'endpoint="/rest/datasets/export",method="GET",stage="{}"'
+        self.assertNotIn(name + '_count{' + labels.format('total') + '} 1',
+                         self._metrics.render().splitlines())
+
+        self.assertEqual('{"id":"entry01"}\n', response.data.replace(' ', ''))
+        response.close()
+
+        lines = self._metrics.render().splitlines()
+        self.assertIn(name + '_count{' + labels.format('total') + '} 1', lines)
+        self.assertIn(name + '_count{' + labels.format('elasticsearch') + '} 1', lines)
+        elastic_search_time = next(
+            float(line.split()[-1]) for line in lines
+            if line.startswith(name + '_sum{' + labels.format('elasticsearch')))
+        self.assertGreaterEqual(elastic_search_time, 0.05)
+        self.assertIn(
+            'data_catalog_outbound_calls_total{service="elasticsearch",outcome="success"} 3',
+            lines)
+
+    @patch.object(Security, '_get_token_verification_key')
+    def test_metrics_noAuthorization_notAuthenticated(self, _):
+        client = data_catalog.app._create_app(self._config).test_client()
+        self.assertEqual(200, client.get('/metrics').status_code)
+        self.assertEqual(401, client.get('/rest/datasets/count').status_code)
+
+
+if __name__ == '__main__':
+    unittest.main()
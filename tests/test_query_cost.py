@@ -0,0 +1,99 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+
+from mock import MagicMock
+
+from data_catalog.query_cost import estimate_cost, QueryAdmission, QueryRejectedError
+
+
+class QueryCostTests(unittest.TestCase):
+
+    def setUp(self):
+        self.es_query = {
+            'query': {
+                'bool': {
+                    'must': {
+                        'bool': {
+                            'should': [
+                                {'wildcard': {'title': {'value': '*zebra*', 'boost': 3}}},
+                                {'match': {'dataSample': {'query': 'zebra', 'boost': 2}}}
+                            ]
+                        }
+                    },
+                    'filter': [
+                        {'terms': {'visibleTo': ['org01', 'org02', 'public']}}
+                    ]
+                }
+            },
+            'post_filter': {'bool': {'filter': [{'term': {'format.raw': 'CSV'}}]}},
+            'aggregations': {
+                'categories': {'terms': {'size': 100, 'field': 'category.raw'}},
+                'formats': {'terms': {'field': 'format.raw'}}
+            },
+            'from': 10,
+            'size': 20
+        }
+        self.cost_config = MagicMock(max_size=1000, max_terms=100,
+                                     degrade_threshold=2000, reject_threshold=5000)
+        self.admission = QueryAdmission(self.cost_config)
+
+    def test_estimateCost_translatedQuery_componentsCounted(self):
+        cost = estimate_cost(self.es_query)
+
+        self.assertEqual(30, cost.hits)
+        self.assertEqual([5], cost.wildcard_lengths)
+        self.assertEqual(4, cost.terms)
+        self.assertEqual(2, cost.aggregations)
+        self.assertEqual(30 + 200 + 4 + 200, cost.score)
+
+    def test_estimateCost_noSize_defaultSizeCounted(self):
+        self.assertEqual(10, estimate_cost({'query': {'match_all': {}}}).hits)
+
+    def test_admit_cheapQuery_queryUnchanged(self):
+        admitted_query = self.admission.admit(dict(self.es_query))
+        self.assertEqual(self.es_query, admitted_query)
+
+    def test_admit_hugeSize_sizeClamped(self):
+        self.es_query['size'] = 100000
+        admitted_query = self.admission.admit(self.es_query)
+        self.assertEqual(1000, admitted_query['size'])
+        self.assertIn('aggregations', admitted_query)
+
+    def test_admit_expensiveQuery_aggregationsDropped(self):
+        self.es_query['query']['bool']['must']['bool']['should'][0]['wildcard']['title'] = '*z*'
+        self.es_query['size'] = 1000
+        admitted_query = self.admission.admit(self.es_query)
+        self.assertNotIn('aggregations', admitted_query)
+
+    def test_admit_tooExpensiveQuery_429Rejection(self):
+        self.es_query['size'] = 1000
+        self.cost_config.reject_threshold = 1000
+        with self.assertRaises(QueryRejectedError) as context:
+            self.admission.admit(self.es_query)
+        self.assertEqual(429, context.exception.status)
+
+    def test_admit_tooManyTerms_400Rejection(self):
+        self.es_query['query']['bool']['filter'][0]['terms']['visibleTo'] = \
+            ['org{}'.format(number) for number in range(200)]
+        with self.assertRaises(QueryRejectedError) as context:
+            self.admission.admit(self.es_query)
+        self.assertEqual(400, context.exception.status)
+
+
+if __name__ == '__main__':
+    unittest.main()
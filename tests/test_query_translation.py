@@ -14,8 +14,12 @@
 # limitations under the License.
 #
 
+import glob
 import json
+import os
 import unittest
+
+import pytest
 from ddt import ddt, data, unpack
 
 from data_catalog.query_translation import ElasticSearchQueryTranslator, \
@@ -30,22 +34,21 @@ class FilterExtractorTests(TestCase):
         self.filter_extractor = ElasticSearchFilterExtractor()
 
     # first uuids (list), then input filters (list),
-    # then output query filters (json)
+    # then output query filters (list of bool query's filter clauses)
     # then output post_filters (json)
     # then dataset_filtering value (True, False, None)
     example_singleFilter_org = (
         ['org-id-001'],
         [{'format': ['csv']}],
+        [
+            {'terms': {'visibleTo': ['org-id-001', 'public']}}
+        ],
         {
-            'or': [
-                {'term': {'orgUUID': 'org-id-001'}},
-                {'term': {'isPublic': 'true'}}
-            ]
-        },
-        {
-            'and': [
-                {'term': {'format': 'csv'}}
-            ]
+            'bool': {
+                'filter': [
+                    {'term': {'format.lowercase': 'csv'}}
+                ]
+            }
         },
         None
     )
@@ -53,15 +56,15 @@ class FilterExtractorTests(TestCase):
     example_singleFilter_onlyPublic = (
         ['org-id-001'],
         [{'format': ['csv']}],
+        [
+            {'term': {'isPublic': 'true'}}
+        ],
         {
-            'and': [
-                {'term': {'isPublic': 'true'}}
-            ]
-        },
-        {
-            'and': [
-                {'term': {'format': 'csv'}}
-            ]
+            'bool': {
+                'filter': [
+                    {'term': {'format.lowercase': 'csv'}}
+                ]
+            }
         },
         True
     )
@@ -69,16 +72,16 @@ class FilterExtractorTests(TestCase):
     example_singleFilter_onlyPrivate = (
         ['org-id-001'],
         [{'format': ['csv']}],
+        [
+            {'term': {'orgUUID': 'org-id-001'}},
+            {'term': {'isPublic': 'false'}}
+        ],
         {
-            'and': [
-                {'term': {'orgUUID': 'org-id-001'}},
-                {'term': {'isPublic': 'false'}}
-            ]
-        },
-        {
-            'and': [
-                {'term': {'format': 'csv'}}
-            ]
+            'bool': {
+                'filter': [
+                    {'term': {'format.lowercase': 'csv'}}
+                ]
+            }
         },
         False
     )
@@ -88,16 +91,15 @@ class FilterExtractorTests(TestCase):
         [
             {'category': ['health', 'finance']}
         ],
+        [
+            {'terms': {'visibleTo': ['org-id-002', 'public']}}
+        ],
         {
-            'or': [
-                {'term': {'orgUUID': 'org-id-002'}},
-                {'term': {'isPublic': 'true'}}
-            ]
-        },
-        {
-            'and': [
-                {'terms': {'category': ['health', 'finance']}}
-            ]
+            'bool': {
+                'filter': [
+                    {'terms': {'category.lowercase': ['health', 'finance']}}
+                ]
+            }
         },
         None
     )
@@ -107,15 +109,15 @@ class FilterExtractorTests(TestCase):
         [
             {'category': ['health', 'finance']}
         ],
+        [
+            {'term': {'isPublic': 'true'}}
+        ],
         {
-            'and': [
-                {'term': {'isPublic': 'true'}}
-            ]
-        },
-        {
-            'and': [
-                {'terms': {'category': ['health', 'finance']}}
-            ]
+            'bool': {
+                'filter': [
+                    {'terms': {'category.lowercase': ['health', 'finance']}}
+                ]
+            }
         },
         True
     )
@@ -125,16 +127,16 @@ class FilterExtractorTests(TestCase):
         [
             {'category': ['health', 'finance']}
         ],
+        [
+            {'term': {'orgUUID': 'org-id-002'}},
+            {'term': {'isPublic': 'false'}}
+        ],
         {
-            'and': [
-                {'term': {'orgUUID': 'org-id-002'}},
-                {'term': {'isPublic': 'false'}}
-            ]
-        },
-        {
-            'and': [
-                {'terms': {'category': ['health', 'finance']}}
-            ]
+            'bool': {
+                'filter': [
+                    {'terms': {'category.lowercase': ['health', 'finance']}}
+                ]
+            }
         },
         False
     )
@@ -145,17 +147,16 @@ class FilterExtractorTests(TestCase):
             {'format': ['csv']},
             {'category': ['health']}
         ],
+        [
+            {'terms': {'visibleTo': ['org-id-003', 'public']}}
+        ],
         {
-            'or': [
-                {'term': {'orgUUID': 'org-id-003'}},
-                {'term': {'isPublic': 'true'}}
-            ]
-        },
-        {
-            'and': [
-                {'term': {'format': 'csv'}},
-                {'term': {'category': 'health'}}
-            ]
+            'bool': {
+                'filter': [
+                    {'term': {'format.lowercase': 'csv'}},
+                    {'term': {'category.lowercase': 'health'}}
+                ]
+            }
         },
         None
     )
@@ -166,16 +167,16 @@ class FilterExtractorTests(TestCase):
             {'format': ['csv']},
             {'category': ['health']}
         ],
+        [
+            {'term': {'isPublic': 'true'}}
+        ],
         {
-            'and': [
-                {'term': {'isPublic': 'true'}}
-            ]
-        },
-        {
-            'and': [
-                {'term': {'format': 'csv'}},
-                {'term': {'category': 'health'}}
-            ]
+            'bool': {
+                'filter': [
+                    {'term': {'format.lowercase': 'csv'}},
+                    {'term': {'category.lowercase': 'health'}}
+                ]
+            }
         },
         True
     )
@@ -186,17 +187,17 @@ class FilterExtractorTests(TestCase):
             {'format': ['csv']},
             {'category': ['health']}
         ],
+        [
+            {'term': {'orgUUID': 'org-id-003'}},
+            {'term': {'isPublic': 'false'}}
+        ],
         {
-            'and': [
-                {'term': {'orgUUID': 'org-id-003'}},
-                {'term': {'isPublic': 'false'}}
-            ]
-        },
-        {
-            'and': [
-                {'term': {'format': 'csv'}},
-                {'term': {'category': 'health'}}
-            ]
+            'bool': {
+                'filter': [
+                    {'term': {'format.lowercase': 'csv'}},
+                    {'term': {'category.lowercase': 'health'}}
+                ]
+            }
         },
         False
     )
@@ -206,16 +207,15 @@ class FilterExtractorTests(TestCase):
         [
             {'format': ['CSV']}
         ],
+        [
+            {'terms': {'visibleTo': ['org-id-004', 'public']}}
+        ],
         {
-            'or': [
-                {'term': {'orgUUID': 'org-id-004'}},
-                {'term': {'isPublic': 'true'}}
-            ]
-        },
-        {
-            'and': [
-                {'term': {'format': 'csv'}}
-            ]
+            'bool': {
+                'filter': [
+                    {'term': {'format.lowercase': 'csv'}}
+                ]
+            }
         },
         None
     )
@@ -225,15 +225,15 @@ class FilterExtractorTests(TestCase):
         [
             {'format': ['CSV']}
         ],
+        [
+            {'term': {'isPublic': 'true'}}
+        ],
         {
-            'and': [
-                {'term': {'isPublic': 'true'}}
-            ]
-        },
-        {
-            'and': [
-                {'term': {'format': 'csv'}}
-            ]
+            'bool': {
+                'filter': [
+                    {'term': {'format.lowercase': 'csv'}}
+                ]
+            }
         },
         True
     )
@@ -243,18 +243,36 @@ class FilterExtractorTests(TestCase):
         [
             {'format': ['CSV']}
         ],
+        [
+            {'term': {'orgUUID': 'org-id-004'}},
+            {'term': {'isPublic': 'false'}}
+        ],
         {
-            'and': [
-                {'term': {'orgUUID': 'org-id-004'}},
-                {'term': {'isPublic': 'false'}}
-            ]
+            'bool': {
+                'filter': [
+                    {'term': {'format.lowercase': 'csv'}}
+                ]
+            }
         },
+        False
+    )
+
+    example_uriFilter_org = (
+        ['org-id-004'],
+        [
+            {'sourceUri': ['http://example.com/Some-Data.csv']}
+        ],
+        [
+            {'terms': {'visibleTo': ['org-id-004', 'public']}}
+        ],
         {
-            'and': [
-                {'term': {'format': 'csv'}}
-            ]
+            'bool': {
+                'filter': [
+                    {'term': {'sourceUri.lowercase': 'http://example.com/some-data.csv'}}
+                ]
+            }
         },
-        False
+        None
     )
 
     example_fromToTimeQuery_org = (
@@ -262,18 +280,10 @@ class FilterExtractorTests(TestCase):
         [
             {'creationTime': ['2014-05-18', '2014-11-03']}
         ],
-        {
-            'and': [
-                {'range': {'creationTime': {'from': '2014-05-18', 'to': '2014-11-03'}}},
-                {
-                    'or': [
-                        {'term': {'orgUUID': 'org-id-005'}},
-                        {'term': {'isPublic': 'true'}}
-                    ]
-                }
-
-            ]
-        },
+        [
+            {'range': {'creationTime': {'from': '2014-05-18', 'to': '2014-11-03'}}},
+            {'terms': {'visibleTo': ['org-id-005', 'public']}}
+        ],
         {},
         None
     )
@@ -283,12 +293,10 @@ class FilterExtractorTests(TestCase):
         [
             {'creationTime': ['2014-05-18', '2014-11-03']}
         ],
-        {
-            'and': [
-                {'range': {'creationTime': {'from': '2014-05-18', 'to': '2014-11-03'}}},
-                {'term': {'isPublic': 'true'}}
-            ]
-        },
+        [
+            {'range': {'creationTime': {'from': '2014-05-18', 'to': '2014-11-03'}}},
+            {'term': {'isPublic': 'true'}}
+        ],
         {},
         True
     )
@@ -298,13 +306,11 @@ class FilterExtractorTests(TestCase):
         [
             {'creationTime': ['2014-05-18', '2014-11-03']}
         ],
-        {
-            'and': [
-                {'range': {'creationTime': {'from': '2014-05-18', 'to': '2014-11-03'}}},
-                {'term': {'orgUUID': 'org-id-005'}},
-                {'term': {'isPublic': 'false'}}
-            ]
-        },
+        [
+            {'range': {'creationTime': {'from': '2014-05-18', 'to': '2014-11-03'}}},
+            {'term': {'orgUUID': 'org-id-005'}},
+            {'term': {'isPublic': 'false'}}
+        ],
         {},
         False
     )
@@ -314,18 +320,10 @@ class FilterExtractorTests(TestCase):
         [
             {'creationTime': [-1, '2014-11-03']}
         ],
-        {
-            'and': [
-                {'range': {'creationTime': {'to': '2014-11-03'}}},
-                {
-                    'or': [
-                        {'term': {'orgUUID': 'org-id-006'}},
-                        {'term': {'isPublic': 'true'}}
-                    ]
-                }
-
-            ]
-        },
+        [
+            {'range': {'creationTime': {'to': '2014-11-03'}}},
+            {'terms': {'visibleTo': ['org-id-006', 'public']}}
+        ],
         {},
         None
     )
@@ -335,18 +333,10 @@ class FilterExtractorTests(TestCase):
         [
             {'creationTime': ['2014-05-18', -1]}
         ],
-        {
-            'and': [
-                {'range': {'creationTime': {'from': '2014-05-18'}}},
-                {
-                    'or': [
-                        {'term': {'orgUUID': 'org-id-007'}},
-                        {'term': {'isPublic': 'true'}}
-                    ]
-                }
-
-            ]
-        },
+        [
+            {'range': {'creationTime': {'from': '2014-05-18'}}},
+            {'terms': {'visibleTo': ['org-id-007', 'public']}}
+        ],
         {},
         None
     )
@@ -363,6 +353,7 @@ class FilterExtractorTests(TestCase):
           example_upperCaseFilterValue_org,
           example_upperCaseFilterValue_onlyPublic,
           example_upperCaseFilterValue_onlyPrivate,
+          example_uriFilter_org,
           example_fromToTimeQuery_org,
           example_fromToTimeQuery_onlyPublic,
           example_fromToTimeQuery_onlyPrivate,
@@ -431,9 +422,25 @@ class FilterExtractorTests(TestCase):
         ]}"""
         filters = {'filters': input_filters}
         output_filter, post_filter = self.filter_extractor.extract_filter(filters, org_uuid_list, dataset_filtering, False)
-        self.assertDictEqual(test_query_filter, output_filter)
+        self.assertListEqual(test_query_filter, output_filter)
         self.assertDictEqual(test_post_filter, post_filter)
 
+    # first input time range, then expected range of the ElasticSearch filter
+    @data(([-1, '2014-11-03T10:15:23'], {'to': '2014-11-03T10:15:23||/m'}),
+          (['2014-05-18T08:00:01', -1], {'from': '2014-05-18T08:00:01||/m'}),
+          ([1400400001000, -1], {'from': '1400400001000||/m'}),
+          (['now-7d', 'now'], {'from': 'now-7d/m', 'to': 'now/m'}),
+          (['2014-05-18||+1d', -1], {'from': '2014-05-18||+1d/m'}),
+          (['2014-05-18||/d', -1], {'from': '2014-05-18||/d'}),
+          (['2014-05-18', '2014-11-03'], {'from': '2014-05-18', 'to': '2014-11-03'}))
+    @unpack
+    def test_filterExtraction_timeRoundingSet_openAndRelativeRangesRounded(self, time_range,
+                                                                           es_range):
+        filter_extractor = ElasticSearchFilterExtractor(time_rounding='m')
+        output_filter, _ = filter_extractor.extract_filter(
+            {'filters': [{'creationTime': time_range}]}, ['org-id-012'], None, False)
+        self.assertEqual({'range': {'creationTime': es_range}}, output_filter[0])
+
 
 class ElasticSearchBaseQueryCreationTests(TestCase):
     MATCH_ALL = {'match_all': {}}
@@ -488,6 +495,7 @@ class ElasticSearchBaseQueryCreationTests(TestCase):
             self.query_creator.create_base_query({'query': ''}))
 
 
+@ddt
 class ElasticSearchQueryTranslationTests(TestCase):
     def setUp(self):
         self.translator = ElasticSearchQueryTranslator()
@@ -509,15 +517,30 @@ class ElasticSearchQueryTranslationTests(TestCase):
 
         self.assertEqual(FROM, json.loads(translated_query)['from'])
 
-    def test_combiningQueryAndFilter_queryWithFilter_filteredQueryCreated(self):
+    def test_queryTranslation_paginationAsStrings_integersInOutput(self):
+        pagination_query = json.dumps({'from': '10', 'size': '5'})
+
+        translated_query = self.translator.translate_to_dict(
+            pagination_query, self.org_uuid, None, False)
+
+        self.assertEqual(10, translated_query['from'])
+        self.assertEqual(5, translated_query['size'])
+
+    @data({'size': 'five'}, {'from': None}, {'size': [5]}, {'from': -1})
+    def test_queryTranslation_invalidPagination_invalidQueryError(self, pagination):
+        with self.assertRaises(InvalidQueryError):
+            self.translator.translate_to_dict(json.dumps(pagination), self.org_uuid, None, False)
+
+    def test_combiningQueryAndFilter_queryWithFilter_boolQueryCreated(self):
         FAKE_BASE_QUERY = {'yup': 'totally fake'}
-        FAKE_FILTER = {'uhuh': 'this filter is also fake'}
+        FAKE_FILTER = [{'uhuh': 'this filter is also fake'}]
         FAKE_POST_FILTER = {'hello': 'fake filter'}
         expected_query = {
+            '_source': {'excludes': ['visibleTo', 'titleSuggest', 'indexedAt']},
             'query': {
-                'filtered': {
-                    'filter': FAKE_FILTER,
-                    'query': FAKE_BASE_QUERY
+                'bool': {
+                    'must': FAKE_BASE_QUERY,
+                    'filter': FAKE_FILTER
                 }
             },
             'post_filter': FAKE_POST_FILTER,
@@ -525,12 +548,12 @@ class ElasticSearchQueryTranslationTests(TestCase):
                 'categories': {
                     'terms': {
                         'size': 100,
-                        'field': 'category'
+                        'field': 'category.raw'
                     }
                 },
                 'formats': {
                     'terms': {
-                        'field': 'format'
+                        'field': 'format.raw'
                     }
                 }
             }
@@ -562,10 +585,65 @@ class ElasticSearchQueryTranslationTests(TestCase):
         output_query_string = self.translator.translate(json.dumps(input_query), self.org_uuid, True, False)
         output_query = json.loads(output_query_string)
 
-        self.assertIn('filtered', output_query['query'])
+        self.assertIn('filter', output_query['query']['bool'])
         self.assertIn('size', output_query)
         self.assertIn('from', output_query)
 
+    def test_exportQueryTranslation_paginatedQuery_noPaginationNorAggregations(self):
+        input_query = {
+            'query': 'blabla',
+            'filters': [
+                {'format': ['csv']}
+            ],
+            'size': 3,
+            'from': 14
+        }
+
+        output_query = self.translator.translate_for_export(
+            json.dumps(input_query), self.org_uuid, None, False)
+
+        self.assertIn('filter', output_query['query']['bool'])
+        self.assertIn('post_filter', output_query)
+        self.assertEqual(['_uid'], output_query['sort'])
+        # exported lines don't have the fields kept only for the index
+        self.assertEqual({'excludes': ['visibleTo', 'titleSuggest', 'indexedAt']},
+                         output_query['_source'])
+        self.assertNotIn('aggregations', output_query)
+        self.assertNotIn('size', output_query)
+        self.assertNotIn('from', output_query)
+
+
+GOLDEN_DIR = os.path.join(os.path.dirname(__file__), 'golden', 'query_translation')
+GOLDEN_FILES = sorted(glob.glob(os.path.join(GOLDEN_DIR, '*.json')))
+# setting this variable overwrites expected queries in golden files with the actual ones
+UPDATE_GOLDEN_ENV = 'UPDATE_GOLDEN_FILES'
+
+
+@pytest.mark.parametrize('golden_path', GOLDEN_FILES,
+                         ids=[os.path.basename(path) for path in GOLDEN_FILES])
+def test_translate_goldenFile_expectedQueryCreated(golden_path):
+    """
+    Each golden file contains an input of the translator ("query", "orgs", "datasetFiltering",
+    "isAdmin") and the full ElasticSearch query that is expected from it.
+    """
+    with open(golden_path) as golden_file:
+        golden = json.load(golden_file)
+    test_input = golden['input']
+    query = test_input['query']
+
+    output_query = json.loads(ElasticSearchQueryTranslator().translate(
+        json.dumps(query) if query is not None else None,
+        test_input['orgs'],
+        test_input['datasetFiltering'],
+        test_input['isAdmin']))
+
+    if os.getenv(UPDATE_GOLDEN_ENV):
+        golden['expected'] = output_query
+        with open(golden_path, 'w') as golden_file:
+            golden_file.write(json.dumps(golden, indent=4, sort_keys=True,
+                                         separators=(',', ': ')) + '\n')
+    assert output_query == golden['expected']
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,107 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+
+from elasticsearch.exceptions import NotFoundError
+from mock import MagicMock
+
+from data_catalog.routing import OrgRouting
+from tests.base_test import DataCatalogTestCase
+
+
+class OrgRoutingTests(DataCatalogTestCase):
+
+    ENTRY_ID = 'test-entry-id'
+
+    def setUp(self):
+        super(OrgRoutingTests, self).setUp()
+        self._mock_es = MagicMock()
+        self._routing = OrgRouting(self._config.elastic, self._mock_es)
+
+    def test_params_routingDisabled_noParams(self):
+        self.assertEqual({}, self._routing.params('org01'))
+        self.assertEqual({}, self._routing.search_params(['org01']))
+
+    def test_params_routingEnabled_orgUuidReturned(self):
+        self._config.elastic.org_routing = True
+        self.assertEqual({'routing': 'org01'}, self._routing.params('ORG01'))
+
+    def test_searchParams_routingEnabled_orgsJoined(self):
+        self._config.elastic.org_routing = True
+        self.assertEqual({'routing': 'org01,org02'},
+                         self._routing.search_params(['org02', 'org01', 'org02']))
+        self.assertEqual({}, self._routing.search_params([]))
+
+    def test_getEntry_routingDisabled_entryFetchedById(self):
+        self._routing.get_entry(self.ENTRY_ID)
+        self._mock_es.get.assert_called_once_with(
+            index=self._config.elastic.elastic_index,
+            doc_type=self._config.elastic.elastic_metadata_type,
+            id=self.ENTRY_ID)
+
+    def test_getEntry_routingEnabled_entryFoundOnAllShardsAndReadInRealtime(self):
+        self._config.elastic.org_routing = True
+        self._mock_es.search.return_value = {
+            'hits': {'hits': [{'_id': self.ENTRY_ID, '_source': {'orgUUID': 'ORG01'}}]}}
+        self._mock_es.get.return_value = {'_id': self.ENTRY_ID, 'found': True,
+                                          '_source': {'orgUUID': 'ORG01', 'title': 'new'}}
+
+        entry = self._routing.get_entry(self.ENTRY_ID)
+
+        self.assertEqual({'orgUUID': 'ORG01', 'title': 'new'}, entry['_source'])
+        self.assertEqual({'ids': {'values': [self.ENTRY_ID]}},
+                         self._mock_es.search.call_args[1]['body']['query'])
+        self._mock_es.get.assert_called_once_with(
+            index=self._config.elastic.elastic_index,
+            doc_type=self._config.elastic.elastic_metadata_type,
+            id=self.ENTRY_ID,
+            routing='org01')
+        self.assertFalse(self._mock_es.indices.refresh.called)
+
+    def test_getEntry_routingEnabledEntryOnOrgShard_entryReadWithoutSearch(self):
+        self._config.elastic.org_routing = True
+        self._mock_es.mget.return_value = {'docs': [
+            {'_id': self.ENTRY_ID, 'found': True, '_source': {'orgUUID': 'org01'}},
+            {'_id': self.ENTRY_ID, 'found': False}]}
+
+        entry = self._routing.get_entry(self.ENTRY_ID, org_uuid_list=['ORG02', 'org01'])
+
+        self.assertEqual({'orgUUID': 'org01'}, entry['_source'])
+        self.assertEqual([{'_id': self.ENTRY_ID, '_routing': 'org01'},
+                          {'_id': self.ENTRY_ID, '_routing': 'org02'}],
+                         self._mock_es.mget.call_args[1]['body']['docs'])
+        self.assertFalse(self._mock_es.search.called)
+
+    def test_getEntry_routingEnabledNotOnOrgShards_searchedWithoutRefresh(self):
+        self._config.elastic.org_routing = True
+        self._mock_es.mget.return_value = {'docs': [{'_id': self.ENTRY_ID, 'found': False}]}
+        self._mock_es.search.return_value = {'hits': {'hits': []}}
+
+        with self.assertRaises(NotFoundError):
+            self._routing.get_entry(self.ENTRY_ID, org_uuid_list=['org01'])
+        self.assertTrue(self._mock_es.search.called)
+        self.assertFalse(self._mock_es.indices.refresh.called)
+
+    def test_getEntry_routingEnabledNoEntry_notFoundErrorRaised(self):
+        self._config.elastic.org_routing = True
+        self._mock_es.search.return_value = {'hits': {'hits': []}}
+        with self.assertRaises(NotFoundError):
+            self._routing.get_entry(self.ENTRY_ID)
+
+
+if __name__ == '__main__':
+    unittest.main()
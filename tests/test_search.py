@@ -18,10 +18,13 @@ import json
 import unittest
 import flask
 
-from elasticsearch.exceptions import RequestError, ConnectionError
+from elasticsearch.exceptions import RequestError, ConnectionError, ConnectionTimeout
 from mock import patch, MagicMock
 
-from data_catalog.search import DataSetSearch, InvalidQueryError, IndexConnectionError
+from data_catalog.query_cost import QueryRejectedError
+from data_catalog.query_translation import DataSetFiltering
+from data_catalog.search import (DataSetSearch, DataSetMultiSearchResource, InvalidQueryError,
+                                 IndexConnectionError, SearchTimeoutError)
 from tests.base_test import DataCatalogTestCase
 
 
@@ -65,8 +68,10 @@ class SearchTests(DataCatalogTestCase):
         }
 
         self._search_obj = DataSetSearch()
-        self._search_obj._translator.translate = self._mock_translate = MagicMock()
+        self._search_obj._translator.translate_to_dict = self._mock_translate = MagicMock()
+        self._mock_translate.return_value = {'query': {'match_all': {}}}
         self._search_obj._elastic_search.search = self._mock_es_search = MagicMock()
+        self._search_obj._elastic_search.msearch = self._mock_es_msearch = MagicMock()
         self.request_context = self.app.test_request_context('/rest/datasets')
         self.request_context.push()
 
@@ -76,20 +81,96 @@ class SearchTests(DataCatalogTestCase):
 
     def test_search_withQuery_queryPassedToIndex(self):
         QUERY_STRING = 'fake data catalog query'
-        TRANSLATED_QUERY = 'fake translated query'
+        TRANSLATED_QUERY = {'query': {'match': {'title': 'fake translated query'}}}
         self._mock_es_search.return_value = dict(self.test_es_search_results)
-        self._mock_translate.return_value = str(TRANSLATED_QUERY)
+        self._mock_translate.return_value = dict(TRANSLATED_QUERY)
 
         response = self._search_obj.search(QUERY_STRING, self.fake_org_id, True, False)
 
         self.assertListEqual([self.test_search_result], response['hits'])
         self.assertEqual(self.test_total_hits, response['total'])
         self.assertEqual(self.test_id, response['hits'][0]['id'])
+        self.assertFalse(response['timedOut'])
         self._mock_translate.assert_called_once_with(QUERY_STRING, self.fake_org_id, True, False)
         self._mock_es_search.assert_called_once_with(
             index=self._config.elastic.elastic_index,
             doc_type=self._config.elastic.elastic_metadata_type,
-            body=TRANSLATED_QUERY)
+            body=TRANSLATED_QUERY,
+            timeout=self._config.search.timeout,
+            request_timeout=self._config.search.request_timeout)
+
+    def test_search_timeBudgetExceeded_partialResultsReturned(self):
+        self._search_obj._config.search.terminate_after = 1000
+        self._mock_es_search.return_value = dict(self.test_es_search_results, timed_out=True)
+
+        response = self._search_obj.search('some query', self.fake_org_id, None, False)
+
+        self.assertTrue(response['timedOut'])
+        self.assertListEqual([self.test_search_result], response['hits'])
+        self.assertEqual(1000, self._mock_es_search.call_args[1]['terminate_after'])
+
+    def test_search_noResponseBeforeDeadline_searchTimeoutErrorRaised(self):
+        self._mock_es_search.side_effect = ConnectionTimeout
+        with self.assertRaises(SearchTimeoutError):
+            self._search_obj.search('some query string', self.fake_org_id, False, False)
+
+    def test_search_onlyPrivateWithOrgRouting_searchRoutedToOrgs(self):
+        self._search_obj._config.elastic.org_routing = True
+        self._mock_es_search.return_value = dict(self.test_es_search_results)
+
+        self._search_obj.search('some query', ['Org02', 'org01'], False, False)
+
+        self.assertEqual('org01,org02', self._mock_es_search.call_args[1]['routing'])
+
+    def test_search_privateAndPublicWithOrgRouting_searchNotRouted(self):
+        self._search_obj._config.elastic.org_routing = True
+        self._mock_es_search.return_value = dict(self.test_es_search_results)
+
+        self._search_obj.search('some query', ['org01'], None, False)
+
+        self.assertNotIn('routing', self._mock_es_search.call_args[1])
+
+    def test_search_profile_profileAndTimingsReturned(self):
+        TRANSLATED_QUERY = {'query': {'match': {'title': 'zebra'}}}
+        shard_profiles = [{'id': '[node01][data-catalog][0]', 'searches': []}]
+        self._mock_translate.return_value = dict(TRANSLATED_QUERY)
+        self._mock_es_search.return_value = dict(self.test_es_search_results, took=12,
+                                                 profile={'shards': shard_profiles})
+
+        response = self._search_obj.search('zebra', self.fake_org_id, None, True, profile=True)
+
+        self.assertListEqual([self.test_search_result], response['hits'])
+        self.assertEqual(TRANSLATED_QUERY, response['profile']['query'])
+        self.assertEqual(12, response['profile']['took'])
+        self.assertEqual(shard_profiles, response['profile']['shards'])
+        self.assertItemsEqual(['translationMs', 'elasticSearchMs', 'extractionMs'],
+                              response['profile']['timings'].keys())
+        self.assertTrue(self._mock_es_search.call_args[1]['body']['profile'])
+
+    def test_search_facetsOnly_requestCacheUsed(self):
+        self._mock_translate.return_value = {'query': {'match_all': {}}, 'size': 0}
+        self._mock_es_search.return_value = dict(self.test_es_search_results)
+
+        self._search_obj.search('{"size": 0}', self.fake_org_id, None, False)
+
+        self.assertTrue(self._mock_es_search.call_args[1]['request_cache'])
+
+    def test_search_withHits_requestCacheNotAsked(self):
+        self._mock_es_search.return_value = dict(self.test_es_search_results)
+        self._search_obj.search('some query', self.fake_org_id, None, False)
+        self.assertNotIn('request_cache', self._mock_es_search.call_args[1])
+
+    def test_count_visibleDataSets_countedWithoutHitsOrAggregations(self):
+        self._mock_translate.return_value = {'query': {'match_all': {}}, 'aggregations': {}}
+        self._mock_es_search.return_value = {'hits': {'hits': [], 'total': 42}}
+
+        count = self._search_obj.count([self.fake_org_id], None, False)
+
+        self.assertEqual(42, count)
+        self._mock_translate.assert_called_once_with(None, [self.fake_org_id], None, False)
+        search_kwargs = self._mock_es_search.call_args[1]
+        self.assertEqual({'query': {'match_all': {}}, 'size': 0}, search_kwargs['body'])
+        self.assertTrue(search_kwargs['request_cache'])
 
     def test_search_invalidQuery_invalidQueryErrorRaised(self):
         self._mock_es_search.side_effect = RequestError
@@ -101,6 +182,127 @@ class SearchTests(DataCatalogTestCase):
         with self.assertRaises(IndexConnectionError):
             self._search_obj.search('some query string', self.fake_org_id, False, False)
 
+    def test_multiSearch_validAndInvalidQueries_resultsInOrder(self):
+        self._mock_translate.side_effect = [{'query': 'first'}, InvalidQueryError,
+                                            {'query': 'third'}]
+        self._mock_es_msearch.return_value = {
+            'responses': [dict(self.test_es_search_results), {'error': 'some ES error'}]
+        }
+
+        results = self._search_obj.multi_search(
+            [('first', None), ('second', False), ('third', True)], [self.fake_org_id], False)
+
+        self.assertEqual(3, len(results))
+        self.assertEqual(200, results[0]['status'])
+        self.assertEqual(self.test_total_hits, results[0]['total'])
+        self.assertEqual(
+            {'status': 400, 'message': DataSetSearch.INVALID_QUERY_ERROR_MESSAGE}, results[1])
+        self.assertEqual(
+            {'status': 400, 'message': DataSetSearch.INVALID_QUERY_ERROR_MESSAGE}, results[2])
+        self._mock_es_msearch.assert_called_once_with(
+            index=self._config.elastic.elastic_index,
+            doc_type=self._config.elastic.elastic_metadata_type,
+            body=[{}, {'query': 'first', 'timeout': self._config.search.timeout},
+                  {}, {'query': 'third', 'timeout': self._config.search.timeout}],
+            request_timeout=self._config.search.request_timeout)
+
+    def test_multiSearch_timeBudgetExceeded_budgetInBodiesAndPartialResults(self):
+        self._search_obj._config.search.terminate_after = 1000
+        self._mock_translate.side_effect = [{'query': 'first'}, {'query': 'second'}]
+        self._mock_es_msearch.return_value = {'responses': [
+            dict(self.test_es_search_results),
+            dict(self.test_es_search_results, timed_out=True)
+        ]}
+
+        results = self._search_obj.multi_search(
+            [('first', None), ('second', None)], [self.fake_org_id], False)
+
+        self.assertEqual([False, True], [result['timedOut'] for result in results])
+        for body in self._mock_es_msearch.call_args[1]['body'][1::2]:
+            self.assertEqual(self._config.search.timeout, body['timeout'])
+            self.assertEqual(1000, body['terminate_after'])
+
+    def test_search_tooExpensiveQuery_queryRejectedError(self):
+        self._mock_translate.return_value = {
+            'query': {'wildcard': {'title': '*a*'}},
+            'size': 10000
+        }
+        self._search_obj._config.query_cost.reject_threshold = 1500
+        with self.assertRaises(QueryRejectedError):
+            self._search_obj.search('a', self.fake_org_id, None, False)
+        self.assertFalse(self._mock_es_search.called)
+
+    def test_multiSearch_tooManyTerms_errorForThatQuery(self):
+        self._search_obj._config.query_cost.max_terms = 2
+        self._mock_translate.side_effect = [
+            {'query': {'terms': {'visibleTo': ['org01', 'org02', 'public']}}},
+            {'query': {'match_all': {}}}
+        ]
+        self._mock_es_msearch.return_value = {'responses': [dict(self.test_es_search_results)]}
+
+        results = self._search_obj.multi_search([('first', None), ('second', None)], [], False)
+
+        self.assertEqual(400, results[0]['status'])
+        self.assertEqual(200, results[1]['status'])
+
+    def test_multiSearch_facetsOnlyQuery_requestCacheInHeader(self):
+        self._mock_translate.side_effect = [{'query': 'first', 'size': 0}, {'query': 'second'}]
+        self._mock_es_msearch.return_value = {
+            'responses': [dict(self.test_es_search_results), dict(self.test_es_search_results)]
+        }
+
+        self._search_obj.multi_search([('first', None), ('second', None)], [], False)
+
+        self.assertEqual(
+            [{'request_cache': True}, {'query': 'first', 'size': 0, 'timeout': '5s'},
+             {}, {'query': 'second', 'timeout': '5s'}],
+            self._mock_es_msearch.call_args[1]['body'])
+
+    def test_multiSearch_onlyInvalidQueries_indexNotAsked(self):
+        self._mock_translate.side_effect = InvalidQueryError
+        results = self._search_obj.multi_search([('invalid', None)], [self.fake_org_id], False)
+        self.assertEqual(400, results[0]['status'])
+        self.assertFalse(self._mock_es_msearch.called)
+
+    def test_multiSearch_noIndexConnection_connectionErrorRaised(self):
+        self._mock_es_msearch.side_effect = ConnectionError
+        with self.assertRaises(IndexConnectionError):
+            self._search_obj.multi_search([('some query', None)], [self.fake_org_id], False)
+
+    @patch.object(DataSetSearch, 'multi_search')
+    def test_restMultiSearch_withQueries_searchesPassed(self, mock_multi_search):
+        flask.g.org_uuid_list = ['orgid001']
+        flask.g.is_admin = False
+        mock_multi_search.return_value = [{'status': 200}, {'status': 200}]
+        queries = [{'query': {'query': 'text'}, 'onlyPublic': True}, {'onlyPrivate': 'true'}]
+
+        response = self.client.get(
+            self._config.app_base_path + '/msearch?queries=' + json.dumps(queries))
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({'responses': [{'status': 200}, {'status': 200}]},
+                         json.loads(response.data))
+        mock_multi_search.assert_called_once_with(
+            [('{"query": "text"}', DataSetFiltering.ONLY_PUBLIC),
+             (None, DataSetFiltering.ONLY_PRIVATE)],
+            ['orgid001'],
+            False)
+
+    def test_restMultiSearch_malformedQueries_400Returned(self):
+        flask.g.is_admin = False
+        too_many_queries = [{}] * (DataSetMultiSearchResource.MAX_QUERIES + 1)
+        for queries in ['not a JSON', '{"query": "text"}', '[]', '["text"]',
+                        json.dumps(too_many_queries)]:
+            response = self.client.get(self._config.app_base_path + '/msearch?queries=' + queries)
+            self.assertEqual(400, response.status_code)
+
+    @patch.object(DataSetSearch, 'multi_search')
+    def test_restMultiSearch_noIndexConnection_500Returned(self, mock_multi_search):
+        flask.g.is_admin = False
+        mock_multi_search.side_effect = IndexConnectionError
+        response = self.client.get(self._config.app_base_path + '/msearch?queries=[{}]')
+        self.assertEqual(500, response.status_code)
+
     @patch.object(DataSetSearch, 'search')
     def test_restSearch_withQuery_queryPassedToSearch(self, mock_search):
         flask.g.org_uuid_list = '[orgid001]'
@@ -112,7 +314,28 @@ class SearchTests(DataCatalogTestCase):
         org_uuid_list = '[orgid001]'
         self.assertEqual(200, response.status_code)
         self.assertDictEqual(self.test_es_search_results, json.loads(response.data))
-        mock_search.assert_called_once_with(test_query, org_uuid_list, None, False)
+        mock_search.assert_called_once_with(test_query, org_uuid_list, None, False,
+                                            profile=False)
+
+    @patch.object(DataSetSearch, 'search')
+    def test_restSearch_adminProfile_requestTimingsAdded(self, mock_search):
+        flask.g.is_admin = True
+        mock_search.return_value = dict(self.test_es_search_results,
+                                        profile={'took': 3, 'timings': {'translationMs': 0.1}})
+
+        response = self.client.get(self._config.app_base_path + '?profile=true')
+
+        self.assertEqual(200, response.status_code)
+        timings = json.loads(response.data)['profile']['timings']
+        self.assertItemsEqual(['translationMs', 'authMs', 'serializationMs'], timings.keys())
+        self.assertTrue(mock_search.call_args[1]['profile'])
+
+    @patch.object(DataSetSearch, 'search')
+    def test_restSearch_nonAdminProfile_403Returned(self, mock_search):
+        flask.g.is_admin = False
+        response = self.client.get(self._config.app_base_path + '?profile=true')
+        self.assertEqual(403, response.status_code)
+        self.assertFalse(mock_search.called)
 
     @patch.object(DataSetSearch, 'search')
     def test_restSearch_invalidQuery_400Returned(self, mock_search):
@@ -121,6 +344,20 @@ class SearchTests(DataCatalogTestCase):
         response = self.client.get(self._config.app_base_path + '?query=some_invalid_query')
         self.assertEqual(400, response.status_code)
 
+    @patch.object(DataSetSearch, 'search')
+    def test_restSearch_queryRejected_429Returned(self, mock_search):
+        flask.g.is_admin = False
+        mock_search.side_effect = QueryRejectedError(429, 'too expensive')
+        response = self.client.get(self._config.app_base_path + '?query=some_query')
+        self.assertEqual(429, response.status_code)
+
+    @patch.object(DataSetSearch, 'search')
+    def test_restSearch_searchTimeout_504Returned(self, mock_search):
+        flask.g.is_admin = False
+        mock_search.side_effect = SearchTimeoutError
+        response = self.client.get(self._config.app_base_path + '?query=some_query')
+        self.assertEqual(504, response.status_code)
+
     @patch.object(DataSetSearch, 'search')
     def test_restSearch_noIndexConnection_500Returned(self, mock_search):
         flask.g.is_admin = False
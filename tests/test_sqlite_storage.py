@@ -0,0 +1,86 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import copy
+import os
+import shutil
+import tempfile
+import unittest
+
+from elasticsearch.exceptions import RequestError
+from mock import patch
+
+from data_catalog.bases import create_storage
+from data_catalog.configuration import SQLITE_PATH, STORAGE_BACKEND
+from data_catalog.sqlite_storage import SqliteStorage
+from tests.base_test import DataCatalogTestCase
+from tests.test_fake_elastic_search import get_entry
+
+
+class SqliteStorageTests(DataCatalogTestCase):
+
+    """
+    Behaviour of the SQLite storage that ElasticSearch's doesn't have, the rest is checked
+    by tests.test_storage.
+    """
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        instances_patcher = patch.dict(SqliteStorage._instances)
+        instances_patcher.start()
+        self.addCleanup(instances_patcher.stop)
+        os.environ[STORAGE_BACKEND] = 'sqlite'
+        os.environ[SQLITE_PATH] = os.path.join(directory, 'data_catalog.sqlite')
+        super(SqliteStorageTests, self).setUp()
+        self._storage = create_storage(self._config.elastic, None)
+
+    def test_createStorage_sqliteBackend_sharedStorageReturned(self):
+        self.assertIsInstance(self._storage, SqliteStorage)
+        self.assertIs(self._storage, create_storage(self._config.elastic, None))
+
+    def test_index_valueNotFittingMapping_requestErrorRaisedAndNothingWritten(self):
+        with self.assertRaises(RequestError):
+            self._storage.index('entry', {'orgUUID': 'org01', 'size': 'big'})
+        self.assertEqual(0, self._storage.count({}))
+
+    def test_init_mappingsChanged_entriesIndexedAgain(self):
+        self._storage.index('entry', get_entry(0))
+        query = {'query': {'match': {'title': 'census'}}}
+        self.assertEqual(1, self._storage.count(query))
+
+        elastic_config = copy.copy(self._config.elastic)
+        elastic_config.metadata_index_setup = copy.deepcopy(
+            self._config.elastic.metadata_index_setup)
+        mapping = elastic_config.metadata_index_setup['mappings'][
+            elastic_config.elastic_metadata_type]
+        mapping['properties']['title'] = {'type': 'string', 'index': 'not_analyzed'}
+
+        storage = SqliteStorage(elastic_config)
+
+        # the whole title is a single term now
+        self.assertEqual(0, storage.count(query))
+        self.assertEqual(1, storage.count(
+            {'query': {'term': {'title': 'population census number 0'}}}))
+
+    def test_endpoints_elasticSearchOnly_notAvailable(self):
+        self.assertEqual(404, self.client.get('/rest/datasets/admin/elastic').status_code)
+        self.assertEqual(404, self.client.get('/rest/datasets/admin/elastic/settings')
+                         .status_code)
+
+
+if __name__ == '__main__':
+    unittest.main()
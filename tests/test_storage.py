@@ -0,0 +1,268 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import flask
+from elasticsearch.exceptions import NotFoundError, RequestError
+from mock import patch
+
+from data_catalog.bases import create_elastic_search, create_storage
+from data_catalog.configuration import SQLITE_PATH, STORAGE_BACKEND
+from data_catalog.metadata_entry import (CFNotifier, INTERNAL_FIELDS,
+                                         MetadataIndexingTransformer)
+from data_catalog.metadata_index import MetadataIndex
+from data_catalog.query_translation import DataSetFiltering, ElasticSearchQueryTranslator
+from data_catalog.sqlite_storage import SqliteStorage
+from data_catalog.storage import ElasticSearchStorage, ReindexDeletes
+from tests.base_test import DataCatalogTestCase
+from tests.fake_elastic_search import FakeElasticSearch
+from tests.test_fake_elastic_search import get_entry
+
+
+class StorageConformance(object):
+
+    """
+    Behaviour every storage backend has, checked for each of them by the test cases below.
+    """
+
+    def _create_storage(self):
+        raise NotImplementedError()
+
+    def setUp(self):
+        super(StorageConformance, self).setUp()
+        self._storage = self._create_storage()
+        self._translator = ElasticSearchQueryTranslator()
+
+    def _index_entries(self, entries):
+        transformer = MetadataIndexingTransformer()
+        for number, entry in enumerate(entries):
+            transformer.transform(entry)
+            self._storage.index('entry-{}'.format(number), entry)
+
+    def _translate(self, query, orgs=(), dataset_filtering=DataSetFiltering.PRIVATE_AND_PUBLIC,
+                   is_admin=False):
+        return self._translator.translate_to_dict(
+            json.dumps(query) if query is not None else None, list(orgs), dataset_filtering,
+            is_admin)
+
+    def _search_ids(self, query):
+        response = self._storage.search(query)
+        return sorted(hit['_id'] for hit in response['hits']['hits'])
+
+    def test_entries_writtenReadAndDeleted(self):
+        self.assertTrue(self._storage.index('entry', {'title': 'old', 'orgUUID': 'org01'}))
+        self.assertFalse(self._storage.index('entry', {'title': 'older', 'orgUUID': 'org01'}))
+        self._storage.update('entry', {'title': 'new'}, {'title': 'older', 'orgUUID': 'org01'})
+
+        document = self._storage.get('entry', org_uuid_list=['org01'])
+        self.assertEqual('entry', document['_id'])
+        self.assertEqual({'title': 'new', 'orgUUID': 'org01'}, document['_source'])
+        self.assertEqual(['entry'], self._search_ids({'query': {'match': {'title': 'new'}}}))
+        self.assertEqual([], self._search_ids({'query': {'match': {'title': 'old'}}}))
+
+        self._storage.delete('entry', 'org01')
+        self.assertEqual([], self._search_ids({}))
+        with self.assertRaises(NotFoundError):
+            self._storage.get('entry')
+        with self.assertRaises(NotFoundError):
+            self._storage.update('entry', {'title': 'newest'}, {'orgUUID': 'org01'})
+        with self.assertRaises(NotFoundError):
+            self._storage.delete('entry', 'org01')
+
+    def test_search_translatedQuery_hitsFilteredAndAggregated(self):
+        self._index_entries([get_entry(number) for number in range(6)])
+        self._index_entries([get_entry(6, title='something else')])
+        es_query = self._translate({
+            'query': 'census',
+            'filters': [{'format': ['csv']}, {'creationTime': ['2015-02-02T00:00', -1]}]
+        }, ['org02'])
+
+        response = self._storage.search(es_query, ['org02'])
+
+        # public entries and the private ones of org02 (odd numbers), the first one is too old
+        self.assertEqual(['entry-1', 'entry-3', 'entry-5'],
+                         sorted(hit['_id'] for hit in response['hits']['hits']))
+        self.assertEqual(3, response['hits']['total'])
+        # aggregations don't take the post filter (format) into account
+        self.assertEqual([{'key': 'csv', 'doc_count': 3}, {'key': 'json', 'doc_count': 2}],
+                         response['aggregations']['formats']['buckets'])
+
+    def test_search_filterInOtherCase_wholeValuesMatchedAndAggregatedAsStored(self):
+        self._index_entries([get_entry(0, format='CSV', category='Public Health'),
+                             get_entry(2, format='csv', category='health')])
+        es_query = self._translate({'filters': [{'format': ['Csv']},
+                                                {'category': ['public health']}]},
+                                   dataset_filtering=DataSetFiltering.ONLY_PUBLIC)
+
+        response = self._storage.search(es_query)
+
+        self.assertEqual(['entry-0'], [hit['_id'] for hit in response['hits']['hits']])
+        self.assertEqual([{'key': 'CSV', 'doc_count': 1}, {'key': 'csv', 'doc_count': 1}],
+                         response['aggregations']['formats']['buckets'])
+
+    def test_search_filterByPartOfValue_onlyWholeValuesMatched(self):
+        self._index_entries([
+            get_entry(0, category='health care', sourceUri='http://x.org/data/more'),
+            get_entry(2, category='Health', sourceUri='http://x.org/data')])
+
+        for value_filter in ({'category': ['health']}, {'sourceUri': ['http://x.org/data']}):
+            es_query = self._translate({'filters': [value_filter]},
+                                       dataset_filtering=DataSetFiltering.ONLY_PUBLIC)
+            self.assertEqual(['entry-1'], self._search_ids(es_query))
+
+    def test_search_visibilityFilters_onlyVisibleEntriesFound(self):
+        self._index_entries([get_entry(number) for number in range(4)])
+
+        def search(orgs, dataset_filtering, is_admin=False):
+            return self._search_ids(self._translate({}, orgs, dataset_filtering, is_admin))
+
+        self.assertEqual(['entry-0', 'entry-2'], search(['org01'], DataSetFiltering.ONLY_PUBLIC))
+        self.assertEqual(['entry-1', 'entry-3'], search(['org02'], DataSetFiltering.ONLY_PRIVATE))
+        self.assertEqual(['entry-0', 'entry-1', 'entry-2', 'entry-3'],
+                         search(['org02'], DataSetFiltering.PRIVATE_AND_PUBLIC))
+        self.assertEqual([], search(['org03'], DataSetFiltering.ONLY_PRIVATE))
+        self.assertEqual(['entry-0', 'entry-1', 'entry-2', 'entry-3'],
+                         search([], DataSetFiltering.PRIVATE_AND_PUBLIC, is_admin=True))
+
+    def test_search_sortedAndPaged_pageReturned(self):
+        self._index_entries([get_entry(number) for number in range(5)])
+        response = self._storage.search(
+            {'sort': [{'size': {'order': 'desc'}}], 'from': 1, 'size': 2, '_source': ['size']})
+        self.assertEqual(5, response['hits']['total'])
+        self.assertEqual([{'size': 3000}, {'size': 2000}],
+                         [hit['_source'] for hit in response['hits']['hits']])
+
+    def test_search_wildcardOnAnalyzedUri_matchingTermsFound(self):
+        self._index_entries([get_entry(1), get_entry(2, sourceUri='ftp://other.org/file.json')])
+        self.assertEqual(['entry-0'], self._search_ids(
+            {'query': {'wildcard': {'sourceUri': 'exam*'}}}))
+        self.assertEqual(['entry-1'], self._search_ids(
+            {'query': {'wildcard': {'sourceUri.raw': 'ftp://*'}}}))
+
+    def test_search_invalidQuery_requestErrorRaised(self):
+        with self.assertRaises(RequestError):
+            self._storage.search({'query': {'fuzzy': {'title': 'x'}}})
+
+    def test_facetsAndCount_visibleEntries_noHitsFetched(self):
+        self._index_entries([get_entry(number) for number in range(5)])
+        es_query = self._translate(None, ['org01'], DataSetFiltering.PRIVATE_AND_PUBLIC)
+
+        facets = self._storage.facets(es_query, ['org01'])
+
+        self.assertEqual([{'key': 'json', 'doc_count': 3}], facets['formats']['buckets'])
+        self.assertEqual(3, self._storage.count(es_query, ['org01']))
+        self.assertEqual(2, self._storage.count(
+            self._translate(None, ['org02'], DataSetFiltering.ONLY_PRIVATE), ['org02']))
+
+    def test_multiSearch_validAndInvalidQueries_responsesInOrder(self):
+        self._index_entries([get_entry(number) for number in range(3)])
+        responses = self._storage.multi_search([
+            (self._translate({}, dataset_filtering=DataSetFiltering.ONLY_PUBLIC), []),
+            ({'query': {'fuzzy': {'title': 'x'}}}, []),
+            ({'query': {'match': {'title': 'census'}}, 'size': 0}, [])
+        ])
+        self.assertEqual(3, len(responses))
+        self.assertEqual(2, responses[0]['hits']['total'])
+        self.assertIn('error', responses[1])
+        self.assertEqual(3, responses[2]['hits']['total'])
+
+    def test_endpoints_entriesPutSearchedAndUpdated(self):
+        with patch.object(CFNotifier, 'notify'), self.app.test_request_context('fake_path'):
+            flask.g.is_admin = False
+            flask.g.org_uuid_list = ['org01', 'org02']
+            for number in range(4):
+                response = self.client.put('/rest/datasets/entry-{}'.format(number),
+                                           data=json.dumps(get_entry(number)))
+                self.assertEqual(201, response.status_code)
+
+            response = self.client.get('/rest/datasets', query_string={
+                'query': json.dumps({'query': 'census', 'filters': [{'format': ['csv']}]})})
+            self.assertEqual(200, response.status_code)
+            result = json.loads(response.data)
+            self.assertEqual(['entry-1', 'entry-3'], sorted(hit['id'] for hit in result['hits']))
+            self.assertEqual(2, result['total'])
+            # fields kept only for the index aren't returned
+            for hit in result['hits']:
+                self.assertFalse(set(hit).intersection(INTERNAL_FIELDS))
+
+            response = self.client.get('/rest/datasets/count',
+                                       query_string={'onlyPublic': 'true'})
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(2, json.loads(response.data))
+
+            response = self.client.post('/rest/datasets/entry-1',
+                                        data=json.dumps({'title': 'updated title'}))
+            self.assertEqual(200, response.status_code)
+            response = self.client.get('/rest/datasets/entry-1')
+            source = json.loads(response.data)['_source']
+            self.assertEqual('updated title', source['title'])
+            self.assertFalse(set(source).intersection(INTERNAL_FIELDS))
+            self.assertEqual(404, self.client.get('/rest/datasets/entry-9').status_code)
+
+
+class ElasticSearchStorageTests(StorageConformance, DataCatalogTestCase):
+
+    def _create_storage(self):
+        fake_es = FakeElasticSearch()
+        fake_es.start()
+        self.addCleanup(fake_es.stop)
+        elastic_search = create_elastic_search(self._config.elastic)
+        MetadataIndex(elastic_search, self._config.elastic).create_if_missing()
+        storage = create_storage(self._config.elastic, elastic_search)
+        self.assertIsInstance(storage, ElasticSearchStorage)
+        self._reindex_deletes = ReindexDeletes(elastic_search, self._config.elastic)
+        return storage
+
+    def test_delete_reindexRunning_deleteRecordedUntilReindexEnds(self):
+        self._index_entries([get_entry(number) for number in range(3)])
+        self._storage.delete('entry-0', 'org01')
+        self._reindex_deletes.start()
+        self._storage.delete('entry-1', 'org02')
+        self.assertIsNone(self._reindex_deletes.get_deleted_at('entry-0'))
+        self.assertIsNotNone(self._reindex_deletes.get_deleted_at('entry-1'))
+
+        self._reindex_deletes.stop()
+        self._storage.delete('entry-2', 'org01')
+        self._reindex_deletes.start()
+        self.assertIsNone(self._reindex_deletes.get_deleted_at('entry-1'))
+        self.assertIsNone(self._reindex_deletes.get_deleted_at('entry-2'))
+
+
+class SqliteStorageTests(StorageConformance, DataCatalogTestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        instances_patcher = patch.dict(SqliteStorage._instances)
+        instances_patcher.start()
+        self.addCleanup(instances_patcher.stop)
+        os.environ[STORAGE_BACKEND] = 'sqlite'
+        os.environ[SQLITE_PATH] = os.path.join(directory, 'data_catalog.sqlite')
+        super(SqliteStorageTests, self).setUp()
+
+    def _create_storage(self):
+        storage = create_storage(self._config.elastic, create_elastic_search(self._config.elastic))
+        self.assertIsInstance(storage, SqliteStorage)
+        return storage
+
+
+if __name__ == '__main__':
+    unittest.main()
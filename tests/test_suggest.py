@@ -0,0 +1,110 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import unittest
+
+import flask
+from elasticsearch.exceptions import RequestError, ConnectionError
+from mock import patch, MagicMock
+
+from data_catalog.search import IndexConnectionError
+from data_catalog.suggest import DataSetSuggest
+from tests.base_test import DataCatalogTestCase
+
+
+class SuggestTests(DataCatalogTestCase):
+
+    def setUp(self):
+        super(SuggestTests, self).setUp()
+        self._suggest_obj = DataSetSuggest()
+        self._suggest_obj._elastic_search.suggest = self._mock_es_suggest = MagicMock()
+        self.request_context = self.app.test_request_context('/rest/datasets/suggest')
+        self.request_context.push()
+
+    def tearDown(self):
+        super(SuggestTests, self).tearDown()
+        self.request_context.pop()
+
+    def _get_context(self):
+        return self._mock_es_suggest.call_args[1]['body']['titles']['completion']['context']
+
+    def test_suggest_userOrgs_visibleTitlesReturned(self):
+        self._mock_es_suggest.return_value = {
+            'titles': [{'text': 'zeb', 'options': [{'text': 'Zebras in Africa', 'score': 1.0},
+                                                   {'text': 'Zebra crossings', 'score': 1.0}]}]
+        }
+
+        suggestions = self._suggest_obj.suggest('zeb', 5, ['Org01', 'org02'], False)
+
+        self.assertEqual(['Zebras in Africa', 'Zebra crossings'], suggestions)
+        self.assertEqual({'visibility': ['org01', 'org02', 'public']}, self._get_context())
+        completion = self._mock_es_suggest.call_args[1]['body']['titles']['completion']
+        self.assertEqual(5, completion['size'])
+
+    def test_suggest_adminWithoutOrgs_allTitlesSuggested(self):
+        self._mock_es_suggest.return_value = {'titles': [{'text': 'zeb', 'options': []}]}
+        self.assertEqual([], self._suggest_obj.suggest('zeb', 5, [], True))
+        self.assertEqual({'visibility': ['all']}, self._get_context())
+
+    def test_suggest_noCompletionFieldInIndex_noSuggestions(self):
+        self._mock_es_suggest.side_effect = RequestError
+        self.assertEqual([], self._suggest_obj.suggest('zeb', 5, ['org01'], False))
+
+    def test_suggest_noIndexConnection_connectionErrorRaised(self):
+        self._mock_es_suggest.side_effect = ConnectionError
+        with self.assertRaises(IndexConnectionError):
+            self._suggest_obj.suggest('zeb', 5, ['org01'], False)
+
+    @patch.object(DataSetSuggest, 'suggest')
+    def test_restSuggest_withPrefix_suggestionsReturned(self, mock_suggest):
+        flask.g.org_uuid_list = ['org01']
+        flask.g.is_admin = False
+        mock_suggest.return_value = ['Zebras in Africa']
+
+        response = self.client.get('/rest/datasets/suggest?prefix=zeb&size=3')
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({'suggestions': ['Zebras in Africa']}, json.loads(response.data))
+        mock_suggest.assert_called_once_with('zeb', 3, ['org01'], False)
+
+    @patch.object(DataSetSuggest, 'suggest')
+    def test_restSuggest_nonAsciiPrefix_prefixPassed(self, mock_suggest):
+        flask.g.org_uuid_list = ['org01']
+        flask.g.is_admin = False
+        mock_suggest.return_value = [u'\u017b\xf3\u0142wie']
+
+        response = self.client.get('/rest/datasets/suggest?prefix=%C5%BC%C3%B3%C5%82')
+
+        self.assertEqual(200, response.status_code)
+        mock_suggest.assert_called_once_with(u'\u017c\xf3\u0142', 5, ['org01'], False)
+
+    def test_restSuggest_invalidParams_400Returned(self):
+        flask.g.is_admin = False
+        for params in ['', 'prefix=%20', 'prefix=zeb&size=0', 'prefix=zeb&size=100']:
+            response = self.client.get('/rest/datasets/suggest?' + params)
+            self.assertEqual(400, response.status_code)
+
+    @patch.object(DataSetSuggest, 'suggest')
+    def test_restSuggest_noIndexConnection_500Returned(self, mock_suggest):
+        flask.g.is_admin = False
+        mock_suggest.side_effect = IndexConnectionError
+        response = self.client.get('/rest/datasets/suggest?prefix=zeb')
+        self.assertEqual(500, response.status_code)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,136 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Compares the JSON codecs available in this environment on the path of a search page:
+decoding ElasticSearch's response, extracting the metadata and encoding the REST response.
+Doesn't need ElasticSearch, the responses are generated.
+Accelerated codecs are used only when their libraries are installed ("pip install ujson").
+"""
+
+from __future__ import print_function
+
+import argparse
+import random
+import time
+import uuid
+
+from data_catalog.codec import CODECS, PREFERRED_CODECS, get_codec
+from data_catalog.search import DataSetSearch
+
+FORMATS = ['CSV', 'JSON', 'XML']
+CATEGORIES = ['agriculture', 'business', 'consumer', 'education', 'energy', 'finance', 'health',
+              'science']
+WORDS = ['zebra', 'giraffe', 'antelope', 'savanna', 'rainfall', 'census', 'revenue', 'sensor',
+         'temperature', 'population', 'export', 'yield', 'clinic', 'voltage']
+
+
+def generate_response(hit_number, sample_length, seed):
+    """
+    Generates an ElasticSearch search response with entries similar to the indexed ones.
+    :rtype: dict
+    """
+    rand = random.Random(seed)
+    hits = []
+    for _ in range(hit_number):
+        title = ' '.join(rand.choice(WORDS) for _ in range(4))
+        sample_rows = []
+        while sum(len(row) for row in sample_rows) < sample_length:
+            sample_rows.append(','.join(str(rand.randint(0, 100000)) for _ in range(8)))
+        hits.append({
+            '_id': str(uuid.UUID(int=rand.getrandbits(128))),
+            '_source': {
+                'title': title,
+                'category': rand.choice(CATEGORIES),
+                'format': rand.choice(FORMATS),
+                'dataSample': '\n'.join(sample_rows),
+                'recordCount': rand.randint(1, 10 ** 6),
+                'size': rand.randint(1, 10 ** 9),
+                'orgUUID': str(uuid.UUID(int=rand.getrandbits(128))),
+                'isPublic': rand.random() < 0.5,
+                'creationTime': '2015-{:02d}-{:02d}T12:00:00'.format(rand.randint(1, 12),
+                                                                    rand.randint(1, 28)),
+                'sourceUri': 'http://example.com/{}.csv'.format(rand.getrandbits(32)),
+                'targetUri': 'hdfs://nameservice1/org/{}/000000_1'.format(rand.getrandbits(32))
+            }
+        })
+    return {
+        'took': 5,
+        'timed_out': False,
+        'hits': {'total': hit_number, 'hits': hits},
+        'aggregations': {
+            'categories': {'buckets': [{'key': category} for category in CATEGORIES]},
+            'formats': {'buckets': [{'key': data_format} for data_format in FORMATS]}
+        }
+    }
+
+
+def benchmark_codec(codec, response_string, rounds):
+    """
+    :returns: Average times (in ms) of decoding, metadata extraction and encoding.
+    :rtype: dict
+    """
+    decode_time = extract_time = encode_time = 0.0
+    for _ in range(rounds):
+        start = time.time()
+        response = codec.loads(response_string)
+        decoded = time.time()
+        result = DataSetSearch._extract_metadata(response)  # pylint: disable=protected-access
+        extracted = time.time()
+        codec.dumps(result)
+        encoded = time.time()
+
+        decode_time += decoded - start
+        extract_time += extracted - decoded
+        encode_time += encoded - extracted
+    return {
+        'codec': codec.name,
+        'decode_ms': round(decode_time * 1000 / rounds, 3),
+        'extract_ms': round(extract_time * 1000 / rounds, 3),
+        'encode_ms': round(encode_time * 1000 / rounds, 3),
+        'total_ms': round((decode_time + extract_time + encode_time) * 1000 / rounds, 3),
+    }
+
+
+def print_results(results, response_string):
+    print('response size: {} bytes'.format(len(response_string)))
+    columns = ['codec', 'decode_ms', 'extract_ms', 'encode_ms', 'total_ms']
+    print('\t'.join(columns))
+    for result in results:
+        print('\t'.join(str(result[column]) for column in columns))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Compares JSON codecs on generated search pages.')
+    parser.add_argument('--hits', type=int, default=1000,
+                        help='number of hits on a page. Default: %(default)s')
+    parser.add_argument('--sample-length', type=int, default=1000,
+                        help='number of characters in "dataSample" of every hit. '
+                             'Default: %(default)s')
+    parser.add_argument('--rounds', type=int, default=20,
+                        help='how many times every page is processed. Default: %(default)s')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed for generating the hits. Default: %(default)s')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    page = get_codec('json').dumps(generate_response(args.hits, args.sample_length, args.seed))
+    print_results([benchmark_codec(CODECS[name], page, args.rounds)
+                   for name in PREFERRED_CODECS if name in CODECS],
+                  page)
@@ -16,20 +16,43 @@
 
 from __future__ import print_function
 
+import gzip
+import hashlib
+import io
 import json
+import os
+import shutil
 import sys
+import time
 import urlparse
 import argparse
+import zlib
+from collections import deque
+from multiprocessing.pool import ThreadPool
 
 from jwt.utils import base64url_decode
 import requests
 from requests.auth import AuthBase
 
-FETCH_URL = "rest/datasets"
+FETCH_URL = "rest/datasets/export"
 DELETE_URL = "rest/datasets/admin/elastic"
 INSERT_URL = "rest/datasets/admin/elastic"
+BULK_LOAD_URL = "rest/datasets/admin/elastic/bulk-load"
 LOCALHOST_URL = "http://localhost:5000"
+# newline delimited JSON: one entry (with its "id") per line
 DEFAULT_FILE = "data_input.json"
+CHECKPOINT_SUFFIX = ".checkpoint"
+PARTIAL_SUFFIX = ".partial"
+# gzip compressed NDJSON with a header line, see SnapshotWriter
+SNAPSHOT_FORMAT = "data-catalog-snapshot"
+SNAPSHOT_VERSION = 1
+GZIP_MAGIC = b"\x1f\x8b"
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_CONCURRENCY = 4
+# entries written between checkpoints of a fetch
+FETCH_CHECKPOINT_INTERVAL = 1000
+REQUEST_TIMEOUT = 300
+MAX_ATTEMPTS = 3
 
 
 class Authorization(AuthBase):
@@ -41,26 +64,359 @@ class Authorization(AuthBase):
         return request
 
 
-def fetch_data(base_url, token):
+class Checkpoint(object):
+    """
+    Progress of a fetch or insert saved next to the data file, so an interrupted run
+    can continue where it stopped. It's removed when the run finishes.
+    """
+
+    def __init__(self, data_file, operation):
+        self.path = data_file + CHECKPOINT_SUFFIX
+        self.operation = operation
+
+    def load(self):
+        """
+        :returns: State saved by an interrupted run of the same operation or None.
+        :rtype: dict
+        """
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as checkpoint_file:
+            state = json.load(checkpoint_file)
+        if state.get('operation') != self.operation:
+            sys.exit('ERROR! {} holds the progress of "{}", finish it or use --restart.'.format(
+                self.path, state.get('operation')))
+        return state
+
+    def save(self, state):
+        state = dict(state, operation=self.operation)
+        # written to another file first, so the checkpoint is never half-written
+        with open(self.path + '.tmp', 'w') as checkpoint_file:
+            json.dump(state, checkpoint_file)
+        os.rename(self.path + '.tmp', self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Progress(object):
+    """
+    Prints the number of processed entries and the throughput.
+    """
+
+    def __init__(self, operation, done=0):
+        self._operation = operation
+        self._start = time.time()
+        self._start_done = done
+        self.done = done
+
+    def update(self, done):
+        self.done = done
+        elapsed = time.time() - self._start
+        rate = (done - self._start_done) / elapsed if elapsed else 0
+        print('{}: {} entries, {:.0f} entries/s'.format(self._operation, done, rate))
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def detect_format(data_file):
+    """
+    :returns: "snapshot", "ndjson" or "array" (a single JSON array, written by older versions
+        of this tool).
+    :rtype: str
+    """
+    with open(data_file, 'rb') as input_file:
+        start = input_file.read(64)
+    if start.startswith(GZIP_MAGIC):
+        return 'snapshot'
+    if start.lstrip().startswith('['):
+        return 'array'
+    return 'ndjson'
+
+
+def get_target_format(data_file, data_format=None):
+    """
+    :returns: The given format or the one implied by the file's extension:
+        snapshot for ".gz", NDJSON otherwise.
+    :rtype: str
+    """
+    if data_format:
+        return data_format
+    return 'snapshot' if data_file.endswith('.gz') else 'ndjson'
+
+
+def read_entries(data_file):
+    """
+    Reads entries from a file in any of the formats. NDJSON and snapshots are streamed,
+    only the old array format needs to be loaded whole.
+    :returns: Generator of entries as JSON strings.
+    :raises SnapshotError: The snapshot's header is unknown or its entries don't match
+        the count or checksum from the header (checked after the last entry).
+    """
+    data_format = detect_format(data_file)
+    if data_format == 'array':
+        with open(data_file) as input_file:
+            for entry in json.load(input_file):
+                yield json.dumps(entry)
+    elif data_format == 'ndjson':
+        with open(data_file) as input_file:
+            for line in input_file:
+                line = line.strip()
+                if line:
+                    yield line
+    else:
+        for line in _read_snapshot(data_file):
+            yield line
+
+
+def _read_snapshot(data_file):
+    # GzipFile reads lines slowly on its own, the buffer makes it read bigger blocks
+    with io.BufferedReader(gzip.open(data_file, 'rb'), 1024 * 1024) as input_file:
+        header = read_snapshot_header(input_file.readline(), data_file)
+        checksum = hashlib.sha256()
+        entries = 0
+        for line in input_file:
+            checksum.update(line)
+            entries += 1
+            yield line.rstrip('\n')
+    if entries != header['entries'] or checksum.hexdigest() != header['sha256']:
+        raise SnapshotError('{} is damaged: the header lists {} entries, {} were read, '
+                            'or their checksum differs.'.format(data_file, header['entries'],
+                                                                 entries))
+
+
+def read_snapshot_header(line, data_file):
+    """
+    :param str line: First line of the snapshot.
+    :returns: The header: format, version, number of entries and SHA-256 of the entry lines.
+    :rtype: dict
+    :raises SnapshotError:
+    """
+    try:
+        header = json.loads(line)
+    except ValueError:
+        raise SnapshotError('{} has no snapshot header.'.format(data_file))
+    if not isinstance(header, dict) or header.get('format') != SNAPSHOT_FORMAT:
+        raise SnapshotError('{} has no snapshot header.'.format(data_file))
+    if header.get('version') != SNAPSHOT_VERSION:
+        raise SnapshotError('{} has snapshot version {}, only version {} is supported.'.format(
+            data_file, header.get('version'), SNAPSHOT_VERSION))
+    return header
+
+
+class NdjsonWriter(object):
+    """
+    Appends entries to a newline delimited JSON file. Checkpoints return the size of the
+    part of the file that is written completely; writing can be resumed from it.
+    """
+
+    def __init__(self, data_file, resume_bytes=None):
+        """
+        :param str data_file:
+        :param int resume_bytes: When given, the file (written by an interrupted run)
+            is truncated to this size and the entries before it are kept.
+        """
+        self.data_file = data_file
+        self.entries = 0
+        self._checksum = hashlib.sha256()
+        self._path = self._get_path()
+        if resume_bytes is None:
+            self._file = open(self._path, 'wb')
+        else:
+            with open(self._path, 'r+b') as output_file:
+                output_file.truncate(resume_bytes)
+            for line in self._read_written():
+                self._count(line)
+            self._file = open(self._path, 'ab')
+
+    def _get_path(self):
+        return self.data_file
+
+    def _read_written(self):
+        with open(self._path, 'rb') as input_file:
+            for line in input_file:
+                yield line
+
+    def _count(self, line):
+        self.entries += 1
+        self._checksum.update(line)
+
+    def write(self, entry):
+        """
+        :param str entry: Entry as a JSON string (without newlines).
+        """
+        line = entry + '\n'
+        self._file.write(line)
+        self._count(line)
+
+    def checkpoint(self):
+        """
+        :returns: Size of the completely written part of the file.
+        :rtype: int
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return self._file.tell()
+
+    def finish(self):
+        self._file.close()
+
+
+class SnapshotWriter(NdjsonWriter):
+    """
+    Writes a snapshot: gzip compressed NDJSON, whose first line is a header with the format's
+    name and version, the number of entries and SHA-256 of the entry lines, e.g.
+    {"format": "data-catalog-snapshot", "version": 1, "entries": 2, "sha256": "5d41..."}
+
+    The count and the checksum are known at the end, so entries are written to a ".partial"
+    file first. Every checkpoint ends a gzip member (concatenated members are a valid gzip file),
+    so the partial file can be truncated at a checkpoint. When the writing finishes, the header
+    is compressed as the first member of the snapshot and the partial file's members are
+    copied after it without compressing them again.
+    """
+
+    def __init__(self, data_file, resume_bytes=None):
+        self._compressor = None
+        super(SnapshotWriter, self).__init__(data_file, resume_bytes)
+
+    def _get_path(self):
+        return self.data_file + PARTIAL_SUFFIX
+
+    def _read_written(self):
+        with io.BufferedReader(gzip.open(self._path, 'rb'), 1024 * 1024) as input_file:
+            for line in input_file:
+                yield line
+
+    @staticmethod
+    def _get_compressor():
+        # 16 + MAX_WBITS gives a gzip container
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def write(self, entry):
+        if self._compressor is None:
+            self._compressor = self._get_compressor()
+        line = entry + '\n'
+        self._file.write(self._compressor.compress(line))
+        self._count(line)
+
+    def checkpoint(self):
+        if self._compressor is not None:
+            self._file.write(self._compressor.flush())
+            self._compressor = None
+        return super(SnapshotWriter, self).checkpoint()
+
+    def finish(self):
+        self.checkpoint()
+        self._file.close()
+        header = {'format': SNAPSHOT_FORMAT, 'version': SNAPSHOT_VERSION,
+                  'entries': self.entries, 'sha256': self._checksum.hexdigest()}
+        compressor = self._get_compressor()
+        with open(self.data_file, 'wb') as output_file:
+            output_file.write(compressor.compress(json.dumps(header, sort_keys=True) + '\n'))
+            output_file.write(compressor.flush())
+            with open(self._path, 'rb') as body_file:
+                shutil.copyfileobj(body_file, output_file, 1024 * 1024)
+        os.remove(self._path)
+
+
+class ArrayWriter(object):
+    """
+    Writes a single JSON array (with one entry per line), for tools expecting the format
+    written by older versions of this tool. Writing it can't be resumed.
+    """
+
+    def __init__(self, data_file):
+        self.data_file = data_file
+        self.entries = 0
+        self._file = open(data_file, 'wb')
+        self._file.write('[')
+
+    def write(self, entry):
+        self._file.write((',\n' if self.entries else '\n') + entry)
+        self.entries += 1
+
+    def finish(self):
+        self._file.write('\n]\n')
+        self._file.close()
+
+
+WRITERS = {
+    'snapshot': SnapshotWriter,
+    'ndjson': NdjsonWriter,
+    'array': ArrayWriter
+}
+
+
+def fetch_data(base_url, token, data_file=DEFAULT_FILE, restart=False, data_format=None):
+    """
+    Streams the export of all entries to the file. The export is read with ElasticSearch's
+    scroll cursors on the service's side, so neither the service nor this tool holds
+    all entries in memory. The export is sorted by ID, so the checkpoint keeps the ID
+    of the last saved entry and an interrupted fetch asks the export to continue after it.
+    """
     full_path = urlparse.urljoin(base_url, FETCH_URL)
+    data_format = get_target_format(data_file, data_format)
+    if data_format not in ('snapshot', 'ndjson'):
+        sys.exit('ERROR! Fetch writes only snapshots and NDJSON, use -convert afterwards.')
+    checkpoint = Checkpoint(data_file, 'fetch')
+    if restart:
+        checkpoint.remove()
+    state = checkpoint.load()
+    if state and 'after' not in state:
+        sys.exit('ERROR! {} was saved by an older version of this tool, use --restart.'.format(
+            checkpoint.path))
+    if state:
+        writer = WRITERS[state['format']](data_file, state['bytes'])
+        print('Resuming the fetch,', writer.entries, 'entries already in', data_file)
+    else:
+        writer = WRITERS[data_format](data_file)
+        state = {'bytes': 0, 'format': data_format, 'after': None}
+    checkpoint.save(state)
+
     print('Calling URL', full_path)
-    r = requests.get(full_path, auth=Authorization(token))
-    r.raise_for_status()
-    data = json.loads(r.content)
-    
-    if data and "hits" in data:
-        query = json.dumps({"size": data["total"]})
-        r = requests.get(full_path, params={'query': query}, auth=Authorization(token))
+    params = {'after': state['after']} if state['after'] else None
+    r = requests.get(full_path, auth=Authorization(token), params=params, stream=True,
+                     timeout=REQUEST_TIMEOUT)
+    if r.status_code != 200:
+        print("no data or error recived:", r.status_code, r.text)
+        return
 
-        data = json.loads(r.content)
-        new_data = data["hits"]
+    progress = Progress('fetched', writer.entries)
+    for line in r.iter_lines(chunk_size=64 * 1024):
+        if not line:
+            continue
+        writer.write(line)
+        if writer.entries % FETCH_CHECKPOINT_INTERVAL == 0:
+            state['bytes'] = writer.checkpoint()
+            state['after'] = json.loads(line)['id']
+            checkpoint.save(state)
+            progress.update(writer.entries)
+    writer.finish()
+    progress.update(writer.entries)
+    checkpoint.remove()
+    print("data fetched and saved in:", data_file)
 
-        f = open(DEFAULT_FILE, 'w')
-        f.write(json.dumps(new_data, sort_keys=True, indent=2, separators=(',', ': ')))
-        f.close()
-        print("data fetched and saved in:", DEFAULT_FILE)
-    else:
-        print("no data or error recived:", r.status_code, data)
+
+def convert_data(source_file, target_file, data_format=None):
+    """
+    Writes entries from a file in any format to a file in the given format (or the one
+    implied by its extension).
+    :raises SnapshotError:
+    """
+    if os.path.abspath(source_file) == os.path.abspath(target_file):
+        sys.exit('ERROR! The converted file has to be written to another file.')
+    writer = WRITERS[get_target_format(target_file, data_format)](target_file)
+    progress = Progress('converted')
+    for entry in read_entries(source_file):
+        writer.write(entry)
+        if writer.entries % FETCH_CHECKPOINT_INTERVAL == 0:
+            progress.update(writer.entries)
+    writer.finish()
+    progress.update(writer.entries)
+    print("data converted and saved in:", target_file)
 
 
 def delete_index(base_url, token):
@@ -71,16 +427,135 @@ def delete_index(base_url, token):
     else:
         print("problem with delete: ", r.status_code, r.text)
 
-def insert_data(base_url, token):
 
-    f = open(DEFAULT_FILE, 'r')
-    data = f.read()
-    full_path = urlparse.urljoin(base_url, INSERT_URL)
-    r = requests.put(full_path, auth=Authorization(token), data=data)
-    if (r.status_code == 200):
-        print("data inserted")
+def insert_data(base_url, token, data_file=DEFAULT_FILE, chunk_size=DEFAULT_CHUNK_SIZE,
+                concurrency=DEFAULT_CONCURRENCY, restart=False):
+    """
+    Sends the entries from the file in chunks, a few chunks at a time. Chunks already
+    inserted by an interrupted run are skipped (inserting an entry again only overwrites it).
+    The service's bulk load mode is turned on once for the whole insert, not by every chunk.
+    """
+    full_path = urlparse.urljoin(base_url, INSERT_URL) + '?bulkLoadMode=false'
+    checkpoint = Checkpoint(data_file, 'insert')
+    if restart:
+        checkpoint.remove()
+    state = checkpoint.load()
+    if state and state['chunkSize'] != chunk_size:
+        sys.exit('ERROR! The interrupted insert used chunks of {} entries, '
+                 'use the same --chunk-size or --restart.'.format(state['chunkSize']))
+    if not state:
+        state = {'chunkSize': chunk_size, 'doneChunks': [],
+                 'summary': {'indexed': 0, 'rejected': 0, 'failed': 0}}
+    elif state['doneChunks']:
+        print('Resuming the insert,', len(state['doneChunks']), 'chunks already inserted')
+    done_chunks = set(state['doneChunks'])
+
+    session = requests.Session()
+    session.auth = Authorization(token)
+    progress = Progress('inserted', sum(state['summary'].values()))
+    _switch_bulk_load(session, base_url, on=True)
+    pool = ThreadPool(concurrency)
+    pending = deque()
+    try:
+        for number, lines in _read_chunks(data_file, chunk_size):
+            if number in done_chunks:
+                continue
+            pending.append((number, pool.apply_async(_send_chunk, (session, full_path, lines))))
+            if len(pending) >= concurrency:
+                _finish_chunk(pending.popleft(), state, checkpoint, progress)
+        while pending:
+            _finish_chunk(pending.popleft(), state, checkpoint, progress)
+    except InsertError as ex:
+        pool.terminate()
+        sys.exit('problem with insert: {} (run -insert again to continue)'.format(ex))
+    except SnapshotError as ex:
+        pool.terminate()
+        sys.exit('ERROR! {}'.format(ex))
+    finally:
+        pool.close()
+        pool.join()
+        _switch_bulk_load(session, base_url, on=False)
+    checkpoint.remove()
+    print("data inserted:", state['summary'])
+
+
+class InsertError(Exception):
+    pass
+
+
+def _switch_bulk_load(session, base_url, on):
+    """
+    Turns the service's bulk load mode (no refreshes and replicas until the insert ends)
+    on or off. It's restored by the service when it restarts, so a killed insert doesn't
+    leave it on for good.
+    """
+    full_path = urlparse.urljoin(base_url, BULK_LOAD_URL)
+    method = session.post if on else session.delete
+    try:
+        r = method(full_path, timeout=REQUEST_TIMEOUT)
+    except requests.RequestException as ex:
+        error = str(ex)
     else:
-        print("problem with insert:", r.status_code, r.text)
+        if r.status_code == 200:
+            print('bulk load mode', 'on' if on else 'off', 'for', r.json()['indices'])
+            return
+        error = '{} {}'.format(r.status_code, r.text)
+    if on:
+        sys.exit('problem with starting the bulk load: {}'.format(error))
+    print('problem with ending the bulk load:', error)
+
+
+def _read_chunks(data_file, chunk_size):
+    """
+    :returns: Generator of chunk numbers and lists of JSON entries (as strings).
+    """
+    chunk = []
+    number = 0
+    for line in read_entries(data_file):
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            yield number, chunk
+            number += 1
+            chunk = []
+    if chunk:
+        yield number, chunk
+
+
+def _send_chunk(session, full_path, lines):
+    """
+    Runs in the pool's threads.
+    :returns: Numbers of indexed, rejected and failed entries.
+    :rtype: dict
+    :raises InsertError:
+    """
+    # metadata compresses well, so it's sent with gzip (16 + MAX_WBITS gives a gzip container)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    body = compressor.compress('[' + ','.join(lines) + ']') + compressor.flush()
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            r = session.put(full_path, data=body, headers={'Content-Encoding': 'gzip'},
+                            timeout=REQUEST_TIMEOUT)
+        except requests.RequestException as ex:
+            error = str(ex)
+        else:
+            if r.status_code == 200:
+                return r.json()
+            error = '{} {}'.format(r.status_code, r.text)
+            if r.status_code < 500:
+                break
+        if attempt < MAX_ATTEMPTS:
+            time.sleep(2 ** attempt)
+    raise InsertError(error)
+
+
+def _finish_chunk(pending_chunk, state, checkpoint, progress):
+    number, result = pending_chunk
+    chunk_summary = result.get()
+    for key in state['summary']:
+        state['summary'][key] += chunk_summary.get(key, 0)
+    state['doneChunks'].append(number)
+    checkpoint.save(state)
+    progress.update(sum(state['summary'].values()))
 
 class CheckUrlSchemeAction(argparse.Action):
     def __call__(self, parser, namespace, base_url, option_string=None):
@@ -96,11 +571,20 @@ def parse_args():
     group_list.add_argument('-fetch', help='fetch data from elastic search. Retrived data is save in working directory in file: ' + DEFAULT_FILE, action='store_true')
     group_list.add_argument('-delete', help='delete data by removing elastic search index', action='store_true')
     group_list.add_argument('-insert', help='insert data from file. Expected file name is: '+DEFAULT_FILE+' and it should be found in working directory', action='store_true')
+    group_list.add_argument('-convert', nargs=2, metavar=('SOURCE', 'TARGET'), help='convert data file between formats, token is not needed')
 
-    parser.add_argument('token',help="OAUTH token. For delete and insert it must have admin privileges")
+    parser.add_argument('token', nargs='?', help="OAUTH token. For delete and insert it must have admin privileges")
     parser.add_argument('base_url', nargs='?', default=LOCALHOST_URL, action=CheckUrlSchemeAction, help="base URL for datacatalog service. Default: %(default)s")
+    parser.add_argument('--file', default=DEFAULT_FILE, help="data file for fetch and insert. Default: %(default)s")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="entries sent in a single insert request. Default: %(default)s")
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help="insert requests sent at the same time. Default: %(default)s")
+    parser.add_argument('--restart', action='store_true', help="ignore the checkpoint of an interrupted fetch or insert and start from the beginning")
+    parser.add_argument('--format', choices=sorted(WRITERS), help="format of the fetched or converted file. Default: snapshot for files ending with .gz, ndjson otherwise")
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    if not args.convert and not args.token:
+        parser.error('token is required for -fetch, -delete and -insert')
+    return args
 
 
 def is_admin(user_token):
@@ -122,15 +606,23 @@ def is_admin(user_token):
 if __name__ == '__main__':
     args = parse_args()
 
+    if args.convert:
+        try:
+            convert_data(args.convert[0], args.convert[1], args.format)
+        except SnapshotError as ex:
+            sys.exit('ERROR! {}'.format(ex))
+        sys.exit()
+
     if not is_admin(args.token):
         sys.exit('ERROR! You must have admin privilages (console.admin scope) to use this tool.')            
     
     if args.fetch:
-        fetch_data(args.base_url, args.token)
+        fetch_data(args.base_url, args.token, args.file, args.restart, args.format)
     elif args.delete:
         delete_index(args.base_url, args.token)
     elif args.insert:
-        insert_data(args.base_url, args.token)
+        insert_data(args.base_url, args.token, args.file, args.chunk_size, args.concurrency,
+                    args.restart)
     else:
         print("This shouldn't happen...")
 
@@ -0,0 +1,164 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Compares the admin import's former loop indexing one entry per request
+with the bulk import (with and without the bulk load mode), on a local ElasticSearch.
+Entries are imported into a separate, temporary index, so Data Catalog's index isn't touched.
+"""
+
+from __future__ import print_function
+
+import argparse
+import copy
+import random
+import time
+import uuid
+
+from data_catalog.bases import create_elastic_search
+from data_catalog.bulk_import import BulkImporter, BulkLoadMode
+from data_catalog.configuration import DCConfig
+from data_catalog.metadata_entry import MetadataIndexingTransformer, ORG_UUID_FIELD
+from data_catalog.routing import OrgRouting
+
+CONFIG = DCConfig()
+BENCHMARK_INDEX = CONFIG.elastic.elastic_index + '-import-benchmark'
+ORGS = ['org01', 'org02', 'org03']
+FORMATS = ['CSV', 'JSON', 'XML']
+CATEGORIES = ['agriculture', 'business', 'consumer', 'education', 'energy', 'finance', 'health',
+              'science']
+
+elastic_search = create_elastic_search(CONFIG.elastic)
+routing = OrgRouting(CONFIG.elastic, elastic_search)
+
+
+def generate_entries(entry_number, seed):
+    """
+    :returns: Entries like the ones exported by the migration tool (with IDs).
+    :rtype: list[dict]
+    """
+    rand = random.Random(seed)
+    return [{
+        'id': str(uuid.UUID(int=rand.getrandbits(128))),
+        'category': rand.choice(CATEGORIES),
+        'dataSample': 'ID,Something,OtherThing\n1,2,3',
+        'format': rand.choice(FORMATS),
+        'recordCount': rand.randint(10, 100000),
+        'size': rand.randint(1000, 1000000000),
+        'sourceUri': 'http://some-addres.example.com/dataset',
+        'targetUri': 'hdfs://nameservice1/org/{}/000000_1'.format(rand.getrandbits(32)),
+        'isPublic': rand.random() < 0.5,
+        'orgUUID': rand.choice(ORGS),
+        'title': 'Data set number {}'.format(number),
+        'creationTime': '2015-{:02d}-{:02d}T12:00:00'.format(rand.randint(1, 12),
+                                                            rand.randint(1, 28))
+    } for number in range(entry_number)]
+
+
+def recreate_index():
+    elastic_search.indices.delete(BENCHMARK_INDEX, ignore=404)
+    elastic_search.indices.create(index=BENCHMARK_INDEX,
+                                  body=CONFIG.elastic.metadata_index_setup)
+
+
+def import_entry_by_entry(entries):
+    """
+    The admin import before it used the bulk API.
+    """
+    transformer = MetadataIndexingTransformer()
+    for entry in entries:
+        entry_id = entry.pop('id')
+        transformer.transform(entry)
+        elastic_search.index(
+            index=BENCHMARK_INDEX,
+            doc_type=CONFIG.elastic.elastic_metadata_type,
+            id=entry_id,
+            body=entry,
+            **routing.params(entry[ORG_UUID_FIELD])
+        )
+
+
+def import_in_bulk(entries, chunk_size, concurrency, bulk_load_mode):
+    import_config = copy.copy(CONFIG.bulk_import)
+    import_config.chunk_size = chunk_size
+    import_config.concurrency = concurrency
+    importer = BulkImporter(elastic_search, BENCHMARK_INDEX,
+                            CONFIG.elastic.elastic_metadata_type, routing, import_config)
+    # the time of restoring the settings and refreshing the index is included
+    with BulkLoadMode(elastic_search, CONFIG.elastic, BENCHMARK_INDEX, enabled=bulk_load_mode):
+        importer.import_entries(iter(entries))
+
+
+def benchmark(method_name, import_function, entries):
+    recreate_index()
+    start = time.time()
+    import_function(copy.deepcopy(entries))
+    wall_time = time.time() - start
+    elastic_search.indices.refresh(index=BENCHMARK_INDEX)
+    indexed = elastic_search.count(index=BENCHMARK_INDEX)['count']
+    return {
+        'method': method_name,
+        'entries': len(entries),
+        'indexed': indexed,
+        'wall_time_s': round(wall_time, 3),
+        'entries_per_s': int(len(entries) / wall_time) if wall_time else 0,
+    }
+
+
+def print_results(results):
+    columns = ['method', 'entries', 'indexed', 'wall_time_s', 'entries_per_s']
+    print('\t'.join(columns))
+    for result in results:
+        print('\t'.join(str(result[column]) for column in columns))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Compares entry by entry and bulk imports on a local ElasticSearch.')
+    parser.add_argument('--entries', type=int, default=10000,
+                        help='number of imported entries. Default: %(default)s')
+    parser.add_argument('--chunk-sizes', type=int, nargs='+', default=[500],
+                        help='entries in a bulk request. Default: %(default)s')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4],
+                        help='numbers of bulk requests sent at once. Default: %(default)s')
+    parser.add_argument('--bulk-load-mode', choices=['on', 'off', 'both'], default='both',
+                        help='whether bulk imports turn off refreshing and replication '
+                             'of the index. Default: %(default)s')
+    parser.add_argument('--skip-entry-by-entry', action='store_true',
+                        help="don't run the slow entry by entry import")
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed for generating the entries. Default: %(default)s')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    test_entries = generate_entries(args.entries, args.seed)
+    results = []
+    if not args.skip_entry_by_entry:
+        results.append(benchmark('entry by entry', import_entry_by_entry, test_entries))
+    bulk_load_modes = {'on': [True], 'off': [False], 'both': [False, True]}[args.bulk_load_mode]
+    for chunk_size in args.chunk_sizes:
+        for concurrency in args.concurrency:
+            for bulk_load_mode in bulk_load_modes:
+                results.append(benchmark(
+                    'bulk chunk={} concurrency={} bulk_load_mode={}'.format(
+                        chunk_size, concurrency, 'on' if bulk_load_mode else 'off'),
+                    lambda entries: import_in_bulk(entries, chunk_size, concurrency,
+                                                   bulk_load_mode),
+                    test_entries))
+    elastic_search.indices.delete(BENCHMARK_INDEX, ignore=404)
+    print_results(results)
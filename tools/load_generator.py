@@ -0,0 +1,419 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Sends a mix of search, get, put, post, delete and count requests to Data Catalog from a few
+threads and reports throughput and latency percentiles of every endpoint.
+
+In process (the default) the app is created with data_catalog.app._create_app and called
+through Flask's test client. Authentication is replaced by a fake user in the given number
+of organisations, NATS notifications and deleting from Downloader and Dataset Publisher
+do nothing, so only ElasticSearch (from VCAP_SERVICES) is needed. Requests sent
+to ElasticSearch are counted and the process' CPU time is measured (it includes the load
+generator itself, which is small compared to the app).
+
+Over HTTP (--url) the requests go to a running instance and need a real token. Its
+organisations are given with --org. CPU time of the instance's workers is read from /proc
+when their PIDs are given (--worker-pid).
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+import flask
+import requests
+from elasticsearch.transport import Transport
+from mock import patch
+
+from data_catalog.app import _create_app, _prepare_environment
+from data_catalog.configuration import DCConfig
+from data_catalog.dataset_delete import DataSetRemover
+from data_catalog.notifier import CFNotifier
+from tools.micro_benchmark import CATEGORIES, FORMATS, get_entries
+
+DEFAULT_MIX = 'search=50,get=20,count=10,put=10,post=5,delete=5'
+OPERATIONS = ['search', 'get', 'count', 'put', 'post', 'delete']
+BASE_PATH = '/rest/datasets'
+SEARCH_WORDS = ['population', 'census', 'county', 'data', 'sales', 'energy', 'health']
+
+
+class InProcessClient(object):
+
+    """
+    Calls the app created in this process, every thread with its own test client.
+    """
+
+    def __init__(self, org_uuid_list):
+        config = DCConfig()
+        _prepare_environment(config)
+        self._app = _create_app(config)
+        self._app.before_request_funcs = {None: [lambda: self._fake_authenticate(org_uuid_list)]}
+        self._local = threading.local()
+
+    @staticmethod
+    def _fake_authenticate(org_uuid_list):
+        flask.g.is_admin = False
+        flask.g.org_uuid_list = org_uuid_list
+
+    def request(self, method, path, body=None):
+        """
+        :returns: Status code of the response.
+        :rtype: int
+        """
+        if not hasattr(self._local, 'client'):
+            self._local.client = self._app.test_client()
+        response = self._local.client.open(
+            path, method=method, data=json.dumps(body) if body is not None else None,
+            headers={'Authorization': 'bearer fake-token'}, content_type='application/json')
+        # reading the body runs streamed responses to the end
+        response.get_data()
+        return response.status_code
+
+
+class HttpClient(object):
+
+    """
+    Sends requests to a running instance of Data Catalog.
+    """
+
+    def __init__(self, url, token):
+        self._url = url.rstrip('/')
+        self._token = token
+        self._local = threading.local()
+
+    def request(self, method, path, body=None):
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+            self._local.session.headers['Authorization'] = self._token
+        response = self._local.session.request(method, self._url + path, json=body)
+        return response.status_code
+
+
+class ElasticSearchCounter(object):
+
+    """
+    Counts requests sent to ElasticSearch by every thread (only in process).
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._patcher = None
+
+    def start(self):
+        original_perform_request = Transport.perform_request
+        counter = self
+
+        def counting_perform_request(transport, *args, **kwargs):
+            counter._local.count = counter.get() + 1
+            return original_perform_request(transport, *args, **kwargs)
+
+        self._patcher = patch.object(Transport, 'perform_request', counting_perform_request)
+        self._patcher.start()
+
+    def stop(self):
+        if self._patcher:
+            self._patcher.stop()
+
+    def get(self):
+        return getattr(self._local, 'count', 0)
+
+
+class LoadGenerator(object):
+
+    """
+    Runs the requests and collects their latencies, statuses and ElasticSearch requests.
+    """
+
+    def __init__(self, client, mix, org_uuid_list, seed, es_counter=None):
+        """
+        :param client: InProcessClient or HttpClient.
+        :param dict mix: Relative weights of the operations.
+        :param list[str] org_uuid_list: Organisations of the user, entries are put in them.
+        :param int seed:
+        :param ElasticSearchCounter es_counter: None when the requests can't be counted.
+        """
+        self._client = client
+        self._operations = [operation for operation in OPERATIONS if mix.get(operation)]
+        self._weights = [mix[operation] for operation in self._operations]
+        self._orgs = org_uuid_list
+        self._seed = seed
+        self._es_counter = es_counter
+        self._ids = []
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+
+    def prefill(self, entry_number):
+        """
+        Puts entries that get, post and delete requests work with.
+        """
+        rand = random.Random(self._seed)
+        for entry in self._get_entries(rand, entry_number):
+            entry_id = str(uuid.UUID(int=rand.getrandbits(128)))
+            self._client.request('PUT', '{}/{}'.format(BASE_PATH, entry_id), entry)
+            self._ids.append(entry_id)
+
+    def run(self, duration, concurrency):
+        """
+        :returns: Wall time of the run in seconds.
+        :rtype: float
+        """
+        end = time.time() + duration
+        threads = [threading.Thread(target=self._run_thread, args=(end, self._seed + number))
+                   for number in range(1, concurrency + 1)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.time() - start
+
+    def _run_thread(self, end, seed):
+        rand = random.Random(seed)
+        while time.time() < end:
+            operation = self._choose(rand)
+            es_requests_before = self._es_counter.get() if self._es_counter else 0
+            start = time.time()
+            status = getattr(self, '_' + operation)(rand)
+            latency = time.time() - start
+            es_requests = self._es_counter.get() - es_requests_before if self._es_counter \
+                else None
+            with self._lock:
+                self.samples[operation].append((latency, status, es_requests))
+
+    def _choose(self, rand):
+        point = rand.random() * sum(self._weights)
+        for operation, weight in zip(self._operations, self._weights):
+            point -= weight
+            if point < 0:
+                return operation
+        return self._operations[-1]
+
+    def _get_entries(self, rand, entry_number):
+        entries = get_entries(rand, entry_number)
+        for entry in entries:
+            entry['orgUUID'] = rand.choice(self._orgs)
+        return entries
+
+    def _random_id(self, rand):
+        with self._lock:
+            return rand.choice(self._ids) if self._ids else str(uuid.uuid4())
+
+    def _search(self, rand):
+        query = {
+            'query': rand.choice(SEARCH_WORDS),
+            'filters': [{'category': rand.sample(CATEGORIES, 2)},
+                        {'format': [rand.choice(FORMATS)]}],
+            'from': rand.choice([0, 0, 0, 10, 20]),
+            'size': 10
+        }
+        return self._client.request(
+            'GET', '{}?query={}'.format(BASE_PATH, requests.utils.quote(json.dumps(query))))
+
+    def _get(self, rand):
+        return self._client.request('GET', '{}/{}'.format(BASE_PATH, self._random_id(rand)))
+
+    def _count(self, _):
+        return self._client.request('GET', BASE_PATH + '/count')
+
+    def _put(self, rand):
+        entry_id = str(uuid.UUID(int=rand.getrandbits(128)))
+        status = self._client.request('PUT', '{}/{}'.format(BASE_PATH, entry_id),
+                                      self._get_entries(rand, 1)[0])
+        with self._lock:
+            self._ids.append(entry_id)
+        return status
+
+    def _post(self, rand):
+        return self._client.request(
+            'POST', '{}/{}'.format(BASE_PATH, self._random_id(rand)),
+            {'title': 'Updated title {}'.format(rand.getrandbits(32))})
+
+    def _delete(self, rand):
+        with self._lock:
+            if not self._ids:
+                return None
+            entry_id = self._ids.pop(rand.randrange(len(self._ids)))
+        return self._client.request('DELETE', '{}/{}'.format(BASE_PATH, entry_id))
+
+
+def get_cpu_time(pids=None):
+    """
+    :param list[int] pids: Processes whose CPU time is summed, the current one if not given.
+    :returns: User and system CPU time in seconds.
+    :rtype: float
+    """
+    if not pids:
+        times = os.times()
+        return times[0] + times[1]
+    ticks = os.sysconf('SC_CLK_TCK')
+    total = 0.0
+    for pid in pids:
+        with open('/proc/{}/stat'.format(pid)) as stat_file:
+            # the command can contain spaces, fields after it are counted from its end
+            fields = stat_file.read().rsplit(')', 1)[1].split()
+        total += (int(fields[11]) + int(fields[12])) / float(ticks)
+    return total
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def summarize(samples, wall_time, cpu_time):
+    """
+    :returns: Numbers of requests, errors, throughput, latency percentiles (in ms)
+        and average ElasticSearch requests of every operation, and the totals.
+    :rtype: dict
+    """
+    endpoints = []
+    for operation in OPERATIONS:
+        if not samples.get(operation):
+            continue
+        latencies = sorted(latency * 1000 for latency, _, _ in samples[operation])
+        es_requests = [count for _, _, count in samples[operation] if count is not None]
+        endpoints.append({
+            'operation': operation,
+            'requests': len(latencies),
+            'errors': sum(1 for _, status, _ in samples[operation]
+                          if status is None or status >= 400),
+            'requests_per_s': round(len(latencies) / wall_time, 1),
+            'p50_ms': round(percentile(latencies, 0.5), 1),
+            'p90_ms': round(percentile(latencies, 0.9), 1),
+            'p99_ms': round(percentile(latencies, 0.99), 1),
+            'max_ms': round(latencies[-1], 1),
+            'es_requests_per_request':
+                round(float(sum(es_requests)) / len(es_requests), 2) if es_requests else None
+        })
+    request_number = sum(endpoint['requests'] for endpoint in endpoints)
+    return {
+        'endpoints': endpoints,
+        'total': {
+            'requests': request_number,
+            'requests_per_s': round(request_number / wall_time, 1),
+            'wall_time_s': round(wall_time, 1),
+            'cpu_time_s': round(cpu_time, 2) if cpu_time is not None else None,
+            'cpu_ms_per_request': round(cpu_time * 1000 / request_number, 2)
+                                  if cpu_time is not None and request_number else None
+        }
+    }
+
+
+def print_summary(summary):
+    columns = ['operation', 'requests', 'errors', 'requests_per_s', 'p50_ms', 'p90_ms', 'p99_ms',
+               'max_ms', 'es_requests_per_request']
+    print('\t'.join(columns))
+    for endpoint in summary['endpoints']:
+        print('\t'.join(str(endpoint[column]) for column in columns))
+    print(', '.join('{}: {}'.format(name, value)
+                    for name, value in sorted(summary['total'].items())))
+
+
+def parse_mix(mix_string):
+    """
+    :param str mix_string: E.g. "search=80,get=20".
+    :rtype: dict
+    """
+    mix = {}
+    for part in mix_string.split(','):
+        operation, _, weight = part.partition('=')
+        if operation.strip() not in OPERATIONS:
+            raise argparse.ArgumentTypeError('Unknown operation: {}'.format(operation))
+        mix[operation.strip()] = float(weight)
+    return mix
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Sends a mix of requests to Data Catalog and reports the latencies.')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help='relative weights of the operations ({}). Default: {}'.format(
+                            ', '.join(OPERATIONS), DEFAULT_MIX))
+    parser.add_argument('--duration', type=float, default=30,
+                        help='duration of the run in seconds. Default: %(default)s')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='number of threads sending requests. Default: %(default)s')
+    parser.add_argument('--prefill', type=int, default=100,
+                        help='number of entries put before the run. Default: %(default)s')
+    parser.add_argument('--orgs', type=int, default=20,
+                        help="number of the fake user's organisations (in process). "
+                             "Default: %(default)s")
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed of the requests. Default: %(default)s')
+    parser.add_argument('--url', help='base URL of a running instance, e.g. '
+                                      'http://localhost:5000 (the app is created in this '
+                                      'process when not given)')
+    parser.add_argument('--token', help='OAuth token with "bearer" prefix (with --url)')
+    parser.add_argument('--org', action='append', default=[],
+                        help="organisation of the token's user (with --url), can be repeated")
+    parser.add_argument('--worker-pid', type=int, action='append', default=[],
+                        help="PID of the instance's worker (with --url), can be repeated")
+    parser.add_argument('--output', help='JSON file the summary is saved to')
+    args = parser.parse_args()
+    if args.url and not (args.token and args.org):
+        parser.error('--token and --org are required with --url')
+    return args
+
+
+def main(args):
+    if args.url:
+        client = HttpClient(args.url, args.token)
+        orgs = args.org
+        es_counter = None
+    else:
+        rand = random.Random(args.seed)
+        orgs = [str(uuid.UUID(int=rand.getrandbits(128))) for _ in range(args.orgs)]
+        client = InProcessClient(orgs)
+        es_counter = ElasticSearchCounter()
+
+    # notifications and external deletes are faked only in process (the patches don't
+    # reach a running instance)
+    with patch.object(CFNotifier, 'notify'), \
+            patch.object(DataSetRemover, '_external_delete', return_value=True):
+        generator = LoadGenerator(client, args.mix, orgs, args.seed, es_counter)
+        print('Putting {} entries.'.format(args.prefill))
+        generator.prefill(args.prefill)
+        print('Running for {} s with {} threads.'.format(args.duration, args.concurrency))
+        if es_counter:
+            es_counter.start()
+        cpu_before = get_cpu_time(args.worker_pid) if not args.url or args.worker_pid else None
+        try:
+            wall_time = generator.run(args.duration, args.concurrency)
+        finally:
+            if es_counter:
+                es_counter.stop()
+        cpu_time = get_cpu_time(args.worker_pid) - cpu_before if cpu_before is not None \
+            else None
+
+    summary = summarize(generator.samples, wall_time, cpu_time)
+    summary['parameters'] = dict(vars(args), token=None)
+    print_summary(summary)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(summary, output_file, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -14,15 +14,26 @@
 # limitations under the License.
 #
 
+"""
+Local ElasticSearch index for development and capacity tests: filling it with example
+metadata, deleting it and generating example metadata (see README.md).
+"""
+
+from __future__ import print_function
+
+import argparse
+import copy
 import json
 import os.path
-import random
 import sys
 import time
-from datetime import datetime
 
-from data_catalog.metadata_entry import CATEGORY_FIELD, CREATION_TIME_FIELD, TITLE_FIELD
+from data_catalog.metadata_entry import (CATEGORY_FIELD, CERBERUS_SCHEMA, CREATION_TIME_FIELD,
+                                         ORG_UUID_FIELD, TITLE_FIELD)
+from data_catalog.bulk_import import BulkImporter, BulkLoadMode
 from data_catalog.configuration import DCConfig
+from data_catalog.metadata_index import MetadataIndex
+from data_catalog.routing import OrgRouting
 from elasticsearch import Elasticsearch
 
 
@@ -38,100 +49,251 @@ CONFIG = DCConfig()
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
 EXAMPLE_METADATA_FILE = os.path.join(SCRIPT_DIR, 'example_metadata.json')
 
+elastic_search = Elasticsearch()
 
-def print_help():
-    print(
-        '''To fill the local ElasticSearch index with test metadata entries run:
-    {0} {1}
 
-To delete the index run:
-    {0} {2}
+def delete_index():
+    print('Deleting the ElasticSearch index.')
+    MetadataIndex(elastic_search, CONFIG.elastic).delete()
+    print('Done.')
 
-To generate new example metadata run:
-    {0} {3} <example-entry-number>'''.format(__file__,
-                                   SETUP_FILLED_COMMAND,
-                                   DELETE_INDEX_COMMAND,
-                                   GENERATE_DATA_COMMAND)
-    )
 
+def setup_filled(metadata_file_path, chunk_size, concurrency):
+    print('Filling the index with metadata from {}.'.format(metadata_file_path))
+    MetadataIndex(elastic_search, CONFIG.elastic).create_if_missing()
+    import_config = copy.copy(CONFIG.bulk_import)
+    import_config.chunk_size = chunk_size
+    import_config.concurrency = concurrency
+    importer = BulkImporter(elastic_search, CONFIG.elastic.elastic_index,
+                            CONFIG.elastic.elastic_metadata_type,
+                            OrgRouting(CONFIG.elastic, elastic_search), import_config)
+    start = time.time()
+    with BulkLoadMode(elastic_search, CONFIG.elastic, CONFIG.elastic.elastic_index,
+                      force_merge=CONFIG.bulk_import.force_merge,
+                      enabled=CONFIG.bulk_import.bulk_load_mode):
+        summary = importer.import_entries(read_entries(metadata_file_path))
+    wall_time = time.time() - start
+    print('Done: {} ({:.0f} entries/s).'.format(
+        summary, summary['indexed'] / wall_time if wall_time else 0))
 
-elastic_search = Elasticsearch()
 
+def read_entries(metadata_file_path):
+    """
+    Reads entries from a JSON array (like the example metadata) or lazily from NDJSON.
+    Entries without IDs get their numbers as IDs.
+    :returns: Generator of entries.
+    """
+    with open(metadata_file_path) as metadata_file:
+        if metadata_file.read(1) == '[':
+            metadata_file.seek(0)
+            entries = json.load(metadata_file)
+        else:
+            metadata_file.seek(0)
+            entries = (json.loads(line) for line in metadata_file if line.strip())
+        for number, entry in enumerate(entries):
+            entry.setdefault('id', str(number))
+            # entries generated by older versions of this tool have fields
+            # that aren't in the schema (e.g. "storeType")
+            for field in set(entry) - set(CERBERUS_SCHEMA) - {'id'}:
+                del entry[field]
+            yield entry
 
-def delete_index():
-    print('Deleting the ElasticSearch index.')
-    elastic_search.indices.delete(CONFIG.elastic.elastic_index, ignore=404)
-    print('Done.')
 
+class CatalogGenerator(object):
 
-def setup_filled():
-    print('Filling the index with test metadata.')
-    with open(EXAMPLE_METADATA_FILE) as metadata_file:
-        metadata_entries = json.loads(metadata_file.read())
-    for number, entry in enumerate(metadata_entries):
-        elastic_search.index(
-            CONFIG.elastic.elastic_index,
-            CONFIG.elastic.elastic_metadata_type,
-            entry,
-            number)
+    """
+    Generates metadata entries with distributions resembling a real catalog: a few
+    organisations own most of the data sets, sizes span many orders of magnitude, recent
+    data sets are more common and titles are made of words with Zipf's distribution.
+    Entries are generated in batches and all random values of a batch are drawn at once
+    with NumPy, so that millions of entries can be generated quickly.
+    The same seed and number of entries give the same entries.
+    """
 
-    print('Done.')
+    FORMATS = ['CSV', 'JSON', 'XML', 'PARQUET', 'AVRO', 'TSV']
+    FORMAT_WEIGHTS = [0.55, 0.2, 0.08, 0.07, 0.05, 0.05]
+    CATEGORY_WEIGHTS = [0.08, 0.2, 0.1, 0.07, 0.12, 0.18, 0.15, 0.1]
+    TITLE_WORDS = [
+        'data', 'sales', 'census', 'population', 'revenue', 'sensor', 'temperature', 'energy',
+        'usage', 'monthly', 'daily', 'annual', 'report', 'survey', 'traffic', 'clinic', 'patient',
+        'voltage', 'yield', 'crop', 'rainfall', 'export', 'import', 'price', 'index', 'stock',
+        'market', 'school', 'grades', 'student', 'loan', 'credit', 'transactions', 'customer',
+        'churn', 'power', 'grid', 'weather', 'station', 'readings', 'hospital', 'admissions',
+        'genome', 'samples', 'experiment', 'results', 'zebras', 'africa', 'europe', 'asia',
+        'mordor', 'werewolf', 'sightings', 'bike', 'theft', 'voodoo', 'dolls', 'tanks', 'knives',
+        'vampirism', 'drama', 'north', 'south', 'east', 'west', 'region', 'city', 'county',
+        'logs', 'events', 'clicks', 'orders', 'inventory', 'shipments', 'flights', 'delays']
+    SAMPLE_COLUMNS = ['id', 'name', 'value', 'timestamp', 'region', 'amount', 'count', 'status',
+                      'latitude', 'longitude', 'category', 'price']
+    SOURCE_HOSTS = ['data.example.com', 'open-data.example.org', 'files.example.net',
+                    'archive.example.edu']
+    # fraction of public data sets
+    PUBLIC_RATIO = 0.3
+    # creation times are counted back from here, so they don't depend on the current time
+    REFERENCE_TIME = '2016-07-01T00:00:00'
+    MAX_AGE_YEARS = 5
+    MAX_TITLE_WORDS = 7
+    SAMPLE_TEXT_LENGTH = 1024 * 1024
 
+    def __init__(self, seed=0, org_number=20, batch_size=10000):
+        """
+        :param int seed:
+        :param int org_number: Number of organisations owning the data sets.
+        :param int batch_size: Number of entries whose values are drawn at once.
+        """
+        self._numpy = _import_numpy()
+        self._random = self._numpy.random.RandomState(seed)
+        self._batch_size = batch_size
+        self._orgs = [self._get_uuid(row) for row in self._random_words((org_number, 4))]
+        self._org_weights = self._zipf_weights(org_number, 1.2)
+        self._words = self._numpy.array(self.TITLE_WORDS)
+        self._word_weights = self._zipf_weights(len(self.TITLE_WORDS), 1.0)
+        self._sample_text = self._get_sample_text()
 
-def generate_example_metadata(entry_number):
-    print('Generating {} random entries in file {}'.format(entry_number, EXAMPLE_METADATA_FILE))
-
-    def get_random_ISO8601_date():
-        current_timestamp = int(time.time())
-        seconds_in_year = 3600 * 24 * 365
-        past_timestamp = current_timestamp - (2*seconds_in_year)
-        random_timestamp = random.randint(past_timestamp, current_timestamp)
-
-        random_date = str(datetime.fromtimestamp(random_timestamp))
-        return 'T'.join(random_date.split())
-
-    DATA_SAMPLE = 'ID,Something,OtherThing'
-    titles = ['Zebras in Africa', 'Power usage in Mordor', 'Killings on the Moon',
-              'I know where you live', 'All your base are belong to us',
-              'Bike theft by invisible people', 'Werewolf sightings in 2015',
-              'Teenage drama and vampirism occurences', 'North Dakota Voodoo dolls usage',
-              'Tanks vs knifes - a cautionary tale', "I just love my CSV's"]
-    random.shuffle(titles)
-    org_uuids = ['org01', 'org02', 'org03']
-    entries = []
-    for i in range(entry_number):
-        entry = {
-            CATEGORY_FIELD: CATEGORIES[i % len(CATEGORIES)],
-            'dataSample': DATA_SAMPLE,
-            'format': 'CSV',
-            'recordCount': random.randint(10, 100000),
-            'size': random.randint(1000, 1000000000),
-            'sourceUri': 'http://some-addres.example.com/dataset',
-            'targetUri': '/borker/long-long-hash/9213-154b-a0b9',
-            'storeType': 'hdfs',
-            'isPublic': random.choice([True, False]),
-            'orgUUID': org_uuids[i % len(org_uuids)],
-            TITLE_FIELD: titles[i % len(titles)],
-            CREATION_TIME_FIELD: get_random_ISO8601_date(),
-        }
-        entries.append(entry)
-    with open(EXAMPLE_METADATA_FILE, 'w') as metadata_file:
-        metadata_file.write(json.dumps(entries, sort_keys=True, indent=4))
-    print('Done.')
+    def generate(self, entry_number):
+        """
+        :returns: Generator of entries (with IDs).
+        """
+        for start in range(0, entry_number, self._batch_size):
+            for entry in self._generate_batch(min(self._batch_size, entry_number - start)):
+                yield entry
 
-if __name__ == '__main__':
-    if len(sys.argv) < 2:
-        print_help()
-        quit()
+    def _generate_batch(self, size):
+        numpy, rand = self._numpy, self._random
+        ids = [self._get_uuid(row) for row in self._random_words((size, 4))]
+        orgs = rand.choice(len(self._orgs), size, p=self._org_weights)
+        categories = rand.choice(len(CATEGORIES), size, p=self.CATEGORY_WEIGHTS)
+        formats = rand.choice(len(self.FORMATS), size, p=self.FORMAT_WEIGHTS)
+        sizes = numpy.clip(rand.lognormal(numpy.log(5e7), 2.5, size), 1e3, 1e12).astype(numpy.int64)
+        row_widths = rand.lognormal(numpy.log(120), 0.6, size)
+        record_counts = numpy.maximum(sizes / row_widths, 1).astype(numpy.int64)
+        is_public = rand.random_sample(size) < self.PUBLIC_RATIO
+        ages = numpy.clip(rand.exponential(365 * 24 * 3600, size),
+                          0, self.MAX_AGE_YEARS * 365 * 24 * 3600).astype(numpy.int64)
+        creation_times = numpy.datetime_as_string(
+            numpy.datetime64(self.REFERENCE_TIME, 's') - ages.astype('timedelta64[s]'))
+        title_lengths = rand.randint(2, self.MAX_TITLE_WORDS + 1, size)
+        title_words = rand.choice(len(self.TITLE_WORDS), (size, self.MAX_TITLE_WORDS),
+                                  p=self._word_weights)
+        sample_widths = numpy.clip(rand.lognormal(numpy.log(300), 0.8, size), 20, 4000) \
+            .astype(numpy.int64)
+        sample_offsets = rand.randint(0, self.SAMPLE_TEXT_LENGTH - 4000, size)
+        sample_columns = rand.randint(2, len(self.SAMPLE_COLUMNS) + 1, size)
+        source_hosts = rand.randint(0, len(self.SOURCE_HOSTS), size)
+
+        for i in range(size):
+            org = self._orgs[orgs[i]]
+            data_format = self.FORMATS[formats[i]]
+            title = ' '.join(self._words[title_words[i, :title_lengths[i]]]).capitalize()
+            offset = sample_offsets[i]
+            yield {
+                'id': ids[i],
+                CATEGORY_FIELD: CATEGORIES[categories[i]],
+                'dataSample': ','.join(self.SAMPLE_COLUMNS[:sample_columns[i]]) + '\n' +
+                              self._sample_text[offset:offset + sample_widths[i]],
+                'format': data_format,
+                'recordCount': int(record_counts[i]),
+                'size': int(sizes[i]),
+                'sourceUri': 'http://{}/{}/{}.{}'.format(
+                    self.SOURCE_HOSTS[source_hosts[i]], CATEGORIES[categories[i]],
+                    ids[i][:8], data_format.lower()),
+                'targetUri': 'hdfs://nameservice1/org/{}/brokers/userspace/{}/000000_1'.format(
+                    org, ids[i]),
+                'isPublic': bool(is_public[i]),
+                ORG_UUID_FIELD: org,
+                TITLE_FIELD: title,
+                CREATION_TIME_FIELD: str(creation_times[i]),
+            }
+
+    def _random_words(self, shape):
+        return self._random.randint(0, 2 ** 32, shape).astype(self._numpy.uint32)
 
-    command = sys.argv[1]
-    if command == DELETE_INDEX_COMMAND:
+    @staticmethod
+    def _get_uuid(words):
+        hex_id = ''.join('{:08x}'.format(int(word)) for word in words)
+        return '-'.join([hex_id[:8], hex_id[8:12], hex_id[12:16], hex_id[16:20], hex_id[20:]])
+
+    def _zipf_weights(self, number, exponent):
+        weights = 1.0 / self._numpy.arange(1, number + 1) ** exponent
+        return weights / weights.sum()
+
+    def _get_sample_text(self):
+        """
+        :returns: CSV-like text that data samples are cut from.
+        :rtype: str
+        """
+        numpy = self._numpy
+        # digits with commas and newlines between them
+        characters = numpy.array(list('0123456789,\n'))
+        weights = numpy.array([1.0] * 10 + [2.0, 0.3])
+        indices = self._random.choice(len(characters), self.SAMPLE_TEXT_LENGTH,
+                                      p=weights / weights.sum())
+        return ''.join(characters[indices])
+
+
+def _import_numpy():
+    # NumPy is needed only for generating metadata, so it isn't among Data Catalog's requirements
+    try:
+        import numpy
+    except ImportError:
+        sys.exit('Generating metadata needs NumPy, install it with "pip install numpy".')
+    return numpy
+
+
+def generate_example_metadata(entry_number, output_path, seed, org_number):
+    """
+    Streams generated entries to a file: NDJSON when its name ends with ".ndjson",
+    a JSON array (like the example metadata) otherwise.
+    """
+    print('Generating {} random entries in file {}'.format(entry_number, output_path))
+    start = time.time()
+    entries = CatalogGenerator(seed, org_number).generate(entry_number)
+    with open(output_path, 'w') as metadata_file:
+        if output_path.endswith('.ndjson'):
+            for entry in entries:
+                metadata_file.write(json.dumps(entry, sort_keys=True) + '\n')
+        else:
+            metadata_file.write('[')
+            for number, entry in enumerate(entries):
+                metadata_file.write((',\n' if number else '\n') +
+                                    json.dumps(entry, sort_keys=True, indent=4))
+            metadata_file.write('\n]\n')
+    print('Done in {:.1f} s.'.format(time.time() - start))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Sets up a local ElasticSearch index.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    fill_parser = subparsers.add_parser(
+        SETUP_FILLED_COMMAND, help='fill the index with metadata entries (bulk requests)')
+    fill_parser.add_argument('--file', default=EXAMPLE_METADATA_FILE,
+                             help='JSON array or NDJSON with the entries. Default: %(default)s')
+    fill_parser.add_argument('--chunk-size', type=int, default=CONFIG.bulk_import.chunk_size,
+                             help='entries in a bulk request. Default: %(default)s')
+    fill_parser.add_argument('--concurrency', type=int, default=CONFIG.bulk_import.concurrency,
+                             help='bulk requests sent at once. Default: %(default)s')
+
+    subparsers.add_parser(DELETE_INDEX_COMMAND, help='delete the index')
+
+    generate_parser = subparsers.add_parser(
+        GENERATE_DATA_COMMAND, help='generate random metadata entries (needs NumPy)')
+    generate_parser.add_argument('entry_number', type=int)
+    generate_parser.add_argument('--output', default=EXAMPLE_METADATA_FILE,
+                                 help='output file, NDJSON when it ends with ".ndjson", '
+                                      'a JSON array otherwise. Default: %(default)s')
+    generate_parser.add_argument('--seed', type=int, default=0,
+                                 help='seed of the random values. Default: %(default)s')
+    generate_parser.add_argument('--orgs', type=int, default=20,
+                                 help='number of organisations. Default: %(default)s')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.command == DELETE_INDEX_COMMAND:
         delete_index()
-    elif command == SETUP_FILLED_COMMAND:
-        setup_filled()
-    elif command == GENERATE_DATA_COMMAND and sys.argv > 2:
-        entry_number = int(sys.argv[2])
-        generate_example_metadata(entry_number)
-    else:
-        print('No command: ' + command)
-        print_help()
+    elif args.command == SETUP_FILLED_COMMAND:
+        setup_filled(args.file, args.chunk_size, args.concurrency)
+    elif args.command == GENERATE_DATA_COMMAND:
+        generate_example_metadata(args.entry_number, args.output, args.seed, args.orgs)
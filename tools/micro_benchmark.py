@@ -0,0 +1,253 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Measures the pure Python code on the paths of requests: query translation, validation
+of indexed entries, extraction of search results, authorization and parsing of the UAA key.
+Doesn't need ElasticSearch or other services, their responses are generated
+(VCAP_SERVICES still has to be set, like for running the app locally).
+
+Reports operations per second and allocations of every benchmark. Allocations are the peak
+memory allocated during one operation (only when the tracemalloc module is available)
+and the number of container objects (dicts, lists, ...) that an operation leaves behind.
+Results can be saved to a JSON file and compared with the results of another version.
+"""
+
+from __future__ import print_function
+
+import argparse
+import gc
+import json
+import logging
+import platform
+import random
+import time
+import uuid
+
+from mock import MagicMock, patch
+from werkzeug.datastructures import MultiDict
+
+from data_catalog.auth import _Authorization, _PublicKeyParser
+from data_catalog.metadata_entry import MetadataIndexingTransformer
+from data_catalog.query_translation import DataSetFiltering, ElasticSearchQueryTranslator
+from data_catalog.search import DataSetSearch
+from data_catalog.version import VERSION
+from tools.codec_benchmark import CATEGORIES, FORMATS, generate_response
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+PUBLIC_KEY = {
+    'alg': 'SHA256withRSA',
+    'value': '-----BEGIN PUBLIC KEY-----\n'
+             'MIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEA0m59l2u9iDnMbrXHfqkO'
+             'rn2dVQ3vfBJqcDuFUK03d+1PZGbVlNCqnkpIJ8syFppW8ljnWweP7+LiWpRoz0I7fYb3d8TjhV86Y997Fl4'
+             'DBrxgM6KTJOuE/uxnoDhZQ14LgOU2ckXjOzOdTsnGMKQBLCl0vpcXBtFLMaSbpv1ozi8h7DJyVZ6EnFQZUW'
+             'GFgOMhawg0jN8Vqbs0YlBGMSEiuxozRjtnAwFtNzV3d7G/dUs5h7aSn3JdRgnbw1ZVI/M+0b2XSB3QbKzGx'
+             'v2BsaV/Qj7wVn5HLP8NyGEBlPR0grvzJsqvzEyb2vCVKYOlGOwjdSzzmJLWcTaF3ujC9XhwdAQIDAQAB\n'
+             '-----END PUBLIC KEY-----'
+}
+
+
+def get_translation_input(rand, org_number):
+    """
+    :returns: Arguments of ElasticSearchQueryTranslator.translate for a user in many
+        organisations searching for a phrase with filters on every filterable field.
+    :rtype: tuple
+    """
+    query = {
+        'query': 'population census',
+        'filters': [
+            {'category': rand.sample(CATEGORIES, 3)},
+            {'format': rand.sample(FORMATS, 2)},
+            {'creationTime': ['2014-01-01T00:00', -1]},
+            {'sourceUri': ['http://example.com/data.csv']},
+        ],
+        'from': 20,
+        'size': 10
+    }
+    orgs = [str(uuid.UUID(int=rand.getrandbits(128))) for _ in range(org_number)]
+    return json.dumps(query), orgs, DataSetFiltering.PRIVATE_AND_PUBLIC, False
+
+
+def get_entries(rand, number):
+    """
+    :returns: Entries as they come to the indexing endpoint.
+    :rtype: list[dict]
+    """
+    return [{
+        'category': rand.choice(CATEGORIES),
+        'dataSample': 'ID,Something,OtherThing\n1,2,3',
+        'format': rand.choice(FORMATS),
+        'recordCount': rand.randint(10, 100000),
+        'size': rand.randint(1000, 1000000000),
+        'sourceUri': 'http://some-addres.example.com/dataset',
+        'targetUri': 'hdfs://nameservice1/org/{}/000000_1'.format(rand.getrandbits(32)),
+        'isPublic': rand.random() < 0.5,
+        'orgUUID': str(uuid.UUID(int=rand.getrandbits(128))),
+        'title': 'Population census of the county number {}'.format(number),
+        'creationTime': '2015-{:02d}-{:02d}T12:00:00'.format(rand.randint(1, 12),
+                                                            rand.randint(1, 28))
+    } for number in range(number)]
+
+
+def get_user_management_response(rand, org_number):
+    """
+    :returns: User management's response with the user's organisations and the request
+        asking for some of them.
+    """
+    orgs = [str(uuid.UUID(int=rand.getrandbits(128))) for _ in range(org_number)]
+    response = MagicMock()
+    response.status_code = 200
+    response.text = json.dumps([{'organization': {'metadata': {'guid': org}}} for org in orgs])
+    request = MagicMock()
+    request.method = 'GET'
+    request.args = MultiDict({'orgs': ','.join(rand.sample(orgs, max(1, org_number // 10)))})
+    return response, request
+
+
+def measure(name, operation, ops, alloc_ops):
+    """
+    :param str name:
+    :param operation: Function without arguments doing a single operation.
+    :param int ops: Number of timed operations (after a tenth of that for warming up).
+    :param int alloc_ops: Number of operations for measuring allocations.
+    :rtype: dict
+    """
+    for _ in range(max(1, ops // 10)):
+        operation()
+    start = time.time()
+    for _ in range(ops):
+        operation()
+    elapsed = time.time() - start
+
+    peaks = []
+    gc.collect()
+    gc.disable()
+    try:
+        objects_before = gc.get_count()[0]
+        for _ in range(alloc_ops):
+            if tracemalloc:
+                tracemalloc.start()
+            operation()
+            if tracemalloc:
+                peaks.append(tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+        objects_left = gc.get_count()[0] - objects_before
+    finally:
+        gc.enable()
+
+    return {
+        'name': name,
+        'ops': ops,
+        'ops_per_s': round(ops / elapsed, 1) if elapsed else None,
+        'mean_us': round(elapsed * 1000000 / ops, 1),
+        'peak_kb_per_op': round(sum(peaks) / 1024.0 / len(peaks), 1) if peaks else None,
+        'objects_left_per_op': round(float(objects_left) / alloc_ops, 1)
+    }
+
+
+def run_benchmarks(args):
+    rand = random.Random(args.seed)
+    results = []
+
+    translator = ElasticSearchQueryTranslator()
+    translation_input = get_translation_input(rand, args.orgs)
+    results.append(measure('query_translation.translate',
+                           lambda: translator.translate(*translation_input),
+                           args.ops, args.alloc_ops))
+
+    transformer = MetadataIndexingTransformer()
+    # transform changes the entry, every operation gets its own one
+    entry_number = args.ops + max(1, args.ops // 10) + args.alloc_ops
+    entries = iter(get_entries(rand, entry_number))
+    results.append(measure('metadata_entry.transform',
+                           lambda: transformer.transform(next(entries)),
+                           args.ops, args.alloc_ops))
+
+    # _extract_metadata only sets the IDs in the response, so the same one can be used again
+    es_response = generate_response(args.hits, 1000, args.seed)
+    # pylint: disable=protected-access
+    results.append(measure('search._extract_metadata ({} hits)'.format(args.hits),
+                           lambda: DataSetSearch._extract_metadata(es_response),
+                           max(1, args.ops // 10), args.alloc_ops))
+
+    authorization = _Authorization()
+    response, request = get_user_management_response(rand, args.orgs)
+    with patch('data_catalog.auth.requests.get', return_value=response):
+        results.append(measure('auth.get_user_scope ({} orgs)'.format(args.orgs),
+                               lambda: authorization.get_user_scope('token', request, False),
+                               args.ops, args.alloc_ops))
+
+    parser = _PublicKeyParser()
+    results.append(measure('auth._PublicKeyParser.parse', lambda: parser.parse(PUBLIC_KEY),
+                           args.ops * 10, args.alloc_ops))
+    return results
+
+
+def print_results(results, previous_results=None):
+    columns = ['name', 'ops_per_s', 'mean_us', 'peak_kb_per_op', 'objects_left_per_op']
+    previous = {result['name']: result for result in previous_results or []}
+    print('\t'.join(columns + (['vs_previous'] if previous else [])))
+    for result in results:
+        row = [str(result[column]) for column in columns]
+        if result['name'] in previous and previous[result['name']]['ops_per_s']:
+            row.append('{:.2f}x'.format(result['ops_per_s'] /
+                                        previous[result['name']]['ops_per_s']))
+        print('\t'.join(row))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Measures the pure Python hot paths of Data Catalog without ElasticSearch.')
+    parser.add_argument('--ops', type=int, default=2000,
+                        help='number of timed operations of every benchmark '
+                             '(a tenth of that for the search results). Default: %(default)s')
+    parser.add_argument('--alloc-ops', type=int, default=20,
+                        help='number of operations measuring allocations. Default: %(default)s')
+    parser.add_argument('--hits', type=int, default=1000,
+                        help='number of hits in the search response. Default: %(default)s')
+    parser.add_argument('--orgs', type=int, default=500,
+                        help="number of the user's organisations. Default: %(default)s")
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed for generating the inputs. Default: %(default)s')
+    parser.add_argument('--output', help='JSON file the results are saved to')
+    parser.add_argument('--compare', help='JSON file with results of another version, '
+                                          'their operations per second are compared')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    # the code logs a lot on the debug level, which isn't used in production
+    logging.basicConfig(level=logging.WARNING)
+    results = run_benchmarks(args)
+    previous_results = None
+    if args.compare:
+        with open(args.compare) as previous_file:
+            previous_results = json.load(previous_file)['results']
+    print_results(results, previous_results)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({
+                'version': VERSION,
+                'python': platform.python_version(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'parameters': vars(args),
+                'results': results
+            }, output_file, indent=2, sort_keys=True)
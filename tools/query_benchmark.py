@@ -0,0 +1,252 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Compares the behaviour of different query shapes on a local ElasticSearch.
+The index should be filled beforehand (e.g. with "python -m tools.local_index_setup fill").
+Keep in mind that ElasticSearch caches filters only on big enough segments,
+so the index needs at least tens of thousands of entries to show meaningful numbers.
+"""
+
+from __future__ import print_function
+
+import argparse
+import copy
+import json
+import random
+import time
+import uuid
+
+from elasticsearch import Elasticsearch
+
+from data_catalog.configuration import DCConfig
+from data_catalog.metadata_entry import (ORG_UUID_FIELD, IS_PUBLIC_FIELD, VISIBLE_TO_FIELD,
+                                         PUBLIC_VISIBILITY_MARKER)
+from data_catalog.query_translation import ElasticSearchQueryTranslator, DataSetFiltering
+
+CONFIG = DCConfig()
+FALLBACK_ORGS = ['org01', 'org02', 'org03']
+FORMATS = ['CSV', 'JSON', 'XML']
+CATEGORIES = ['agriculture', 'business', 'consumer', 'education', 'energy', 'finance', 'health',
+              'science']
+TIME_RANGES = [['2014-01-01T00:00', -1], [-1, '2015-06-30T00:00'],
+               ['2014-06-01T00:00', '2015-06-01T00:00']]
+
+elastic_search = Elasticsearch()
+
+
+def to_legacy_query(es_query):
+    """
+    Rewrites a query made by the translator to the legacy "filtered" query
+    with "and" / "or" filters, as it was sent by Data Catalog before.
+    """
+    legacy_query = to_org_or_public_query(es_query)
+    bool_query = legacy_query['query']['bool']
+    legacy_query['query'] = {
+        'filtered': {
+            'query': bool_query['must'],
+            'filter': _to_legacy_filter(bool_query['filter'])
+        }
+    }
+    post_filter = es_query['post_filter']
+    legacy_query['post_filter'] = _to_legacy_filter(post_filter['bool']['filter']) \
+        if post_filter else {}
+    return legacy_query
+
+
+def to_org_or_public_query(es_query):
+    """
+    Rewrites the "visibleTo" filter of a query made by the translator to the former
+    filter: "orgUUID" is one of user's organisations or "isPublic" is true.
+    """
+    or_query = copy.deepcopy(es_query)
+    filters = or_query['query']['bool']['filter']
+    for position, clause in enumerate(filters):
+        visible_to = clause.get('terms', {}).get(VISIBLE_TO_FIELD)
+        if visible_to is None:
+            continue
+        org_uuids = [value for value in visible_to if value != PUBLIC_VISIBILITY_MARKER]
+        filters[position] = {
+            'bool': {
+                'should': [
+                    {'terms': {ORG_UUID_FIELD: org_uuids}},
+                    {'term': {IS_PUBLIC_FIELD: 'true'}}
+                ],
+                'minimum_should_match': 1
+            }
+        }
+    return or_query
+
+
+def _to_legacy_filter(clauses):
+    legacy_clauses = [{'or': clause['bool']['should']} if 'bool' in clause else clause
+                      for clause in clauses]
+    return {'and': legacy_clauses} if legacy_clauses else {}
+
+
+def get_orgs():
+    response = elastic_search.search(
+        index=CONFIG.elastic.elastic_index,
+        doc_type=CONFIG.elastic.elastic_metadata_type,
+        body={'size': 0, 'aggregations': {'orgs': {'terms': {'field': 'orgUUID', 'size': 0}}}})
+    orgs = [bucket['key'] for bucket in response['aggregations']['orgs']['buckets']]
+    return orgs or FALLBACK_ORGS
+
+
+def generate_queries(query_number, orgs, seed):
+    """
+    Generates translated queries similar to the ones sent by the console.
+    :rtype: list[dict]
+    """
+    rand = random.Random(seed)
+    translator = ElasticSearchQueryTranslator()
+    queries = []
+    for _ in range(query_number):
+        filters = [{'creationTime': rand.choice(TIME_RANGES)}]
+        if rand.random() < 0.5:
+            filters.append({'format': [rand.choice(FORMATS)]})
+        if rand.random() < 0.5:
+            filters.append({'category': [rand.choice(CATEGORIES)]})
+        data_catalog_query = {'filters': filters, 'size': 10}
+        user_orgs = rand.sample(orgs, rand.randint(1, len(orgs)))
+        dataset_filtering = rand.choice([DataSetFiltering.PRIVATE_AND_PUBLIC,
+                                         DataSetFiltering.ONLY_PRIVATE])
+        queries.append(json.loads(translator.translate(
+            json.dumps(data_catalog_query), user_orgs, dataset_filtering, False)))
+    return queries
+
+
+def generate_visibility_queries(query_number, orgs, orgs_per_user, seed):
+    """
+    Generates queries of users belonging to many organisations, so that each user's visibility
+    filter is unique. Organisations missing in the index are filled out with random UUIDs.
+    :rtype: list[dict]
+    """
+    rand = random.Random(seed)
+    translator = ElasticSearchQueryTranslator()
+    queries = []
+    for _ in range(query_number):
+        user_orgs = rand.sample(orgs, min(orgs_per_user, len(orgs)))
+        user_orgs += [str(uuid.UUID(int=rand.getrandbits(128)))
+                      for _ in range(orgs_per_user - len(user_orgs))]
+        queries.append(json.loads(translator.translate(
+            json.dumps({'size': 10}), user_orgs, DataSetFiltering.PRIVATE_AND_PUBLIC, False)))
+    return queries
+
+
+def get_query_cache_stats():
+    stats = elastic_search.indices.stats(index=CONFIG.elastic.elastic_index, metric='query_cache')
+    return stats['_all']['total']['query_cache']
+
+
+def run_queries(queries, rounds):
+    """
+    :returns: Wall time (in seconds) and a list of ElasticSearch "took" times (in ms).
+    """
+    took_times = []
+    start = time.time()
+    for _ in range(rounds):
+        for query in queries:
+            response = elastic_search.search(
+                index=CONFIG.elastic.elastic_index,
+                doc_type=CONFIG.elastic.elastic_metadata_type,
+                body=query)
+            took_times.append(response['took'])
+    return time.time() - start, took_times
+
+
+def benchmark_shape(shape_name, queries, rounds):
+    elastic_search.indices.clear_cache(index=CONFIG.elastic.elastic_index, query=True)
+    stats_before = get_query_cache_stats()
+    wall_time, took_times = run_queries(queries, rounds)
+    stats_after = get_query_cache_stats()
+
+    hits = stats_after['hit_count'] - stats_before['hit_count']
+    misses = stats_after['miss_count'] - stats_before['miss_count']
+    lookups = hits + misses
+    took_times.sort()
+    return {
+        'shape': shape_name,
+        'queries': len(took_times),
+        'wall_time_s': round(wall_time, 3),
+        'avg_took_ms': round(float(sum(took_times)) / len(took_times), 3),
+        'p95_took_ms': took_times[int(len(took_times) * 0.95)],
+        'cache_hits': hits,
+        'cache_misses': misses,
+        'cache_hit_rate': round(float(hits) / lookups, 3) if lookups else 0.0,
+        'cache_memory_bytes': stats_after['memory_size_in_bytes'],
+    }
+
+
+def filter_cache_benchmark(query_number, rounds, seed):
+    queries = generate_queries(query_number, get_orgs(), seed)
+    shapes = [
+        ('legacy filtered', [to_legacy_query(query) for query in queries]),
+        ('bool filter context', queries),
+    ]
+    return [benchmark_shape(name, shape_queries, rounds) for name, shape_queries in shapes]
+
+
+def visibility_benchmark(query_number, rounds, orgs_per_user, seed):
+    queries = generate_visibility_queries(query_number, get_orgs(), orgs_per_user, seed)
+    shapes = [
+        ('orgUUID or isPublic', [to_org_or_public_query(query) for query in queries]),
+        ('visibleTo', queries),
+    ]
+    return [benchmark_shape(name, shape_queries, rounds) for name, shape_queries in shapes]
+
+
+def print_results(results):
+    columns = ['shape', 'queries', 'wall_time_s', 'avg_took_ms', 'p95_took_ms',
+               'cache_hits', 'cache_misses', 'cache_hit_rate', 'cache_memory_bytes']
+    print('\t'.join(columns))
+    for result in results:
+        print('\t'.join(str(result[column]) for column in columns))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Compares query shapes on a local ElasticSearch.')
+    subparsers = parser.add_subparsers(dest='benchmark')
+
+    filter_cache_parser = subparsers.add_parser(
+        'filter-cache',
+        help='filter cache hit rates of the legacy "filtered" queries and the "bool" queries')
+    visibility_parser = subparsers.add_parser(
+        'visibility',
+        help='latency of "orgUUID or isPublic" filters and the "visibleTo" filter')
+    visibility_parser.add_argument(
+        '--orgs-per-user', type=int, default=50,
+        help='number of organisations every user belongs to. Default: %(default)s')
+
+    for subparser in [filter_cache_parser, visibility_parser]:
+        subparser.add_argument('--queries', type=int, default=50,
+                               help='number of distinct queries. Default: %(default)s')
+        subparser.add_argument('--rounds', type=int, default=20,
+                               help='how many times every query is repeated. '
+                                    'Default: %(default)s')
+        subparser.add_argument('--seed', type=int, default=0,
+                               help='seed for generating the queries. Default: %(default)s')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.benchmark == 'filter-cache':
+        print_results(filter_cache_benchmark(args.queries, args.rounds, args.seed))
+    else:
+        print_results(visibility_benchmark(args.queries, args.rounds, args.orgs_per_user,
+                                           args.seed))
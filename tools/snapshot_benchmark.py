@@ -0,0 +1,143 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Compares the data file formats of the migration tool: the pretty printed JSON array written
+by its older versions, NDJSON and the compressed snapshot. Measures the size of the file
+and the times of writing and loading it (parsing all entries, like the insert does).
+Doesn't need ElasticSearch, the entries are generated.
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import uuid
+
+from tools.elastic_migrate_tool import WRITERS, read_entries
+
+ORGS = ['org01', 'org02', 'org03']
+FORMATS = ['CSV', 'JSON', 'XML']
+CATEGORIES = ['agriculture', 'business', 'consumer', 'education', 'energy', 'finance', 'health',
+              'science']
+
+
+def generate_entries(entry_number, seed):
+    """
+    :returns: Entries like the ones returned by Data Catalog's export (with IDs).
+    :rtype: list[dict]
+    """
+    rand = random.Random(seed)
+    return [{
+        'id': str(uuid.UUID(int=rand.getrandbits(128))),
+        'category': rand.choice(CATEGORIES),
+        'dataSample': 'ID,Something,OtherThing\n1,2,3',
+        'format': rand.choice(FORMATS),
+        'recordCount': rand.randint(10, 100000),
+        'size': rand.randint(1000, 1000000000),
+        'sourceUri': 'http://some-addres.example.com/dataset',
+        'targetUri': 'hdfs://nameservice1/org/{}/000000_1'.format(rand.getrandbits(32)),
+        'isPublic': rand.random() < 0.5,
+        'orgUUID': rand.choice(ORGS),
+        'title': 'Data set number {}'.format(number),
+        'creationTime': '2015-{:02d}-{:02d}T12:00:00'.format(rand.randint(1, 12),
+                                                            rand.randint(1, 28))
+    } for number in range(entry_number)]
+
+
+def write_pretty_array(entries, data_file):
+    """
+    The format written by the migration tool's fetch before it streamed the export.
+    """
+    with open(data_file, 'w') as output_file:
+        output_file.write(json.dumps(entries, indent=2))
+
+
+def load_pretty_array(data_file):
+    """
+    The migration tool's insert before it read the file in chunks.
+    """
+    with open(data_file) as input_file:
+        return len(json.load(input_file))
+
+
+def write_with(data_format):
+    def write(entries, data_file):
+        writer = WRITERS[data_format](data_file)
+        for entry in entries:
+            writer.write(json.dumps(entry))
+        writer.finish()
+    return write
+
+
+def load_streamed(data_file):
+    return sum(1 for line in read_entries(data_file) if json.loads(line))
+
+
+def benchmark(format_name, write_function, load_function, entries, directory):
+    data_file = os.path.join(directory, format_name)
+    start = time.time()
+    write_function(entries, data_file)
+    write_time = time.time() - start
+    start = time.time()
+    loaded = load_function(data_file)
+    load_time = time.time() - start
+    return {
+        'format': format_name,
+        'entries': loaded,
+        'size_bytes': os.path.getsize(data_file),
+        'write_s': round(write_time, 3),
+        'load_s': round(load_time, 3),
+    }
+
+
+def print_results(results):
+    columns = ['format', 'entries', 'size_bytes', 'write_s', 'load_s']
+    print('\t'.join(columns))
+    for result in results:
+        print('\t'.join(str(result[column]) for column in columns))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compares the migration tool's data file formats on generated entries.")
+    parser.add_argument('--entries', type=int, default=100000,
+                        help='number of entries in the file. Default: %(default)s')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed for generating the entries. Default: %(default)s')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    test_entries = generate_entries(args.entries, args.seed)
+    temp_directory = tempfile.mkdtemp()
+    try:
+        print_results([
+            benchmark('pretty array', write_pretty_array, load_pretty_array, test_entries,
+                      temp_directory),
+            benchmark('ndjson', write_with('ndjson'), load_streamed, test_entries,
+                      temp_directory),
+            benchmark('snapshot', write_with('snapshot'), load_streamed, test_entries,
+                      temp_directory),
+        ])
+    finally:
+        shutil.rmtree(temp_directory)
@@ -0,0 +1,268 @@
+#
+# Copyright (c) 2016 Intel Corporation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""
+Compares the storage backends (see STORAGE_BACKEND in README.md) on generated catalogs
+of different sizes. For every backend and size the entries are loaded into a temporary
+index (an SQLite database in a temporary directory, the "storage-benchmark" alias
+on the configured ElasticSearch) and searches, facets, counts and gets are timed through
+the storage interface the models use (see data_catalog.storage).
+
+Reports the loading rate, latency percentiles of the operations, the size of the stored
+index and memory: for SQLite (which runs in this process) the growth of the process' RSS
+while loading and querying, the JVM heap used by the ElasticSearch nodes otherwise.
+Needs NumPy for generating the entries (like "python -m tools.local_index_setup generate").
+"""
+
+from __future__ import print_function
+
+import argparse
+import copy
+import json
+import os
+import random
+import resource
+import shutil
+import tempfile
+import time
+
+from elasticsearch.exceptions import ConnectionError as ElasticConnectionError
+
+from data_catalog.bases import create_elastic_search, create_storage
+from data_catalog.bulk_import import BulkImporter, BulkLoadMode
+from data_catalog.configuration import DCConfig
+from data_catalog.metadata_entry import MetadataIndexingTransformer
+from data_catalog.metadata_index import MetadataIndex
+from data_catalog.query_translation import DataSetFiltering, ElasticSearchQueryTranslator
+from data_catalog.routing import OrgRouting
+from tools.local_index_setup import CATEGORIES, CatalogGenerator
+
+CONFIG = DCConfig()
+BENCHMARK_INDEX = 'storage-benchmark'
+OPERATIONS = ['search', 'facets', 'count', 'get']
+
+
+class StorageUnderTest(object):
+
+    """
+    Temporary index of a backend, filled with generated entries.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._directory = tempfile.mkdtemp() if backend == 'sqlite' else None
+        self.elastic_config = copy.copy(CONFIG.elastic)
+        self.elastic_config.elastic_index = BENCHMARK_INDEX
+        self.elastic_config.storage_backend = backend
+        if self._directory:
+            self.elastic_config.sqlite_path = os.path.join(self._directory, 'benchmark.sqlite')
+        self.client = create_elastic_search(self.elastic_config)
+        self.storage = create_storage(self.elastic_config, self.client)
+        self._index = MetadataIndex(self.client, self.elastic_config)
+        self._initial_rss = self._get_rss()
+
+    @staticmethod
+    def _get_rss():
+        try:
+            with open('/proc/self/statm') as statm:
+                return int(statm.read().split()[1]) * resource.getpagesize()
+        except IOError:
+            # without procfs the peak RSS has to do (kilobytes on Linux and BSDs)
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def __enter__(self):
+        if self.backend == 'elasticsearch':
+            self._index.delete()
+            self._index.create_if_missing()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.backend == 'elasticsearch':
+            self._index.delete()
+        if self._directory:
+            shutil.rmtree(self._directory)
+
+    def load(self, entries):
+        """
+        Imports the entries like the admin import endpoint does, SQLite gets them
+        like from the put endpoint.
+        :returns: Loaded entries per second.
+        :rtype: float
+        """
+        if self.backend == 'sqlite':
+            transformer = MetadataIndexingTransformer()
+            start = time.time()
+            for entry in entries:
+                entry = dict(entry)
+                entry_id = entry.pop('id')
+                transformer.transform(entry)
+                self.storage.index(entry_id, entry)
+            self.storage.optimize()
+            return len(entries) / (time.time() - start)
+        importer = BulkImporter(self.client, BENCHMARK_INDEX,
+                                self.elastic_config.elastic_metadata_type,
+                                OrgRouting(self.elastic_config, self.client), CONFIG.bulk_import)
+        start = time.time()
+        with BulkLoadMode(self.client, self.elastic_config, BENCHMARK_INDEX):
+            summary = importer.import_entries(entries)
+        return summary['indexed'] / (time.time() - start)
+
+    def get_store_size(self):
+        if self.backend == 'sqlite':
+            return self.storage.get_size()
+        stats = self.client.indices.stats(index=BENCHMARK_INDEX, metric='store')
+        return stats['_all']['total']['store']['size_in_bytes']
+
+    def get_memory(self):
+        """
+        :returns: Bytes of memory used by the storage.
+        :rtype: int
+        """
+        if self.backend == 'sqlite':
+            return self._get_rss() - self._initial_rss
+        nodes = self.client.nodes.stats(metric='jvm')['nodes'].values()
+        return sum(node['jvm']['mem']['heap_used_in_bytes'] for node in nodes)
+
+
+class Operations(object):
+
+    """
+    Requests that Data Catalog's endpoints send, with random users, phrases and filters.
+    """
+
+    def __init__(self, storage, ids, orgs, orgs_per_user, seed):
+        self._storage = storage
+        self._ids = ids
+        self._orgs = orgs
+        self._orgs_per_user = orgs_per_user
+        self._rand = random.Random(seed)
+        self._translator = ElasticSearchQueryTranslator(CONFIG.search.time_rounding)
+
+    def _get_user_orgs(self):
+        return self._rand.sample(self._orgs, min(self._orgs_per_user, len(self._orgs)))
+
+    def search(self):
+        query = {
+            'query': ' '.join(self._rand.sample(CatalogGenerator.TITLE_WORDS[:20], 2)),
+            'filters': [
+                {'category': self._rand.sample(CATEGORIES, 2)},
+                {'creationTime': ['2014-{:02d}-01T00:00'.format(self._rand.randint(1, 12)),
+                                  -1]}
+            ],
+            'size': 20
+        }
+        return self._storage.storage.search(self._translator.translate_to_dict(
+            json.dumps(query), self._get_user_orgs(), DataSetFiltering.PRIVATE_AND_PUBLIC,
+            False))
+
+    def facets(self):
+        return self._storage.storage.facets(self._translator.translate_to_dict(
+            json.dumps({}), self._get_user_orgs(), DataSetFiltering.PRIVATE_AND_PUBLIC, False))
+
+    def count(self):
+        # like DataSetSearch.count
+        return self._storage.storage.count(self._translator.translate_to_dict(
+            None, self._get_user_orgs(), DataSetFiltering.PRIVATE_AND_PUBLIC, False))
+
+    def get(self):
+        return self._storage.storage.get(self._rand.choice(self._ids))
+
+
+def measure(operation, number):
+    """
+    :returns: Latencies of the operation's calls, in milliseconds, sorted.
+    :rtype: list[float]
+    """
+    for _ in range(max(1, number // 10)):
+        operation()
+    latencies = []
+    for _ in range(number):
+        start = time.time()
+        operation()
+        latencies.append((time.time() - start) * 1000)
+    return sorted(latencies)
+
+
+def percentile(sorted_values, fraction):
+    return round(sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))],
+                 3)
+
+
+def benchmark(backend, size, args):
+    entries = list(CatalogGenerator(args.seed, args.orgs).generate(size))
+    ids = [entry['id'] for entry in entries]
+    orgs = sorted({entry['orgUUID'] for entry in entries})
+    with StorageUnderTest(backend) as storage:
+        load_rate = storage.load(entries)
+        del entries
+        operations = Operations(storage, ids, orgs, args.orgs_per_user, args.seed)
+        result = {
+            'backend': backend,
+            'entries': size,
+            'load_per_s': round(load_rate, 1),
+        }
+        for name in OPERATIONS:
+            latencies = measure(getattr(operations, name), args.requests)
+            result[name + '_p50_ms'] = percentile(latencies, 0.5)
+            result[name + '_p90_ms'] = percentile(latencies, 0.9)
+        result['store_mb'] = round(storage.get_store_size() / 1024.0 ** 2, 1)
+        result['memory_mb'] = round(storage.get_memory() / 1024.0 ** 2, 1)
+    return result
+
+
+def print_results(results):
+    latencies = ['{}_{}_ms'.format(name, level)
+                 for name in OPERATIONS for level in ('p50', 'p90')]
+    columns = ['backend', 'entries', 'load_per_s'] + latencies + ['store_mb', 'memory_mb']
+    print('\t'.join(columns))
+    for result in results:
+        print('\t'.join(str(result[column]) for column in columns))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Compares latency and footprint of the storage backends.')
+    parser.add_argument('--backends', default='sqlite,elasticsearch',
+                        help='comma separated backends. Default: %(default)s')
+    parser.add_argument('--sizes', default='10000,100000',
+                        help='comma separated numbers of entries. Default: %(default)s')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='number of timed requests of every operation. Default: %(default)s')
+    parser.add_argument('--orgs', type=int, default=20,
+                        help='number of organisations owning the entries. Default: %(default)s')
+    parser.add_argument('--orgs-per-user', type=int, default=3,
+                        help="number of the searching user's organisations. Default: %(default)s")
+    parser.add_argument('--seed', type=int, default=0,
+                        help='seed for generating the entries and requests. Default: %(default)s')
+    parser.add_argument('--output', help='JSON file the results are saved to')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    results = []
+    for backend in args.backends.split(','):
+        for size in [int(size) for size in args.sizes.split(',')]:
+            try:
+                results.append(benchmark(backend, size, args))
+            except ElasticConnectionError:
+                print('Skipping {}: it is not available.'.format(backend))
+                break
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'parameters': vars(args), 'results': results}, output_file, indent=2,
+                      sort_keys=True)